@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Compare the changeset graph backends on a synthetic graph.
+
+Usage: changeset_graph_benchmark.py [--changesets=N] [--deps=N]
+                                    [--cycles=FRACTION] [--seed=N]
+                                    [--batch] [BACKEND...]
+
+The passes from BreakRevisionChangesetCyclesPass through
+TopologicalSortPass build a ChangesetGraph, then consume it in
+dependency order, breaking any cycles that they encounter.  This
+script generates a graph of N changesets, each of which depends on
+about --deps earlier changesets; the given FRACTION of the changesets
+also depends on a later changeset, which creates cycles.  Each
+BACKEND (by default, all of them) is run in a separate process, which
+builds the graph and consumes it, breaking cycles by splitting
+changesets the way that BreakRevisionChangesetCyclesPass does (with
+--batch, a maximal set of disjoint cycles is broken at a time).  The
+time taken for each phase, the memory used by the graph, and the
+number of rounds (searches of the whole graph for cycles), scans (of
+strongly connected components), and split changesets are reported,
+and the commit orders of the backends are compared."""
+
+
+import sys
+import os
+import time
+import random
+import getopt
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cvs2svn_lib.time_range import TimeRange
+from cvs2svn_lib.changeset_graph_node import ChangesetGraphNode
+from cvs2svn_lib.changeset_graph import GRAPH_BACKENDS
+from cvs2svn_lib.changeset_graph import create_changeset_graph
+
+
+def get_rss():
+  """Return the current resident set size of this process in bytes."""
+
+  f = open('/proc/self/status')
+  try:
+    for line in f:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1]) * 1024
+  finally:
+    f.close()
+  return 0
+
+
+class SyntheticChangeset(object):
+  """A stand-in for a Changeset, with explicit dependencies."""
+
+  def __init__(self, id, timestamp, pred_ids, succ_ids):
+    self.id = id
+    self.timestamp = timestamp
+    self.pred_ids = pred_ids
+    self.succ_ids = succ_ids
+    self.cvs_item_ids = []
+
+  def create_graph_node(self, cvs_item_to_changeset_id):
+    time_range = TimeRange()
+    time_range.add(self.timestamp)
+    return ChangesetGraphNode(
+        self.id, time_range, set(self.pred_ids), set(self.succ_ids)
+        )
+
+  def __cmp__(self, other):
+    return cmp(self.id, other.id)
+
+
+class SyntheticChangesetDatabase(dict):
+  def store(self, changeset):
+    self[changeset.id] = changeset
+
+  def close(self):
+    pass
+
+
+class NullTable(object):
+  def __setitem__(self, key, value):
+    pass
+
+  def close(self):
+    pass
+
+
+def generate_changesets(count, deps, cycles, seed):
+  """Return a list of COUNT SyntheticChangesets with ids 1 to COUNT."""
+
+  rng = random.Random(seed)
+  pred_ids = [[] for i in xrange(count + 1)]
+  succ_ids = [[] for i in xrange(count + 1)]
+  for id in xrange(2, count + 1):
+    for i in xrange(rng.randint(1, 2 * deps - 1)):
+      # Most dependencies are on recent changesets:
+      pred_id = max(1, id - int(rng.expovariate(1.0 / 50)) - 1)
+      if pred_id not in pred_ids[id]:
+        pred_ids[id].append(pred_id)
+        succ_ids[pred_id].append(id)
+    if id < count and rng.random() < cycles:
+      # A dependency on a later changeset:
+      pred_id = min(count, id + rng.randint(1, 20))
+      pred_ids[id].append(pred_id)
+      succ_ids[pred_id].append(id)
+
+  changesets = []
+  for id in xrange(1, count + 1):
+    changesets.append(SyntheticChangeset(
+        id, 1000000000 + id * 60, pred_ids[id], succ_ids[id]
+        ))
+  return changesets
+
+
+def run_backend(backend, count, deps, cycles, seed, batch):
+  """Build and consume the graph using BACKEND; print the results."""
+
+  changesets = generate_changesets(count, deps, cycles, seed)
+  changeset_db = SyntheticChangesetDatabase()
+  for changeset in changesets:
+    changeset_db.store(changeset)
+  ids = [count]
+
+  graph = create_changeset_graph(changeset_db, NullTable(), backend)
+
+  def break_cycle(cycle):
+    # Split the first changeset in the cycle into one changeset with
+    # its predecessors and one with its successors:
+    changeset = cycle[0]
+    node = graph[changeset.id]
+    graph.delete_changeset(changeset)
+    ids[0] += 1
+    graph.add_new_changeset(SyntheticChangeset(
+        ids[0], changeset.timestamp, list(node.pred_ids), []
+        ))
+    ids[0] += 1
+    graph.add_new_changeset(SyntheticChangeset(
+        ids[0], changeset.timestamp, [], list(node.succ_ids)
+        ))
+
+  rss = get_rss()
+  start = time.time()
+  for changeset in changesets:
+    graph.add_changeset(changeset)
+  # Make sure that the graph is fully built:
+  graph.has_pred_ids(1)
+  list(graph.get_pred_ids(1))
+  build_time = time.time() - start
+  memory = get_rss() - rss
+  del changesets
+
+  start = time.time()
+  order = 0
+  for (changeset, time_range) in graph.consume_graph(
+        cycle_breaker=break_cycle, batch=batch
+        ):
+    order = (order * 1000003 + changeset.id) & 0xffffffff
+  consume_time = time.time() - start
+
+  sys.stdout.write(
+      '%s %f %f %d %d %d %d %08x\n'
+      % (
+          backend, build_time, consume_time, memory,
+          graph.statistics.rounds, graph.statistics.components,
+          graph.statistics.splits, order,
+          )
+      )
+
+
+def usage():
+  sys.stderr.write(__doc__)
+  sys.exit(1)
+
+
+def main(args):
+  try:
+    (opts, args) = getopt.getopt(
+        args, 'h',
+        ['changesets=', 'deps=', 'cycles=', 'seed=', 'batch', 'run', 'help']
+        )
+  except getopt.GetoptError:
+    usage()
+
+  count = 100000
+  deps = 3
+  cycles = 0.001
+  seed = 0
+  batch = False
+  run = False
+  for (opt, value) in opts:
+    if opt == '--changesets':
+      count = int(value)
+    elif opt == '--deps':
+      deps = int(value)
+    elif opt == '--cycles':
+      cycles = float(value)
+    elif opt == '--seed':
+      seed = int(value)
+    elif opt == '--batch':
+      batch = True
+    elif opt == '--run':
+      run = True
+    else:
+      usage()
+
+  backends = args or GRAPH_BACKENDS
+  for backend in backends:
+    if backend not in GRAPH_BACKENDS:
+      sys.stderr.write('Unknown backend %r\n' % (backend,))
+      sys.exit(1)
+
+  if run:
+    # We are the child process that measures a single backend:
+    run_backend(backends[0], count, deps, cycles, seed, batch)
+    return
+
+  sys.stdout.write(
+      '%d changesets, about %d dependencies each, %g with cycles\n'
+      % (count, deps, cycles,)
+      )
+  sys.stdout.write(
+      '%-8s %9s %9s %10s %6s %6s %6s  %s\n'
+      % (
+          'backend', 'build', 'consume', 'memory',
+          'rounds', 'scans', 'splits', 'order',
+          )
+      )
+  orders = set()
+  for backend in backends:
+    command = [
+        sys.executable, os.path.abspath(__file__), '--run',
+        '--changesets=%d' % (count,), '--deps=%d' % (deps,),
+        '--cycles=%r' % (cycles,), '--seed=%d' % (seed,),
+        ]
+    if batch:
+      command.append('--batch')
+    command.append(backend)
+    output = subprocess.Popen(command, stdout=subprocess.PIPE).communicate()[0]
+    (name, build_time, consume_time, memory, rounds, scans, splits, order) = \
+        output.split()
+    orders.add(order)
+    sys.stdout.write(
+        '%-8s %7.3f s %7.3f s %7.1f MB %6s %6s %6s  %s\n'
+        % (
+            name, float(build_time), float(consume_time),
+            int(memory) / 1048576.0, rounds, scans, splits, order,
+            )
+        )
+
+  if len(orders) > 1:
+    sys.stdout.write(
+        'The backends broke cycles differently, so the orders differ.\n'
+        )
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
+
+
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Compare the speed of key-value stores on checkout database accesses.
+
+Usage: checkout_db_benchmark.py [--files=N] [--revisions=N] [--size=N]
+                                [--dir=PATH] [BACKEND...]
+
+InternalRevisionReader stores the fulltexts of revisions in a checkout
+database (config.CVS_CHECKOUT_DB) while OutputPass runs.  Files are
+processed interleaved, and each fulltext is written once, read when
+the next revision of the file is checked out, and then deleted.  This
+script replays that access pattern with synthetic texts against the
+built-in LogStore and against any of the DBM modules gdbm, dbhash,
+and dbm that are available (or against the BACKENDs named on the
+command line), and reports the time taken and the final file size for
+each one."""
+
+
+import sys
+import os
+import time
+import random
+import getopt
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.log_store import LogStore
+
+
+DBM_MODULES = ['gdbm', 'dbhash', 'dbm']
+
+
+def open_logstore(filename):
+  return LogStore(filename, DB_OPEN_NEW)
+
+
+def get_opener(name):
+  """Return a function that creates a new store of type NAME, or None."""
+
+  if name == 'logstore':
+    return open_logstore
+
+  try:
+    module = __import__(name)
+  except ImportError:
+    return None
+  else:
+    return lambda filename: module.open(filename, 'n')
+
+
+def generate_accesses(files, revisions, size, seed=0):
+  """Generate the checkout database accesses for a synthetic conversion.
+
+  Generate tuples (op, key, value), where op is 'set', 'get', or
+  'del'.  FILES files with REVISIONS revisions each are checked out in
+  a random interleaving; texts are about SIZE bytes long."""
+
+  rng = random.Random(seed)
+  next_rev = [0] * files
+  live = range(files)
+  while live:
+    i = rng.randrange(len(live))
+    file_id = live[i]
+    rev = next_rev[file_id]
+    key = '%x' % (file_id * revisions + rev,)
+    if rev > 0:
+      # Check out the new revision from the previous one, which is
+      # then no longer needed:
+      prev_key = '%x' % (file_id * revisions + rev - 1,)
+      yield ('get', prev_key, None)
+      yield ('del', prev_key, None)
+    yield ('set', key, 'x' * rng.randrange(size // 2, size * 3 // 2))
+    next_rev[file_id] += 1
+    if next_rev[file_id] == revisions:
+      del live[i]
+
+
+def run_benchmark(name, opener, accesses, directory):
+  filename = os.path.join(directory, 'checkout-%s.db' % (name,))
+  start = time.time()
+  db = opener(filename)
+  for (op, key, value) in accesses:
+    if op == 'set':
+      db[key] = value
+    elif op == 'get':
+      db[key]
+    else:
+      del db[key]
+  db.close()
+  elapsed = time.time() - start
+
+  size = 0
+  for f in os.listdir(directory):
+    if f.startswith('checkout-%s.db' % (name,)):
+      size += os.path.getsize(os.path.join(directory, f))
+
+  return (elapsed, size)
+
+
+def usage():
+  sys.stderr.write(__doc__ + '\n')
+  sys.exit(1)
+
+
+def main(args):
+  try:
+    (opts, args) = getopt.getopt(
+        args, 'h', ['files=', 'revisions=', 'size=', 'dir=', 'help']
+        )
+  except getopt.GetoptError:
+    usage()
+
+  files = 1000
+  revisions = 20
+  size = 4000
+  directory = None
+  for (opt, value) in opts:
+    if opt == '--files':
+      files = int(value)
+    elif opt == '--revisions':
+      revisions = int(value)
+    elif opt == '--size':
+      size = int(value)
+    elif opt == '--dir':
+      directory = value
+    else:
+      usage()
+
+  backends = args or ['logstore'] + DBM_MODULES
+
+  accesses = list(generate_accesses(files, revisions, size))
+  sys.stdout.write(
+      '%d files, %d revisions each, %d accesses\n'
+      % (files, revisions, len(accesses),)
+      )
+
+  tmpdir = tempfile.mkdtemp(dir=directory)
+  try:
+    for name in backends:
+      opener = get_opener(name)
+      if opener is None:
+        sys.stdout.write('%-10s not available\n' % (name,))
+        continue
+      (elapsed, size) = run_benchmark(name, opener, accesses, tmpdir)
+      sys.stdout.write(
+          '%-10s %8.3f s %12d bytes\n' % (name, elapsed, size,)
+          )
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
+
+
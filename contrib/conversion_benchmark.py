@@ -0,0 +1,606 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Measure the passes of cvs2svn and cvs2git on a synthetic CVS repository.
+
+Usage: conversion_benchmark.py [--files=N] [--revisions=N] [--branches=N]
+                               [--branch-revisions=N] [--tags=N]
+                               [--lines=N] [--delta=N] [--attic=FRACTION]
+                               [--dirs=N] [--seed=N] [--jobs=N]
+                               [--repeat=N] [--keep=DIR] [--output=FILE]
+                               [PROGRAM...]
+       conversion_benchmark.py --compare [--threshold=FRACTION] OLD NEW
+
+The first form generates a CVS repository of --files ,v files, spread
+over --dirs directories.  Each file has --revisions revisions on
+trunk, of --lines lines each; every revision changes --delta lines of
+its predecessor.  Each file also has --branches branches (sprouting
+from random trunk revisions, with --branch-revisions revisions each)
+and --tags tags.  The branches and tags have the same names in all
+files, and the revisions with the same number are committed at about
+the same time with the same log message, so that they are combined
+into changesets.  The given FRACTION of the files is deleted on trunk
+at the end and stored in the Attic.
+
+Then each PROGRAM (cvs2svn and cvs2git by default) converts the
+repository --repeat times with --profile-resources, and the resources
+used by each pass are written as JSON to FILE (by default, to
+stdout).  For each pass, the wall and CPU times, the peak memory
+usage, and the temporary disk space of the best run are recorded;
+the measurements of all runs are included, too.  The repository and
+the output of the conversions are removed afterwards, unless --keep
+is given.
+
+The second form compares two such results, OLD and NEW, pass by pass.
+A pass whose wall time or peak memory usage grew by more than the
+given FRACTION (default 0.2) is reported as a regression, unless the
+difference is too small to be significant, and the exit status is 1
+if any regressions were found."""
+
+
+import sys
+import os
+import time
+import random
+import getopt
+import tempfile
+import shutil
+import subprocess
+
+try:
+  import json
+except ImportError:
+  # json was only added in Python 2.6:
+  json = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cvs2svn_lib import config
+from cvs2svn_lib.version import VERSION
+
+
+# The version of the format of the results:
+RESULTS_FORMAT = 1
+
+PROGRAMS = ['cvs2svn', 'cvs2git']
+
+# Differences smaller than these are not reported as regressions:
+MIN_TIME_DIFFERENCE = 0.1
+MIN_RSS_DIFFERENCE = 4 * 1024 * 1024
+
+WORDS = [
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+    'hotel', 'india', 'juliet', 'kilo', 'lima', 'mike', 'november',
+    'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform',
+    'victor', 'whiskey', 'xray', 'yankee', 'zulu',
+    ]
+
+AUTHORS = ['jrandom', 'brane', 'ringstrom', 'dionisos', 'kfogel']
+
+# The time of the first revision in the repository:
+START_TIME = 946684800
+
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+
+
+def make_line(rng):
+  return ' '.join([rng.choice(WORDS) for i in xrange(8)])
+
+
+def change_lines(rng, lines, delta):
+  """Return (new_lines, positions) for a random change to LINES.
+
+  DELTA of the lines are replaced; POSITIONS is the sorted list of
+  their indexes."""
+
+  new_lines = list(lines)
+  positions = rng.sample(xrange(len(lines)), min(delta, len(lines)))
+  positions.sort()
+  for p in positions:
+    new_lines[p] = make_line(rng)
+  return (new_lines, positions)
+
+
+def rcs_diff(new_lines, positions):
+  """Return the RCS diff that replaces the lines at POSITIONS by NEW_LINES.
+
+  The two texts must differ only at POSITIONS."""
+
+  return ''.join([
+      'd%d 1\na%d 1\n%s\n' % (p + 1, p + 1, new_lines[p],)
+      for p in positions
+      ])
+
+
+def rcs_text(lines):
+  return ''.join([line + '\n' for line in lines])
+
+
+def format_date(t):
+  return time.strftime('%Y.%m.%d.%H.%M.%S', time.gmtime(t))
+
+
+class SyntheticRevision(object):
+  def __init__(self, rev, timestamp, author, state, log):
+    self.rev = rev
+    self.timestamp = timestamp
+    self.author = author
+    self.state = state
+    self.log = log
+    self.branches = []
+    self.next = None
+    # The text of this revision's deltatext:
+    self.text = None
+
+
+def generate_rcs_file(rng, params):
+  """Return the contents of a synthetic ,v file, and whether it is dead."""
+
+  lines = [make_line(rng) for i in xrange(params['lines'])]
+  count = params['revisions']
+  dead = rng.random() < params['attic']
+
+  # The trunk revisions (1.1 first), their texts, and the positions of
+  # the lines that each revision changed in its predecessor:
+  trunk = []
+  texts = []
+  changes = []
+  for k in xrange(1, count + 1):
+    if k > 1:
+      (lines, positions) = change_lines(rng, lines, params['delta'])
+    else:
+      positions = []
+    trunk.append(SyntheticRevision(
+        '1.%d' % (k,), START_TIME + k * DAY + rng.randrange(60),
+        AUTHORS[k % len(AUTHORS)], 'Exp',
+        'Revision %d of the synthetic repository.\n' % (k,),
+        ))
+    texts.append(lines)
+    changes.append(positions)
+  if dead:
+    trunk.append(SyntheticRevision(
+        '1.%d' % (count + 1,), START_TIME + (count + 1) * DAY,
+        AUTHORS[0], 'dead', 'Remove the file.\n',
+        ))
+    texts.append(lines)
+    changes.append([])
+
+  # The head revision contains the full text; the other trunk
+  # revisions contain the diffs that reconstruct them from their
+  # successors:
+  trunk[-1].text = rcs_text(texts[-1])
+  for i in xrange(len(trunk) - 1):
+    trunk[i].text = rcs_diff(texts[i], changes[i + 1])
+    trunk[i + 1].next = trunk[i].rev
+
+  # The branches contain the diffs from their predecessors:
+  symbols = []
+  branch_revisions = []
+  for j in xrange(params['branches']):
+    i = rng.randrange(count)
+    parent = trunk[i]
+    branch_number = '%s.%d' % (parent.rev, 2 * (j + 1),)
+    symbols.append((
+        'BRANCH_%d' % (j,), '%s.0.%d' % (parent.rev, 2 * (j + 1),)
+        ))
+    lines = texts[i]
+    revs = []
+    for k in xrange(1, params['branch_revisions'] + 1):
+      (new_lines, positions) = change_lines(rng, lines, params['delta'])
+      rev = SyntheticRevision(
+          '%s.%d' % (branch_number, k,),
+          parent.timestamp + (j + 1) * HOUR + k * 60,
+          AUTHORS[(j + k) % len(AUTHORS)], 'Exp',
+          'Change %d on branch BRANCH_%d.\n' % (k, j,),
+          )
+      rev.text = rcs_diff(new_lines, positions)
+      if revs:
+        revs[-1].next = rev.rev
+      else:
+        parent.branches.append(rev.rev)
+      revs.append(rev)
+      lines = new_lines
+    branch_revisions.extend(revs)
+
+  for t in xrange(params['tags']):
+    symbols.append(('TAG_%d' % (t,), trunk[rng.randrange(count)].rev))
+
+  out = []
+  out.append('head\t%s;\n' % (trunk[-1].rev,))
+  out.append('access;\n')
+  out.append('symbols')
+  for (name, rev) in symbols:
+    out.append('\n\t%s:%s' % (name, rev,))
+  out.append(';\n')
+  out.append('locks; strict;\n')
+  out.append('comment\t@# @;\n')
+  out.append('\n')
+
+  revisions = list(reversed(trunk)) + branch_revisions
+  for rev in revisions:
+    out.append(
+        '\n%s\ndate\t%s;\tauthor %s;\tstate %s;\nbranches%s;\nnext\t%s;\n'
+        % (
+            rev.rev, format_date(rev.timestamp), rev.author, rev.state,
+            ''.join(['\n\t%s' % (b,) for b in rev.branches]),
+            rev.next or '',
+            )
+        )
+
+  out.append('\n\ndesc\n@@\n')
+  for rev in revisions:
+    out.append(
+        '\n\n%s\nlog\n@%s@\ntext\n@%s@\n' % (rev.rev, rev.log, rev.text,)
+        )
+
+  return (''.join(out), dead)
+
+
+def generate_repository(path, params):
+  """Create a synthetic CVS repository at PATH.
+
+  Return the path of the project directory within it, and a map
+  describing the repository."""
+
+  rng = random.Random(params['seed'])
+  os.mkdir(path)
+  os.mkdir(os.path.join(path, 'CVSROOT'))
+  project_path = os.path.join(path, 'proj')
+  os.mkdir(project_path)
+
+  size = 0
+  dead_files = 0
+  for f in xrange(params['files']):
+    directory = os.path.join(project_path, 'dir%03d' % (f % params['dirs'],))
+    (contents, dead) = generate_rcs_file(rng, params)
+    if dead:
+      directory = os.path.join(directory, 'Attic')
+      dead_files += 1
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    filename = os.path.join(directory, 'file%05d.txt,v' % (f,))
+    out = open(filename, 'wb')
+    out.write(contents)
+    out.close()
+    size += len(contents)
+
+  return (project_path, {'size' : size, 'attic_files' : dead_files})
+
+
+def run_conversion(program, project_path, workdir, jobs):
+  """Convert PROJECT_PATH using PROGRAM; return the resource usage records.
+
+  The output, log, and temporary files are written to WORKDIR."""
+
+  tmpdir = os.path.join(workdir, '%s-tmp' % (program,))
+  # The resource usage file is only left behind if the temporary
+  # directory already exists:
+  os.mkdir(tmpdir)
+  if program == 'cvs2svn':
+    output_options = ['--dumpfile=%s' % (os.path.join(workdir, 'svn.dump'),)]
+  else:
+    output_options = [
+        '--blobfile=%s' % (os.path.join(workdir, 'git-blob.dat'),),
+        '--dumpfile=%s' % (os.path.join(workdir, 'git-dump.dat'),),
+        '--username=cvs2git', '--use-external-blob-generator',
+        ]
+  command = [
+      sys.executable, os.path.join(ROOT, program),
+      '--tmpdir=%s' % (tmpdir,), '--profile-resources', '--jobs=%d' % (jobs,),
+      ] + output_options + [project_path]
+
+  log_filename = os.path.join(workdir, '%s.log' % (program,))
+  log = open(log_filename, 'w')
+  try:
+    status = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+  finally:
+    log.close()
+  if status != 0:
+    sys.stderr.write(
+        '%s failed; see %s (use --keep to keep it):\n%s\n'
+        % (program, log_filename, ' '.join(command),)
+        )
+    sys.exit(1)
+
+  f = open(os.path.join(tmpdir, config.RESOURCE_USAGE_FILE))
+  try:
+    passes = json.load(f)['passes']
+  finally:
+    f.close()
+  shutil.rmtree(tmpdir)
+  return passes
+
+
+def get_cpu_time(record):
+  cpu_time = record['cpu_time']
+  if cpu_time is None:
+    return None
+  return sum(cpu_time.values())
+
+
+def best(values):
+  values = [value for value in values if value is not None]
+  if not values:
+    return None
+  return min(values)
+
+
+def summarize_runs(runs):
+  """Return the best measurements for each pass in RUNS.
+
+  RUNS is a list of the pass records of each run of a program."""
+
+  passes = []
+  for records in zip(*runs):
+    passes.append({
+        'pass' : records[0]['pass'],
+        'name' : records[0]['name'],
+        'wall_time' : best([record['wall_time'] for record in records]),
+        'cpu_time' : best([get_cpu_time(record) for record in records]),
+        'peak_rss' : best([record['peak_rss'] for record in records]),
+        'tmpdir_size' : best([record['tmpdir_size'] for record in records]),
+        })
+  return {
+      'wall_time' : best([
+          sum([record['wall_time'] for record in records])
+          for records in runs
+          ]),
+      'passes' : passes,
+      }
+
+
+def format_size(size):
+  if size is None:
+    return '-'
+  return '%.1f MB' % (size / 1048576.0,)
+
+
+def format_time(t):
+  if t is None:
+    return '-'
+  return '%.3f s' % (t,)
+
+
+def print_summary(out, results):
+  for (program, result) in sorted(results['programs'].items()):
+    out.write('%s: %s total\n' % (program, format_time(result['wall_time']),))
+    out.write(
+        '  %-36s %10s %10s %10s %10s\n'
+        % ('pass', 'wall', 'cpu', 'peak rss', 'tmpdir',)
+        )
+    for record in result['passes']:
+      out.write(
+          '  %-36s %10s %10s %10s %10s\n'
+          % (
+              '%d %s' % (record['pass'], record['name'],),
+              format_time(record['wall_time']),
+              format_time(record['cpu_time']),
+              format_size(record['peak_rss']),
+              format_size(record['tmpdir_size']),
+              )
+          )
+
+
+def is_regression(old, new, threshold, min_difference):
+  return (
+      old is not None and new is not None
+      and new > old * (1.0 + threshold)
+      and new - old >= min_difference
+      )
+
+
+def compare_results(old_results, new_results, threshold):
+  """Print a comparison of OLD_RESULTS and NEW_RESULTS.
+
+  Return the number of regressions found."""
+
+  if old_results['repository'] != new_results['repository']:
+    sys.stdout.write(
+        'Warning: the results are for different repositories.\n'
+        )
+
+  regressions = 0
+  for (program, new) in sorted(new_results['programs'].items()):
+    old = old_results['programs'].get(program)
+    if old is None:
+      continue
+    sys.stdout.write('%s:\n' % (program,))
+    sys.stdout.write(
+        '  %-36s %10s %10s %7s %10s %10s %7s\n'
+        % ('pass', 'old wall', 'new wall', 'ratio',
+           'old rss', 'new rss', 'ratio',)
+        )
+    old_passes = dict([(record['name'], record) for record in old['passes']])
+    for record in new['passes']:
+      old_record = old_passes.get(record['name'])
+      if old_record is None:
+        continue
+      flags = []
+      columns = []
+      for (key, format, min_difference) in [
+            ('wall_time', format_time, MIN_TIME_DIFFERENCE),
+            ('peak_rss', format_size, MIN_RSS_DIFFERENCE),
+            ]:
+        (old_value, new_value) = (old_record[key], record[key])
+        if old_value and new_value is not None:
+          ratio = '%.2f' % (float(new_value) / old_value,)
+        else:
+          ratio = '-'
+        columns.extend([format(old_value), format(new_value), ratio])
+        if is_regression(old_value, new_value, threshold, min_difference):
+          flags.append(key)
+      sys.stdout.write(
+          '  %-36s %10s %10s %7s %10s %10s %7s%s\n'
+          % tuple(
+              ['%d %s' % (record['pass'], record['name'],)] + columns
+              + [flags and ('  REGRESSION (%s)' % ', '.join(flags)) or '']
+              )
+          )
+      if flags:
+        regressions += 1
+
+  return regressions
+
+
+def read_results(filename):
+  f = open(filename)
+  try:
+    results = json.load(f)
+  finally:
+    f.close()
+  if results.get('format') != RESULTS_FORMAT:
+    sys.stderr.write('%s: unknown results format\n' % (filename,))
+    sys.exit(1)
+  return results
+
+
+def usage():
+  sys.stderr.write(__doc__)
+  sys.exit(1)
+
+
+def main(args):
+  try:
+    (opts, args) = getopt.getopt(
+        args, 'h',
+        [
+            'files=', 'revisions=', 'branches=', 'branch-revisions=',
+            'tags=', 'lines=', 'delta=', 'attic=', 'dirs=', 'seed=',
+            'jobs=', 'repeat=', 'keep=', 'output=',
+            'compare', 'threshold=', 'help',
+            ]
+        )
+  except getopt.GetoptError:
+    usage()
+
+  if json is None:
+    sys.stderr.write('This script requires the Python json module.\n')
+    sys.exit(1)
+
+  params = {
+      'files' : 1000,
+      'revisions' : 20,
+      'branches' : 2,
+      'branch_revisions' : 3,
+      'tags' : 5,
+      'lines' : 100,
+      'delta' : 5,
+      'attic' : 0.1,
+      'dirs' : 20,
+      'seed' : 0,
+      }
+  jobs = 1
+  repeat = 1
+  keep = None
+  output = None
+  compare = False
+  threshold = 0.2
+  for (opt, value) in opts:
+    if opt in [
+          '--files', '--revisions', '--branches', '--branch-revisions',
+          '--tags', '--lines', '--delta', '--dirs', '--seed',
+          ]:
+      params[opt[2:].replace('-', '_')] = int(value)
+    elif opt == '--attic':
+      params['attic'] = float(value)
+    elif opt == '--jobs':
+      jobs = int(value)
+    elif opt == '--repeat':
+      repeat = int(value)
+    elif opt == '--keep':
+      keep = value
+    elif opt == '--output':
+      output = value
+    elif opt == '--compare':
+      compare = True
+    elif opt == '--threshold':
+      threshold = float(value)
+    else:
+      usage()
+
+  if compare:
+    if len(args) != 2:
+      usage()
+    regressions = compare_results(
+        read_results(args[0]), read_results(args[1]), threshold
+        )
+    if regressions:
+      sys.stdout.write('%d passes regressed.\n' % (regressions,))
+      sys.exit(1)
+    return
+
+  programs = args or PROGRAMS
+  for program in programs:
+    if program not in PROGRAMS:
+      sys.stderr.write('Unknown program %r\n' % (program,))
+      sys.exit(1)
+  if params['revisions'] < 1 or params['dirs'] < 1:
+    usage()
+
+  if keep is None:
+    workdir = tempfile.mkdtemp(prefix='cvs2svn-benchmark-')
+  else:
+    workdir = keep
+    os.makedirs(workdir)
+
+  try:
+    sys.stderr.write('Generating the repository in %s...\n' % (workdir,))
+    (project_path, repository) = generate_repository(
+        os.path.join(workdir, 'cvsrepos'), params
+        )
+    repository.update(params)
+
+    results = {
+        'format' : RESULTS_FORMAT,
+        'date' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'version' : VERSION,
+        'python' : sys.version.split()[0],
+        'platform' : sys.platform,
+        'jobs' : jobs,
+        'repository' : repository,
+        'programs' : {},
+        }
+    for program in programs:
+      runs = []
+      for i in xrange(repeat):
+        sys.stderr.write('Running %s (%d/%d)...\n' % (program, i + 1, repeat,))
+        runs.append(run_conversion(program, project_path, workdir, jobs))
+      result = summarize_runs(runs)
+      result['runs'] = runs
+      results['programs'][program] = result
+  finally:
+    if keep is None:
+      shutil.rmtree(workdir)
+
+  print_summary(sys.stderr, results)
+
+  if output is None:
+    out = sys.stdout
+  else:
+    out = open(output, 'w')
+  json.dump(results, out, indent=2, sort_keys=True)
+  out.write('\n')
+  if output is not None:
+    out.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
+
+
@@ -56,6 +56,14 @@ class AbstractRCSRevisionReader(RevisionReader):
 
     raise NotImplementedError()
 
+  def get_checkpoint_state(self):
+    # The contents are read from the RCS files each time, so there is
+    # no state to be saved:
+    return ()
+
+  def resume(self, checkpoint_state):
+    self.start()
+
   def get_content(self, cvs_rev):
     # Is EOL fixing requested?
     eol_fix = cvs_rev.get_property('_eol_fix') or None
@@ -82,6 +82,10 @@ class ArtifactManager:
     # set of artifacts needed by the pass.
     self._pass_needs = { }
 
+    # A map { pass : set_of_artifacts }, where set_of_artifacts is a
+    # set of artifacts created by the pass.
+    self._pass_creates = { }
+
     # A set of passes that are currently being executed.
     self._active_passes = set()
 
@@ -116,6 +120,7 @@ class ArtifactManager:
     # An artifact is automatically "needed" in the pass in which it is
     # created:
     self.uses(which_pass, artifact)
+    self._pass_creates.setdefault(which_pass, set()).add(artifact)
 
   def uses(self, which_pass, artifact):
     """Register that WHICH_PASS uses ARTIFACT.
@@ -165,6 +170,18 @@ class ArtifactManager:
 
     self.register_artifact_needed(basename, which_pass)
 
+  def get_pass_artifacts(self, which_pass):
+    """Return the artifacts used by WHICH_PASS, which has not finished yet.
+
+    Return a list of (artifact, created) pairs, where created is True
+    for the artifacts that are created by WHICH_PASS."""
+
+    created = self._pass_creates.get(which_pass, set())
+    return [
+        (artifact, artifact in created)
+        for artifact in self._pass_needs.get(which_pass, [])
+        ]
+
   def _unregister_artifacts(self, which_pass):
     """Unregister any artifacts that were needed for WHICH_PASS.
 
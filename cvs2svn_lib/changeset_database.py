@@ -17,6 +17,7 @@
 """This module contains classes to store changesets."""
 
 
+from cvs2svn_lib.common import DB_OPEN_NEW
 from cvs2svn_lib.changeset import Changeset
 from cvs2svn_lib.changeset import RevisionChangeset
 from cvs2svn_lib.changeset import OrderedChangeset
@@ -26,6 +27,8 @@ from cvs2svn_lib.changeset import TagChangeset
 from cvs2svn_lib.record_table import UnsignedIntegerPacker
 from cvs2svn_lib.record_table import MmapRecordTable
 from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import OverlayRecordTable
+from cvs2svn_lib.record_table import is_overlay_file
 from cvs2svn_lib.indexed_database import IndexedStore
 from cvs2svn_lib.serializer import PrimedPickleSerializer
 
@@ -38,11 +41,42 @@ from cvs2svn_lib.serializer import PrimedPickleSerializer
 use_mmap_for_cvs_item_to_changeset_table = False
 
 
-def CVSItemToChangesetTable(filename, mode):
-  if use_mmap_for_cvs_item_to_changeset_table:
-    return MmapRecordTable(filename, mode, UnsignedIntegerPacker())
+def CVSItemToChangesetTable(
+      filename, mode, base_filename=None, use_mmap=None
+      ):
+  """Open the table mapping CVSItem ids to changeset ids in FILENAME.
+
+  If BASE_FILENAME is specified (which requires MODE to be
+  DB_OPEN_NEW), the new table starts out as a copy of the table in
+  BASE_FILENAME, but only the entries that are changed are stored in
+  FILENAME.  Such an overlay table (see OverlayRecordTable) can only
+  be read while the file of the first plain table that it derives
+  from still exists.
+
+  If USE_MMAP is True, the table (or the base table of an overlay) is
+  memory mapped; if it is None, use_mmap_for_cvs_item_to_changeset_table
+  decides."""
+
+  if use_mmap is None:
+    use_mmap = use_mmap_for_cvs_item_to_changeset_table
+
+  if use_mmap:
+    table_class = MmapRecordTable
+  else:
+    table_class = RecordTable
+
+  if base_filename is not None:
+    assert mode == DB_OPEN_NEW
+    return OverlayRecordTable(
+        filename, mode, UnsignedIntegerPacker(), base_filename,
+        base_class=table_class,
+        )
+  elif mode != DB_OPEN_NEW and is_overlay_file(filename):
+    return OverlayRecordTable(
+        filename, mode, UnsignedIntegerPacker(), base_class=table_class
+        )
   else:
-    return RecordTable(filename, mode, UnsignedIntegerPacker())
+    return table_class(filename, mode, UnsignedIntegerPacker())
 
 
 class ChangesetDatabase(IndexedStore):
@@ -18,12 +18,26 @@
 
 
 import heapq
+from array import array
+from collections import deque
 
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.context import Ctx
 from cvs2svn_lib.log import logger
+from cvs2svn_lib.time_range import TimeRange
 from cvs2svn_lib.changeset import RevisionChangeset
 from cvs2svn_lib.changeset import OrderedChangeset
 from cvs2svn_lib.changeset import BranchChangeset
 from cvs2svn_lib.changeset import TagChangeset
+from cvs2svn_lib.changeset_graph_node import ChangesetGraphNode
+from cvs2svn_lib.changeset_graph_snapshot import ChangesetGraphSnapshotWriter
+
+
+# The ways in which the nodes of a ChangesetGraph can be stored (see
+# create_changeset_graph()):
+GRAPH_BACKEND_DICT = 'dict'
+GRAPH_BACKEND_COMPACT = 'compact'
+GRAPH_BACKENDS = [GRAPH_BACKEND_DICT, GRAPH_BACKEND_COMPACT]
 
 
 class CycleInGraphException(Exception):
@@ -39,6 +53,49 @@ class NoPredNodeInGraphException(Exception):
     Exception.__init__(self, 'Node %s has no predecessors' % (node,))
 
 
+class CycleBreakingStatistics(object):
+  """Counters describing the cycles that consume_graph() has broken."""
+
+  def __init__(self):
+    # The number of times that the whole graph was searched for
+    # cycles (after consuming all of the nodes that were ready):
+    self.rounds = 0
+    # The number of strongly connected components in which cycles
+    # were broken:
+    self.components = 0
+    # The number of cycles that were passed to the cycle breaker:
+    self.cycles = 0
+    # The number of changesets that the cycle breaker deleted (i.e.,
+    # split), and the number that it added:
+    self.splits = 0
+    self.new_changesets = 0
+
+  def add(self, other):
+    self.rounds += other.rounds
+    self.components += other.components
+    self.cycles += other.cycles
+    self.splits += other.splits
+    self.new_changesets += other.new_changesets
+
+
+# The statistics of all ChangesetGraphs closed since the last call to
+# pop_cycle_breaking_statistics():
+_cycle_breaking_statistics = CycleBreakingStatistics()
+
+
+def pop_cycle_breaking_statistics():
+  """Return the cycle breaking statistics collected so far.
+
+  The statistics are reset, so the next call only reports on
+  ChangesetGraphs that are closed after this call."""
+
+  global _cycle_breaking_statistics
+
+  retval = _cycle_breaking_statistics
+  _cycle_breaking_statistics = CycleBreakingStatistics()
+  return retval
+
+
 class _NoPredNodes(object):
   """Manage changesets that are ready to be processed.
 
@@ -47,48 +104,72 @@ class _NoPredNodes(object):
   def __init__(self, changeset_db, initial_nodes):
     """Initialize.
 
-    INITIAL_NODES is an iterable over node to add to this object on
-    initialization."""
+    INITIAL_NODES is an iterable over (id, time_range) pairs of the
+    nodes to add to this object on initialization."""
 
     self.changeset_db = changeset_db
 
-    # A heapified list of (node.time_range, changeset, node) tuples
+    # A heapified list of (time_range, changeset) tuples for the nodes
     # that have no predecessors.  These tuples sort in the desired
     # commit order:
     self._nodes = [
-      (node.time_range, self.changeset_db[node.id], node)
-      for node in initial_nodes
+      (time_range, self.changeset_db[id])
+      for (id, time_range) in initial_nodes
       ]
     heapq.heapify(self._nodes)
 
   def __len__(self):
     return len(self._nodes)
 
-  def add(self, node):
-    node = (node.time_range, self.changeset_db[node.id], node)
-    heapq.heappush(self._nodes, node)
+  def add(self, id, time_range):
+    heapq.heappush(self._nodes, (time_range, self.changeset_db[id]))
 
   def get(self):
-    """Return (node, changeset,) of the next node to be committed.
+    """Return (changeset, time_range,) of the next node to be committed.
 
     'Smallest' is defined by the ordering of the tuples in
     self._nodes; namely, the changeset with the earliest time_range,
     with ties broken by comparing the changesets themselves."""
 
-    (time_range, changeset, node) = heapq.heappop(self._nodes)
-    return (node, changeset)
+    (time_range, changeset) = heapq.heappop(self._nodes)
+    return (changeset, time_range)
 
 
 class ChangesetGraph(object):
-  """A graph of changesets and their dependencies."""
+  """A graph of changesets and their dependencies.
+
+  This class implements the algorithms that work on the graph.  The
+  nodes themselves are stored by a subclass, which implements the
+  methods that raise NotImplementedError here.  Use
+  create_changeset_graph() to create a graph of the kind selected by
+  Ctx().changeset_graph_backend."""
 
   def __init__(self, changeset_db, cvs_item_to_changeset_id):
     self._changeset_db = changeset_db
     self._cvs_item_to_changeset_id = cvs_item_to_changeset_id
-    # A map { id : ChangesetGraphNode }
-    self.nodes = {}
+    # While consume_graph() is breaking cycles, a list of the ids of
+    # the changesets that are added by add_new_changeset():
+    self._added_ids = None
+    self.statistics = CycleBreakingStatistics()
+    self._snapshot_writer = None
+
+  def write_snapshot(self, filename):
+    """Write the final state of this graph to FILENAME when it is closed.
+
+    This method must be called before any nodes are added.  The graph
+    can be consumed in the meantime; the snapshot contains the nodes
+    that were added and not deleted by delete_changeset(), with the
+    dependencies among them.  It can be read using
+    load_changeset_graph_snapshot()."""
+
+    assert not self
+    self._snapshot_writer = ChangesetGraphSnapshotWriter(filename)
 
   def close(self):
+    if self._snapshot_writer is not None:
+      self._snapshot_writer.close()
+      self._snapshot_writer = None
+    _cycle_breaking_statistics.add(self.statistics)
     self._cvs_item_to_changeset_id.close()
     self._cvs_item_to_changeset_id = None
     self._changeset_db.close()
@@ -100,28 +181,28 @@ class ChangesetGraph(object):
     Determine and record any dependencies to changesets that are
     already in the graph.  This method does not affect the databases."""
 
-    node = changeset.create_graph_node(self._cvs_item_to_changeset_id)
+    self.add_node(
+        changeset.create_graph_node(self._cvs_item_to_changeset_id)
+        )
 
-    # Now tie the node into our graph.  If a changeset referenced by
-    # node is already in our graph, then add the backwards connection
-    # from the other node to the new one.  If not, then delete the
-    # changeset from node.
+  def add_node(self, node):
+    """Add the ChangesetGraphNode NODE to this graph.
 
-    for pred_id in list(node.pred_ids):
-      pred_node = self.nodes.get(pred_id)
-      if pred_node is not None:
-        pred_node.succ_ids.add(node.id)
-      else:
-        node.pred_ids.remove(pred_id)
+    NODE must have been created by the create_graph_node() method of
+    its changeset, using the current contents of
+    self._cvs_item_to_changeset_id.  Its dependencies on changesets
+    that are not in the graph are ignored."""
 
-    for succ_id in list(node.succ_ids):
-      succ_node = self.nodes.get(succ_id)
-      if succ_node is not None:
-        succ_node.pred_ids.add(node.id)
-      else:
-        node.succ_ids.remove(succ_id)
+    if self._snapshot_writer is not None:
+      self._snapshot_writer.add_node(node)
+    self._add_node(node)
 
-    self.nodes[node.id] = node
+  def _add_node(self, node):
+    """Add NODE to this graph (see add_node()).
+
+    NODE may be modified."""
+
+    raise NotImplementedError()
 
   def store_changeset(self, changeset):
     for cvs_item_id in changeset.cvs_item_ids:
@@ -136,6 +217,8 @@ class ChangesetGraph(object):
 
     self.add_changeset(changeset)
     self.store_changeset(changeset)
+    if self._added_ids is not None:
+      self._added_ids.append(changeset.id)
 
   def delete_changeset(self, changeset):
     """Remove CHANGESET from the graph and also from the databases.
@@ -150,47 +233,77 @@ class ChangesetGraph(object):
 
     del self[changeset.id]
     del self._changeset_db[changeset.id]
+    if self._snapshot_writer is not None:
+      self._snapshot_writer.delete_node(changeset.id)
+    if self._added_ids is not None:
+      self.statistics.splits += 1
 
   def __nonzero__(self):
     """Instances are considered True iff they contain any nodes."""
 
-    return bool(self.nodes)
+    raise NotImplementedError()
 
   def __contains__(self, id):
     """Return True if the specified ID is contained in this graph."""
 
-    return id in self.nodes
+    raise NotImplementedError()
 
   def __getitem__(self, id):
-    return self.nodes[id]
+    """Return the ChangesetGraphNode for ID.
+
+    Raise KeyError if ID is not in the graph."""
+
+    raise NotImplementedError()
 
   def get(self, id):
-    return self.nodes.get(id)
+    if id in self:
+      return self[id]
+    else:
+      return None
 
   def __delitem__(self, id):
     """Remove the node corresponding to ID.
 
     Also remove references to it from other nodes.  This method does
-    not change pred_ids or succ_ids of the node being deleted, nor
-    does it affect the databases."""
+    not affect the databases."""
 
-    node = self[id]
+    raise NotImplementedError()
 
-    for succ_id in node.succ_ids:
-      succ = self[succ_id]
-      succ.pred_ids.remove(node.id)
+  def keys(self):
+    raise NotImplementedError()
 
-    for pred_id in node.pred_ids:
-      pred = self[pred_id]
-      pred.succ_ids.remove(node.id)
+  def __iter__(self):
+    """Iterate over the ChangesetGraphNodes in the graph."""
 
-    del self.nodes[node.id]
+    raise NotImplementedError()
 
-  def keys(self):
-    return self.nodes.keys()
+  def get_pred_ids(self, id):
+    """Return an iterable over the ids of the predecessors of node ID."""
 
-  def __iter__(self):
-    return self.nodes.itervalues()
+    raise NotImplementedError()
+
+  def get_succ_ids(self, id):
+    """Return an iterable over the ids of the successors of node ID."""
+
+    raise NotImplementedError()
+
+  def has_pred_ids(self, id):
+    """Return True iff node ID has any predecessors."""
+
+    raise NotImplementedError()
+
+  def get_time_range(self, id):
+    """Return the TimeRange of node ID."""
+
+    raise NotImplementedError()
+
+  def iter_nopred_ids(self):
+    """Iterate over the ids of the nodes that have no predecessors.
+
+    The graph keeps track of these nodes as they are added and
+    removed, so this does not have to look at the whole graph."""
+
+    raise NotImplementedError()
 
   def _get_path(self, reachable_changesets, starting_node_id, ending_node_id):
     """Return the shortest path from ENDING_NODE_ID to STARTING_NODE_ID.
@@ -237,15 +350,14 @@ class ChangesetGraph(object):
     # only included as a key if there is a loop leading back to it.
     reachable_changesets = {}
 
-    # A list of (node_id, steps) that still have to be investigated,
+    # A queue of (node_id, steps) that still have to be investigated,
     # and STEPS is the number of steps to get to NODE_ID.
-    open_nodes = [(starting_node_id, 0)]
+    open_nodes = deque([(starting_node_id, 0)])
     # A breadth-first search:
     while open_nodes:
-      (id, steps) = open_nodes.pop(0)
+      (id, steps) = open_nodes.popleft()
       steps += 1
-      node = self[id]
-      for pred_id in node.pred_ids:
+      for pred_id in self.get_pred_ids(id):
         # Since the search is breadth-first, we only have to set steps
         # that don't already exist.
         if pred_id not in reachable_changesets:
@@ -278,65 +390,210 @@ class ChangesetGraph(object):
     The graph should not be otherwise altered while this generator is
     running."""
 
-    # Find a list of (node,changeset,) where the node has no
-    # predecessors:
+    # Find the nodes that have no predecessors:
     nopred_nodes = _NoPredNodes(
       self._changeset_db,
       (
-          node
-          for node in self.nodes.itervalues()
-          if not node.pred_ids
+          (id, self.get_time_range(id))
+          for id in self.iter_nopred_ids()
           ),
       )
 
     while nopred_nodes:
-      (node, changeset,) = nopred_nodes.get()
-      del self[node.id]
+      (changeset, time_range,) = nopred_nodes.get()
+      succ_ids = list(self.get_succ_ids(changeset.id))
+      del self[changeset.id]
       # See if any successors are now ready for extraction:
-      for succ_id in node.succ_ids:
-        succ = self[succ_id]
-        if not succ.pred_ids:
-          nopred_nodes.add(succ)
-      yield (changeset, node.time_range)
+      for succ_id in succ_ids:
+        if not self.has_pred_ids(succ_id):
+          nopred_nodes.add(succ_id, self.get_time_range(succ_id))
+      yield (changeset, time_range)
 
-  def find_cycle(self, starting_node_id):
+  def find_cycle(self, starting_node_id, component=None):
     """Find a cycle in the dependency graph and return it.
 
     Use STARTING_NODE_ID as the place to start looking.  This routine
-    must only be called after all nopred_nodes have been removed.
-    Return the list of changesets that are involved in the cycle
-    (ordered such that cycle[n-1] is a predecessor of cycle[n] and
-    cycle[-1] is a predecessor of cycle[0])."""
+    must only be called after all nopred_nodes have been removed.  If
+    COMPONENT is specified, it is the set of ids of the strongly
+    connected component that contains STARTING_NODE_ID, and the cycle
+    is looked for within it.  Return the list of changesets that are
+    involved in the cycle (ordered such that cycle[n-1] is a
+    predecessor of cycle[n] and cycle[-1] is a predecessor of
+    cycle[0])."""
 
     # Since there are no nopred nodes in the graph, all nodes in the
     # graph must either be involved in a cycle or depend (directly or
-    # indirectly) on nodes that are in a cycle.
+    # indirectly) on nodes that are in a cycle.  Similarly, each node
+    # in a (nontrivial) strongly connected component has a predecessor
+    # within the component.
 
     # Pick an arbitrary node:
-    node = self[starting_node_id]
+    node_id = starting_node_id
+
+    seen_node_ids = [node_id]
 
-    seen_nodes = [node]
+    # A map { node_id : index in seen_node_ids }:
+    seen_indexes = {node_id : 0}
 
     # Follow it backwards until a node is seen a second time; then we
     # have our cycle.
     while True:
       # Pick an arbitrary predecessor of node.  It must exist, because
       # there are no nopred nodes:
-      try:
-        node_id = node.pred_ids.__iter__().next()
-      except StopIteration:
-        raise NoPredNodeInGraphException(node)
-      node = self[node_id]
-      try:
-        i = seen_nodes.index(node)
-      except ValueError:
-        seen_nodes.append(node)
+      for pred_id in self.get_pred_ids(node_id):
+        if component is None or pred_id in component:
+          break
       else:
-        seen_nodes = seen_nodes[i:]
-        seen_nodes.reverse()
-        return [self._changeset_db[node.id] for node in seen_nodes]
-
-  def consume_graph(self, cycle_breaker=None):
+        raise NoPredNodeInGraphException(self[node_id])
+      node_id = pred_id
+      i = seen_indexes.get(node_id)
+      if i is None:
+        seen_indexes[node_id] = len(seen_node_ids)
+        seen_node_ids.append(node_id)
+      else:
+        seen_node_ids = seen_node_ids[i:]
+        seen_node_ids.reverse()
+        return [self._changeset_db[id] for id in seen_node_ids]
+
+  def find_disjoint_cycles(self, component):
+    """Find a maximal set of vertex-disjoint cycles within COMPONENT.
+
+    COMPONENT is a list of the ids of the nodes of a strongly connected
+    component.  Return a list of cycles, each in the format returned by
+    find_cycle(), such that no two of them involve the same node, and
+    every other cycle within COMPONENT involves a node of one of them.
+
+    This is a depth-first search along predecessors.  When the search
+    returns to a node that is on the current path, the nodes from
+    there on form a cycle; they are removed from the path and excluded
+    from the rest of the search.  A node whose predecessors have all
+    been searched cannot be in any further cycle, so it is also
+    excluded.  Each node is thus added to the path at most once."""
+
+    members = set(component)
+
+    # The nodes that are in one of the cycles found so far, or that
+    # cannot be in any more cycles:
+    finished = set()
+
+    cycles = []
+
+    for start_id in component:
+      if start_id in finished:
+        continue
+
+      # The path being followed, as a list of (node_id, iterator over
+      # its pred_ids).  Each node is a predecessor of the one before it:
+      path = [(start_id, iter(self.get_pred_ids(start_id)))]
+      # A map { node_id : index in path }:
+      path_indexes = {start_id : 0}
+
+      while path:
+        (node_id, pred_ids) = path[-1]
+        for pred_id in pred_ids:
+          if pred_id not in members or pred_id in finished:
+            continue
+
+          i = path_indexes.get(pred_id)
+          if i is None:
+            path_indexes[pred_id] = len(path)
+            path.append((pred_id, iter(self.get_pred_ids(pred_id))))
+          else:
+            # The nodes path[i:] form a cycle:
+            cycle_ids = [id for (id, ignored) in path[i:]]
+            del path[i:]
+            for id in cycle_ids:
+              del path_indexes[id]
+            finished.update(cycle_ids)
+            cycle_ids.reverse()
+            cycles.append([self._changeset_db[id] for id in cycle_ids])
+          break
+        else:
+          # All predecessors of node_id have been searched:
+          path.pop()
+          del path_indexes[node_id]
+          finished.add(node_id)
+
+    return cycles
+
+  def get_strongly_connected_components(self, ids=None):
+    """Return the nontrivial strongly connected components of the graph.
+
+    Return a list of lists of node ids.  Each list contains the ids of
+    a set of nodes that are all involved in cycles with each other;
+    every cycle in the graph lies within one of the lists.  If IDS is
+    specified, only consider the subgraph made up of the nodes with
+    those ids.
+
+    This is Tarjan's algorithm, which takes time linear in the number
+    of nodes and dependencies.  It is written iteratively because the
+    depth of the search can exceed Python's recursion limit."""
+
+    if ids is None:
+      ids = self.keys()
+      members = None
+    else:
+      members = set(ids)
+
+    # Maps { node_id : int } of the order in which the nodes were
+    # visited, and of the lowest such index of a node that is known to
+    # be reachable from each node and still on the stack:
+    indexes = {}
+    lowlinks = {}
+
+    # The nodes that have been visited but not yet assigned to a
+    # component, and the same thing as a set:
+    stack = []
+    on_stack = set()
+
+    components = []
+
+    for root_id in ids:
+      if root_id in indexes:
+        continue
+
+      indexes[root_id] = lowlinks[root_id] = len(indexes)
+      stack.append(root_id)
+      on_stack.add(root_id)
+
+      # A stack of (node_id, iterator over its pred_ids) for the nodes
+      # that are being searched:
+      work = [(root_id, iter(self.get_pred_ids(root_id)))]
+      while work:
+        (node_id, pred_ids) = work[-1]
+        for pred_id in pred_ids:
+          if members is not None and pred_id not in members:
+            continue
+          if pred_id not in indexes:
+            indexes[pred_id] = lowlinks[pred_id] = len(indexes)
+            stack.append(pred_id)
+            on_stack.add(pred_id)
+            work.append((pred_id, iter(self.get_pred_ids(pred_id))))
+            break
+          elif pred_id in on_stack:
+            lowlinks[node_id] = min(lowlinks[node_id], indexes[pred_id])
+        else:
+          # All predecessors of node_id have been searched:
+          work.pop()
+          if work:
+            parent_id = work[-1][0]
+            lowlinks[parent_id] = min(lowlinks[parent_id], lowlinks[node_id])
+
+          if lowlinks[node_id] == indexes[node_id]:
+            # node_id is the root of a strongly connected component,
+            # which consists of it and the nodes above it on the stack:
+            i = len(stack) - 1
+            while stack[i] != node_id:
+              i -= 1
+            component = stack[i:]
+            del stack[i:]
+            on_stack.difference_update(component)
+            if len(component) > 1:
+              components.append(component)
+
+    return components
+
+  def consume_graph(self, cycle_breaker=None, batch=False):
     """Remove and yield changesets from this graph in dependency order.
 
     Each iteration, this generator yields a (changeset, time_range)
@@ -346,7 +603,13 @@ class ChangesetGraph(object):
     is the list of changesets that are involved in the cycle (ordered
     such that cycle[n-1] is a predecessor of cycle[n] and cycle[-1] is
     a predecessor of cycle[0]).  CYCLE_BREAKER should break the cycle
-    in place then return.
+    in place, using delete_changeset() and add_new_changeset() to
+    update the graph, then return.
+
+    If BATCH is True, then break a maximal set of vertex-disjoint
+    cycles of each strongly connected component (see
+    find_disjoint_cycles()) before examining the component again.
+    Otherwise, break one cycle at a time.
 
     If a cycle is found and CYCLE_BREAKER was not specified, raise
     CycleInGraphException."""
@@ -355,25 +618,54 @@ class ChangesetGraph(object):
       for (changeset, time_range) in self.consume_nopred_nodes():
         yield (changeset, time_range)
 
-      # If there are any nodes left in the graph, then there must be
-      # at least one cycle.  Find a cycle and process it.
-
-      # This might raise StopIteration, but that indicates that the
-      # graph has been fully consumed, so we just let the exception
-      # escape.
-      start_node_id = self.nodes.iterkeys().next()
-
-      cycle = self.find_cycle(start_node_id)
+      if not self:
+        # The graph has been fully consumed.
+        return
 
-      if cycle_breaker is not None:
-        cycle_breaker(cycle)
-      else:
-        raise CycleInGraphException(cycle)
+      # If there are any nodes left in the graph, then there must be
+      # at least one cycle.  Rather than looking for one cycle at a
+      # time, find all of the strongly connected components, and break
+      # all of the cycles within each one before consuming more nodes.
+      components = self.get_strongly_connected_components()
+      assert components
+      self.statistics.rounds += 1
+
+      if cycle_breaker is None:
+        component = components[0]
+        raise CycleInGraphException(
+            self.find_cycle(component[0], set(component))
+            )
+
+      while components:
+        component = components.pop()
+        if batch:
+          cycles = self.find_disjoint_cycles(component)
+        else:
+          cycles = [self.find_cycle(component[0], set(component))]
+
+        self._added_ids = []
+        for cycle in cycles:
+          cycle_breaker(cycle)
+        added_ids = self._added_ids
+        self._added_ids = None
+
+        self.statistics.components += 1
+        self.statistics.cycles += len(cycles)
+        self.statistics.new_changesets += len(added_ids)
+
+        # The changesets that were created to break the cycles only
+        # have dependencies that the broken ones had, so they cannot
+        # be in cycles with the nodes of other components.  Only the
+        # remaining nodes of this component and the new nodes need to
+        # be examined again:
+        ids = [id for id in component if id in self]
+        ids.extend([id for id in added_ids if id in self])
+        components.extend(self.get_strongly_connected_components(ids))
 
   def __repr__(self):
     """For convenience only.  The format is subject to change at any time."""
 
-    if self.nodes:
+    if self:
       return 'ChangesetGraph:\n%s' \
              % ''.join(['  %r\n' % node for node in self])
     else:
@@ -442,3 +734,439 @@ class ChangesetGraph(object):
     f.write('}\n')
 
 
+class DictChangesetGraph(ChangesetGraph):
+  """A ChangesetGraph that stores a ChangesetGraphNode for each node."""
+
+  def __init__(self, changeset_db, cvs_item_to_changeset_id):
+    ChangesetGraph.__init__(self, changeset_db, cvs_item_to_changeset_id)
+    # A map { id : ChangesetGraphNode }
+    self.nodes = {}
+    # The set of ids of the nodes that have no predecessors:
+    self._nopred_ids = set()
+
+  def _add_node(self, node):
+    # Tie the node into our graph.  If a changeset referenced by
+    # node is already in our graph, then add the backwards connection
+    # from the other node to the new one.  If not, then delete the
+    # changeset from node.
+
+    for pred_id in list(node.pred_ids):
+      pred_node = self.nodes.get(pred_id)
+      if pred_node is not None:
+        pred_node.succ_ids.add(node.id)
+      else:
+        node.pred_ids.remove(pred_id)
+
+    for succ_id in list(node.succ_ids):
+      succ_node = self.nodes.get(succ_id)
+      if succ_node is not None:
+        succ_node.pred_ids.add(node.id)
+        self._nopred_ids.discard(succ_id)
+      else:
+        node.succ_ids.remove(succ_id)
+
+    self.nodes[node.id] = node
+    if not node.pred_ids:
+      self._nopred_ids.add(node.id)
+
+  def __nonzero__(self):
+    return bool(self.nodes)
+
+  def __contains__(self, id):
+    return id in self.nodes
+
+  def __getitem__(self, id):
+    return self.nodes[id]
+
+  def get(self, id):
+    return self.nodes.get(id)
+
+  def __delitem__(self, id):
+    """Remove the node corresponding to ID.
+
+    Also remove references to it from other nodes.  This method does
+    not change pred_ids or succ_ids of the node being deleted, nor
+    does it affect the databases."""
+
+    node = self[id]
+
+    for succ_id in node.succ_ids:
+      succ = self[succ_id]
+      succ.pred_ids.remove(node.id)
+      if not succ.pred_ids:
+        self._nopred_ids.add(succ_id)
+
+    for pred_id in node.pred_ids:
+      pred = self[pred_id]
+      pred.succ_ids.remove(node.id)
+
+    del self.nodes[node.id]
+    self._nopred_ids.discard(node.id)
+
+  def keys(self):
+    return self.nodes.keys()
+
+  def __iter__(self):
+    return self.nodes.itervalues()
+
+  def get_pred_ids(self, id):
+    return self.nodes[id].pred_ids
+
+  def get_succ_ids(self, id):
+    return self.nodes[id].succ_ids
+
+  def has_pred_ids(self, id):
+    return bool(self.nodes[id].pred_ids)
+
+  def get_time_range(self, id):
+    return self.nodes[id].time_range
+
+  def iter_nopred_ids(self):
+    return list(self._nopred_ids)
+
+
+class CompactChangesetGraph(ChangesetGraph):
+  """A ChangesetGraph that stores its nodes in arrays of integers.
+
+  A DictChangesetGraph needs a ChangesetGraphNode and two sets for
+  each node, which adds up to several gigabytes for a repository with
+  millions of changesets.  This class instead keeps the per-node data
+  in arrays indexed by changeset id, and the dependencies in
+  compressed sparse row (CSR) form: the predecessors of node ID are
+
+      self._pred_targets[self._pred_offsets[ID]:self._pred_offsets[ID + 1]]
+
+  and its successors are stored likewise in self._succ_offsets and
+  self._succ_targets.  The CSR arrays are built the first time that
+  the graph is queried, from the dependencies that were collected
+  while the changesets were added.
+
+  A node is deleted by marking it as such in self._states (a
+  tombstone); dependencies on deleted nodes are skipped whenever the
+  arrays are read.  Dependencies that are added after the arrays have
+  been built (e.g., those of the changesets that are created to break
+  cycles) are kept in an overflow area.  When the overflow area and
+  the dependencies on deleted nodes make up a large enough part of
+  the graph, the arrays are rebuilt.
+
+  ChangesetGraphNodes are only created on demand, by __getitem__()
+  and __iter__().  They are copies, which do not change when the
+  graph changes."""
+
+  # The values in self._states:
+  _ABSENT = 0
+  _PRESENT = 1
+  _DELETED = 2
+
+  # Don't rebuild the arrays for fewer than this many obsolete
+  # dependencies:
+  _MIN_REBUILD = 10000
+
+  def __init__(self, changeset_db, cvs_item_to_changeset_id):
+    ChangesetGraph.__init__(self, changeset_db, cvs_item_to_changeset_id)
+
+    # Per-node data, indexed by changeset id.  self._states holds
+    # _ABSENT, _PRESENT, or _DELETED; self._pred_counts the number of
+    # predecessors that are still in the graph:
+    self._states = array('b')
+    self._t_mins = array('d')
+    self._t_maxs = array('d')
+    self._pred_counts = array('l')
+
+    # The number of nodes that are in the graph:
+    self._node_count = 0
+
+    # The set of ids of the nodes that have no predecessors:
+    self._nopred_ids = set()
+
+    # Dependencies that have not been added to the CSR arrays yet, as
+    # two parallel arrays of predecessor and successor ids.  None once
+    # the CSR arrays have been built:
+    self._new_pred_ids = array('l')
+    self._new_succ_ids = array('l')
+
+    # The CSR arrays, which cover the ids less than self._csr_size:
+    self._csr_size = 0
+    self._pred_offsets = array('l', [0])
+    self._pred_targets = array('l')
+    self._succ_offsets = array('l', [0])
+    self._succ_targets = array('l')
+
+    # The overflow area, maps { id : [id, ...] } of the dependencies
+    # that were added after the CSR arrays were built:
+    self._overflow_pred_ids = {}
+    self._overflow_succ_ids = {}
+
+    # The number of dependencies in the overflow area, and the number
+    # of dependencies in the CSR arrays or in the overflow area that
+    # involve deleted nodes:
+    self._overflow_count = 0
+    self._dead_count = 0
+
+  def _grow(self, id):
+    """Make the per-node arrays big enough to hold ID."""
+
+    n = len(self._states)
+    if id >= n:
+      extra = max(id + 1 - n, n // 2, 1024)
+      self._states.extend(array('b', [self._ABSENT]) * extra)
+      self._t_mins.extend(array('d', [0.0]) * extra)
+      self._t_maxs.extend(array('d', [0.0]) * extra)
+      self._pred_counts.extend(array('l', [0]) * extra)
+
+  def _get_offsets(self, ids):
+    """Return an array of CSR offsets for dependencies grouped by IDS."""
+
+    n = len(self._states)
+    offsets = array('l', [0]) * (n + 1)
+    for id in ids:
+      offsets[id + 1] += 1
+    total = 0
+    for i in xrange(1, n + 1):
+      total += offsets[i]
+      offsets[i] = total
+    return offsets
+
+  def _fill_targets(self, offsets, ids, targets):
+    """Return the CSR array of TARGETS, grouped by IDS using OFFSETS."""
+
+    retval = array('l', [0]) * len(targets)
+    positions = array('l', offsets)
+    for i in xrange(len(ids)):
+      id = ids[i]
+      j = positions[id]
+      retval[j] = targets[i]
+      positions[id] = j + 1
+    return retval
+
+  def _build(self):
+    """Build the CSR arrays from self._new_pred_ids and self._new_succ_ids."""
+
+    pred_ids = self._new_pred_ids
+    succ_ids = self._new_succ_ids
+    self._new_pred_ids = None
+    self._new_succ_ids = None
+
+    # Release the old arrays before allocating new ones:
+    self._pred_offsets = self._pred_targets = None
+    self._succ_offsets = self._succ_targets = None
+
+    self._pred_offsets = self._get_offsets(succ_ids)
+    self._pred_targets = self._fill_targets(
+        self._pred_offsets, succ_ids, pred_ids
+        )
+    self._succ_offsets = self._get_offsets(pred_ids)
+    self._succ_targets = self._fill_targets(
+        self._succ_offsets, pred_ids, succ_ids
+        )
+    self._csr_size = len(self._states)
+
+    self._overflow_pred_ids = {}
+    self._overflow_succ_ids = {}
+    self._overflow_count = 0
+    self._dead_count = 0
+
+  def _ensure_built(self):
+    if self._new_pred_ids is not None:
+      self._build()
+
+  def _rebuild(self):
+    """Rebuild the CSR arrays, leaving out the obsolete dependencies."""
+
+    pred_ids = array('l')
+    succ_ids = array('l')
+    states = self._states
+    for id in xrange(len(states)):
+      if states[id] == self._PRESENT:
+        for succ_id in self.get_succ_ids(id):
+          pred_ids.append(id)
+          succ_ids.append(succ_id)
+
+    self._new_pred_ids = pred_ids
+    self._new_succ_ids = succ_ids
+    self._build()
+
+  def _check_rebuild(self):
+    """Rebuild the CSR arrays if most of the dependencies are obsolete.
+
+    A dependency is obsolete if it is in the overflow area or if it
+    involves a deleted node."""
+
+    obsolete = self._overflow_count + self._dead_count
+    total = len(self._pred_targets) + self._overflow_count
+    if obsolete >= self._MIN_REBUILD and 4 * obsolete >= 3 * total:
+      self._rebuild()
+
+  def _get_neighbors(self, id, offsets, targets, overflow):
+    states = self._states
+    if id < self._csr_size:
+      retval = [
+          other_id
+          for other_id in targets[offsets[id]:offsets[id + 1]]
+          if states[other_id] == self._PRESENT
+          ]
+    else:
+      retval = []
+    extra = overflow.get(id)
+    if extra:
+      retval.extend([
+          other_id
+          for other_id in extra
+          if states[other_id] == self._PRESENT
+          ])
+    return retval
+
+  def _add_node(self, node):
+    id = node.id
+
+    self._grow(id)
+    if self._states[id] == self._DELETED:
+      # The arrays might still contain dependencies on the old node
+      # with this id; get rid of them:
+      self._ensure_built()
+      self._rebuild()
+
+    states = self._states
+    n = len(states)
+    pred_ids = [
+        pred_id
+        for pred_id in node.pred_ids
+        if pred_id < n and states[pred_id] == self._PRESENT
+        ]
+    succ_ids = [
+        succ_id
+        for succ_id in node.succ_ids
+        if succ_id < n and states[succ_id] == self._PRESENT
+        ]
+
+    if self._new_pred_ids is not None:
+      for pred_id in pred_ids:
+        self._new_pred_ids.append(pred_id)
+        self._new_succ_ids.append(id)
+      for succ_id in succ_ids:
+        self._new_pred_ids.append(id)
+        self._new_succ_ids.append(succ_id)
+    else:
+      if pred_ids:
+        self._overflow_pred_ids[id] = pred_ids
+      for pred_id in pred_ids:
+        self._overflow_succ_ids.setdefault(pred_id, []).append(id)
+      if succ_ids:
+        self._overflow_succ_ids[id] = succ_ids
+      for succ_id in succ_ids:
+        self._overflow_pred_ids.setdefault(succ_id, []).append(id)
+      self._overflow_count += len(pred_ids) + len(succ_ids)
+
+    for succ_id in succ_ids:
+      self._pred_counts[succ_id] += 1
+      self._nopred_ids.discard(succ_id)
+
+    self._states[id] = self._PRESENT
+    self._t_mins[id] = node.time_range.t_min
+    self._t_maxs[id] = node.time_range.t_max
+    self._pred_counts[id] = len(pred_ids)
+    self._node_count += 1
+    if not pred_ids:
+      self._nopred_ids.add(id)
+
+    if self._new_pred_ids is None:
+      self._check_rebuild()
+
+  def __nonzero__(self):
+    return self._node_count > 0
+
+  def __contains__(self, id):
+    return 0 <= id < len(self._states) and self._states[id] == self._PRESENT
+
+  def __getitem__(self, id):
+    if id not in self:
+      raise KeyError(id)
+
+    return ChangesetGraphNode(
+        id, self.get_time_range(id),
+        set(self.get_pred_ids(id)), set(self.get_succ_ids(id)),
+        )
+
+  def __delitem__(self, id):
+    if id not in self:
+      raise KeyError(id)
+
+    self._ensure_built()
+
+    succ_ids = self.get_succ_ids(id)
+    for succ_id in succ_ids:
+      self._pred_counts[succ_id] -= 1
+      if not self._pred_counts[succ_id]:
+        self._nopred_ids.add(succ_id)
+
+    self._dead_count += self._pred_counts[id] + len(succ_ids)
+    self._states[id] = self._DELETED
+    self._node_count -= 1
+    self._nopred_ids.discard(id)
+
+    self._check_rebuild()
+
+  def keys(self):
+    return list(self._iter_ids())
+
+  def _iter_ids(self):
+    states = self._states
+    for id in xrange(len(states)):
+      if states[id] == self._PRESENT:
+        yield id
+
+  def __iter__(self):
+    for id in self._iter_ids():
+      yield self[id]
+
+  def get_pred_ids(self, id):
+    self._ensure_built()
+    return self._get_neighbors(
+        id, self._pred_offsets, self._pred_targets, self._overflow_pred_ids
+        )
+
+  def get_succ_ids(self, id):
+    self._ensure_built()
+    return self._get_neighbors(
+        id, self._succ_offsets, self._succ_targets, self._overflow_succ_ids
+        )
+
+  def has_pred_ids(self, id):
+    return self._pred_counts[id] > 0
+
+  def get_time_range(self, id):
+    time_range = TimeRange()
+    time_range.t_min = int(self._t_mins[id])
+    time_range.t_max = int(self._t_maxs[id])
+    return time_range
+
+  def iter_nopred_ids(self):
+    return list(self._nopred_ids)
+
+
+def check_graph_backend(backend):
+  """Raise FatalError if BACKEND is not one of GRAPH_BACKENDS."""
+
+  if backend not in GRAPH_BACKENDS:
+    raise FatalError('Unknown changeset graph backend %r' % (backend,))
+
+
+def create_changeset_graph(
+      changeset_db, cvs_item_to_changeset_id, backend=None
+      ):
+  """Return a new, empty ChangesetGraph.
+
+  BACKEND is one of GRAPH_BACKENDS; if it is None, use
+  Ctx().changeset_graph_backend."""
+
+  if backend is None:
+    backend = Ctx().changeset_graph_backend
+
+  if backend == GRAPH_BACKEND_DICT:
+    return DictChangesetGraph(changeset_db, cvs_item_to_changeset_id)
+  elif backend == GRAPH_BACKEND_COMPACT:
+    return CompactChangesetGraph(changeset_db, cvs_item_to_changeset_id)
+  else:
+    raise FatalError('Unknown changeset graph backend %r' % (backend,))
+
+
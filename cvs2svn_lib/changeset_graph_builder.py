@@ -0,0 +1,171 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Compute the nodes of a changeset graph in worker processes.
+
+To create the ChangesetGraphNode for a changeset, all of its CVSItems
+have to be read, and the changesets of their predecessors and
+successors have to be looked up in the CVSItem-to-changeset table.
+The nodes of different changesets can be computed independently of
+each other, so if Ctx().jobs is greater than one, a
+ChangesetGraphBuilder sends runs of consecutive changesets to a
+WorkerPool.  Each worker opens the CVSItem store and the
+CVSItem-to-changeset table read-only; if
+indexed_database.use_mmap_for_reading is set (by default, on 64-bit
+systems), both are memory mapped, so the workers share the pages of
+the files rather than each reading its own copy.  Only the changesets
+themselves are pickled to the workers.  The main process links the
+resulting nodes into the graph, in the order in which the changesets
+were added, so the graph doesn't depend on the number of jobs."""
+
+
+from collections import deque
+
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib import indexed_database
+from cvs2svn_lib.cvs_item_database import IndexedCVSItemStore
+from cvs2svn_lib.changeset_database import CVSItemToChangesetTable
+from cvs2svn_lib.worker_pool import create_worker_pool
+
+
+# The CVSItem-to-changeset table that _create_graph_nodes() uses in a
+# worker process, and the filenames that its databases were opened
+# from:
+_worker_cvs_item_to_changeset_id = None
+_worker_filenames = None
+
+
+def _create_graph_nodes(args):
+  """Return a list of the ChangesetGraphNodes for some changesets.
+
+  This function is run in a worker process by ChangesetGraphBuilder.
+  ARGS is a tuple (filenames, changesets).  FILENAMES is a tuple
+  (cvs_items_filename, cvs_items_index_filename,
+  cvs_item_to_changeset_filename), from which the databases are
+  opened read-only (and memory mapped if
+  indexed_database.use_mmap_for_reading is set) the first time that
+  they are needed.  CHANGESETS is a list of Changesets.  (Unpickling
+  SymbolChangesets uses the Ctx()._symbol_db that the worker inherited
+  from the main process.)"""
+
+  global _worker_cvs_item_to_changeset_id, _worker_filenames
+
+  (filenames, changesets) = args
+
+  if filenames != _worker_filenames:
+    if _worker_filenames is not None:
+      Ctx()._cvs_items_db.close()
+      _worker_cvs_item_to_changeset_id.close()
+    # This replaces the CVSItem store inherited from the main process,
+    # which shares its file position with the main process's copy:
+    Ctx()._cvs_items_db = IndexedCVSItemStore(
+        filenames[0], filenames[1], DB_OPEN_READ
+        )
+    _worker_cvs_item_to_changeset_id = CVSItemToChangesetTable(
+        filenames[2], DB_OPEN_READ,
+        use_mmap=indexed_database.use_mmap_for_reading,
+        )
+    _worker_filenames = filenames
+
+  return [
+      changeset.create_graph_node(_worker_cvs_item_to_changeset_id)
+      for changeset in changesets
+      ]
+
+
+class ChangesetGraphBuilder(object):
+  """Add changesets to a ChangesetGraph, using worker processes if allowed.
+
+  Call add_changeset() for each changeset, then finish().  The graph
+  is only complete after finish() has been called.  The
+  CVSItem-to-changeset table of the graph must not be changed in the
+  meantime."""
+
+  # The approximate number of CVSItems in the changesets that are
+  # sent to a worker at a time:
+  CHUNK_ITEMS = 10000
+
+  def __init__(self, changeset_graph):
+    self._changeset_graph = changeset_graph
+    self._worker_pool = create_worker_pool(Ctx().jobs)
+    if self._worker_pool is None:
+      return
+
+    cvs_item_to_changeset_id = changeset_graph._cvs_item_to_changeset_id
+    # The workers read the table from disk:
+    cvs_item_to_changeset_id.flush()
+    self._filenames = (
+        Ctx()._cvs_items_db.filename,
+        Ctx()._cvs_items_db.index_filename,
+        cvs_item_to_changeset_id.filename,
+        )
+
+    # The number of chunks that may be waiting to be linked:
+    self._lookahead = 4 * self._worker_pool.jobs
+
+    # The changesets that have not been sent to a worker yet, and the
+    # number of CVSItems that they contain:
+    self._chunk = []
+    self._chunk_items = 0
+
+    # The results of the chunks that have been sent to the workers, in
+    # order:
+    self._pending = deque()
+
+  def add_changeset(self, changeset):
+    """Add CHANGESET to the graph (perhaps not until later)."""
+
+    if self._worker_pool is None:
+      self._changeset_graph.add_changeset(changeset)
+      return
+
+    self._chunk.append(changeset)
+    self._chunk_items += len(changeset.cvs_item_ids)
+    if self._chunk_items >= self.CHUNK_ITEMS:
+      self._submit_chunk()
+
+  def _submit_chunk(self):
+    self._pending.append(
+        self._worker_pool.apply_async(
+            _create_graph_nodes, (self._filenames, self._chunk),
+            )
+        )
+    self._chunk = []
+    self._chunk_items = 0
+
+    while len(self._pending) > self._lookahead:
+      self._link_nodes(self._pending.popleft())
+
+  def _link_nodes(self, result):
+    for node in result.get():
+      self._changeset_graph.add_node(node)
+
+  def finish(self):
+    """Add any changesets that are still outstanding to the graph."""
+
+    if self._worker_pool is None:
+      return
+
+    if self._chunk:
+      self._submit_chunk()
+    while self._pending:
+      self._link_nodes(self._pending.popleft())
+
+    self._worker_pool.close()
+    self._worker_pool = None
+
+
@@ -0,0 +1,299 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Pass the final changeset graph of a pass on to the next pass.
+
+RevisionTopologicalSortPass and TopologicalSortPass need the graphs
+of the changesets that BreakRevisionChangesetCyclesPass and
+BreakAllChangesetCyclesPass leave behind.  Instead of deriving those
+graphs again from the CVSItems, they load a snapshot that was written
+by the cycle-breaking pass.
+
+While a cycle-breaking pass runs, a ChangesetGraphSnapshotWriter
+appends a record to the snapshot file for each node that is added to
+the graph (before the node's dependencies are restricted to the
+changesets that are in the graph at that moment), and remembers which
+changesets are deleted again.  When a changeset is split, the nodes of
+the new changesets refer to their neighbors correctly, but the
+records of the neighbors might still refer to the deleted changeset.
+So when the writer is closed, it discards the records of the deleted
+changesets and all references to changesets that are not in the
+final graph, and makes each dependency symmetric (if A is a
+predecessor of B, then B is a successor of A).  The result is the
+graph that would be derived from the final changesets.
+
+This is done without holding the graph in memory: each dependency is
+written as a fixed-width record for each of its two ends, and the
+records are sorted by changeset id using sort_file(), as are the
+records holding the time ranges of the nodes.  Then both sorted files
+are read in step to write the snapshot.  Only a bitmap of the ids of
+the changesets in the final graph is kept in memory.
+
+The finished file consists of SNAPSHOT_MAGIC, then the number of
+nodes on a line of its own, then a record for each node in order of
+changeset id: NODE_FORMAT (id, t_min, t_max, number of predecessors,
+number of successors), followed by the ids of the predecessors and
+the successors."""
+
+
+import os
+import struct
+import array
+import itertools
+
+from cvs2svn_lib.common import InternalError
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.log import logger
+from cvs2svn_lib.sort import sort_file
+from cvs2svn_lib.time_range import TimeRange
+from cvs2svn_lib.changeset_graph_node import ChangesetGraphNode
+
+
+SNAPSHOT_MAGIC = 'cvs2svn changeset graph snapshot\n'
+
+NODE_FORMAT = '=IqqII'
+NODE_LEN = struct.calcsize(NODE_FORMAT)
+
+# The records that are sorted when the snapshot is written.  The id
+# that they are sorted by comes first, big-endian, so that sorting the
+# records as strings sorts them by id.  A time range record holds a
+# changeset id, t_min, and t_max; a dependency record holds the id of
+# a changeset, _PRED or _SUCC, and the id of one of its predecessors
+# or successors, respectively:
+_TIME_RANGE_FORMAT = '>Iqq'
+_TIME_RANGE_LEN = struct.calcsize(_TIME_RANGE_FORMAT)
+_DEPENDENCY_FORMAT = '>IBI'
+_DEPENDENCY_LEN = struct.calcsize(_DEPENDENCY_FORMAT)
+_PRED = 0
+_SUCC = 1
+
+
+def _write_node(f, id, t_min, t_max, pred_ids, succ_ids):
+  f.write(struct.pack(
+      NODE_FORMAT, id, t_min, t_max, len(pred_ids), len(succ_ids)
+      ))
+  ids = list(pred_ids) + list(succ_ids)
+  f.write(struct.pack('=%dI' % (len(ids),), *ids))
+
+
+def _read_node(f):
+  """Read a node record from F.
+
+  Return (id, t_min, t_max, pred_ids, succ_ids), where pred_ids and
+  succ_ids are tuples, or None at the end of the file."""
+
+  s = f.read(NODE_LEN)
+  if not s:
+    return None
+  (id, t_min, t_max, pred_count, succ_count) = struct.unpack(NODE_FORMAT, s)
+  ids = struct.unpack(
+      '=%dI' % (pred_count + succ_count,),
+      f.read(4 * (pred_count + succ_count)),
+      )
+  return (id, t_min, t_max, ids[:pred_count], ids[pred_count:])
+
+
+def _iter_records(filename, format):
+  """Yield the unpacked fixed-width records in FILENAME.
+
+  FORMAT is the struct format of the records."""
+
+  record_len = struct.calcsize(format)
+  block_len = record_len * 4096
+  f = open(filename, 'rb')
+  while True:
+    s = f.read(block_len)
+    if not s:
+      break
+    for i in xrange(0, len(s), record_len):
+      yield struct.unpack(format, s[i:i + record_len])
+  f.close()
+
+
+class ChangesetGraphSnapshotWriter(object):
+  """Record the changes to a ChangesetGraph, and write its final state."""
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.f = open(self.filename, 'wb+')
+    # The ids of the changesets that were deleted from the graph:
+    self._deleted_ids = set()
+
+  def add_node(self, node):
+    """Record ChangesetGraphNode NODE, which is being added to the graph.
+
+    This has to be called before the graph modifies the node."""
+
+    _write_node(
+        self.f, node.id, node.time_range.t_min, node.time_range.t_max,
+        node.pred_ids, node.succ_ids,
+        )
+
+  def delete_node(self, id):
+    """Record that the node with id ID is deleted (not consumed)."""
+
+    self._deleted_ids.add(id)
+
+  def close(self):
+    """Replace the recorded nodes with the final graph."""
+
+    logger.debug('Writing changeset graph snapshot %s' % (self.filename,))
+
+    time_ranges_filename = self.filename + '.time-ranges'
+    dependencies_filename = self.filename + '.dependencies'
+
+    # A bitmap of the ids of the changesets in the final graph:
+    ids = array.array('B')
+    count = 0
+
+    time_ranges_file = open(time_ranges_filename, 'wb')
+    dependencies_file = open(dependencies_filename, 'wb')
+    self.f.seek(0)
+    while True:
+      record = _read_node(self.f)
+      if record is None:
+        break
+      (id, t_min, t_max, pred_ids, succ_ids) = record
+      if id in self._deleted_ids:
+        continue
+      (k, bit) = divmod(id, 8)
+      if k >= len(ids):
+        ids.extend([0] * (k + 1 - len(ids)))
+      ids[k] |= 1 << bit
+      count += 1
+      time_ranges_file.write(struct.pack(_TIME_RANGE_FORMAT, id, t_min, t_max))
+      for pred_id in pred_ids:
+        dependencies_file.write(
+            struct.pack(_DEPENDENCY_FORMAT, id, _PRED, pred_id)
+            + struct.pack(_DEPENDENCY_FORMAT, pred_id, _SUCC, id)
+            )
+      for succ_id in succ_ids:
+        dependencies_file.write(
+            struct.pack(_DEPENDENCY_FORMAT, id, _SUCC, succ_id)
+            + struct.pack(_DEPENDENCY_FORMAT, succ_id, _PRED, id)
+            )
+    time_ranges_file.close()
+    dependencies_file.close()
+    self._deleted_ids = None
+
+    for (filename, record_len) in [
+          (time_ranges_filename, _TIME_RANGE_LEN),
+          (dependencies_filename, _DEPENDENCY_LEN),
+          ]:
+      sort_file(
+          filename, filename + '-s',
+          tempdirs=[os.path.dirname(self.filename)],
+          memory_limit=Ctx().sort_memory,
+          jobs=Ctx().jobs,
+          record_size=record_len,
+          )
+      os.remove(filename)
+
+    self.f.seek(0)
+    self.f.truncate()
+    self.f.write(SNAPSHOT_MAGIC)
+    self.f.write('%d\n' % (count,))
+
+    # A function returning the next dependency record, or None if there
+    # are no more:
+    next_dependency = itertools.chain(
+        _iter_records(dependencies_filename + '-s', _DEPENDENCY_FORMAT),
+        [None],
+        ).next
+    dependency = next_dependency()
+    for (id, t_min, t_max) in _iter_records(
+          time_ranges_filename + '-s', _TIME_RANGE_FORMAT
+          ):
+      # Skip the dependencies of changesets that are not in the graph:
+      while dependency is not None and dependency[0] < id:
+        dependency = next_dependency()
+
+      neighbor_ids = ([], [])
+      last = None
+      while dependency is not None and dependency[0] == id:
+        if dependency != last:
+          (k, bit) = divmod(dependency[2], 8)
+          if k < len(ids) and ids[k] & (1 << bit):
+            neighbor_ids[dependency[1]].append(dependency[2])
+          last = dependency
+        dependency = next_dependency()
+
+      _write_node(
+          self.f, id, t_min, t_max, neighbor_ids[_PRED], neighbor_ids[_SUCC]
+          )
+
+    os.remove(time_ranges_filename + '-s')
+    os.remove(dependencies_filename + '-s')
+    self.f.close()
+    self.f = None
+
+
+def load_changeset_graph_snapshot(filename, changeset_graph):
+  """Add the nodes in the snapshot file FILENAME to CHANGESET_GRAPH."""
+
+  f = open(filename, 'rb')
+  try:
+    if f.readline() != SNAPSHOT_MAGIC:
+      raise InternalError(
+          '%r is not a changeset graph snapshot' % (filename,)
+          )
+    count = int(f.readline())
+    for i in xrange(count):
+      (id, t_min, t_max, pred_ids, succ_ids) = _read_node(f)
+      time_range = TimeRange()
+      time_range.t_min = t_min
+      time_range.t_max = t_max
+      changeset_graph.add_node(
+          ChangesetGraphNode(id, time_range, set(pred_ids), set(succ_ids))
+          )
+  finally:
+    f.close()
+
+
+def check_changeset_graph_snapshot(changeset_graph, derived_graph):
+  """Check that CHANGESET_GRAPH is the same as DERIVED_GRAPH.
+
+  CHANGESET_GRAPH was loaded from a snapshot; DERIVED_GRAPH was built
+  from the changesets.  Raise InternalError if they differ."""
+
+  logger.verbose('Checking the changeset graph snapshot...')
+
+  ids = set(changeset_graph.keys())
+  derived_ids = set(derived_graph.keys())
+  if ids != derived_ids:
+    raise InternalError(
+        'Changeset graph snapshot has the wrong changesets: '
+        'missing %s; extra %s'
+        % (sorted(derived_ids - ids), sorted(ids - derived_ids),)
+        )
+
+  for id in ids:
+    time_range = changeset_graph.get_time_range(id)
+    derived_time_range = derived_graph.get_time_range(id)
+    if (
+        set(changeset_graph.get_pred_ids(id))
+            != set(derived_graph.get_pred_ids(id))
+        or set(changeset_graph.get_succ_ids(id))
+            != set(derived_graph.get_succ_ids(id))
+        or time_range.t_min != derived_time_range.t_min
+        or time_range.t_max != derived_time_range.t_max
+        ):
+      raise InternalError(
+          'Changeset graph snapshot differs for changeset %x: %r != %r'
+          % (id, changeset_graph[id], derived_graph[id],)
+          )
+
+
@@ -73,12 +73,25 @@ CVSRevision is incremented.  After that, any records with refcount==0
 are removed.  When one record is removed, that can cause another
 record's reference count to go to zero and be removed too,
 recursively.  When a TextRecord is deleted at this stage, its
-deltatext is also deleted from the delta database."""
+deltatext is also deleted from the delta database.
 
+If more than one job is allowed (Ctx().jobs), InternalRevisionReader
+can also be told in advance which revisions will be requested (see
+RevisionReader.prefetch()).  The checkouts of those revisions are then
+planned immediately, in request order, by TextRecord.prefetch(), which
+updates the TextRecords exactly as checkout() would, and the deltas
+are applied in worker processes while the main process writes the
+output.  There is one worker job for the announced revisions of each
+CVSFile; a new job for a file is only planned after the results of the
+previous one have been collected."""
+
+
+from collections import deque
 
 from cvs2svn_lib import config
 from cvs2svn_lib.common import DB_OPEN_NEW
 from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import warning_prefix
 from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import InternalError
@@ -86,10 +99,17 @@ from cvs2svn_lib.common import canonicalize_eol
 from cvs2svn_lib.common import is_trunk_revision
 from cvs2svn_lib.context import Ctx
 from cvs2svn_lib.log import logger
+from cvs2svn_lib.worker_pool import create_worker_pool
 from cvs2svn_lib.artifact_manager import artifact_manager
 from cvs2svn_lib.cvs_item import CVSRevisionModification
+from cvs2svn_lib.database import Database
+from cvs2svn_lib.database import BACKEND_LOGSTORE
+from cvs2svn_lib.log_store import LogStore
+from cvs2svn_lib.checkpoint import CheckpointError
+from cvs2svn_lib.checkpoint import truncate_file
 from cvs2svn_lib.indexed_database import IndexedDatabase
 from cvs2svn_lib.rcs_stream import RCSStream
+from cvs2svn_lib.rcs_stream import create_rcs_stream
 from cvs2svn_lib.rcs_stream import MalformedDeltaException
 from cvs2svn_lib.keyword_expander import expand_keywords
 from cvs2svn_lib.keyword_expander import collapse_keywords
@@ -146,6 +166,17 @@ class TextRecord(object):
 
     raise NotImplementedError()
 
+  def prefetch(self, text_record_db, steps):
+    """Plan the checkout of this revision's text by a worker process.
+
+    Update the databases exactly as checkout() would, but instead of
+    computing the text, append to STEPS the steps that are needed to
+    compute it (see _reconstruct_texts()).  Texts that checkout()
+    would store to the checkout database are only marked as pending
+    there; they are stored when the worker's results arrive."""
+
+    raise NotImplementedError()
+
   def free(self, text_record_db):
     """This instance will never again be checked out; free it.
 
@@ -176,6 +207,10 @@ class FullTextRecord(TextRecord):
     self.decrement_refcount(text_record_db)
     return text
 
+  def prefetch(self, text_record_db, steps):
+    steps.append((_FULLTEXT, self.id, None))
+    self.decrement_refcount(text_record_db)
+
   def free(self, text_record_db):
     del text_record_db.delta_db[self.id]
 
@@ -210,7 +245,7 @@ class DeltaTextRecord(TextRecord):
 
   def checkout(self, text_record_db):
     base_text = text_record_db[self.pred_id].checkout(text_record_db)
-    rcs_stream = RCSStream(base_text)
+    rcs_stream = create_rcs_stream(base_text)
     delta_text = text_record_db.delta_db[self.id]
     rcs_stream.apply_diff(delta_text)
     text = rcs_stream.get_text()
@@ -229,6 +264,18 @@ class DeltaTextRecord(TextRecord):
       text_record_db.replace(new_text_record)
     return text
 
+  def prefetch(self, text_record_db, steps):
+    text_record_db[self.pred_id].prefetch(text_record_db, steps)
+    steps.append((_DELTA, self.id, self.pred_id))
+    self.refcount -= 1
+    if self.refcount == 0:
+      del text_record_db[self.id]
+    else:
+      text_record_db.checkout_db.expect('%x' % self.id)
+      new_text_record = CheckedOutTextRecord(self.id)
+      new_text_record.refcount = self.refcount
+      text_record_db.replace(new_text_record)
+
   def free(self, text_record_db):
     del text_record_db.delta_db[self.id]
     text_record_db[self.pred_id].decrement_refcount(text_record_db)
@@ -259,6 +306,14 @@ class CheckedOutTextRecord(TextRecord):
     self.decrement_refcount(text_record_db)
     return text
 
+  def prefetch(self, text_record_db, steps):
+    key = '%x' % self.id
+    if not text_record_db.checkout_db.is_pending(key):
+      steps.append((_TEXT, self.id, text_record_db.checkout_db[key]))
+    # Otherwise the text is computed by an earlier step of the same
+    # job.
+    self.decrement_refcount(text_record_db)
+
   def free(self, text_record_db):
     del text_record_db.checkout_db['%x' % self.id]
 
@@ -266,6 +321,128 @@ class CheckedOutTextRecord(TextRecord):
     return 'CheckedOutTextRecord(%x, %d)' % (self.id, self.refcount,)
 
 
+class _PrefetchingCheckoutDatabase(object):
+  """A checkout database that can have stores pending.
+
+  When text records are checked out by worker processes, the texts
+  that have to be stored to the checkout database only become
+  available when the worker's results are collected.  Until then, the
+  keys of those texts are marked as pending.  If a pending key is
+  deleted (because the text turns out not to be needed after all),
+  the text is simply dropped when it arrives."""
+
+  def __init__(self, db):
+    self.db = db
+
+    # The set of keys whose texts are still being computed:
+    self._pending = set()
+
+  def expect(self, key):
+    """Mark KEY as pending; its text will be passed to store()."""
+
+    self._pending.add(key)
+
+  def is_pending(self, key):
+    return key in self._pending
+
+  def store(self, key, text):
+    """Store TEXT under KEY if KEY is still pending."""
+
+    if key in self._pending:
+      self._pending.remove(key)
+      self.db[key] = text
+
+  def __getitem__(self, key):
+    return self.db[key]
+
+  def __setitem__(self, key, text):
+    self._pending.discard(key)
+    self.db[key] = text
+
+  def __delitem__(self, key):
+    if key in self._pending:
+      self._pending.remove(key)
+    else:
+      del self.db[key]
+
+
+# The kinds of steps in the jobs run by _reconstruct_texts():
+_FULLTEXT = 'full'
+_DELTA = 'delta'
+_TEXT = 'text'
+
+# The delta database that _reconstruct_texts() uses in a worker
+# process, and the filenames that it was opened from:
+_worker_delta_db = None
+_worker_delta_db_filenames = None
+
+
+def _reconstruct_texts(args):
+  """Compute the fulltexts of revisions of one file.
+
+  This function is run in a worker process by InternalRevisionReader.
+  ARGS is a tuple (delta_db_filenames, steps, wanted).
+  DELTA_DB_FILENAMES are the filenames of the delta database, which
+  is opened read-only the first time it is needed.  STEPS is a list of
+  (kind, id, arg) tuples, which are carried out in order:
+
+      (_FULLTEXT, id, None) -- the text of id is stored in the delta
+          database.
+
+      (_DELTA, id, pred_id) -- the text of id is derived by applying
+          the delta stored in the delta database to the text of
+          pred_id, which was computed by an earlier step.
+
+      (_TEXT, id, text) -- the text of id is TEXT.
+
+  Return a list of (id, text) for the ids in WANTED."""
+
+  global _worker_delta_db, _worker_delta_db_filenames
+
+  (delta_db_filenames, steps, wanted) = args
+
+  if delta_db_filenames != _worker_delta_db_filenames:
+    if _worker_delta_db is not None:
+      _worker_delta_db.close()
+    _worker_delta_db = IndexedDatabase(
+        delta_db_filenames[0], delta_db_filenames[1], DB_OPEN_READ
+        )
+    _worker_delta_db_filenames = delta_db_filenames
+
+  texts = {}
+  for (kind, id, arg) in steps:
+    if kind == _FULLTEXT:
+      texts[id] = _worker_delta_db[id]
+    elif kind == _DELTA:
+      rcs_stream = create_rcs_stream(texts[arg])
+      rcs_stream.apply_diff(_worker_delta_db[id])
+      texts[id] = rcs_stream.get_text()
+      del rcs_stream
+    else:
+      texts[id] = arg
+
+  return [(id, texts[id]) for id in wanted]
+
+
+class _PrefetchJob(object):
+  """A _reconstruct_texts() job for the revisions of one CVSFile."""
+
+  def __init__(self, cvs_file, requested_ids, stored_ids, result):
+    self.cvs_file = cvs_file
+
+    # The ids of the revisions whose contents will be requested, in
+    # order:
+    self.requested_ids = requested_ids
+
+    # The ids of the texts that have to be stored to the checkout
+    # database:
+    self.stored_ids = stored_ids
+
+    # The object whose get() method returns the output of
+    # _reconstruct_texts():
+    self.result = result
+
+
 class NullDatabase(object):
   """A do-nothing database that can be used with TextRecordDatabase.
 
@@ -629,13 +806,11 @@ class InternalRevisionCollector(RevisionCollector):
 class InternalRevisionReader(RevisionReader):
   """A RevisionReader that reads the contents from an own delta store."""
 
-  def __init__(self, compress):
-    # Only import Database if an InternalRevisionReader is really
-    # instantiated, because the import fails if a decent dbm is not
-    # installed.
-    from cvs2svn_lib.database import Database
-    self._Database = Database
+  # The number of revisions per worker process whose contents should
+  # be announced via prefetch() ahead of being requested:
+  PREFETCH_WINDOW_PER_JOB = 50
 
+  def __init__(self, compress):
     self._compress = compress
 
   def register_artifacts(self, which_pass):
@@ -654,9 +829,31 @@ class InternalRevisionReader(RevisionReader):
         )
 
   def start(self):
-    self._delta_db = IndexedDatabase(
+    self._start(DB_OPEN_NEW)
+
+  def _start(self, co_db_mode):
+    """Open the databases, creating or reopening the checkout database.
+
+    CO_DB_MODE is DB_OPEN_NEW, or DB_OPEN_WRITE to continue with the
+    checkout database of an interrupted run (which must have been
+    stored in a LogStore)."""
+
+    # Start the workers before opening any files, so that they don't
+    # inherit them:
+    self._worker_pool = create_worker_pool(Ctx().jobs)
+    if self._worker_pool is None:
+      self.prefetch_window = 0
+    else:
+      self.prefetch_window = (
+          self.PREFETCH_WINDOW_PER_JOB * self._worker_pool.jobs
+          )
+
+    self._delta_db_filenames = (
         artifact_manager.get_temp_file(config.RCS_DELTAS_STORE),
         artifact_manager.get_temp_file(config.RCS_DELTAS_INDEX_TABLE),
+        )
+    self._delta_db = IndexedDatabase(
+        self._delta_db_filenames[0], self._delta_db_filenames[1],
         DB_OPEN_READ,
         )
     self._delta_db.__delitem__ = lambda id: None
@@ -665,13 +862,19 @@ class InternalRevisionReader(RevisionReader):
         artifact_manager.get_temp_file(config.RCS_TREES_INDEX_TABLE),
         DB_OPEN_READ,
         )
-    serializer = MarshalSerializer()
-    if self._compress:
-      serializer = CompressingSerializer(serializer)
-    self._co_db = self._Database(
-        artifact_manager.get_temp_file(config.CVS_CHECKOUT_DB),
-        DB_OPEN_NEW, serializer,
-        )
+    if co_db_mode == DB_OPEN_NEW:
+      serializer = MarshalSerializer()
+      if self._compress:
+        serializer = CompressingSerializer(serializer)
+      self._co_db = _PrefetchingCheckoutDatabase(Database(
+          artifact_manager.get_temp_file(config.CVS_CHECKOUT_DB),
+          DB_OPEN_NEW, serializer,
+          ))
+    else:
+      self._co_db = _PrefetchingCheckoutDatabase(Database(
+          artifact_manager.get_temp_file(config.CVS_CHECKOUT_DB),
+          co_db_mode, backend=BACKEND_LOGSTORE,
+          ))
 
     # The set of CVSFile instances whose TextRecords have already been
     # read:
@@ -681,6 +884,69 @@ class InternalRevisionReader(RevisionReader):
     # revisions:
     self._text_record_db = TextRecordDatabase(self._delta_db, self._co_db)
 
+    # The _PrefetchJobs whose results have not been collected yet, in
+    # the order that they were submitted:
+    self._prefetch_jobs = deque()
+
+    # A map { CVSFile : _PrefetchJob } holding the most recent
+    # uncollected job for each file:
+    self._file_prefetch_jobs = {}
+
+    # A map { cvs_rev_id : _PrefetchJob } for revisions whose contents
+    # are being computed by an uncollected job:
+    self._requested_prefetch_jobs = {}
+
+    # A map { cvs_rev_id : text } holding the contents of revisions
+    # that have been prefetched but not requested yet:
+    self._prefetched_texts = {}
+
+  def get_checkpoint_state(self):
+    if not isinstance(self._co_db.db.db, LogStore):
+      # Only a LogStore can be restored to an earlier state:
+      return None
+
+    # Wait for the outstanding prefetch jobs, so that no texts are
+    # pending for the checkout database:
+    self._collect_prefetch_jobs()
+
+    return (
+        self._text_record_db,
+        [cvs_file.id for cvs_file in self._loaded_files],
+        self._prefetched_texts,
+        self._co_db.db.db.checkpoint(),
+        )
+
+  def resume(self, checkpoint_state):
+    (text_record_db, loaded_file_ids, prefetched_texts, co_db_size) = \
+        checkpoint_state
+    truncate_file(
+        artifact_manager.get_temp_file(config.CVS_CHECKOUT_DB), co_db_size
+        )
+    try:
+      self._start(DB_OPEN_WRITE)
+    except KeyError:
+      raise CheckpointError('the checkout database is damaged')
+
+    # If the checkout database was compacted after the checkpoint was
+    # saved, then truncating it did not restore its old contents.
+    # Since the text stored under a key never changes, it suffices to
+    # check that the texts that are still needed are present:
+    for text_record in text_record_db.itervalues():
+      if isinstance(text_record, CheckedOutTextRecord) \
+             and '%x' % (text_record.id,) not in self._co_db.db:
+        self._close()
+        raise CheckpointError(
+            'the checkout database was changed after the checkpoint'
+            )
+
+    text_record_db.delta_db = self._delta_db
+    text_record_db.checkout_db = self._co_db
+    self._text_record_db = text_record_db
+    self._loaded_files = set(
+        Ctx()._cvs_path_db.get_path(id) for id in loaded_file_ids
+        )
+    self._prefetched_texts = prefetched_texts
+
   def _get_text_record(self, cvs_rev):
     """Return the TextRecord instance for CVS_REV.
 
@@ -694,6 +960,95 @@ class InternalRevisionReader(RevisionReader):
 
     return self._text_record_db[cvs_rev.id]
 
+  def prefetch(self, cvs_revs):
+    if self._worker_pool is None:
+      return
+
+    # Group the revisions by file, keeping them in order:
+    files = []
+    file_revs = {}
+    for cvs_rev in cvs_revs:
+      revs = file_revs.get(cvs_rev.cvs_file)
+      if revs is None:
+        files.append(cvs_rev.cvs_file)
+        revs = file_revs[cvs_rev.cvs_file] = []
+      revs.append(cvs_rev)
+
+    for cvs_file in files:
+      # The new job might need texts that a previous job for this file
+      # is still computing:
+      job = self._file_prefetch_jobs.get(cvs_file)
+      if job is not None:
+        self._collect_prefetch_jobs(job)
+
+      steps = []
+      requested_ids = []
+      for cvs_rev in file_revs[cvs_file]:
+        self._get_text_record(cvs_rev).prefetch(self._text_record_db, steps)
+        requested_ids.append(cvs_rev.id)
+
+      stored_ids = [
+          id
+          for (kind, id, arg) in steps
+          if kind == _DELTA and self._co_db.is_pending('%x' % (id,))
+          ]
+      result = self._worker_pool.apply_async(
+          _reconstruct_texts,
+          (self._delta_db_filenames, steps, requested_ids + stored_ids),
+          )
+      job = _PrefetchJob(cvs_file, requested_ids, stored_ids, result)
+      self._prefetch_jobs.append(job)
+      self._file_prefetch_jobs[cvs_file] = job
+      for id in requested_ids:
+        self._requested_prefetch_jobs[id] = job
+
+  def _collect_prefetch_jobs(self, last_job=None):
+    """Collect the results of prefetch jobs, up to and including LAST_JOB.
+
+    If LAST_JOB is None, collect the results of all jobs."""
+
+    while self._prefetch_jobs:
+      job = self._prefetch_jobs.popleft()
+      try:
+        texts = job.result.get()
+      except MalformedDeltaException, (msg):
+        raise FatalError(
+            'Malformed RCS delta in %s: %s' % (job.cvs_file.rcs_path, msg)
+            )
+
+      n = len(job.requested_ids)
+      for (id, text) in texts[:n]:
+        self._prefetched_texts[id] = text
+        del self._requested_prefetch_jobs[id]
+      for (id, text) in texts[n:]:
+        self._co_db.store('%x' % (id,), text)
+
+      if self._file_prefetch_jobs[job.cvs_file] is job:
+        del self._file_prefetch_jobs[job.cvs_file]
+
+      if job is last_job:
+        break
+
+  def _checkout(self, cvs_rev):
+    """Return the text of CVS_REV as stored in the RCS file."""
+
+    job = self._requested_prefetch_jobs.get(cvs_rev.id)
+    if job is not None:
+      self._collect_prefetch_jobs(job)
+
+    try:
+      return self._prefetched_texts.pop(cvs_rev.id)
+    except KeyError:
+      pass
+
+    # This revision was not prefetched, but a job might still be
+    # computing texts that its checkout depends on:
+    job = self._file_prefetch_jobs.get(cvs_rev.cvs_file)
+    if job is not None:
+      self._collect_prefetch_jobs(job)
+
+    return self._get_text_record(cvs_rev).checkout(self._text_record_db)
+
   def get_content(self, cvs_rev):
     """Check out the text for revision C_REV from the repository.
 
@@ -716,7 +1071,7 @@ class InternalRevisionReader(RevisionReader):
     requested only once."""
 
     try:
-      text = self._get_text_record(cvs_rev).checkout(self._text_record_db)
+      text = self._checkout(cvs_rev)
     except MalformedDeltaException, (msg):
       raise FatalError(
           'Malformed RCS delta in %s, revision %s: %s'
@@ -750,10 +1105,24 @@ class InternalRevisionReader(RevisionReader):
     return text
 
   def finish(self):
+    self._collect_prefetch_jobs()
+    if self._worker_pool is not None:
+      self._worker_pool.close()
+      self._worker_pool = None
+    self._prefetched_texts.clear()
+
     self._text_record_db.log_leftovers()
 
     del self._text_record_db
+    self._close()
+
+  def _close(self):
+    """Close the worker pool (if it is still open) and the databases."""
+
+    if self._worker_pool is not None:
+      self._worker_pool.close()
+      self._worker_pool = None
     self._delta_db.close()
     self._tree_db.close()
-    self._co_db.close()
+    self._co_db.db.close()
 
@@ -0,0 +1,135 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Save the state of a pass so that it can be continued later.
+
+An interrupted conversion can always be restarted at the beginning of
+the pass that was interrupted.  But CollectRevsPass and OutputPass can
+take many hours for a large repository, so they save a checkpoint
+every so often, from which the pass can be continued if the
+conversion is restarted with --resume.
+
+A checkpoint is a pickled object that describes the in-memory state
+of the pass.  The files that the pass writes are only ever appended
+to; when a checkpoint is saved, they are written to disk and their
+lengths are recorded in the checkpoint.  When the pass is continued,
+the files are truncated to those lengths, which discards anything
+that was written after the checkpoint was saved."""
+
+
+import os
+import cPickle
+
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.log import logger
+
+
+class CheckpointError(Exception):
+  """A pass cannot be continued from its checkpoint."""
+
+  pass
+
+
+def sync_file(f):
+  """Write the contents of file object F to disk."""
+
+  f.flush()
+  os.fsync(f.fileno())
+
+
+def truncate_file(filename, size):
+  """Truncate the file FILENAME to SIZE bytes.
+
+  Raise CheckpointError if the file does not exist or is shorter than
+  SIZE bytes."""
+
+  try:
+    old_size = os.path.getsize(filename)
+  except OSError:
+    raise CheckpointError('%r does not exist' % (filename,))
+
+  if old_size < size:
+    raise CheckpointError(
+        '%r is shorter than when the checkpoint was saved' % (filename,)
+        )
+  elif old_size > size:
+    f = open(filename, 'rb+')
+    try:
+      f.truncate(size)
+    finally:
+      f.close()
+
+
+class Checkpoint(object):
+  """The checkpoint of a pass, stored in a file in the temporary directory."""
+
+  def __init__(self, basename):
+    self.filename = Ctx().get_temp_filename(basename)
+
+    # The number of checkpoints that have been saved:
+    self._saves = 0
+
+  def load(self):
+    """Return the state that was saved last, or None if there is none."""
+
+    if not os.path.exists(self.filename):
+      return None
+
+    logger.verbose('Reading checkpoint from %s' % (self.filename,))
+    f = open(self.filename, 'rb')
+    try:
+      return cPickle.load(f)
+    finally:
+      f.close()
+
+  def save(self, state):
+    """Save STATE, replacing any checkpoint that was saved earlier.
+
+    The new checkpoint is written to a temporary file that then
+    replaces the old one, so an interruption leaves either the old or
+    the new checkpoint behind."""
+
+    if self._saves == Ctx().interrupt_after_checkpoint:
+      # Simulate an interruption, to test --resume.  The pass has done
+      # (and written to disk) the work that the new checkpoint would
+      # have covered, which has to be discarded when it is continued:
+      raise FatalError(
+          'Interrupted after saving checkpoint %d to %s.'
+          % (self._saves, self.filename,)
+          )
+
+    logger.verbose('Saving checkpoint to %s' % (self.filename,))
+    new_filename = self.filename + '.new'
+    f = open(new_filename, 'wb')
+    try:
+      cPickle.dump(state, f, -1)
+      sync_file(f)
+    finally:
+      f.close()
+
+    # os.rename() cannot replace an existing file on Windows:
+    self.remove()
+    os.rename(new_filename, self.filename)
+    self._saves += 1
+
+  def remove(self):
+    """Remove the checkpoint, if there is one."""
+
+    if os.path.exists(self.filename):
+      os.remove(self.filename)
+
+
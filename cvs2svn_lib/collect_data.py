@@ -48,9 +48,13 @@ or branch.
 
 
 import re
+import traceback
 
 from cvs2svn_lib import config
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import DB_OPEN_WRITE
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.common import warning_prefix
 from cvs2svn_lib.common import error_prefix
 from cvs2svn_lib.common import is_trunk_revision
@@ -73,6 +77,12 @@ from cvs2svn_lib.cvs_item_database import NewCVSItemStore
 from cvs2svn_lib.symbol_statistics import SymbolStatisticsCollector
 from cvs2svn_lib.metadata_database import MetadataDatabase
 from cvs2svn_lib.metadata_database import MetadataLogger
+from cvs2svn_lib.worker_pool import create_worker_pool
+from cvs2svn_lib.checkpoint import CheckpointError
+from cvs2svn_lib.checkpoint import truncate_file
+from cvs2svn_lib.incremental import get_stamp
+from cvs2svn_lib.incremental import RecordingStore
+from cvs2svn_lib.incremental import read_recordings
 
 from cvs2svn_lib.rcsparser import Sink
 from cvs2svn_lib.rcsparser import parse
@@ -557,11 +567,19 @@ class _FileDataCollector(Sink):
     # (as opposed to added normally).
     self._file_imported = False
 
+    # The head revision of the file, as recorded in its header:
+    self.head_revision = None
+
   def _get_rev_id(self, revision):
     if revision is None:
       return None
     return self._rev_data[revision].cvs_rev_id
 
+  def set_head_revision(self, revision):
+    """This is a callback method declared in Sink."""
+
+    self.head_revision = revision
+
   def set_principal_branch(self, branch):
     """This is a callback method declared in Sink."""
 
@@ -978,10 +996,130 @@ class _FileDataCollector(Sink):
     self._cvs_file_items.check_link_consistency()
 
 
+class _RecordingSink(Sink):
+  """A Sink that records the callbacks made by the RCS parser.
+
+  This sink is used by worker processes to parse RCS files when
+  CollectRevsPass is run with more than one job.  The recorded
+  callbacks are sent back to the main process, where they are replayed
+  into a _FileDataCollector (see _replay_rcs_file()).  This way the
+  expensive parsing is done in parallel, while all ids are still
+  allocated by the main process, in the same order as in a serial run.
+
+  Since _FileDataCollector only needs to know whether a revision's
+  deltatext is non-empty, the deltatexts themselves are replaced by
+  a boolean to avoid shipping them between processes."""
+
+  def __init__(self):
+    # A list [(method_name, args), ...] of the callbacks received:
+    self.events = []
+
+  def set_head_revision(self, revision):
+    self.events.append(('set_head_revision', (revision,)))
+
+  def set_principal_branch(self, branch_name):
+    self.events.append(('set_principal_branch', (branch_name,)))
+
+  def define_tag(self, name, revision):
+    self.events.append(('define_tag', (name, revision,)))
+
+  def set_expansion(self, mode):
+    self.events.append(('set_expansion', (mode,)))
+
+  def admin_completed(self):
+    self.events.append(('admin_completed', ()))
+
+  def define_revision(self, revision, timestamp, author, state,
+                      branches, next):
+    self.events.append((
+        'define_revision',
+        (revision, timestamp, author, state, branches, next,),
+        ))
+
+  def tree_completed(self):
+    self.events.append(('tree_completed', ()))
+
+  def set_description(self, description):
+    self.events.append(('set_description', (description,)))
+
+  def set_revision_info(self, revision, log, text):
+    self.events.append(('set_revision_info', (revision, log, bool(text),)))
+
+  def parse_completed(self):
+    self.events.append(('parse_completed', ()))
+
+
+def _record_rcs_file(rcs_path):
+  """Parse the RCS file at RCS_PATH using a _RecordingSink.
+
+  This function is run in a worker process.  Return a tuple (events,
+  error), where events is the list of callbacks that were recorded and
+  error is None if the file was parsed successfully.  Otherwise, error
+  is a tuple (kind, message) describing the exception that stopped
+  the parse, where kind is 'parse' (the file is not a valid RCS
+  file), 'value' (a ValueError), or 'internal' (anything else).  The
+  exception itself is not returned because not all exceptions can be
+  pickled."""
+
+  sink = _RecordingSink()
+  error = None
+  try:
+    f = open(rcs_path, 'rb')
+    try:
+      parse(f, sink)
+    finally:
+      f.close()
+  except (RCSParseError, RuntimeError), e:
+    error = ('parse', str(e))
+  except ValueError, e:
+    error = ('value', str(e))
+  except:
+    error = ('internal', traceback.format_exc())
+
+  return (sink.events, error)
+
+
+def _replay_rcs_file(recording, sink):
+  """Replay RECORDING, as returned by _record_rcs_file(), into SINK.
+
+  If the original parse failed, raise an exception equivalent to the
+  one that was raised in the worker process after all of the
+  callbacks that preceded it have been replayed."""
+
+  (events, error) = recording
+  for (method_name, args) in events:
+    getattr(sink, method_name)(*args)
+
+  if error is not None:
+    (kind, message) = error
+    if kind == 'parse':
+      raise RCSParseError(message)
+    elif kind == 'value':
+      raise ValueError(message)
+    else:
+      raise InternalError(
+          'Exception occurred in worker process:\n%s' % (message,)
+          )
+
+
 class _ProjectDataCollector:
-  def __init__(self, collect_data, project):
+  def __init__(self, collect_data, project, checkpoint_state=None):
+    """Prepare to collect the data for PROJECT.
+
+    If CHECKPOINT_STATE is specified, it is a value returned by
+    get_checkpoint_state(), from which the instance continues."""
+
     self.collect_data = collect_data
     self.project = project
+
+    if checkpoint_state is not None:
+      (
+          self.num_files, self.trunk,
+          self.symbols, self.symbol_transform_counts,
+          ) = checkpoint_state
+      self.project.trunk_id = self.trunk.id
+      return
+
     self.num_files = 0
 
     # The Trunk LineOfDevelopment object for this project:
@@ -1003,6 +1141,14 @@ class _ProjectDataCollector:
     # were affected by each each symbol name transformation:
     self.symbol_transform_counts = {}
 
+  def get_checkpoint_state(self):
+    """Return the state of this instance, as a picklable object."""
+
+    return (
+        self.num_files, self.trunk,
+        self.symbols, self.symbol_transform_counts,
+        )
+
   def get_symbol(self, name):
     """Return the Symbol object for the symbol named NAME in this project.
 
@@ -1042,15 +1188,32 @@ class _ProjectDataCollector:
               % (old_name, new_name, count,)
               )
 
-  def process_file(self, cvs_file):
+  def process_file(self, cvs_file, recording=None, stamp=None):
+    """Parse CVS_FILE and return its CVSFileItems.
+
+    If RECORDING is specified, it is the output of _record_rcs_file()
+    for CVS_FILE, computed by a worker process or recorded by the last
+    incremental conversion; replay it rather than parsing the file
+    again.  STAMP is specified for an incremental conversion; it is
+    the stamp of CVS_FILE, with which the file and its recording are
+    added to the manifest.  Return None if the file could not be
+    parsed."""
+
     logger.normal(cvs_file.rcs_path)
+    if stamp is not None and recording is None:
+      # The recording is needed for the next incremental conversion:
+      recording = _record_rcs_file(cvs_file.rcs_path)
+
     fdc = _FileDataCollector(self, cvs_file)
     try:
-      f = open(cvs_file.rcs_path, 'rb')
-      try:
-        parse(f, fdc)
-      finally:
-        f.close()
+      if recording is None:
+        f = open(cvs_file.rcs_path, 'rb')
+        try:
+          parse(f, fdc)
+        finally:
+          f.close()
+      else:
+        _replay_rcs_file(recording, fdc)
     except (RCSParseError, RuntimeError):
       self.collect_data.record_fatal_error(
           "%r is not a valid ,v file" % (cvs_file.rcs_path,)
@@ -1071,6 +1234,11 @@ class _ProjectDataCollector:
     else:
       self.num_files += 1
 
+    if stamp is not None:
+      self.collect_data.add_recording(
+          cvs_file, stamp, fdc.head_revision, recording
+          )
+
     return fdc.get_cvs_file_items()
 
 
@@ -1082,25 +1250,175 @@ class CollectData:
   class by _FileDataCollector instances, one of which is created for
   each file to be parsed."""
 
-  def __init__(self, stats_keeper):
+  def __init__(
+        self, stats_keeper, jobs=1, checkpoint=None, checkpoint_state=None,
+        manifest=None,
+        ):
+    """Prepare to collect data.
+
+    If JOBS is greater than one, then the RCS files are parsed by a
+    pool of JOBS worker processes.  The parsed data are still
+    processed and stored by this process, so the result is the same
+    regardless of the number of jobs.
+
+    If CHECKPOINT is specified, it is a Checkpoint to which the state
+    of the data collection is saved after every
+    Ctx().collect_checkpoint_interval files.  If CHECKPOINT_STATE is
+    specified, it is the state that was saved there last; the data
+    collection continues from that point, provided that the projects
+    are processed in the same order as before.  Raise CheckpointError
+    if the data collection cannot be continued from CHECKPOINT_STATE.
+
+    If MANIFEST is specified, it is a RepositoryManifest to which each
+    RCS file is added after it has been parsed, and the conversion is
+    incremental (see the incremental module): the RCS files that have
+    not changed since the last incremental conversion are not parsed
+    again, but their recorded parser callbacks are replayed.  When
+    continuing from CHECKPOINT_STATE, the manifest that was saved in
+    the checkpoint is used instead."""
+
+    self.stats_keeper = stats_keeper
+    self.manifest = manifest
+    self._checkpoint = checkpoint
+    self._files_since_checkpoint = 0
+
+    # The number of projects that have been processed so far, and a
+    # map { project.id : trunk_id } for those projects:
+    self._project_index = 0
+    self._trunk_ids = {}
+
+    # The state from which this instance continues, until the project
+    # that was being processed when it was saved is reached:
+    self._checkpoint_state = checkpoint_state
+
+    if checkpoint_state is not None:
+      self._restore_checkpoint_state(checkpoint_state)
+    else:
+      self._cvs_item_store = NewCVSItemStore(
+          artifact_manager.get_temp_file(config.CVS_ITEMS_STORE))
+      self.metadata_db = MetadataDatabase(
+          artifact_manager.get_temp_file(config.METADATA_STORE),
+          artifact_manager.get_temp_file(config.METADATA_INDEX_TABLE),
+          DB_OPEN_NEW,
+          )
+      self.metadata_logger = MetadataLogger(self.metadata_db)
+      self.fatal_errors = []
+      self.num_files = 0
+      self.symbol_stats = SymbolStatisticsCollector()
+
+      # Key generator for CVSItems:
+      self.item_key_generator = KeyGenerator()
+
+      # Key generator for Symbols:
+      self.symbol_key_generator = KeyGenerator()
+
+      # The number of RCS files whose recordings were replayed:
+      self.num_replayed_files = 0
+
+      if self.manifest is not None:
+        self._recordings = RecordingStore(
+            artifact_manager.get_temp_file(config.INCREMENTAL_RECORDINGS),
+            DB_OPEN_NEW,
+            )
+
+    if self.manifest is not None:
+      # The recordings of the last incremental conversion, if any:
+      self._old_recordings = read_recordings(Ctx().incremental_manifest)
+    else:
+      self._recordings = None
+      self._old_recordings = None
+
+    # The fatal errors that were recorded before the checkpoint (if
+    # any).  The errors found while walking the repository are
+    # reported again when the processed part of the repository is
+    # walked again; they are only recorded once:
+    self._restored_errors = set(self.fatal_errors)
+
+    # A WorkerPool used to parse RCS files, or None if they should be
+    # parsed in this process:
+    self.worker_pool = create_worker_pool(jobs)
+
+  def _restore_checkpoint_state(self, state):
+    """Open the databases and restore the in-memory data from STATE."""
+
+    if self.manifest is not None:
+      if state.get('manifest') is None:
+        raise CheckpointError(
+            'the checkpoint was saved without --incremental'
+            )
+      self.manifest = state['manifest']
+      filename = artifact_manager.get_temp_file(
+          config.INCREMENTAL_RECORDINGS
+          )
+      truncate_file(filename, state['recordings'])
+      self._recordings = RecordingStore(filename, DB_OPEN_WRITE)
+
     self._cvs_item_store = NewCVSItemStore(
-        artifact_manager.get_temp_file(config.CVS_ITEMS_STORE))
+        artifact_manager.get_temp_file(config.CVS_ITEMS_STORE),
+        state['cvs_items'],
+        )
     self.metadata_db = MetadataDatabase(
         artifact_manager.get_temp_file(config.METADATA_STORE),
         artifact_manager.get_temp_file(config.METADATA_INDEX_TABLE),
-        DB_OPEN_NEW,
+        DB_OPEN_WRITE, state['metadata'],
         )
-    self.metadata_logger = MetadataLogger(self.metadata_db)
-    self.fatal_errors = []
-    self.num_files = 0
-    self.symbol_stats = SymbolStatisticsCollector()
-    self.stats_keeper = stats_keeper
-
-    # Key generator for CVSItems:
-    self.item_key_generator = KeyGenerator()
+    self.metadata_logger = MetadataLogger(
+        self.metadata_db, state['metadata_logger']
+        )
+    self._trunk_ids = state['trunk_ids']
+    self.fatal_errors = state['fatal_errors']
+    self.num_files = state['num_files']
+    self.symbol_stats = state['symbol_stats']
+    self.item_key_generator = state['item_key_generator']
+    self.symbol_key_generator = state['symbol_key_generator']
+    self.num_replayed_files = state['num_replayed_files']
+    self.stats_keeper.__setstate__(state['stats_keeper'])
+
+  def _save_checkpoint(self, pdc, paths_done, last_path, found_rcs_file):
+    """Save the state of the data collection to self._checkpoint.
+
+    PDC is the _ProjectDataCollector of the current project, of whose
+    CVSPaths the first PATHS_DONE (ending with LAST_PATH) have been
+    processed.  FOUND_RCS_FILE tells whether any of them was an RCS
+    file."""
+
+    # The CVSPaths themselves are generated again when the conversion
+    # is continued, but the members of CVSFiles that are set while
+    # parsing the RCS files have to be remembered:
+    cvs_file_states = {}
+    for cvs_path in Ctx()._cvs_path_db.itervalues():
+      if isinstance(cvs_path, CVSFile):
+        cvs_file_states[cvs_path.id] = (
+            cvs_path.mode, cvs_path.description, cvs_path.properties,
+            )
 
-    # Key generator for Symbols:
-    self.symbol_key_generator = KeyGenerator()
+    if self._recordings is not None:
+      recordings_size = self._recordings.checkpoint()
+    else:
+      recordings_size = None
+
+    self._checkpoint.save({
+        'project_index' : self._project_index,
+        'trunk_ids' : self._trunk_ids,
+        'paths_done' : paths_done,
+        'last_path' : (last_path.id, last_path.rcs_path,),
+        'found_rcs_file' : found_rcs_file,
+        'cvs_files' : cvs_file_states,
+        'project_data_collector' : pdc.get_checkpoint_state(),
+        'cvs_items' : self._cvs_item_store.checkpoint(),
+        'metadata' : self.metadata_db.checkpoint(),
+        'metadata_logger' : self.metadata_logger.get_checkpoint_state(),
+        'fatal_errors' : self.fatal_errors,
+        'num_files' : self.num_files,
+        'symbol_stats' : self.symbol_stats,
+        'item_key_generator' : self.item_key_generator,
+        'symbol_key_generator' : self.symbol_key_generator,
+        'stats_keeper' : self.stats_keeper.__getstate__(),
+        'manifest' : self.manifest,
+        'recordings' : recordings_size,
+        'num_replayed_files' : self.num_replayed_files,
+        })
+    self._files_since_checkpoint = 0
 
   def record_fatal_error(self, err):
     """Record that fatal error ERR was found.
@@ -1110,9 +1428,20 @@ class CollectData:
     output again in a summary at the end of CollectRevsPass."""
 
     err = '%s: %s' % (error_prefix, err,)
+    if err in self._restored_errors:
+      return
     logger.error(err + '\n')
     self.fatal_errors.append(err)
 
+  def add_recording(self, cvs_file, stamp, head_revision, recording):
+    """Record CVS_FILE for the next incremental conversion.
+
+    STAMP is the stamp of the file, HEAD_REVISION its head revision,
+    and RECORDING the output of _record_rcs_file() for it."""
+
+    self.manifest.add_file(cvs_file, stamp, head_revision)
+    self._recordings.add(cvs_file, stamp, recording)
+
   def add_cvs_directory(self, cvs_directory):
     """Record CVS_DIRECTORY."""
 
@@ -1157,17 +1486,155 @@ class CollectData:
     self.add_cvs_file_items(cvs_file_items)
     self.symbol_stats.register(cvs_file_items)
 
+  def _get_old_recording(self, cvs_file):
+    """Return (stamp, recording) for CVS_FILE in an incremental conversion.
+
+    Stamp is the current stamp of the file.  Recording is the output of
+    _record_rcs_file() that was saved by the last incremental
+    conversion if the file has not changed since, otherwise None."""
+
+    stamp = get_stamp(cvs_file.rcs_path)
+    if self._old_recordings is None:
+      return (stamp, None)
+
+    recording = self._old_recordings.get(cvs_file, stamp)
+    if recording is not None:
+      self.num_replayed_files += 1
+    return (stamp, recording)
+
+  def _record_cvs_paths(self, cvs_paths):
+    """Generate (cvs_path, recording, stamp) for the CVSPaths in CVS_PATHS.
+
+    For CVSFiles, recording is the output of _record_rcs_file() for
+    the file.  In an incremental conversion, it is the one saved by
+    the last incremental conversion if the file hasn't changed since,
+    and stamp is the stamp of the file.  Otherwise, recording is
+    computed in self.worker_pool, or is None if there is no
+    self.worker_pool, in which case the file has to be parsed.  For
+    CVSDirectories, recording and stamp are None.  The tuples are
+    generated in the same order as CVS_PATHS."""
+
+    def generate_args():
+      for cvs_path in cvs_paths:
+        if isinstance(cvs_path, CVSDirectory):
+          yield ((cvs_path, None, None), None)
+          continue
+
+        if self.manifest is None:
+          (stamp, recording) = (None, None)
+        else:
+          (stamp, recording) = self._get_old_recording(cvs_path)
+
+        if recording is None and self.worker_pool is not None:
+          yield ((cvs_path, None, stamp), cvs_path.rcs_path)
+        else:
+          yield ((cvs_path, recording, stamp), None)
+
+    if self.worker_pool is None:
+      for (tag, arg) in generate_args():
+        yield tag
+    else:
+      for ((cvs_path, recording, stamp), result) in \
+              self.worker_pool.imap_tagged(_record_rcs_file, generate_args()):
+        yield (cvs_path, recording or result, stamp)
+
+  def _restore_cvs_path(self, cvs_path, cvs_file_states):
+    """Record CVS_PATH, which was processed before the checkpoint.
+
+    CVS_FILE_STATES is the map { id : (mode, description, properties) }
+    for the CVSFiles that were recorded before the checkpoint."""
+
+    if isinstance(cvs_path, CVSDirectory):
+      self.add_cvs_directory(cvs_path)
+    else:
+      try:
+        (cvs_path.mode, cvs_path.description, cvs_path.properties) = \
+            cvs_file_states[cvs_path.id]
+      except KeyError:
+        # The file could not be parsed and was not recorded.
+        pass
+      else:
+        Ctx()._cvs_path_db.log_path(cvs_path)
+
+  def _skip_cvs_paths(self, cvs_paths, state):
+    """Generate the CVSPaths from CVS_PATHS that come after the checkpoint.
+
+    STATE is the state that was saved in the checkpoint.  The CVSPaths
+    that had been processed before are only recorded.  Raise
+    FatalError if the CVSPaths don't match those that were generated
+    before the checkpoint."""
+
+    paths_done = state['paths_done']
+    last_cvs_path = None
+    checked = False
+    for (i, cvs_path) in enumerate(cvs_paths):
+      if i < paths_done:
+        self._restore_cvs_path(cvs_path, state['cvs_files'])
+        last_cvs_path = cvs_path
+      else:
+        if not checked:
+          self._check_last_path(last_cvs_path, state['last_path'])
+          checked = True
+        yield cvs_path
+
+    if not checked:
+      self._check_last_path(last_cvs_path, state['last_path'])
+
+  def _check_last_path(self, cvs_path, last_path):
+    """Check that CVS_PATH is the last CVSPath processed before the checkpoint.
+
+    LAST_PATH is the (id, rcs_path) of that CVSPath, as recorded in the
+    checkpoint."""
+
+    if cvs_path is None or (cvs_path.id, cvs_path.rcs_path) != last_path:
+      raise FatalError(
+          'The CVS repository has changed since the checkpoint was saved.\n'
+          'Please restart the conversion without --resume.'
+          )
+
   def process_project(self, project, cvs_paths):
-    pdc = _ProjectDataCollector(self, project)
+    state = self._checkpoint_state
+    self._project_index += 1
+
+    if state is not None and self._project_index < state['project_index']:
+      # This project had been processed completely before the
+      # checkpoint was saved:
+      for cvs_path in cvs_paths:
+        self._restore_cvs_path(cvs_path, state['cvs_files'])
+      project.trunk_id = state['trunk_ids'][project.id]
+      return
+    elif state is not None:
+      # The checkpoint was saved while processing this project:
+      self._checkpoint_state = None
+      pdc = _ProjectDataCollector(
+          self, project, state['project_data_collector']
+          )
+      cvs_paths = self._skip_cvs_paths(cvs_paths, state)
+      paths_done = state['paths_done']
+      found_rcs_file = state['found_rcs_file']
+    else:
+      pdc = _ProjectDataCollector(self, project)
+      paths_done = 0
+      found_rcs_file = False
+    self._trunk_ids[project.id] = project.trunk_id
+
+    if self._checkpoint is None:
+      checkpoint_interval = 0
+    else:
+      checkpoint_interval = Ctx().collect_checkpoint_interval
 
-    found_rcs_file = False
-    for cvs_path in cvs_paths:
+    for (cvs_path, recording, stamp) in self._record_cvs_paths(cvs_paths):
+      paths_done += 1
       if isinstance(cvs_path, CVSDirectory):
         self.add_cvs_directory(cvs_path)
       else:
-        cvs_file_items = pdc.process_file(cvs_path)
+        cvs_file_items = pdc.process_file(cvs_path, recording, stamp)
         self._process_cvs_file_items(cvs_file_items)
         found_rcs_file = True
+        self._files_since_checkpoint += 1
+        if (checkpoint_interval
+            and self._files_since_checkpoint >= checkpoint_interval):
+          self._save_checkpoint(pdc, paths_done, cvs_path, found_rcs_file)
 
     if not found_rcs_file:
       self.record_fatal_error(
@@ -1206,6 +1673,9 @@ class CollectData:
     Return a list of fatal errors encountered while processing input.
     Each list entry is a string describing one fatal error."""
 
+    if self.worker_pool is not None:
+      self.worker_pool.close()
+      self.worker_pool = None
     self.symbol_stats.purge_ghost_symbols()
     self.symbol_stats.close()
     self.symbol_stats = None
@@ -1214,6 +1684,12 @@ class CollectData:
     self.metadata_db = None
     self._cvs_item_store.close()
     self._cvs_item_store = None
+    if self._recordings is not None:
+      self._recordings.close()
+      self._recordings = None
+    if self._old_recordings is not None:
+      self._old_recordings.close()
+      self._old_recordings = None
     self._register_empty_subdirectories()
     retval = self.fatal_errors
     self.fatal_errors = None
@@ -32,27 +32,35 @@ CVS_EXECUTABLE = 'cvs'
 # A pickled list of the projects defined for this conversion.
 PROJECTS = 'projects.pck'
 
-# A file holding the Serializer to be used for CVS_REVS_*_DATAFILE and
-# CVS_SYMBOLS_*_DATAFILE:
+# A file holding the Serializer to be used for CVS_REVS_STORE and
+# CVS_SYMBOLS_STORE:
 ITEM_SERIALIZER = 'item-serializer.pck'
 
-# The first file contains the CVSRevisions in a form that can be
-# sorted to deduce preliminary Changesets.  The second file is the
-# sorted version of the first.
+# The first file contains fixed-width records that can be sorted to
+# deduce preliminary Changesets; each one refers to a CVSRevision
+# serialized in CVS_REVS_STORE.  The second file is the sorted version
+# of the first.
 CVS_REVS_DATAFILE = 'revs.dat'
 CVS_REVS_SORTED_DATAFILE = 'revs-s.dat'
+CVS_REVS_STORE = 'revs-items.pck'
 
-# The first file contains the CVSSymbols in a form that can be sorted
-# to deduce preliminary Changesets.  The second file is the sorted
+# The first file contains fixed-width records that can be sorted to
+# deduce preliminary Changesets; each one refers to a CVSSymbol
+# serialized in CVS_SYMBOLS_STORE.  The second file is the sorted
 # version of the first.
 CVS_SYMBOLS_DATAFILE = 'symbols.dat'
 CVS_SYMBOLS_SORTED_DATAFILE = 'symbols-s.dat'
+CVS_SYMBOLS_STORE = 'symbols-items.pck'
 
 # A mapping from CVSItem id to Changeset id.
 CVS_ITEM_TO_CHANGESET = 'cvs-item-to-changeset.dat'
 
 # A mapping from CVSItem id to Changeset id, after the
-# RevisionChangeset loops have been broken.
+# RevisionChangeset loops have been broken.  This and the following
+# two files are overlays that only store their differences from
+# CVS_ITEM_TO_CHANGESET, unless they differ so much that they have
+# been folded into plain tables (in which case the later ones store
+# their differences from the folded one).
 CVS_ITEM_TO_CHANGESET_REVBROKEN = 'cvs-item-to-changeset-revbroken.dat'
 
 # A mapping from CVSItem id to Changeset id, after the SymbolChangeset
@@ -63,6 +71,13 @@ CVS_ITEM_TO_CHANGESET_SYMBROKEN = 'cvs-item-to-changeset-symbroken.dat'
 # loops have been broken.
 CVS_ITEM_TO_CHANGESET_ALLBROKEN = 'cvs-item-to-changeset-allbroken.dat'
 
+# The dependency graphs of the RevisionChangesets after their loops
+# have been broken, and of all Changesets after all loops have been
+# broken.  These are written by the passes that break the loops, for
+# the passes that sort the changesets (see changeset_graph_snapshot).
+CHANGESET_GRAPH_REVBROKEN = 'changeset-graph-revbroken.dat'
+CHANGESET_GRAPH_ALLBROKEN = 'changeset-graph-allbroken.dat'
+
 # A mapping from id to Changeset.
 CHANGESETS_INDEX = 'changesets-index.dat'
 CHANGESETS_STORE = 'changesets.pck'
@@ -98,21 +113,46 @@ CHANGESETS_SORTED_DATAFILE = 'changesets-s.txt'
 # filenames.
 STATISTICS_FILE = 'statistics-%02d.pck'
 
-# This text file contains records (1 per line) that describe openings
-# and closings for copies to tags and branches.  The format is as
-# follows:
+# If --profile-resources is used, the resources used by each pass are
+# written to this file (as JSON) at the end of each pass.  The file is
+# not removed at the end of the conversion.
+RESOURCE_USAGE_FILE = 'resource-usage.json'
+
+# The checkpoints from which CollectRevsPass and OutputPass can be
+# continued if the conversion is interrupted (see --resume).  Each
+# file contains a pickled map describing the state of the pass after
+# the last checkpoint.  See the checkpoint module.
+COLLECT_REVS_CHECKPOINT = 'collect-revs-checkpoint.pck'
+OUTPUT_CHECKPOINT = 'output-checkpoint.pck'
+
+# The part of the --incremental manifest that describes the RCS files
+# of the CVS repository (a pickled RepositoryManifest), as recorded by
+# CollectRevsPass.  OutputPass adds the digests of the revisions that
+# it writes and saves the complete manifest.  See the incremental
+# module.
+INCREMENTAL_MANIFEST = 'incremental-manifest.pck'
+
+# The parser callbacks for each RCS file, recorded by CollectRevsPass
+# for the next incremental conversion (a RecordingStore).  OutputPass
+# saves them along with the manifest.
+INCREMENTAL_RECORDINGS = 'incremental-recordings.db'
+
+# This binary file contains fixed-width records that describe
+# openings and closings for copies to tags and branches.  Each record
+# holds
 #
 #     SYMBOL_ID SVN_REVNUM TYPE CVS_SYMBOL_ID
 #
-# where type is either OPENING or CLOSING.  CVS_SYMBOL_ID is the id of
-# the CVSSymbol whose opening or closing is being described (in hex).
-SYMBOL_OPENINGS_CLOSINGS = 'symbolic-names.txt'
+# packed using openings_closings.SYMBOLING_RECORD_FORMAT, where type is
+# either OPENING or CLOSING.  CVS_SYMBOL_ID is the id of the CVSSymbol
+# whose opening or closing is being described.
+SYMBOL_OPENINGS_CLOSINGS = 'symbolic-names.dat'
 # A sorted version of the above file.  SYMBOL_ID and SVN_REVNUM are
 # the primary and secondary sorting criteria.  It is important that
 # SYMBOL_IDs be located together to make it quick to read them at
 # once.  The order of SVN_REVNUM is only important because it is
 # assumed by some internal consistency checks.
-SYMBOL_OPENINGS_CLOSINGS_SORTED = 'symbolic-names-s.txt'
+SYMBOL_OPENINGS_CLOSINGS_SORTED = 'symbolic-names-s.dat'
 
 # Skeleton version of the repository filesystem.  See class
 # RepositoryMirror for how these work.
@@ -121,9 +161,19 @@ MIRROR_NODES_STORE = 'mirror-nodes.pck'
 
 # Offsets pointing to the beginning of each symbol's records in
 # SYMBOL_OPENINGS_CLOSINGS_SORTED.  This file contains a pickled map
-# from symbol_id to file offset.
+# from symbol_id to (file offset, number of records).  It is written
+# along with SYMBOL_OPENINGS_CLOSINGS, before that file is sorted.
 SYMBOL_OFFSETS_DB = 'symbol-offsets.pck'
 
+# The revision numbers of the SVNSymbolCommits, as a pickled list.
+SVN_SYMBOL_COMMIT_REVNUMS = 'svn-symbol-commit-revnums.pck'
+
+# The plans of the symbol fills, made by PlanSymbolFillsPass.  This
+# database maps the revision number of each SVNSymbolCommit to the
+# marshalled plan returned by FillSource.get_plan().
+SYMBOL_FILL_PLANS_INDEX_TABLE = 'symbol-fill-plans-index.dat'
+SYMBOL_FILL_PLANS_STORE = 'symbol-fill-plans.dat'
+
 # Pickled map of CVSPath.id to instance.
 CVS_PATHS_DB = 'cvs-paths.pck'
 
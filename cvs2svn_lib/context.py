@@ -59,6 +59,16 @@ class Ctx:
     self.file_property_setters = []
     self.revision_property_setters = []
     self.tmpdir = None
+    self.jobs = 1
+    self.sort_memory = None
+    self.db_backend = 'logstore'
+    self.changeset_graph_backend = 'dict'
+    self.batch_cycle_breaking = True
+    self.verify_changeset_graph_snapshots = False
+    self.collect_checkpoint_interval = 1000
+    self.output_checkpoint_interval = 1000
+    self.interrupt_after_checkpoint = None
+    self.incremental_manifest = None
     self.skip_cleanup = False
     self.keep_cvsignore = False
     self.cross_project_commits = True
@@ -17,7 +17,9 @@
 """This module contains a database that can store arbitrary CVSItems."""
 
 
-import re
+import os
+import struct
+import mmap
 import cPickle
 
 from cvs2svn_lib.cvs_item import CVSRevisionAdd
@@ -29,9 +31,11 @@ from cvs2svn_lib.cvs_item import CVSBranchNoop
 from cvs2svn_lib.cvs_item import CVSTag
 from cvs2svn_lib.cvs_item import CVSTagNoop
 from cvs2svn_lib.cvs_file_items import CVSFileItems
-from cvs2svn_lib.serializer import Serializer
 from cvs2svn_lib.serializer import PrimedPickleSerializer
+from cvs2svn_lib.checkpoint import sync_file
+from cvs2svn_lib.checkpoint import truncate_file
 from cvs2svn_lib.indexed_database import IndexedStore
+from cvs2svn_lib.sort import read_records
 
 
 cvs_item_primer = (
@@ -53,21 +57,37 @@ class NewCVSItemStore:
   We don't use a single pickler for all items because the memo would
   grow too large."""
 
-  def __init__(self, filename):
-    """Initialize an instance, creating the file and writing the primer."""
+  def __init__(self, filename, checkpoint=None):
+    """Initialize an instance, creating the file and writing the primer.
 
-    self.f = open(filename, 'wb')
+    If CHECKPOINT is specified, it is a value returned by checkpoint();
+    instead of creating a new file, continue writing the existing file
+    from the time of that call."""
 
-    self.serializer = PrimedPickleSerializer(
-        cvs_item_primer + (CVSFileItems,)
-        )
-    cPickle.dump(self.serializer, self.f, -1)
+    if checkpoint is None:
+      self.f = open(filename, 'wb')
+
+      self.serializer = PrimedPickleSerializer(
+          cvs_item_primer + (CVSFileItems,)
+          )
+      cPickle.dump(self.serializer, self.f, -1)
+    else:
+      truncate_file(filename, checkpoint)
+      self.f = open(filename, 'rb+')
+      self.serializer = cPickle.load(self.f)
+      self.f.seek(0, 2)
 
   def add(self, cvs_file_items):
     """Write CVS_FILE_ITEMS into the database."""
 
     self.serializer.dumpf(self.f, cvs_file_items)
 
+  def checkpoint(self):
+    """Write the file to disk and return its length."""
+
+    sync_file(self.f)
+    return self.f.tell()
+
   def close(self):
     self.f.close()
     self.f = None
@@ -101,142 +121,143 @@ class OldCVSItemStore:
     self.f = None
 
 
-class LinewiseSerializer(Serializer):
-  """A serializer that writes exactly one line for each object.
+class _SortableItemDatabase(object):
+  """A serially-accessible, sortable file for holding CVSItems.
 
-  The actual serialization is done by a wrapped serializer; this class
-  only escapes any newlines in the serialized data then appends a
-  single newline."""
+  Such a database consists of two files.  The payload file holds the
+  serialized CVSItems, in the order that they were added.  The record
+  file holds one fixed-width record for each item, consisting of a
+  sort key followed by the offset and length of the item within the
+  payload file.  The keys are packed big-endian, so sorting the
+  records as strings (e.g., using sort_file() with RECORD_SIZE)
+  orders them by key, and items with equal keys stay in the order
+  that they were added.  Only the record file has to be sorted; the
+  payloads are never rewritten.
 
-  def __init__(self, wrapee):
-    self.wrapee = wrapee
+  Deriving classes have to set RECORD_FORMAT, a struct format whose
+  last two fields are the payload offset and length."""
 
-  @staticmethod
-  def _encode_newlines(s):
-    """Return s with newlines and backslashes encoded.
+  RECORD_FORMAT = None
 
-    The string is returned with the following character transformations:
+  @classmethod
+  def record_size(cls):
+    """Return the size in bytes of the records of this database."""
 
-      LF -> \n
-      CR -> \r
-      ^Z -> \z (needed for Windows)
-      \ -> \\
+    return struct.calcsize(cls.RECORD_FORMAT)
 
-    """
 
-    return s.replace('\\', '\\\\') \
-            .replace('\n', '\\n') \
-            .replace('\r', '\\r') \
-            .replace('\x1a', '\\z')
+class _NewSortableItemDatabase(_SortableItemDatabase):
+  """Create a database of sortable CVSItems."""
 
-  _escape_re = re.compile(r'(\\\\|\\n|\\r|\\z)')
-  _subst = {'\\n' : '\n', '\\r' : '\r', '\\z' : '\x1a', '\\\\' : '\\'}
+  def __init__(self, filename, payload_filename, serializer):
+    self.f = open(filename, 'wb')
+    self.payload_f = open(payload_filename, 'wb')
+    self.serializer = serializer
+    self.payload_offset = 0
 
-  @staticmethod
-  def _decode_newlines(s):
-    """Return s with newlines and backslashes decoded.
+  def _add(self, cvs_item, *key):
+    s = self.serializer.dumps(cvs_item)
+    self.payload_f.write(s)
+    self.f.write(
+        struct.pack(self.RECORD_FORMAT, *(key + (self.payload_offset, len(s))))
+        )
+    self.payload_offset += len(s)
+
+  def close(self):
+    self.f.close()
+    self.f = None
+    self.payload_f.close()
+    self.payload_f = None
 
-    This function reverses the encoding of _encode_newlines().
 
-    """
+class _OldSortableItemDatabase(_SortableItemDatabase):
+  """Read the CVSItems of a (sorted) database in record order."""
 
-    def repl(m):
-      return LinewiseSerializer._subst[m.group(1)]
+  def __init__(self, filename, payload_filename, serializer):
+    self.filename = filename
+    self.payload_filename = payload_filename
+    self.serializer = serializer
 
-    return LinewiseSerializer._escape_re.sub(repl, s)
+  def __iter__(self):
+    if not os.path.getsize(self.payload_filename):
+      # An empty file cannot be memory-mapped (and has no items):
+      return
 
-  def dumpf(self, f, object):
-    f.write(self.dumps(object))
+    record_format = self.RECORD_FORMAT
+    payload_f = open(self.payload_filename, 'rb')
+    try:
+      payload = mmap.mmap(payload_f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        f = open(self.filename, 'rb')
+        try:
+          for record in read_records(f, self.record_size()):
+            (offset, length) = struct.unpack(record_format, record)[-2:]
+            yield self.serializer.loads(payload[offset:offset + length])
+        finally:
+          f.close()
+      finally:
+        payload.close()
+    finally:
+      payload_f.close()
 
-  def dumps(self, object):
-    return self._encode_newlines(self.wrapee.dumps(object)) + '\n'
+  def close(self):
+    pass
 
-  def loadf(self, f):
-    return self.loads(f.readline())
 
-  def loads(self, s):
-    return self.wrapee.loads(self._decode_newlines(s[:-1]))
+class _SortableCVSRevisionDatabase(_SortableItemDatabase):
+  # Records are sorted by (metadata_id, timestamp).  The timestamp is
+  # offset by TIMESTAMP_BIAS so that it can be stored unsigned:
+  RECORD_FORMAT = '>IQQI'
+  TIMESTAMP_BIAS = 1L << 63
 
 
-class NewSortableCVSRevisionDatabase(object):
+class NewSortableCVSRevisionDatabase(
+      _SortableCVSRevisionDatabase, _NewSortableItemDatabase
+      ):
   """A serially-accessible, sortable file for holding CVSRevisions.
 
   This class creates such files."""
 
-  def __init__(self, filename, serializer):
-    self.f = open(filename, 'w')
-    self.serializer = LinewiseSerializer(serializer)
-
   def add(self, cvs_rev):
-    self.f.write(
-        '%x %08x %s' % (
-            cvs_rev.metadata_id, cvs_rev.timestamp,
-            self.serializer.dumps(cvs_rev),
-            )
+    self._add(
+        cvs_rev, cvs_rev.metadata_id, cvs_rev.timestamp + self.TIMESTAMP_BIAS
         )
 
-  def close(self):
-    self.f.close()
-    self.f = None
 
-
-class OldSortableCVSRevisionDatabase(object):
+class OldSortableCVSRevisionDatabase(
+      _SortableCVSRevisionDatabase, _OldSortableItemDatabase
+      ):
   """A serially-accessible, sortable file for holding CVSRevisions.
 
   This class reads such files."""
 
-  def __init__(self, filename, serializer):
-    self.filename = filename
-    self.serializer = LinewiseSerializer(serializer)
+  pass
 
-  def __iter__(self):
-    f = open(self.filename, 'r')
-    for l in f:
-      s = l.split(' ', 2)[-1]
-      yield self.serializer.loads(s)
-    f.close()
 
-  def close(self):
-    pass
+class _SortableCVSSymbolDatabase(_SortableItemDatabase):
+  # Records are sorted by symbol id:
+  RECORD_FORMAT = '>IQI'
 
 
-class NewSortableCVSSymbolDatabase(object):
+class NewSortableCVSSymbolDatabase(
+      _SortableCVSSymbolDatabase, _NewSortableItemDatabase
+      ):
   """A serially-accessible, sortable file for holding CVSSymbols.
 
   This class creates such files."""
 
-  def __init__(self, filename, serializer):
-    self.f = open(filename, 'w')
-    self.serializer = LinewiseSerializer(serializer)
-
   def add(self, cvs_symbol):
-    self.f.write(
-        '%x %s' % (cvs_symbol.symbol.id, self.serializer.dumps(cvs_symbol))
-        )
+    self._add(cvs_symbol, cvs_symbol.symbol.id)
 
-  def close(self):
-    self.f.close()
-    self.f = None
 
-
-class OldSortableCVSSymbolDatabase(object):
+class OldSortableCVSSymbolDatabase(
+      _SortableCVSSymbolDatabase, _OldSortableItemDatabase
+      ):
   """A serially-accessible, sortable file for holding CVSSymbols.
 
   This class reads such files."""
 
-  def __init__(self, filename, serializer):
-    self.filename = filename
-    self.serializer = LinewiseSerializer(serializer)
-
-  def __iter__(self):
-    f = open(self.filename, 'r')
-    for l in f:
-      s = l.split(' ', 1)[-1]
-      yield self.serializer.loads(s)
-    f.close()
-
-  def close(self):
-    pass
+  pass
 
 
 def IndexedCVSItemStore(filename, index_filename, mode):
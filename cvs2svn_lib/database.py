@@ -22,53 +22,125 @@ import os
 import cPickle
 
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import warning_prefix
-from cvs2svn_lib.common import error_prefix
+from cvs2svn_lib.context import Ctx
 from cvs2svn_lib.log import logger
+from cvs2svn_lib.log_store import LogStore
 
 
-# DBM module selection
-
-# 1. If we have bsddb3, it is probably newer than bsddb.  Fake bsddb = bsddb3,
-#    so that the dbhash module used by anydbm will use bsddb3.
-try:
-  import bsddb3
-  sys.modules['bsddb'] = bsddb3
-except ImportError:
-  pass
-
-# 2. These DBM modules are not good for cvs2svn.
-import anydbm
-if anydbm._defaultmod.__name__ in ['dumbdbm', 'dbm']:
-  logger.error(
-      '%s: cvs2svn uses the anydbm package, which depends on lower level '
-          'dbm\n'
-      'libraries.  Your system has %s, with which cvs2svn is known to have\n'
-      'problems.  To use cvs2svn, you must install a Python dbm library '
-          'other than\n'
-      'dumbdbm or dbm.  See '
-          'http://python.org/doc/current/lib/module-anydbm.html\n'
-      'for more information.\n'
-      % (error_prefix, anydbm._defaultmod.__name__,)
-      )
-  sys.exit(1)
-
-# 3. If we are using the old bsddb185 module, then try prefer gdbm instead.
-#    Unfortunately, gdbm appears not to be trouble free, either.
-if hasattr(anydbm._defaultmod, 'bsddb') \
-    and not hasattr(anydbm._defaultmod.bsddb, '__version__'):
+# The names of the available database backends.  See Database.
+BACKEND_LOGSTORE = 'logstore'
+BACKEND_ANYDBM = 'anydbm'
+BACKENDS = [BACKEND_LOGSTORE, BACKEND_ANYDBM]
+
+
+_anydbm = None
+
+def _get_anydbm():
+  """Import and return the anydbm module, choosing a DBM module for it.
+
+  This is done lazily so that the choice (and the complaints about the
+  DBM modules that are available) only happens if the anydbm backend
+  is actually used."""
+
+  global _anydbm
+
+  if _anydbm is not None:
+    return _anydbm
+
+  # 1. If we have bsddb3, it is probably newer than bsddb.  Fake bsddb =
+  #    bsddb3, so that the dbhash module used by anydbm will use bsddb3.
   try:
-    gdbm = __import__('gdbm')
+    import bsddb3
+    sys.modules['bsddb'] = bsddb3
   except ImportError:
-    logger.warn(
-        '%s: The version of the bsddb module found on your computer '
-            'has been\n'
-        'reported to malfunction on some datasets, causing KeyError '
-            'exceptions.\n'
-        % (warning_prefix,)
+    pass
+
+  # 2. These DBM modules are not good for cvs2svn.
+  import anydbm
+  if anydbm._defaultmod.__name__ in ['dumbdbm', 'dbm']:
+    raise FatalError(
+        'The anydbm database backend depends on lower level dbm\n'
+        'libraries.  Your system has %s, with which cvs2svn is known to '
+            'have\n'
+        'problems.  To use this backend, you must install a Python dbm '
+            'library\n'
+        'other than dumbdbm or dbm (or use the default backend, "%s").  '
+            'See\n'
+        'http://python.org/doc/current/lib/module-anydbm.html for more '
+            'information.'
+        % (anydbm._defaultmod.__name__, BACKEND_LOGSTORE,)
         )
+
+  # 3. If we are using the old bsddb185 module, then try prefer gdbm
+  #    instead.  Unfortunately, gdbm appears not to be trouble free,
+  #    either.
+  if hasattr(anydbm._defaultmod, 'bsddb') \
+      and not hasattr(anydbm._defaultmod.bsddb, '__version__'):
+    try:
+      gdbm = __import__('gdbm')
+    except ImportError:
+      logger.warn(
+          '%s: The version of the bsddb module found on your computer '
+              'has been\n'
+          'reported to malfunction on some datasets, causing KeyError '
+              'exceptions.\n'
+          % (warning_prefix,)
+          )
+    else:
+      anydbm._defaultmod = gdbm
+
+  _anydbm = anydbm
+  return _anydbm
+
+
+def _open_anydbm(filename, mode):
+  """Open FILENAME as an anydbm database in MODE."""
+
+  anydbm = _get_anydbm()
+
+  # pybsddb3 has a bug which prevents it from working with
+  # Berkeley DB 4.2 if you open the db with 'n' ("new").  This
+  # causes the DB_TRUNCATE flag to be passed, which is disallowed
+  # for databases protected by lock and transaction support
+  # (bsddb databases use locking from bsddb version 4.2.4 onwards).
+  #
+  # Therefore, manually perform the removal (we can do this, because
+  # we know that for bsddb - but *not* anydbm in general - the database
+  # consists of one file with the name we specify, rather than several
+  # based on that name).
+  if mode == DB_OPEN_NEW and anydbm._defaultmod.__name__ == 'dbhash':
+    if os.path.isfile(filename):
+      os.unlink(filename)
+    return anydbm.open(filename, 'c')
   else:
-    anydbm._defaultmod = gdbm
+    return anydbm.open(filename, mode)
+
+
+def check_backend(backend):
+  """Raise FatalError if BACKEND is unknown or cannot be used here."""
+
+  if backend == BACKEND_ANYDBM:
+    _get_anydbm()
+  elif backend not in BACKENDS:
+    raise FatalError('Unknown database backend %r' % (backend,))
+
+
+def open_backend(filename, mode, backend=None):
+  """Open FILENAME in MODE as a string-to-string database.
+
+  BACKEND is one of BACKENDS; if it is None, use Ctx().db_backend."""
+
+  if backend is None:
+    backend = Ctx().db_backend
+
+  if backend == BACKEND_LOGSTORE:
+    return LogStore(filename, mode)
+  elif backend == BACKEND_ANYDBM:
+    return _open_anydbm(filename, mode)
+  else:
+    raise FatalError('Unknown database backend %r' % (backend,))
 
 
 class Database:
@@ -78,34 +150,21 @@ class Database:
   self.serializer_key.  (This implies that self.serializer_key may not
   be used as a key for normal entries.)
 
-  The backing database is an anydbm-based DBM.
+  The backing database is opened by open_backend(); it is either a
+  LogStore or an anydbm-based DBM.
 
   """
 
   serializer_key = '_.%$1\t;_ '
 
-  def __init__(self, filename, mode, serializer=None):
+  def __init__(self, filename, mode, serializer=None, backend=None):
     """Constructor.
 
     The database stores its Serializer, so none needs to be supplied
-    when opening an existing database."""
-
-    # pybsddb3 has a bug which prevents it from working with
-    # Berkeley DB 4.2 if you open the db with 'n' ("new").  This
-    # causes the DB_TRUNCATE flag to be passed, which is disallowed
-    # for databases protected by lock and transaction support
-    # (bsddb databases use locking from bsddb version 4.2.4 onwards).
-    #
-    # Therefore, manually perform the removal (we can do this, because
-    # we know that for bsddb - but *not* anydbm in general - the database
-    # consists of one file with the name we specify, rather than several
-    # based on that name).
-    if mode == DB_OPEN_NEW and anydbm._defaultmod.__name__ == 'dbhash':
-      if os.path.isfile(filename):
-        os.unlink(filename)
-      self.db = anydbm.open(filename, 'c')
-    else:
-      self.db = anydbm.open(filename, mode)
+    when opening an existing database.  BACKEND is passed to
+    open_backend()."""
+
+    self.db = open_backend(filename, mode, backend)
 
     # Import implementations for many mapping interface methods.
     for meth_name in ('__delitem__',
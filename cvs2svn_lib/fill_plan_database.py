@@ -0,0 +1,164 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This module contains the database of the plans of symbol fills.
+
+PlanSymbolFillsPass decides, for each SVNSymbolCommit, from which
+source each path of the symbol fill would best be copied (see
+FillSource.get_plan()), and stores the plan in a FillPlanDatabase
+indexed by the revision number of the SVNSymbolCommit.  OutputPass
+then fills the symbol from a PlannedFillSource made from the plan, so
+that it doesn't have to read the openings and closings of the symbol
+and score the possible sources itself."""
+
+
+from cvs2svn_lib import config
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.artifact_manager import artifact_manager
+from cvs2svn_lib.worker_pool import create_worker_pool
+from cvs2svn_lib.serializer import MarshalSerializer
+from cvs2svn_lib.indexed_database import IndexedDatabase
+from cvs2svn_lib.cvs_item_database import IndexedCVSItemStore
+from cvs2svn_lib.openings_closings import SymbolingsReader
+from cvs2svn_lib.fill_source import get_source_set
+from cvs2svn_lib.fill_source import PlannedFillSource
+
+
+# The approximate number of CVSSymbols in the SVNSymbolCommits that
+# are sent to a worker at a time:
+_CHUNK_ITEMS = 10000
+
+
+class FillPlanDatabase(IndexedDatabase):
+  """A database mapping SVN revision numbers to plans of symbol fills."""
+
+  def __init__(self, mode):
+    IndexedDatabase.__init__(
+        self,
+        artifact_manager.get_temp_file(config.SYMBOL_FILL_PLANS_STORE),
+        artifact_manager.get_temp_file(config.SYMBOL_FILL_PLANS_INDEX_TABLE),
+        mode, MarshalSerializer(),
+        )
+
+  def get_fill_source(self, svn_symbol_commit):
+    """Return a PlannedFillSource for filling SVN_SYMBOL_COMMIT."""
+
+    return PlannedFillSource(
+        svn_symbol_commit.symbol, self[svn_symbol_commit.revnum]
+        )
+
+
+def plan_symbol_fill(svn_symbol_commit, symbolings_reader):
+  """Return the plan for filling SVN_SYMBOL_COMMIT.
+
+  Read the openings and closings of the CVSSymbols in
+  SVN_SYMBOL_COMMIT using SYMBOLINGS_READER."""
+
+  fill_source = get_source_set(
+      svn_symbol_commit.symbol,
+      symbolings_reader.get_range_map(svn_symbol_commit),
+      )
+  return fill_source.get_plan()
+
+
+# The SymbolingsReader that _plan_symbol_fills() uses in a worker
+# process, and the filenames of the CVSItem store that it opened:
+_worker_symbolings_reader = None
+_worker_filenames = None
+
+
+def _plan_symbol_fills(args):
+  """Return a list of (revnum, plan) for some SVNSymbolCommits.
+
+  This function is run in a worker process by plan_symbol_fills().
+  ARGS is a tuple (filenames, svn_symbol_commits).  FILENAMES is a
+  tuple (cvs_items_filename, cvs_items_index_filename), from which the
+  CVSItem store is opened read-only the first time that it is needed.
+  (Unpickling the SVNSymbolCommits and the CVSSymbols uses the
+  Ctx()._symbol_db and Ctx()._cvs_path_db that the worker inherited
+  from the main process.)"""
+
+  global _worker_symbolings_reader, _worker_filenames
+
+  (filenames, svn_symbol_commits) = args
+
+  if filenames != _worker_filenames:
+    if _worker_filenames is not None:
+      Ctx()._cvs_items_db.close()
+      _worker_symbolings_reader.close()
+    Ctx()._cvs_items_db = IndexedCVSItemStore(
+        filenames[0], filenames[1], DB_OPEN_READ
+        )
+    _worker_symbolings_reader = SymbolingsReader()
+    _worker_filenames = filenames
+
+  return [
+      (
+          svn_symbol_commit.revnum,
+          plan_symbol_fill(svn_symbol_commit, _worker_symbolings_reader),
+          )
+      for svn_symbol_commit in svn_symbol_commits
+      ]
+
+
+def _iter_chunks(filenames, svn_symbol_commits):
+  """Generate the arguments of _plan_symbol_fills() for SVN_SYMBOL_COMMITS."""
+
+  chunk = []
+  chunk_items = 0
+  for svn_symbol_commit in svn_symbol_commits:
+    chunk.append(svn_symbol_commit)
+    chunk_items += len(svn_symbol_commit.cvs_symbol_ids)
+    if chunk_items >= _CHUNK_ITEMS:
+      yield (filenames, chunk)
+      chunk = []
+      chunk_items = 0
+
+  if chunk:
+    yield (filenames, chunk)
+
+
+def plan_symbol_fills(svn_symbol_commits, fill_plans):
+  """Store the plans for filling SVN_SYMBOL_COMMITS to FILL_PLANS.
+
+  SVN_SYMBOL_COMMITS is an iterable over SVNSymbolCommits; FILL_PLANS
+  is a FillPlanDatabase opened for writing.  The CVSItems are read
+  from Ctx()._cvs_items_db.  If Ctx().jobs is greater than one, the
+  plans are computed in worker processes."""
+
+  worker_pool = create_worker_pool(Ctx().jobs)
+
+  if worker_pool is None:
+    symbolings_reader = SymbolingsReader()
+    for svn_symbol_commit in svn_symbol_commits:
+      fill_plans[svn_symbol_commit.revnum] = plan_symbol_fill(
+          svn_symbol_commit, symbolings_reader
+          )
+    symbolings_reader.close()
+  else:
+    filenames = (
+        Ctx()._cvs_items_db.filename,
+        Ctx()._cvs_items_db.index_filename,
+        )
+    for plans in worker_pool.imap(
+          _plan_symbol_fills, _iter_chunks(filenames, svn_symbol_commits)
+          ):
+      for (revnum, plan) in plans:
+        fill_plans[revnum] = plan
+    worker_pool.close()
+
+
@@ -20,7 +20,9 @@
 from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import SVN_INVALID_REVNUM
+from cvs2svn_lib.context import Ctx
 from cvs2svn_lib.svn_revision_range import SVNRevisionRange
+from cvs2svn_lib.svn_revision_range import RevisionDeltas
 from cvs2svn_lib.svn_revision_range import RevisionScores
 
 
@@ -39,11 +41,17 @@ class FillSource:
   as a source.
 
   FillSource objects are able to compute the score for arbitrary
-  source LODs and source revision numbers.
+  source LODs and source revision numbers.  The scores of a directory
+  are computed from a RevisionDeltas instance that summarizes the
+  SVNRevisionRanges within it.  These are computed for all of the
+  directories in the tree at once, bottom up, and are shared with the
+  FillSources of the subdirectories, so that the symbol filler doesn't
+  have to collect and sort the ranges of a whole subtree again at
+  every level.
 
   These objects are used by the symbol filler in SVNOutputOption."""
 
-  def __init__(self, cvs_path, symbol, node_tree):
+  def __init__(self, cvs_path, symbol, node_tree, revision_deltas_map=None):
     """Create a fill source.
 
     The best LOD and SVN REVNUM to use as the copy source can be
@@ -61,11 +69,24 @@ class FillSource:
           of SVN revision numbers from which the CVSPath can be
           copied.
 
+      _revision_deltas_map -- (dict) a map { CVSDirectory :
+          RevisionDeltas } summarizing the SVNRevisionRanges within
+          each directory in _node_tree (including the directory
+          described by this FillSource), or None if it hasn't been
+          computed yet.  It is computed by compute_best_source() and
+          passed on to the subsources.
+
+      _revision_scores -- (RevisionScores) the scores of the sources
+          of this FillSource, or None if they haven't been computed
+          yet.
+
     """
 
     self.cvs_path = cvs_path
     self._symbol = symbol
     self._node_tree = node_tree
+    self._revision_deltas_map = revision_deltas_map
+    self._revision_scores = None
 
   def _set_node(self, cvs_file, svn_revision_range):
     parent_node = self._get_node(cvs_file.parent_directory, create=True)
@@ -100,11 +121,36 @@ class FillSource:
     sort order).  The return value's source_lod is the best LOD to
     copy from, and its opening_revnum is the best SVN revision."""
 
-    # Aggregate openings and closings from our rev tree
-    svn_revision_ranges = self._get_revision_ranges(self._node_tree)
-
-    # Score the lists
-    revision_scores = RevisionScores(svn_revision_ranges)
+    if isinstance(self._node_tree, SVNRevisionRange):
+      # It is a leaf node.
+      svn_revision_range = self._node_tree
+      if svn_revision_range.opening_revnum in svn_revision_range:
+        # The best score (1) is that of the opening revision, and
+        # PREFERRED_SOURCE has the same score if and only if it lies
+        # within the range:
+        if (
+            preferred_source is not None
+            and preferred_source.source_lod == svn_revision_range.source_lod
+            and preferred_source.opening_revnum in svn_revision_range
+            ):
+          return SVNRevisionRange(
+              preferred_source.source_lod, preferred_source.opening_revnum
+              )
+        else:
+          return SVNRevisionRange(
+              svn_revision_range.source_lod,
+              svn_revision_range.opening_revnum,
+              )
+      revision_scores = RevisionScores([svn_revision_range])
+    else:
+      if self._revision_scores is None:
+        if self._revision_deltas_map is None:
+          self._revision_deltas_map = {}
+          self._compute_revision_deltas(self.cvs_path, self._node_tree)
+        self._revision_scores = RevisionScores(
+            self._revision_deltas_map[self.cvs_path]
+            )
+      revision_scores = self._revision_scores
 
     best_source_lod, best_revnum, best_score = \
         revision_scores.get_best_revnum()
@@ -124,28 +170,97 @@ class FillSource:
 
     return SVNRevisionRange(best_source_lod, best_revnum)
 
-  def _get_revision_ranges(self, node):
-    """Return a list of all the SVNRevisionRanges at and under NODE.
+  def _compute_revision_deltas(self, cvs_path, node):
+    """Compute the RevisionDeltas for the directory NODE and its subnodes.
+
+    CVS_PATH is the CVSDirectory described by NODE.  Store the
+    RevisionDeltas of it and of all of its subdirectories in
+    self._revision_deltas_map, and return the one for NODE.  This is a
+    helper method used by compute_best_source()."""
+
+    revision_deltas = RevisionDeltas()
+    for (sub_path, subnode) in node.iteritems():
+      if isinstance(subnode, SVNRevisionRange):
+        # It is a leaf node.
+        revision_deltas.add_range(subnode)
+      else:
+        # It is an intermediate node.
+        revision_deltas.update(
+            self._compute_revision_deltas(sub_path, subnode)
+            )
+    self._revision_deltas_map[cvs_path] = revision_deltas
+    return revision_deltas
+
+  def get_plan(self, ancestor_sources=[]):
+    """Return a plan of the fill, from which a PlannedFillSource is made.
+
+    The plan records the result of compute_best_source() for every
+    source that can be preferred when this FillSource or one of its
+    subsources is filled.  The symbol filler prefers the source from
+    which the parent directory was copied, and that is always the best
+    source of one of the ancestor directories.  ANCESTOR_SOURCES is a
+    list of the (distinct) best sources of the ancestors of
+    self.cvs_path, as SVNRevisionRange instances.
+
+    The plan is a tuple (cvs_path_id, best, ties, subplans) that can
+    be serialized using marshal:
+
+      cvs_path_id -- the id of self.cvs_path.
+
+      best -- a tuple (source_lod_id, revnum) describing the best
+          source, or None if there is none.
+
+      ties -- a tuple of the (source_lod_id, revnum) of the
+          ANCESTOR_SOURCES that score as well as the best source
+          (excluding the best source itself).
+
+      subplans -- a tuple of the plans of the subsources, or None if
+          self.cvs_path is a file.
 
-    Include duplicates.  This is a helper method used by
-    compute_best_source()."""
+    """
 
-    if isinstance(node, SVNRevisionRange):
-      # It is a leaf node.
-      return [ node ]
+    try:
+      best_source = self.compute_best_source(None)
+    except FatalError:
+      best = None
     else:
-      # It is an intermediate node.
-      revision_ranges = []
-      for key, subnode in node.items():
-        revision_ranges.extend(self._get_revision_ranges(subnode))
-      return revision_ranges
+      best = (best_source.source_lod.id, best_source.opening_revnum)
+
+    ties = []
+    sources = []
+    for source in ancestor_sources:
+      key = (source.source_lod.id, source.opening_revnum)
+      if key == best:
+        continue
+      sources.append(source)
+      try:
+        copy_source = self.compute_best_source(source)
+      except FatalError:
+        continue
+      if copy_source.source_lod == source.source_lod \
+             and copy_source.opening_revnum == source.opening_revnum:
+        ties.append(key)
+
+    if isinstance(self._node_tree, SVNRevisionRange):
+      subplans = None
+    else:
+      if best is not None:
+        sources.append(best_source)
+      subplans = tuple([
+          fill_subsource.get_plan(sources)
+          for (cvs_path, fill_subsource) in self.get_subsources()
+          ])
+
+    return (self.cvs_path.id, best, tuple(ties), subplans)
 
   def get_subsources(self):
     """Generate (CVSPath, FillSource) for all direct subsources."""
 
     if not isinstance(self._node_tree, SVNRevisionRange):
       for cvs_path, node in self._node_tree.items():
-        fill_source = FillSource(cvs_path, self._symbol, node)
+        fill_source = FillSource(
+            cvs_path, self._symbol, node, self._revision_deltas_map
+            )
         yield (cvs_path, fill_source)
 
   def get_subsource_map(self):
@@ -171,6 +286,92 @@ class FillSource:
     return '%s%r' % (self, self._node_tree,)
 
 
+class PlannedFillSource:
+  """A fill source whose best sources were determined in advance.
+
+  A PlannedFillSource is made from a plan that was returned by
+  FillSource.get_plan(), and can be used by the symbol filler in place
+  of the FillSource.  compute_best_source() returns the same results
+  as the FillSource's method would, but only looks them up in the
+  plan."""
+
+  def __init__(self, symbol, plan):
+    """Create a fill source for SYMBOL from PLAN.
+
+    Members:
+
+      cvs_path -- (CVSPath): the CVSPath described by this fill
+          source.
+
+      _symbol -- (Symbol) the symbol to be filled.
+
+      _best -- the tuple (source_lod_id, revnum) of the best source,
+          or None if there is none.
+
+      _ties -- (set) the (source_lod_id, revnum) of the preferred
+          sources that are as good as the best source.
+
+      _subplans -- the plans of the subsources, or None if cvs_path is
+          a file.
+
+    """
+
+    (cvs_path_id, self._best, ties, self._subplans) = plan
+    self.cvs_path = Ctx()._cvs_path_db.get_path(cvs_path_id)
+    self._symbol = symbol
+    self._ties = set(ties)
+
+  def compute_best_source(self, preferred_source):
+    """Return the best source to copy from, as an SVNRevisionRange.
+
+    See FillSource.compute_best_source().  PREFERRED_SOURCE must be
+    None or the best source of one of the ancestors of
+    self.cvs_path."""
+
+    if (
+        preferred_source is not None
+        and (preferred_source.source_lod.id, preferred_source.opening_revnum)
+            in self._ties
+        ):
+      return SVNRevisionRange(
+          preferred_source.source_lod, preferred_source.opening_revnum
+          )
+
+    if self._best is None:
+      raise FatalError(
+          "failed to find a revision to copy from when copying %s"
+          % self._symbol.name
+          )
+
+    (source_lod_id, revnum) = self._best
+    return SVNRevisionRange(Ctx()._symbol_db.get_symbol(source_lod_id), revnum)
+
+  def get_subsources(self):
+    """Generate (CVSPath, PlannedFillSource) for all direct subsources."""
+
+    if self._subplans is not None:
+      for subplan in self._subplans:
+        fill_source = PlannedFillSource(self._symbol, subplan)
+        yield (fill_source.cvs_path, fill_source)
+
+  def get_subsource_map(self):
+    """Return the map {CVSPath : PlannedFillSource} of direct subsources."""
+
+    src_entries = {}
+
+    for (cvs_path, fill_subsource) in self.get_subsources():
+      src_entries[cvs_path] = fill_subsource
+
+    return src_entries
+
+  def __str__(self):
+    """For convenience only.  The format is subject to change at any time."""
+
+    return '%s(%s:%s)' % (
+        self.__class__.__name__, self._symbol, self.cvs_path,
+        )
+
+
 def get_source_set(symbol, range_map):
   """Return a FillSource describing the fill sources for RANGE_MAP.
 
@@ -0,0 +1,379 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Append the conversion of a live CVS repository to an earlier one.
+
+If --incremental=PATH is used, a manifest is saved to PATH at the end
+of the conversion.  It records the size, modification time, and head
+revision of each ,v file that CollectRevsPass parsed, and a digest of
+the dump stream of each Subversion revision that OutputPass wrote.
+The callbacks that the RCS parser made for each ,v file (see
+collect_data._RecordingSink) are saved along with it, in a
+RecordingStore in the file PATH.recordings.
+
+When the conversion is run again with the same manifest,
+CollectRevsPass only parses the ,v files whose size or modification
+time (their "stamp") has changed since then.  For the other files,
+the recorded callbacks are replayed, which gives the same result as
+parsing them again.  The files are still processed in the same order
+as in a full conversion, so all ids are allocated in the same way.
+CollectRevsPass reports which ,v files have changed, and stops if any
+of them has disappeared (CVS never deletes ,v files, so history was
+removed from the repository).  The later passes run as usual, on the
+data of the whole repository.  OutputPass then writes
+only the revisions after the ones that were output by the earlier
+run, so that the dump stream can be loaded on top of the repository
+that was loaded from the earlier one.  The revisions that are not
+written must still be the same as before; if the digest of any of
+them differs, then CVS history was rewritten (for example, a revision
+was made obsolete or a tag was moved) or a new symbol was placed
+among the old revisions, and the new revisions cannot simply be
+appended.  In that case the conversion stops with an error, and the
+repository has to be converted from scratch."""
+
+
+import os
+import shutil
+import cPickle
+
+try:
+  from hashlib import sha1
+except ImportError:
+  from sha import new as sha1
+
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.log import logger
+from cvs2svn_lib.checkpoint import sync_file
+from cvs2svn_lib.log_store import LogStore
+from cvs2svn_lib.svn_dump import DumpstreamDelegate
+
+
+def get_stamp(rcs_path):
+  """Return the stamp of the ,v file RCS_PATH, as a tuple (size, mtime).
+
+  CVS rewrites the whole ,v file whenever it changes, so a file whose
+  stamp is unchanged is assumed to have the same contents."""
+
+  st = os.stat(rcs_path)
+  return (st.st_size, st.st_mtime,)
+
+
+def _get_file_key(cvs_file):
+  """Return the key under which CVS_FILE is recorded.
+
+  The files are identified by their path within the project, so that
+  moving a file to the Attic doesn't count as deleting it."""
+
+  return (cvs_file.project.project_cvs_repos_path, cvs_file.cvs_path,)
+
+
+class RepositoryManifest(object):
+  """A description of the CVS repository and of the revisions output from it.
+
+  Members:
+
+    files -- a map { (project_cvs_repos_path, cvs_path) : (size, mtime,
+        head_revision) } describing the ,v files that were parsed (see
+        _get_file_key() and get_stamp()).
+
+    revision_digests -- a list of the hex digests of the Subversion
+        revisions that were output, starting with r1."""
+
+  def __init__(self):
+    self.files = {}
+    self.revision_digests = []
+
+  def add_file(self, cvs_file, stamp, head_revision):
+    """Record CVS_FILE, with STAMP and head revision HEAD_REVISION."""
+
+    self.files[_get_file_key(cvs_file)] = stamp + (head_revision,)
+
+  def check_files(self, old_manifest):
+    """Compare the files in this manifest with those in OLD_MANIFEST.
+
+    Log how many files have been changed or added since OLD_MANIFEST
+    was written.  Raise FatalError if any file has been removed."""
+
+    changed = 0
+    added = 0
+    for (key, info) in self.files.iteritems():
+      old_info = old_manifest.files.get(key)
+      if old_info is None:
+        added += 1
+      elif old_info != info:
+        changed += 1
+
+    removed = [
+        os.path.join(*key)
+        for key in old_manifest.files
+        if key not in self.files
+        ]
+    if removed:
+      removed.sort()
+      raise FatalError(
+          'The following ,v files have been removed since the last '
+          'incremental conversion:\n'
+          '    %s\n'
+          'Their history cannot be removed from the earlier output, so '
+          'the repository\n'
+          'has to be converted from scratch.'
+          % ('\n    '.join(removed),)
+          )
+
+    if changed or added:
+      logger.quiet(
+          '%d ,v files changed and %d added since the last '
+          'incremental conversion.'
+          % (changed, added,)
+          )
+    else:
+      logger.quiet(
+          'No ,v files changed since the last incremental conversion.'
+          )
+
+
+class RecordingStore(object):
+  """The recorded parser callbacks for the ,v files of a conversion.
+
+  For each file, the output of collect_data._record_rcs_file() is
+  stored together with the stamp of the file when it was parsed.  The
+  recordings are kept in a LogStore rather than in the
+  RepositoryManifest, because they are too large to keep in memory all
+  at once."""
+
+  def __init__(self, filename, mode):
+    self._store = LogStore(filename, mode)
+
+  def _get_key(self, cvs_file):
+    return '\0'.join(_get_file_key(cvs_file))
+
+  def add(self, cvs_file, stamp, recording):
+    """Store RECORDING for CVS_FILE, which had stamp STAMP when parsed."""
+
+    self._store[self._get_key(cvs_file)] = cPickle.dumps(
+        (stamp, recording,), -1
+        )
+
+  def get(self, cvs_file, stamp):
+    """Return the recording for CVS_FILE if it still has stamp STAMP.
+
+    Return None if no recording was stored for CVS_FILE, or if the file
+    has changed since."""
+
+    try:
+      value = self._store[self._get_key(cvs_file)]
+    except KeyError:
+      return None
+
+    (old_stamp, recording) = cPickle.loads(value)
+    if old_stamp != stamp:
+      return None
+    return recording
+
+  def checkpoint(self):
+    return self._store.checkpoint()
+
+  def close(self):
+    self._store.close()
+    self._store = None
+
+
+def get_recordings_filename(manifest_filename):
+  """Return the name of the RecordingStore file of MANIFEST_FILENAME."""
+
+  return manifest_filename + '.recordings'
+
+
+def read_recordings(manifest_filename):
+  """Return the RecordingStore saved with MANIFEST_FILENAME, opened read-only.
+
+  Return None if there is no such file."""
+
+  filename = get_recordings_filename(manifest_filename)
+  if not os.path.exists(filename):
+    return None
+
+  return RecordingStore(filename, DB_OPEN_READ)
+
+
+def write_recordings(recordings_filename, manifest_filename):
+  """Save the RecordingStore in RECORDINGS_FILENAME with MANIFEST_FILENAME.
+
+  Like the manifest itself (see write_manifest()), the file is
+  replaced in a single step."""
+
+  filename = get_recordings_filename(manifest_filename)
+  new_filename = filename + '.new'
+  shutil.copyfile(recordings_filename, new_filename)
+  f = open(new_filename, 'rb+')
+  try:
+    sync_file(f)
+  finally:
+    f.close()
+
+  # os.rename() cannot replace an existing file on Windows:
+  if os.path.exists(filename):
+    os.remove(filename)
+  os.rename(new_filename, filename)
+
+
+def read_manifest(filename):
+  """Return the RepositoryManifest stored in FILENAME.
+
+  Return an empty RepositoryManifest if the file doesn't exist."""
+
+  if not os.path.exists(filename):
+    return RepositoryManifest()
+
+  f = open(filename, 'rb')
+  try:
+    try:
+      manifest = cPickle.load(f)
+    except Exception:
+      manifest = None
+  finally:
+    f.close()
+
+  if not isinstance(manifest, RepositoryManifest):
+    raise FatalError(
+        '%r is not a manifest written by an incremental conversion'
+        % (filename,)
+        )
+  return manifest
+
+
+def write_manifest(manifest, filename):
+  """Store MANIFEST to FILENAME, replacing whatever was there.
+
+  The manifest is written to a temporary file that then replaces the
+  old one, so an interruption leaves either the old or the new
+  manifest behind."""
+
+  new_filename = filename + '.new'
+  f = open(new_filename, 'wb')
+  try:
+    cPickle.dump(manifest, f, -1)
+    sync_file(f)
+  finally:
+    f.close()
+
+  # os.rename() cannot replace an existing file on Windows:
+  if os.path.exists(filename):
+    os.remove(filename)
+  os.rename(new_filename, filename)
+
+
+class _DigestingFile(object):
+  """A file-like object that computes the digest of the data written to it.
+
+  The data are passed on to the underlying file unless they are being
+  suppressed."""
+
+  def __init__(self, f):
+    self.f = f
+    self.suppress = False
+    self.digest = sha1()
+
+  def restart(self, suppress):
+    """Start a new digest, and decide whether to SUPPRESS the output."""
+
+    self.digest = sha1()
+    self.suppress = suppress
+
+  def write(self, s):
+    self.digest.update(s)
+    if not self.suppress:
+      self.f.write(s)
+
+  def close(self):
+    self.f.close()
+
+
+class IncrementalDumpstreamDelegate(DumpstreamDelegate):
+  """A DumpstreamDelegate that only writes revisions that are new.
+
+  The revisions that were output by the earlier conversion are
+  generated as usual, so that their digests can be checked, but they
+  are not written to the dump stream."""
+
+  def __init__(
+        self, revision_reader, dumpfile, old_digests, checkpoint_state=None
+        ):
+    """Return a new IncrementalDumpstreamDelegate instance.
+
+    OLD_DIGESTS is the list of the digests of the revisions that were
+    output by the earlier conversion.  The other arguments are as for
+    DumpstreamDelegate, except that CHECKPOINT_STATE is a value
+    returned by self.get_checkpoint_state()."""
+
+    self._old_digests = old_digests
+    self._digesting_file = _DigestingFile(dumpfile)
+
+    if checkpoint_state is None:
+      dumpstream_state = None
+      # The digests of the revisions that have been output so far:
+      self.revision_digests = []
+    else:
+      (dumpstream_state, self.revision_digests) = checkpoint_state
+
+    DumpstreamDelegate.__init__(
+        self, revision_reader, self._digesting_file, dumpstream_state
+        )
+
+  def get_checkpoint_state(self):
+    return (
+        DumpstreamDelegate.get_checkpoint_state(self),
+        list(self.revision_digests),
+        )
+
+  def start_commit(self, revnum, revprops):
+    self._digesting_file.restart(revnum <= len(self._old_digests))
+    DumpstreamDelegate.start_commit(self, revnum, revprops)
+
+  def end_commit(self):
+    DumpstreamDelegate.end_commit(self)
+    digest = self._digesting_file.digest.hexdigest()
+    self.revision_digests.append(digest)
+    revnum = len(self.revision_digests)
+    if revnum <= len(self._old_digests) \
+           and digest != self._old_digests[revnum - 1]:
+      raise FatalError(
+          'r%d differs from the r%d that was output by the last incremental '
+          'conversion.\n'
+          'The CVS history has been changed in a way that cannot be '
+          'appended to the\n'
+          'earlier output, so the repository has to be converted from '
+          'scratch.'
+          % (revnum, revnum,)
+          )
+    self._digesting_file.suppress = False
+
+  def finish(self):
+    if len(self.revision_digests) < len(self._old_digests):
+      raise FatalError(
+          'The conversion produced only %d revisions, but the last '
+          'incremental conversion\n'
+          'output %d.  The CVS history has been changed in a way that '
+          'cannot be appended\n'
+          'to the earlier output, so the repository has to be converted '
+          'from scratch.'
+          % (len(self.revision_digests), len(self._old_digests),)
+          )
+
+    DumpstreamDelegate.finish(self)
+
+
@@ -17,15 +17,31 @@
 """This module contains database facilities used by cvs2svn."""
 
 
+import os
+import struct
+import mmap
 import cPickle
 
 from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.checkpoint import sync_file
+from cvs2svn_lib.checkpoint import truncate_file
 from cvs2svn_lib.record_table import FileOffsetPacker
+from cvs2svn_lib.record_table import MmapRecordTable
 from cvs2svn_lib.record_table import RecordTable
 
 
+# Should IndexedDatabases that are opened in DB_OPEN_READ mode memory
+# map their files?  Then items are deserialized directly out of the
+# mapped memory, without a seek() and read() for each one.  But the
+# whole file has to fit into the process's virtual address space, so
+# by default this is only done on 64-bit computers.  This option can
+# be changed externally, affecting any IndexedDatabases opened
+# subsequent to the change:
+use_mmap_for_reading = struct.calcsize('P') >= 8
+
+
 class IndexedDatabase:
   """A file of objects that are written sequentially and read randomly.
 
@@ -47,17 +63,35 @@ class IndexedDatabase:
   advantage that one can create a modified version of a database that
   shares the main data file with an old version by copying the index
   file.  But it has the disadvantage that space is wasted whenever
-  objects are written multiple times."""
+  objects are written multiple times.
+
+  If the database is opened in DB_OPEN_READ mode and
+  use_mmap_for_reading is set, then the main file and the index table
+  are memory mapped.  Each object is then deserialized from a buffer
+  that refers directly to the mapped memory."""
 
-  def __init__(self, filename, index_filename, mode, serializer=None):
+  def __init__(
+        self, filename, index_filename, mode, serializer=None,
+        checkpoint=None,
+        ):
     """Initialize an IndexedDatabase, writing the serializer if necessary.
 
     SERIALIZER is only used if MODE is DB_OPEN_NEW; otherwise the
-    serializer is read from the file."""
+    serializer is read from the file.
+
+    CHECKPOINT can only be used with DB_OPEN_WRITE.  It is a value
+    that was returned by checkpoint(); anything that was written to
+    the database after that call is discarded."""
 
     self.filename = filename
     self.index_filename = index_filename
     self.mode = mode
+    if checkpoint is not None:
+      assert self.mode == DB_OPEN_WRITE
+      (size, index_size) = checkpoint
+      truncate_file(self.filename, size)
+      truncate_file(self.index_filename, index_size)
+
     if self.mode == DB_OPEN_NEW:
       self.f = open(self.filename, 'wb+')
     elif self.mode == DB_OPEN_WRITE:
@@ -67,9 +101,19 @@ class IndexedDatabase:
     else:
       raise RuntimeError('Invalid mode %r' % self.mode)
 
-    self.index_table = RecordTable(
-        self.index_filename, self.mode, FileOffsetPacker()
-        )
+    self._mmap = None
+    if self.mode == DB_OPEN_READ and use_mmap_for_reading:
+      self._mmap = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if self._mmap is not None and os.path.getsize(self.index_filename):
+      # (An empty file cannot be memory mapped.)
+      self.index_table = MmapRecordTable(
+          self.index_filename, self.mode, FileOffsetPacker()
+          )
+    else:
+      self.index_table = RecordTable(
+          self.index_filename, self.mode, FileOffsetPacker()
+          )
 
     if self.mode == DB_OPEN_NEW:
       assert serializer is not None
@@ -97,6 +141,10 @@ class IndexedDatabase:
     self.fp = self.eofp
 
   def _fetch(self, offset):
+    if self._mmap is not None:
+      # The serializers only read as much of the buffer as they need:
+      return self.serializer.loads(buffer(self._mmap, offset))
+
     if self.fp != offset:
       self.f.seek(offset)
 
@@ -126,7 +174,9 @@ class IndexedDatabase:
   def get_many(self, indexes, default=None):
     """Yield (index,item) tuples for INDEXES, in arbitrary order.
 
-    Yield (index,default) for indexes with no defined values."""
+    Yield (index,default) for indexes with no defined values.  The
+    offsets of all of the items are looked up first, and the items are
+    then read in the order that they appear in the file."""
 
     offsets = []
     for (index, offset) in self.index_table.get_many(indexes):
@@ -144,9 +194,25 @@ class IndexedDatabase:
     # We don't actually free the data in self.f.
     del self.index_table[index]
 
+  def checkpoint(self):
+    """Write the database to disk and return a description of its extent.
+
+    The return value can be passed as the CHECKPOINT argument of the
+    constructor to continue writing the database from this point.
+    That only restores the old contents if no records that existed at
+    the time of the checkpoint are overwritten or deleted later."""
+
+    self.index_table.flush()
+    sync_file(self.index_table.f)
+    sync_file(self.f)
+    return (self.eofp, os.path.getsize(self.index_filename),)
+
   def close(self):
     self.index_table.close()
     self.index_table = None
+    if self._mmap is not None:
+      self._mmap.close()
+      self._mmap = None
     self.f.close()
     self.f = None
 
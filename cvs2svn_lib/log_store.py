@@ -0,0 +1,285 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""A simple log-structured key-value store.
+
+A LogStore maps string keys to string values, like a dbm database.
+The data file is an append-only log of records; each record consists
+of a header (the length of the key and the length of the value)
+followed by the key and the value.  A deletion is recorded as a record
+with DELETED as its value length.  The location of the current value
+of each key is kept in an in-memory dict, which is rebuilt by scanning
+the log when an existing store is opened.
+
+Writes are collected in a memory buffer and appended to the file in
+large blocks, and the file is only fsynced when a checkpoint is saved
+(see checkpoint()); the store is meant for temporary data that can be
+regenerated if the conversion is interrupted.  When more than half of
+the file consists of overwritten or deleted values, the live records
+are copied to a new file that then replaces the old one
+("compaction").  This keeps the file small for access patterns such as
+that of the checkout database used by InternalRevisionReader, where
+most values are deleted soon after they are written."""
+
+
+import os
+import struct
+
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.common import DB_OPEN_WRITE
+from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.checkpoint import sync_file
+
+
+class LogStore(object):
+  """A dbm-like mapping from strings to strings, stored in a log file."""
+
+  # The format of record headers: the key length and value length.
+  HEADER_FORMAT = '<II'
+  HEADER_LEN = struct.calcsize(HEADER_FORMAT)
+
+  # The value length that marks a deletion record:
+  DELETED = 0xffffffffL
+
+  # Pending writes are written to the file when they reach this size:
+  WRITE_BUFFER_SIZE = 1024 * 1024
+
+  # Compaction is only considered once the garbage in the file reaches
+  # this size:
+  MIN_GARBAGE = 16 * 1024 * 1024
+
+  def __init__(self, filename, mode):
+    self.filename = filename
+    self.mode = mode
+
+    # A map { key : (offset, length) } giving the location of the
+    # current value of each key:
+    self._index = {}
+
+    # The current size of the data file (not including _buffer):
+    self._file_size = 0
+
+    # Records that have not been written to the file yet, the total
+    # length of those records, and a map { key : value } for the
+    # values that they contain.  Lookups of keys in _pending are
+    # satisfied without touching the file.
+    self._buffer = []
+    self._buffer_len = 0
+    self._pending = {}
+
+    # The number of bytes in the file (or the buffer) that are taken
+    # up by records that are no longer current:
+    self._garbage = 0
+
+    if self.mode == DB_OPEN_NEW:
+      self.f = open(self.filename, 'wb+')
+    elif self.mode == DB_OPEN_WRITE:
+      self.f = open(self.filename, 'rb+')
+      self._read_index()
+    elif self.mode == DB_OPEN_READ:
+      self.f = open(self.filename, 'rb')
+      self._read_index()
+    else:
+      raise RuntimeError('Invalid mode %r' % self.mode)
+
+  def _read_index(self):
+    """Scan the data file and rebuild self._index from it."""
+
+    header_len = self.HEADER_LEN
+    offset = 0
+    self.f.seek(0, 2)
+    file_size = self.f.tell()
+    self.f.seek(0)
+    while True:
+      header = self.f.read(header_len)
+      if len(header) < header_len:
+        # A truncated header can only be the result of an interrupted
+        # write (or of truncating the file to a checkpoint); ignore
+        # it:
+        break
+      (key_len, value_len) = struct.unpack(self.HEADER_FORMAT, header)
+      if value_len == self.DELETED:
+        record_len = header_len + key_len
+      else:
+        record_len = header_len + key_len + value_len
+      if offset + record_len > file_size:
+        # The same goes for a truncated record:
+        break
+      key = self.f.read(key_len)
+      if value_len == self.DELETED:
+        if key in self._index:
+          self._garbage += header_len + key_len + self._index.pop(key)[1]
+        self._garbage += record_len
+      else:
+        if key in self._index:
+          self._garbage += header_len + key_len + self._index[key][1]
+        self._index[key] = (offset + header_len + key_len, value_len)
+        self.f.seek(value_len, 1)
+      offset += record_len
+
+    self._file_size = offset
+    if self.mode == DB_OPEN_WRITE and file_size > offset:
+      # Discard the incomplete record, so that it is not mistaken for
+      # part of the records that are appended later:
+      self.f.truncate(offset)
+
+  def _append(self, key, value):
+    """Append a record for KEY and VALUE (or a deletion if VALUE is None)."""
+
+    if value is None:
+      record = struct.pack(self.HEADER_FORMAT, len(key), self.DELETED) + key
+    else:
+      record = (
+          struct.pack(self.HEADER_FORMAT, len(key), len(value)) + key + value
+          )
+    self._buffer.append(record)
+    self._buffer_len += len(record)
+    if self._buffer_len >= self.WRITE_BUFFER_SIZE:
+      self._flush()
+
+    return self._file_size + self._buffer_len - len(record)
+
+  def _flush(self):
+    """Write any buffered records to the file."""
+
+    if self._buffer:
+      self.f.seek(self._file_size)
+      self.f.write(''.join(self._buffer))
+      self._file_size += self._buffer_len
+      self._buffer = []
+      self._buffer_len = 0
+      self._pending.clear()
+
+  def _discard(self, key):
+    """Record that the current value of KEY (if any) is garbage."""
+
+    location = self._index.get(key)
+    if location is not None:
+      self._garbage += self.HEADER_LEN + len(key) + location[1]
+
+  def __setitem__(self, key, value):
+    if self.mode == DB_OPEN_READ:
+      raise RuntimeError('Cannot write to %s in read mode' % (self,))
+
+    self._discard(key)
+    value_offset = self._append(key, value) + self.HEADER_LEN + len(key)
+    self._index[key] = (value_offset, len(value))
+    if self._buffer:
+      self._pending[key] = value
+    self._maybe_compact()
+
+  def __getitem__(self, key):
+    try:
+      return self._pending[key]
+    except KeyError:
+      (offset, length) = self._index[key]
+      self.f.seek(offset)
+      return self.f.read(length)
+
+  def __delitem__(self, key):
+    if self.mode == DB_OPEN_READ:
+      raise RuntimeError('Cannot write to %s in read mode' % (self,))
+
+    if key not in self._index:
+      raise KeyError(key)
+
+    self._discard(key)
+    del self._index[key]
+    self._pending.pop(key, None)
+    self._garbage += self.HEADER_LEN + len(key)
+    self._append(key, None)
+    self._maybe_compact()
+
+  def __contains__(self, key):
+    return key in self._index
+
+  has_key = __contains__
+
+  def __len__(self):
+    return len(self._index)
+
+  def keys(self):
+    return self._index.keys()
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def _maybe_compact(self):
+    """Compact the file if enough of it is garbage."""
+
+    if self._garbage >= max(
+          self.MIN_GARBAGE, (self._file_size + self._buffer_len) // 2
+          ):
+      self.compact()
+
+  def compact(self):
+    """Copy the live records to a new file that replaces the old one."""
+
+    self._flush()
+    new_filename = self.filename + '.compact'
+    new_f = open(new_filename, 'wb+')
+    new_index = {}
+    offset = 0
+    # Copy in file order, to avoid seeking back and forth:
+    locations = [
+        (value_offset, value_len, key)
+        for (key, (value_offset, value_len)) in self._index.iteritems()
+        ]
+    locations.sort()
+    for (value_offset, value_len, key) in locations:
+      self.f.seek(value_offset)
+      value = self.f.read(value_len)
+      new_f.write(
+          struct.pack(self.HEADER_FORMAT, len(key), value_len) + key + value
+          )
+      offset += self.HEADER_LEN + len(key)
+      new_index[key] = (offset, value_len)
+      offset += value_len
+
+    self.f.close()
+    new_f.close()
+    # os.rename() cannot replace an existing file on Windows:
+    os.remove(self.filename)
+    os.rename(new_filename, self.filename)
+    self.f = open(self.filename, 'rb+')
+    self._index = new_index
+    self._file_size = offset
+    self._garbage = 0
+
+  def sync(self):
+    self._flush()
+    self.f.flush()
+
+  def checkpoint(self):
+    """Write the store to disk and return the size of the file.
+
+    If the file is later truncated to that size, it contains the same
+    records as now, unless the store has been compacted in between."""
+
+    self._flush()
+    sync_file(self.f)
+    return self._file_size
+
+  def close(self):
+    if self.f is not None:
+      self._flush()
+      self.f.close()
+      self.f = None
+
+  def __str__(self):
+    return '%s(%r)' % (self.__class__.__name__, self.filename,)
+
+
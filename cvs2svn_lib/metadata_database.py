@@ -29,18 +29,21 @@ from cvs2svn_lib.serializer import PrimedPickleSerializer
 from cvs2svn_lib.metadata import Metadata
 
 
-def MetadataDatabase(store_filename, index_table_filename, mode):
+def MetadataDatabase(
+      store_filename, index_table_filename, mode, checkpoint=None
+      ):
   """A database to store Metadata instances that describe CVSRevisions.
 
   This database manages a map
 
       id -> Metadata instance
 
-  where id is a unique identifier for the metadata."""
+  where id is a unique identifier for the metadata.  CHECKPOINT is
+  passed to the IndexedDatabase constructor."""
 
   return IndexedDatabase(
       store_filename, index_table_filename,
-      mode, PrimedPickleSerializer((Metadata,)),
+      mode, PrimedPickleSerializer((Metadata,)), checkpoint=checkpoint,
       )
 
 
@@ -64,15 +67,28 @@ class MetadataLogger:
   project_id (if Ctx().cross_project_commits is not set), and
   branch_name (if Ctx().cross_branch_commits is not set)."""
 
-  def __init__(self, metadata_db):
+  def __init__(self, metadata_db, checkpoint_state=None):
+    """Initialize an instance that stores metadata to METADATA_DB.
+
+    If CHECKPOINT_STATE is specified, it is a value returned by
+    get_checkpoint_state(), from which the instance continues."""
+
     self._metadata_db = metadata_db
 
-    # A map { digest : id }:
-    self._digest_to_id = {}
+    if checkpoint_state is None:
+      # A map { digest : id }:
+      self._digest_to_id = {}
+
+      # A key_generator to generate keys for metadata that haven't
+      # been seen yet:
+      self.key_generator = KeyGenerator()
+    else:
+      (self._digest_to_id, self.key_generator,) = checkpoint_state
+
+  def get_checkpoint_state(self):
+    """Return the state of this instance, as a picklable object."""
 
-    # A key_generator to generate keys for metadata that haven't been
-    # seen yet:
-    self.key_generator = KeyGenerator()
+    return (self._digest_to_id, self.key_generator,)
 
   def store(self, project, branch_name, author, log_msg):
     """Store the metadata and return its id.
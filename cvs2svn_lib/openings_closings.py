@@ -17,11 +17,15 @@
 """This module contains classes to keep track of symbol openings/closings."""
 
 
+import os
+import struct
+import mmap
 import cPickle
 
 from cvs2svn_lib import config
 from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.artifact_manager import artifact_manager
+from cvs2svn_lib import indexed_database
 from cvs2svn_lib.svn_revision_range import SVNRevisionRange
 
 
@@ -29,6 +33,12 @@ from cvs2svn_lib.svn_revision_range import SVNRevisionRange
 OPENING = 'O'
 CLOSING = 'C'
 
+# The format of the records in SYMBOL_OPENINGS_CLOSINGS: (symbol_id,
+# svn_revnum, type, cvs_symbol_id).  The records are packed big-endian,
+# so sorting them as strings orders them by symbol_id and svn_revnum.
+SYMBOLING_RECORD_FORMAT = '>IIcI'
+SYMBOLING_RECORD_SIZE = struct.calcsize(SYMBOLING_RECORD_FORMAT)
+
 
 class SymbolingsLogger:
   """Manage the file that contains lines for symbol openings and closings.
@@ -67,11 +77,20 @@ class SymbolingsLogger:
   'bar.c', in the same directory, and 'bar.c's opening and closing for
   BEE correspond to revisions 24 and 39 in Subversion, then we can
   kill two birds with one stone by copying the whole directory from
-  somewhere in the range 24 <= revnum < 30."""
+  somewhere in the range 24 <= revnum < 30.
+
+  The logger also counts the records for each symbol.  Since sorting
+  SYMBOL_OPENINGS_CLOSINGS groups the records of each symbol together
+  in order of symbol_id, the counts determine where the records of
+  each symbol will be in SYMBOL_OPENINGS_CLOSINGS_SORTED.  This index
+  is written to SYMBOL_OFFSETS_DB by close(), so the file doesn't have
+  to be scanned again after it has been sorted."""
 
   def __init__(self):
     self.symbolings = open(
-        artifact_manager.get_temp_file(config.SYMBOL_OPENINGS_CLOSINGS), 'w')
+        artifact_manager.get_temp_file(config.SYMBOL_OPENINGS_CLOSINGS), 'wb')
+    # A map { symbol_id : number of records logged for the symbol }:
+    self._counts = {}
 
   def log_revision(self, cvs_rev, svn_revnum):
     """Log any openings and closings found in CVS_REV."""
@@ -91,15 +110,19 @@ class SymbolingsLogger:
   def _log(self, symbol_id, cvs_symbol_id, svn_revnum, type):
     """Log an opening or closing to self.symbolings.
 
-    Write out a single line to the symbol_openings_closings file
+    Write out a single record to the symbol_openings_closings file
     representing that SVN_REVNUM is either the opening or closing
     (TYPE) of CVS_SYMBOL_ID for SYMBOL_ID.
 
     TYPE should be one of the following constants: OPENING or CLOSING."""
 
     self.symbolings.write(
-        '%x %d %s %x\n' % (symbol_id, svn_revnum, type, cvs_symbol_id)
+        struct.pack(
+            SYMBOLING_RECORD_FORMAT,
+            symbol_id, svn_revnum, type, cvs_symbol_id,
+            )
         )
+    self._counts[symbol_id] = self._counts.get(symbol_id, 0) + 1
 
   def _log_opening(self, symbol_id, cvs_symbol_id, svn_revnum):
     """Log an opening to self.symbolings.
@@ -119,6 +142,23 @@ class SymbolingsLogger:
     self.symbolings.close()
     self.symbolings = None
 
+    # A map { symbol_id : (offset, count) } telling where the records
+    # of each symbol will be in SYMBOL_OPENINGS_CLOSINGS_SORTED:
+    offsets = {}
+    offset = 0
+    symbol_ids = self._counts.keys()
+    symbol_ids.sort()
+    for symbol_id in symbol_ids:
+      count = self._counts[symbol_id]
+      offsets[symbol_id] = (offset, count)
+      offset += count * SYMBOLING_RECORD_SIZE
+    self._counts = None
+
+    offsets_db = open(
+        artifact_manager.get_temp_file(config.SYMBOL_OFFSETS_DB), 'wb')
+    cPickle.dump(offsets, offsets_db, -1)
+    offsets_db.close()
+
 
 class SymbolingsReader:
   """Provides an interface to retrieve symbol openings and closings.
@@ -130,50 +170,72 @@ class SymbolingsReader:
 
   def __init__(self):
     """Opens the SYMBOL_OPENINGS_CLOSINGS_SORTED for reading, and
-    reads the offsets database into memory."""
+    reads the offsets database into memory.
 
-    self.symbolings = open(
-        artifact_manager.get_temp_file(
-            config.SYMBOL_OPENINGS_CLOSINGS_SORTED),
-        'r')
-    # The offsets_db is really small, and we need to read and write
-    # from it a fair bit, so suck it into memory
+    If indexed_database.use_mmap_for_reading is set, the file is
+    memory mapped, and the records of a symbol are sliced out of the
+    mapped memory."""
+
+    filename = artifact_manager.get_temp_file(
+        config.SYMBOL_OPENINGS_CLOSINGS_SORTED
+        )
+    self.symbolings = open(filename, 'rb')
+    self._mmap = None
+    if indexed_database.use_mmap_for_reading and os.path.getsize(filename):
+      self._mmap = mmap.mmap(
+          self.symbolings.fileno(), 0, access=mmap.ACCESS_READ
+          )
+    # The offsets_db is really small, and we need to read from it a
+    # fair bit, so suck it into memory
     offsets_db = file(
         artifact_manager.get_temp_file(config.SYMBOL_OFFSETS_DB), 'rb')
-    # A map from symbol_id to offset.  The values of this map are
-    # incremented as the openings and closings for a symbol are
-    # consumed.
+    # A map { symbol_id : (offset, count) } giving the offset of the
+    # first record for each symbol and the number of its records.
     self.offsets = cPickle.load(offsets_db)
     offsets_db.close()
 
   def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+      self._mmap = None
     self.symbolings.close()
     del self.symbolings
     del self.offsets
 
-  def _generate_lines(self, symbol):
-    """Generate the lines for SYMBOL.
+  def _generate_records(self, symbol):
+    """Generate the records for SYMBOL.
 
     SYMBOL is a TypedSymbol instance.  Yield the tuple (revnum, type,
     cvs_symbol_id) for all openings and closings for SYMBOL."""
 
-    if symbol.id in self.offsets:
-      # Set our read offset for self.symbolings to the offset for this
-      # symbol:
-      self.symbolings.seek(self.offsets[symbol.id])
-
-      while True:
-        line = self.symbolings.readline().rstrip()
-        if not line:
-          break
-        (id, revnum, type, cvs_symbol_id) = line.split()
-        id = int(id, 16)
-        revnum = int(revnum)
-        if id != symbol.id:
-          break
-        cvs_symbol_id = int(cvs_symbol_id, 16)
+    try:
+      (offset, count) = self.offsets[symbol.id]
+    except KeyError:
+      return
+
+    # The records of the symbol are contiguous, so read them at once:
+    size = count * SYMBOLING_RECORD_SIZE
+    if self._mmap is not None:
+      data = self._mmap[offset:offset + size]
+    else:
+      self.symbolings.seek(offset)
+      data = self.symbolings.read(size)
+    if len(data) != size:
+      raise InternalError(
+          'Openings and closings of %s are truncated' % (symbol,)
+          )
+
+    # Unpack all of the records with a single call:
+    fields = struct.unpack('>' + SYMBOLING_RECORD_FORMAT[1:] * count, data)
+    for i in xrange(0, len(fields), 4):
+      (id, revnum, type, cvs_symbol_id) = fields[i:i + 4]
+      if id != symbol.id:
+        raise InternalError(
+            'Openings and closings of %s are not where they were expected'
+            % (symbol,)
+            )
 
-        yield (revnum, type, cvs_symbol_id)
+      yield (revnum, type, cvs_symbol_id)
 
   def get_range_map(self, svn_symbol_commit):
     """Return the ranges of all CVSSymbols in SVN_SYMBOL_COMMIT.
@@ -188,7 +250,7 @@ class SymbolingsReader:
     range_map = {}
 
     for (revnum, type, cvs_symbol_id) \
-            in self._generate_lines(svn_symbol_commit.symbol):
+            in self._generate_records(svn_symbol_commit.symbol):
       cvs_symbol = cvs_symbol_map.get(cvs_symbol_id)
       if cvs_symbol is None:
         # This CVSSymbol is not part of SVN_SYMBOL_COMMIT.
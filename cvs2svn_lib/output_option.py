@@ -27,6 +27,11 @@ class OutputOption:
   # subclasses
   name = None
 
+  # Does this output option fill symbols using the plans that are made
+  # by PlanSymbolFillsPass (see FillPlanDatabase)?  If not, that pass
+  # doesn't make any plans.
+  uses_fill_plans = False
+
   def register_artifacts(self, which_pass):
     """Register artifacts that will be needed for this output option.
 
@@ -82,6 +87,27 @@ class OutputOption:
 
     raise NotImplementedError()
 
+  def get_checkpoint_state(self):
+    """Return the state of this output option, as a picklable object.
+
+    This method is called by OutputPass between commits.  The output
+    written so far must be flushed to disk, so that the output option
+    can later be continued from this point by passing the return value
+    to resume().  Return None if this output option cannot be resumed
+    (which is the default)."""
+
+    return None
+
+  def resume(self, svn_rev_count, checkpoint_state):
+    """Prepare this output option, continuing from CHECKPOINT_STATE.
+
+    This is called instead of setup() when an interrupted OutputPass is
+    continued.  CHECKPOINT_STATE is a value that was returned by
+    get_checkpoint_state().  Raise CheckpointError if the output
+    option cannot be continued from that state."""
+
+    raise NotImplementedError()
+
   def process_initial_project_commit(self, svn_commit):
     """Process SVN_COMMIT, which is an SVNInitialProjectCommit."""
 
@@ -17,6 +17,7 @@
 """This module contains tools to manage the passes of a conversion."""
 
 import sys
+import os
 import time
 import platform
 import gc
@@ -27,7 +28,11 @@ from cvs2svn_lib.context import Ctx
 from cvs2svn_lib.log import logger
 from cvs2svn_lib.stats_keeper import StatsKeeper
 from cvs2svn_lib.stats_keeper import read_stats_keeper
+from cvs2svn_lib.record_table import pop_cache_statistics
+from cvs2svn_lib.changeset_graph import pop_cycle_breaking_statistics
 from cvs2svn_lib.artifact_manager import artifact_manager
+from cvs2svn_lib.resource_usage import ResourceMonitor
+from cvs2svn_lib.resource_usage import write_resource_usage
 
 
 class InvalidPassError(FatalError):
@@ -203,6 +208,28 @@ class PassManager:
           return i + 1
       raise InvalidPassError('Unknown pass name (%r).' % (pass_name,))
 
+  def get_last_completed_pass(self):
+    """Return the number of the last pass that was completed, or 0.
+
+    A pass is considered completed if the statistics file that it
+    writes at its end exists in the temporary directory.  (Any
+    statistics files left over from an earlier conversion are removed
+    by run() when a conversion is started without --resume.)"""
+
+    for i in range(self.num_passes, 0, -1):
+      if os.path.exists(Ctx().get_temp_filename(config.STATISTICS_FILE % i)):
+        return i
+
+    return 0
+
+  def remove_statistics_files(self, start_pass):
+    """Remove the statistics files of passes START_PASS and later."""
+
+    for i in range(start_pass, self.num_passes + 1):
+      filename = Ctx().get_temp_filename(config.STATISTICS_FILE % i)
+      if os.path.exists(filename):
+        os.remove(filename)
+
   def run(self, run_options):
     """Run the specified passes, one after another.
 
@@ -210,7 +237,30 @@ class PassManager:
     RUN_OPTIONS.start_pass is the number of the first pass that should
     be run.  RUN_OPTIONS.end_pass is the number of the last pass that
     should be run.  It must be that 1 <= RUN_OPTIONS.start_pass <=
-    RUN_OPTIONS.end_pass <= self.num_passes."""
+    RUN_OPTIONS.end_pass <= self.num_passes.  If RUN_OPTIONS.resume
+    is set, then the passes that were already completed are skipped,
+    and the first pass that is run is told to continue from its
+    checkpoint (if it has one)."""
+
+    if run_options.resume:
+      last_completed_pass = self.get_last_completed_pass()
+      if last_completed_pass >= run_options.end_pass:
+        logger.quiet(
+            'Passes through %d were already completed; nothing to do.'
+            % (last_completed_pass,)
+            )
+        return
+      elif last_completed_pass >= run_options.start_pass:
+        run_options.start_pass = last_completed_pass + 1
+        logger.quiet(
+            'Resuming the conversion at pass %d.' % (run_options.start_pass,)
+            )
+    else:
+      # Statistics files of the passes that are about to be run or that
+      # follow them are left over from an earlier conversion.  Remove
+      # them so that a later --resume doesn't take them to mean that
+      # those passes were completed by this conversion:
+      self.remove_statistics_files(run_options.start_pass)
 
     # Convert start_pass and end_pass into the indices of the passes
     # to execute, using the Python index range convention (i.e., first
@@ -252,12 +302,42 @@ class PassManager:
                 )
             )
 
+      if run_options.profile_resources:
+        # The statistics file of this pass holds the measurements, so
+        # it is only written after the measurements have been taken
+        # and its size cannot be reported:
+        statistics_artifact = artifact_manager.get_artifact(
+            config.STATISTICS_FILE % (i + 1,)
+            )
+        monitor = ResourceMonitor([
+            (artifact, created)
+            for (artifact, created) in artifact_manager.get_pass_artifacts(
+                the_pass
+                )
+            if artifact is not statistics_artifact
+            ])
+        monitor.start()
+
       the_pass.run(run_options, stats_keeper)
+      # Only the first pass that is run can continue from a checkpoint:
+      run_options.resume = False
       end_time = time.time()
       stats_keeper.log_duration_for_pass(
           end_time - start_time, i + 1, the_pass.name
           )
+      stats_keeper.log_record_table_cache_statistics(
+          pop_cache_statistics(), i + 1
+          )
+      stats_keeper.log_cycle_breaking_statistics(
+          pop_cycle_breaking_statistics(), i + 1
+          )
       logger.normal(stats_keeper.single_pass_timing(i + 1))
+      if run_options.profile_resources:
+        stats_keeper.log_resource_usage_for_pass(monitor.stop(), i + 1)
+        write_resource_usage(
+            Ctx().get_temp_filename(config.RESOURCE_USAGE_FILE),
+            stats_keeper.resource_usage(),
+            )
       stats_keeper.archive(
           artifact_manager.get_temp_file(config.STATISTICS_FILE % (i + 1,))
           )
@@ -275,6 +355,17 @@ class PassManager:
 
     logger.quiet(stats_keeper)
     logger.normal(stats_keeper.timings())
+    cache_statistics = stats_keeper.record_table_cache_statistics()
+    if cache_statistics is not None:
+      logger.normal(cache_statistics)
+    cycle_statistics = stats_keeper.cycle_breaking_statistics()
+    if cycle_statistics is not None:
+      logger.normal(cycle_statistics)
+    if run_options.profile_resources:
+      logger.quiet(
+          'Resource usage written to %s'
+          % (Ctx().get_temp_filename(config.RESOURCE_USAGE_FILE),)
+          )
 
     # Consistency check:
     artifact_manager.check_clean()
@@ -18,8 +18,8 @@
 
 
 import sys
-import shutil
 import cPickle
+from collections import deque
 
 from cvs2svn_lib import config
 from cvs2svn_lib.context import Ctx
@@ -29,9 +29,9 @@ from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.common import DB_OPEN_NEW
 from cvs2svn_lib.common import DB_OPEN_READ
-from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import Timestamper
 from cvs2svn_lib.sort import sort_file
+from cvs2svn_lib.worker_pool import create_worker_pool
 from cvs2svn_lib.log import logger
 from cvs2svn_lib.pass_manager import Pass
 from cvs2svn_lib.serializer import PrimedPickleSerializer
@@ -52,6 +52,7 @@ from cvs2svn_lib.symbol_statistics import SymbolPlanError
 from cvs2svn_lib.symbol_statistics import IndeterminateSymbolException
 from cvs2svn_lib.symbol_statistics import SymbolStatistics
 from cvs2svn_lib.cvs_item import CVSRevision
+from cvs2svn_lib.cvs_item import CVSRevisionModification
 from cvs2svn_lib.cvs_item import CVSSymbol
 from cvs2svn_lib.cvs_item_database import OldCVSItemStore
 from cvs2svn_lib.cvs_item_database import IndexedCVSItemStore
@@ -66,16 +67,30 @@ from cvs2svn_lib.changeset import OrderedChangeset
 from cvs2svn_lib.changeset import SymbolChangeset
 from cvs2svn_lib.changeset import BranchChangeset
 from cvs2svn_lib.changeset import create_symbol_changeset
-from cvs2svn_lib.changeset_graph import ChangesetGraph
+from cvs2svn_lib.changeset_graph import create_changeset_graph
+from cvs2svn_lib.changeset_graph_builder import ChangesetGraphBuilder
+from cvs2svn_lib.changeset_graph_snapshot import load_changeset_graph_snapshot
+from cvs2svn_lib.changeset_graph_snapshot \
+    import check_changeset_graph_snapshot
 from cvs2svn_lib.changeset_graph_link import ChangesetGraphLink
 from cvs2svn_lib.changeset_database import ChangesetDatabase
 from cvs2svn_lib.changeset_database import CVSItemToChangesetTable
 from cvs2svn_lib.svn_commit import SVNRevisionCommit
+from cvs2svn_lib.svn_commit import SVNPrimaryCommit
+from cvs2svn_lib.svn_commit import SVNSymbolCommit
+from cvs2svn_lib.openings_closings import SYMBOLING_RECORD_SIZE
 from cvs2svn_lib.openings_closings import SymbolingsLogger
 from cvs2svn_lib.svn_commit_creator import SVNCommitCreator
 from cvs2svn_lib.persistence_manager import PersistenceManager
+from cvs2svn_lib.fill_plan_database import FillPlanDatabase
+from cvs2svn_lib.fill_plan_database import plan_symbol_fills
 from cvs2svn_lib.repository_walker import walk_repository
 from cvs2svn_lib.collect_data import CollectData
+from cvs2svn_lib.checkpoint import CheckpointError
+from cvs2svn_lib.checkpoint import Checkpoint
+from cvs2svn_lib.incremental import RepositoryManifest
+from cvs2svn_lib.incremental import read_manifest
+from cvs2svn_lib.incremental import write_manifest
 from cvs2svn_lib.check_dependencies_pass \
     import CheckItemStoreDependenciesPass
 from cvs2svn_lib.check_dependencies_pass \
@@ -92,12 +107,55 @@ class CollectRevsPass(Pass):
     self._register_temp_file(config.METADATA_STORE)
     self._register_temp_file(config.CVS_PATHS_DB)
     self._register_temp_file(config.CVS_ITEMS_STORE)
+    if Ctx().incremental_manifest is not None:
+      self._register_temp_file(config.INCREMENTAL_MANIFEST)
+      self._register_temp_file(config.INCREMENTAL_RECORDINGS)
+
+  def _create_collect_data(self, run_options, stats_keeper, checkpoint):
+    """Return the CollectData instance to be used for this pass.
+
+    If the conversion is being resumed and there is a checkpoint from
+    an interrupted run of this pass, continue from there."""
+
+    if Ctx().incremental_manifest is not None:
+      manifest = RepositoryManifest()
+    else:
+      manifest = None
+
+    if run_options.resume:
+      # The projects have to be known to unpickle the checkpoint:
+      for project in run_options.projects:
+        Ctx()._projects[project.id] = project
+      state = checkpoint.load()
+      if state is not None:
+        try:
+          cd = CollectData(
+              stats_keeper, jobs=Ctx().jobs,
+              checkpoint=checkpoint, checkpoint_state=state,
+              manifest=manifest,
+              )
+        except CheckpointError, e:
+          logger.warn(
+              '%s: Cannot continue from the checkpoint (%s); '
+              'starting the pass from the beginning.'
+              % (warning_prefix, e,)
+              )
+        else:
+          logger.normal('Continuing from the checkpoint.')
+          return cd
+
+    checkpoint.remove()
+    return CollectData(
+        stats_keeper, jobs=Ctx().jobs, checkpoint=checkpoint,
+        manifest=manifest,
+        )
 
   def run(self, run_options, stats_keeper):
     logger.quiet("Examining all CVS ',v' files...")
     Ctx()._projects = {}
     Ctx()._cvs_path_db = CVSPathDatabase(DB_OPEN_NEW)
-    cd = CollectData(stats_keeper)
+    checkpoint = Checkpoint(config.COLLECT_REVS_CHECKPOINT)
+    cd = self._create_collect_data(run_options, stats_keeper, checkpoint)
 
     # Key generator for CVSFiles:
     file_key_generator = KeyGenerator()
@@ -110,7 +168,9 @@ class CollectRevsPass(Pass):
           )
     run_options.projects = None
 
+    num_replayed_files = cd.num_replayed_files
     fatal_errors = cd.close()
+    checkpoint.remove()
 
     if fatal_errors:
       raise FatalException("Pass 1 complete.\n"
@@ -119,6 +179,17 @@ class CollectRevsPass(Pass):
                            + "\n".join(fatal_errors) + "\n"
                            + "Exited due to fatal error(s).")
 
+    if cd.manifest is not None:
+      cd.manifest.check_files(read_manifest(Ctx().incremental_manifest))
+      logger.quiet(
+          'Replayed the recorded parses of %d unchanged ,v files.'
+          % (num_replayed_files,)
+          )
+      write_manifest(
+          cd.manifest,
+          artifact_manager.get_temp_file(config.INCREMENTAL_MANIFEST),
+          )
+
     Ctx()._cvs_path_db.close()
     write_projects(artifact_manager.get_temp_file(config.PROJECTS))
     logger.quiet("Done")
@@ -441,7 +512,9 @@ class FilterSymbolsPass(Pass):
   def register_artifacts(self):
     self._register_temp_file(config.ITEM_SERIALIZER)
     self._register_temp_file(config.CVS_REVS_DATAFILE)
+    self._register_temp_file(config.CVS_REVS_STORE)
     self._register_temp_file(config.CVS_SYMBOLS_DATAFILE)
+    self._register_temp_file(config.CVS_SYMBOLS_STORE)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.METADATA_CLEAN_STORE)
@@ -471,11 +544,13 @@ class FilterSymbolsPass(Pass):
 
     rev_db = NewSortableCVSRevisionDatabase(
         artifact_manager.get_temp_file(config.CVS_REVS_DATAFILE),
+        artifact_manager.get_temp_file(config.CVS_REVS_STORE),
         cvs_item_serializer,
         )
 
     symbol_db = NewSortableCVSSymbolDatabase(
         artifact_manager.get_temp_file(config.CVS_SYMBOLS_DATAFILE),
+        artifact_manager.get_temp_file(config.CVS_SYMBOLS_STORE),
         cvs_item_serializer,
         )
 
@@ -541,6 +616,9 @@ class SortRevisionsPass(Pass):
             config.CVS_REVS_SORTED_DATAFILE
             ),
         tempdirs=[Ctx().tmpdir],
+        memory_limit=Ctx().sort_memory,
+        jobs=Ctx().jobs,
+        record_size=OldSortableCVSRevisionDatabase.record_size(),
         )
     logger.quiet("Done")
 
@@ -560,10 +638,116 @@ class SortSymbolsPass(Pass):
             config.CVS_SYMBOLS_SORTED_DATAFILE
             ),
         tempdirs=[Ctx().tmpdir],
+        memory_limit=Ctx().sort_memory,
+        jobs=Ctx().jobs,
+        record_size=OldSortableCVSSymbolDatabase.record_size(),
         )
     logger.quiet("Done")
 
 
+def _get_revision_sort_key(id, timestamp, cvs_path, rev):
+  """Return a key that sorts CVSRevisions within a changeset.
+
+  The CVSRevisions are sorted in a defined order (chronological to
+  the extent that the timestamps are correct and unique)."""
+
+  return (timestamp, cvs_path, tuple([int(x) for x in rev.split('.')]), id)
+
+
+def _break_internal_dependencies(items):
+  """Split up ITEMS if necessary to break internal dependencies.
+
+  ITEMS is a list of (sort_key, succ_ids) tuples describing CVSRevisions
+  that could possibly belong in a single RevisionChangeset, where
+  sort_key was computed by _get_revision_sort_key() and succ_ids
+  contains the ids of successors that might be among ITEMS.  Return a
+  list of lists of such tuples, where at least one internal dependency
+  has been eliminated.  Iff ITEMS does not have to be split, then the
+  return value will contain a single value, namely the original value
+  of ITEMS.  Split ITEMS at most once, even though the resulting
+  changesets might themselves have internal dependencies."""
+
+  # Create a list of tuples (pred, succ) of id pairs for CVSItems that
+  # depend on each other.
+  dependencies = []
+  ids = set([sort_key[-1] for (sort_key, succ_ids) in items])
+  for (sort_key, succ_ids) in items:
+    for succ_id in succ_ids:
+      if succ_id in ids:
+        dependencies.append((sort_key[-1], succ_id,))
+
+  if dependencies:
+    # Sort the items by their precomputed sort keys (which are unique,
+    # so succ_ids is never compared):
+    items.sort()
+    indexes = {}
+    for (i, (sort_key, succ_ids)) in enumerate(items):
+      indexes[sort_key[-1]] = i
+
+    # How many internal dependencies would be broken by breaking the
+    # Changeset after a particular index?
+    breaks = [0] * len(items)
+    for (pred, succ,) in dependencies:
+      pred_index = indexes[pred]
+      succ_index = indexes[succ]
+      breaks[min(pred_index, succ_index)] += 1
+      breaks[max(pred_index, succ_index)] -= 1
+    for i in range(1, len(breaks)):
+      breaks[i] += breaks[i - 1]
+
+    best_i = None
+    best_count = -1
+    best_gap = 0
+    for i in range(0, len(breaks) - 1):
+      # The timestamp is the first component of the sort key:
+      gap = items[i + 1][0][0] - items[i][0][0]
+      if (
+          breaks[i] > best_count
+          or breaks[i] == best_count and gap > best_gap
+          ):
+        best_i = i
+        best_count = breaks[i]
+        best_gap = gap
+
+    return [items[:best_i + 1], items[best_i + 1:]]
+  else:
+    return [items]
+
+
+def _split_revision_changeset(args):
+  """Split a candidate RevisionChangeset to break all internal dependencies.
+
+  ARGS is a list of (id, timestamp, cvs_path, rev, succ_ids) tuples
+  describing the CVSRevisions that could conceivably be part of a
+  single changeset (see InitializeChangesetsPass.get_split_args()).
+  Return a list of lists of CVSRevision ids, one for each changeset
+  that the candidate has to be split into.
+
+  This is a module-level function so that it can be run in a worker
+  process.  It is written non-recursively to avoid any possible
+  problems with recursion depth."""
+
+  items = [
+      (_get_revision_sort_key(id, timestamp, cvs_path, rev), succ_ids)
+      for (id, timestamp, cvs_path, rev, succ_ids) in args
+      ]
+
+  retval = []
+  changesets_to_split = [items]
+  while changesets_to_split:
+    changesets = _break_internal_dependencies(changesets_to_split.pop())
+    if len(changesets) == 1:
+      [items] = changesets
+      retval.append([sort_key[-1] for (sort_key, succ_ids) in items])
+    else:
+      # The changeset had to be split; see if either of the
+      # fragments have to be split:
+      changesets.reverse()
+      changesets_to_split.extend(changesets)
+
+  return retval
+
+
 class InitializeChangesetsPass(Pass):
   """Create preliminary CommitSets."""
 
@@ -578,8 +762,10 @@ class InitializeChangesetsPass(Pass):
     self._register_temp_file_needed(config.CVS_PATHS_DB)
     self._register_temp_file_needed(config.ITEM_SERIALIZER)
     self._register_temp_file_needed(config.CVS_REVS_SORTED_DATAFILE)
+    self._register_temp_file_needed(config.CVS_REVS_STORE)
     self._register_temp_file_needed(
         config.CVS_SYMBOLS_SORTED_DATAFILE)
+    self._register_temp_file_needed(config.CVS_SYMBOLS_STORE)
 
   def get_revision_changesets(self):
     """Generate revision changesets, one at a time.
@@ -596,6 +782,7 @@ class InitializeChangesetsPass(Pass):
         artifact_manager.get_temp_file(
             config.CVS_REVS_SORTED_DATAFILE
             ),
+        artifact_manager.get_temp_file(config.CVS_REVS_STORE),
         self.cvs_item_serializer,
         )
 
@@ -628,6 +815,7 @@ class InitializeChangesetsPass(Pass):
         artifact_manager.get_temp_file(
             config.CVS_SYMBOLS_SORTED_DATAFILE
             ),
+        artifact_manager.get_temp_file(config.CVS_SYMBOLS_STORE),
         self.cvs_item_serializer,
         )
 
@@ -645,101 +833,77 @@ class InitializeChangesetsPass(Pass):
     if changeset_items:
       yield changeset_items
 
-  @staticmethod
-  def compare_items(a, b):
-      return (
-          cmp(a.timestamp, b.timestamp)
-          or cmp(a.cvs_file.cvs_path, b.cvs_file.cvs_path)
-          or cmp([int(x) for x in a.rev.split('.')],
-                 [int(x) for x in b.rev.split('.')])
-          or cmp(a.id, b.id))
-
-  def break_internal_dependencies(self, changeset_items):
-    """Split up CHANGESET_ITEMS if necessary to break internal dependencies.
+  def get_split_args(self, changeset_items):
+    """Return the argument for _split_revision_changeset(CHANGESET_ITEMS).
 
     CHANGESET_ITEMS is a list of CVSRevisions that could possibly
-    belong in a single RevisionChangeset, but there might be internal
-    dependencies among the items.  Return a list of lists, where each
-    sublist is a list of CVSRevisions and at least one internal
-    dependency has been eliminated.  Iff CHANGESET_ITEMS does not have
-    to be split, then the return value will contain a single value,
-    namely the original value of CHANGESET_ITEMS.  Split
-    CHANGESET_ITEMS at most once, even though the resulting changesets
-    might themselves have internal dependencies."""
+    belong in a single RevisionChangeset.  If there are no internal
+    dependencies among them, return None; otherwise, return a list of
+    tuples (id, timestamp, cvs_path, rev, succ_ids), one for each
+    CVSRevision in CHANGESET_ITEMS, where succ_ids is a list of the
+    ids of its successors within CHANGESET_ITEMS."""
 
     # We only look for succ dependencies, since by doing so we
-    # automatically cover pred dependencies as well.  First create a
-    # list of tuples (pred, succ) of id pairs for CVSItems that depend
-    # on each other.
-    dependencies = []
+    # automatically cover pred dependencies as well.
     changeset_cvs_item_ids = set([cvs_rev.id for cvs_rev in changeset_items])
+    succ_ids_list = []
+    dependencies_found = False
     for cvs_item in changeset_items:
+      succ_ids = []
       for next_id in cvs_item.get_succ_ids():
         if next_id in changeset_cvs_item_ids:
           # Sanity check: a CVSItem should never depend on itself:
           if next_id == cvs_item.id:
             raise InternalError('Item depends on itself: %s' % (cvs_item,))
 
-          dependencies.append((cvs_item.id, next_id,))
-
-    if dependencies:
-      # Sort the changeset_items in a defined order (chronological to the
-      # extent that the timestamps are correct and unique).
-      changeset_items.sort(self.compare_items)
-      indexes = {}
-      for (i, changeset_item) in enumerate(changeset_items):
-        indexes[changeset_item.id] = i
-
-      # How many internal dependencies would be broken by breaking the
-      # Changeset after a particular index?
-      breaks = [0] * len(changeset_items)
-      for (pred, succ,) in dependencies:
-        pred_index = indexes[pred]
-        succ_index = indexes[succ]
-        breaks[min(pred_index, succ_index)] += 1
-        breaks[max(pred_index, succ_index)] -= 1
-      for i in range(1, len(breaks)):
-        breaks[i] += breaks[i - 1]
-
-      best_i = None
-      best_count = -1
-      best_gap = 0
-      for i in range(0, len(breaks) - 1):
-        gap = changeset_items[i + 1].timestamp - changeset_items[i].timestamp
-        if (
-            breaks[i] > best_count
-            or breaks[i] == best_count and gap > best_gap
-            ):
-          best_i = i
-          best_count = breaks[i]
-          best_gap = gap
+          succ_ids.append(next_id)
+          dependencies_found = True
+      succ_ids_list.append(succ_ids)
 
-      return [changeset_items[:best_i + 1], changeset_items[best_i + 1:]]
-    else:
-      return [changeset_items]
+    if not dependencies_found:
+      return None
+
+    return [
+        (
+            cvs_item.id, cvs_item.timestamp, cvs_item.cvs_file.cvs_path,
+            cvs_item.rev, succ_ids,
+            )
+        for (cvs_item, succ_ids) in zip(changeset_items, succ_ids_list)
+        ]
 
-  def break_all_internal_dependencies(self, changeset_items):
-    """Keep breaking CHANGESET_ITEMS up to break all internal dependencies.
+  def get_split_revision_changesets(self):
+    """Generate lists of CVSRevisions without internal dependencies.
 
-    CHANGESET_ITEMS is a list of CVSRevisions that could conceivably
-    be part of a single changeset.  Break this list into sublists,
-    where the CVSRevisions in each sublist are free of mutual
-    dependencies."""
+    Each list constitutes a RevisionChangeset.  The candidate
+    changesets that have to be split are split by
+    _split_revision_changeset(), in self.worker_pool if there is one;
+    either way, the lists are generated in the same order."""
 
-    # This method is written non-recursively to avoid any possible
-    # problems with recursion depth.
+    args = (
+        (changeset_items, self.get_split_args(changeset_items))
+        for changeset_items in self.get_revision_changesets()
+        )
 
-    changesets_to_split = [changeset_items]
-    while changesets_to_split:
-      changesets = self.break_internal_dependencies(changesets_to_split.pop())
-      if len(changesets) == 1:
-        [changeset_items] = changesets
+    if self.worker_pool is None:
+      results = (
+          (
+              changeset_items,
+              split_args and _split_revision_changeset(split_args),
+              )
+          for (changeset_items, split_args) in args
+          )
+    else:
+      results = self.worker_pool.imap_tagged(_split_revision_changeset, args)
+
+    for (changeset_items, split_ids) in results:
+      if split_ids is None:
         yield changeset_items
       else:
-        # The changeset had to be split; see if either of the
-        # fragments have to be split:
-        changesets.reverse()
-        changesets_to_split.extend(changesets)
+        cvs_revs = dict(
+            (cvs_rev.id, cvs_rev) for cvs_rev in changeset_items
+            )
+        for ids in split_ids:
+          yield [cvs_revs[id] for id in ids]
 
   def get_changesets(self):
     """Generate (Changeset, [CVSItem,...]) for all changesets.
@@ -748,16 +912,14 @@ class InitializeChangesetsPass(Pass):
     The [CVSItem,...] list is the list of CVSItems in the
     corresponding Changeset."""
 
-    for changeset_items in self.get_revision_changesets():
-      for split_changeset_items \
-              in self.break_all_internal_dependencies(changeset_items):
-        yield (
-            RevisionChangeset(
-                self.changeset_key_generator.gen_id(),
-                [cvs_rev.id for cvs_rev in split_changeset_items]
-                ),
-            split_changeset_items,
-            )
+    for changeset_items in self.get_split_revision_changesets():
+      yield (
+          RevisionChangeset(
+              self.changeset_key_generator.gen_id(),
+              [cvs_rev.id for cvs_rev in changeset_items]
+              ),
+          changeset_items,
+          )
 
     for changeset_items in self.get_symbol_changesets():
       yield (
@@ -772,6 +934,10 @@ class InitializeChangesetsPass(Pass):
   def run(self, run_options, stats_keeper):
     logger.quiet("Creating preliminary commit sets...")
 
+    # Start the workers before opening any files, so that they don't
+    # inherit them:
+    self.worker_pool = create_worker_pool(Ctx().jobs)
+
     Ctx()._projects = read_projects(
         artifact_manager.get_temp_file(config.PROJECTS)
         )
@@ -807,6 +973,10 @@ class InitializeChangesetsPass(Pass):
         self.sorted_cvs_items_db.add(cvs_item)
         cvs_item_to_changeset_id[cvs_item.id] = changeset.id
 
+    if self.worker_pool is not None:
+      self.worker_pool.close()
+      self.worker_pool = None
+
     self.sorted_cvs_items_db.close()
     cvs_item_to_changeset_id.close()
     changeset_db.close()
@@ -842,6 +1012,7 @@ class BreakRevisionChangesetCyclesPass(Pass):
     self._register_temp_file(config.CHANGESETS_REVBROKEN_STORE)
     self._register_temp_file(config.CHANGESETS_REVBROKEN_INDEX)
     self._register_temp_file(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    self._register_temp_file(config.CHANGESET_GRAPH_REVBROKEN)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
@@ -916,31 +1087,33 @@ class BreakRevisionChangesetCyclesPass(Pass):
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
         DB_OPEN_READ)
 
-    shutil.copyfile(
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET),
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET_REVBROKEN))
     cvs_item_to_changeset_id = CVSItemToChangesetTable(
         artifact_manager.get_temp_file(
             config.CVS_ITEM_TO_CHANGESET_REVBROKEN),
-        DB_OPEN_WRITE)
+        DB_OPEN_NEW,
+        artifact_manager.get_temp_file(
+            config.CVS_ITEM_TO_CHANGESET))
 
     changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_REVBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_REVBROKEN_INDEX),
         DB_OPEN_NEW)
 
-    self.changeset_graph = ChangesetGraph(
+    self.changeset_graph = create_changeset_graph(
         changeset_db, cvs_item_to_changeset_id
         )
+    self.changeset_graph.write_snapshot(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_REVBROKEN)
+        )
 
+    graph_builder = ChangesetGraphBuilder(self.changeset_graph)
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       changeset_db.store(changeset)
       if isinstance(changeset, RevisionChangeset):
-        self.changeset_graph.add_changeset(changeset)
+        graph_builder.add_changeset(changeset)
       max_changeset_id = max(max_changeset_id, changeset.id)
+    graph_builder.finish()
 
     self.changeset_key_generator = KeyGenerator(max_changeset_id + 1)
 
@@ -948,7 +1121,8 @@ class BreakRevisionChangesetCyclesPass(Pass):
 
     # Consume the graph, breaking cycles using self.break_cycle():
     for (changeset, time_range) in self.changeset_graph.consume_graph(
-          cycle_breaker=self.break_cycle
+          cycle_breaker=self.break_cycle,
+          batch=Ctx().batch_cycle_breaking,
           ):
       self.processed_changeset_logger.log(changeset.id)
 
@@ -980,6 +1154,9 @@ class RevisionTopologicalSortPass(Pass):
     self._register_temp_file_needed(config.CHANGESETS_REVBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_REVBROKEN_INDEX)
     self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    # ...which only stores its differences from:
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET)
+    self._register_temp_file_needed(config.CHANGESET_GRAPH_REVBROKEN)
 
   def get_source_changesets(self, changeset_db):
     changeset_ids = changeset_db.keys()
@@ -987,6 +1164,23 @@ class RevisionTopologicalSortPass(Pass):
     for changeset_id in changeset_ids:
       yield changeset_db[changeset_id]
 
+  def verify_changeset_graph(
+        self, changeset_graph, changeset_db, cvs_item_to_changeset_id
+        ):
+    """Check CHANGESET_GRAPH against the graph derived from CHANGESET_DB.
+
+    CVS_ITEM_TO_CHANGESET_ID is the table that CHANGESET_GRAPH uses."""
+
+    derived_graph = create_changeset_graph(
+        changeset_db, cvs_item_to_changeset_id
+        )
+    graph_builder = ChangesetGraphBuilder(derived_graph)
+    for changeset in self.get_source_changesets(changeset_db):
+      if isinstance(changeset, RevisionChangeset):
+        graph_builder.add_changeset(changeset)
+    graph_builder.finish()
+    check_changeset_graph_snapshot(changeset_graph, derived_graph)
+
   def get_changesets(self):
     changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_REVBROKEN_STORE),
@@ -994,22 +1188,29 @@ class RevisionTopologicalSortPass(Pass):
         DB_OPEN_READ,
         )
 
-    changeset_graph = ChangesetGraph(
-        changeset_db,
-        CVSItemToChangesetTable(
-            artifact_manager.get_temp_file(
-                config.CVS_ITEM_TO_CHANGESET_REVBROKEN
-                ),
-            DB_OPEN_READ,
-            )
+    cvs_item_to_changeset_id = CVSItemToChangesetTable(
+        artifact_manager.get_temp_file(
+            config.CVS_ITEM_TO_CHANGESET_REVBROKEN
+            ),
+        DB_OPEN_READ,
+        )
+    changeset_graph = create_changeset_graph(
+        changeset_db, cvs_item_to_changeset_id
+        )
+    load_changeset_graph_snapshot(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_REVBROKEN),
+        changeset_graph,
         )
 
     for changeset in self.get_source_changesets(changeset_db):
-      if isinstance(changeset, RevisionChangeset):
-        changeset_graph.add_changeset(changeset)
-      else:
+      if not isinstance(changeset, RevisionChangeset):
         yield changeset
 
+    if Ctx().verify_changeset_graph_snapshots:
+      self.verify_changeset_graph(
+          changeset_graph, changeset_db, cvs_item_to_changeset_id
+          )
+
     changeset_ids = []
 
     # Sentry:
@@ -1073,6 +1274,8 @@ class BreakSymbolChangesetCyclesPass(Pass):
     self._register_temp_file_needed(config.CHANGESETS_REVSORTED_STORE)
     self._register_temp_file_needed(config.CHANGESETS_REVSORTED_INDEX)
     self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    # ...which only stores its differences from:
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET)
 
   def get_source_changesets(self):
     old_changeset_db = ChangesetDatabase(
@@ -1138,31 +1341,30 @@ class BreakSymbolChangesetCyclesPass(Pass):
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
         DB_OPEN_READ)
 
-    shutil.copyfile(
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET_REVBROKEN),
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET_SYMBROKEN))
     cvs_item_to_changeset_id = CVSItemToChangesetTable(
         artifact_manager.get_temp_file(
             config.CVS_ITEM_TO_CHANGESET_SYMBROKEN),
-        DB_OPEN_WRITE)
+        DB_OPEN_NEW,
+        artifact_manager.get_temp_file(
+            config.CVS_ITEM_TO_CHANGESET_REVBROKEN))
 
     changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_INDEX),
         DB_OPEN_NEW)
 
-    self.changeset_graph = ChangesetGraph(
+    self.changeset_graph = create_changeset_graph(
         changeset_db, cvs_item_to_changeset_id
         )
 
+    graph_builder = ChangesetGraphBuilder(self.changeset_graph)
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       changeset_db.store(changeset)
       if isinstance(changeset, SymbolChangeset):
-        self.changeset_graph.add_changeset(changeset)
+        graph_builder.add_changeset(changeset)
       max_changeset_id = max(max_changeset_id, changeset.id)
+    graph_builder.finish()
 
     self.changeset_key_generator = KeyGenerator(max_changeset_id + 1)
 
@@ -1170,7 +1372,8 @@ class BreakSymbolChangesetCyclesPass(Pass):
 
     # Consume the graph, breaking cycles using self.break_cycle():
     for (changeset, time_range) in self.changeset_graph.consume_graph(
-          cycle_breaker=self.break_cycle
+          cycle_breaker=self.break_cycle,
+          batch=Ctx().batch_cycle_breaking,
           ):
       self.processed_changeset_logger.log(changeset.id)
 
@@ -1193,6 +1396,7 @@ class BreakAllChangesetCyclesPass(Pass):
     self._register_temp_file(config.CHANGESETS_ALLBROKEN_STORE)
     self._register_temp_file(config.CHANGESETS_ALLBROKEN_INDEX)
     self._register_temp_file(config.CVS_ITEM_TO_CHANGESET_ALLBROKEN)
+    self._register_temp_file(config.CHANGESET_GRAPH_ALLBROKEN)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
@@ -1201,6 +1405,10 @@ class BreakAllChangesetCyclesPass(Pass):
     self._register_temp_file_needed(config.CHANGESETS_SYMBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_SYMBROKEN_INDEX)
     self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_SYMBROKEN)
+    # ...which only stores its differences from one of these (the last
+    # one that was too different from its base to remain an overlay):
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET)
 
   def get_source_changesets(self):
     old_changeset_db = ChangesetDatabase(
@@ -1358,24 +1566,24 @@ class BreakAllChangesetCyclesPass(Pass):
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
         DB_OPEN_READ)
 
-    shutil.copyfile(
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET_SYMBROKEN),
-        artifact_manager.get_temp_file(
-            config.CVS_ITEM_TO_CHANGESET_ALLBROKEN))
     self.cvs_item_to_changeset_id = CVSItemToChangesetTable(
         artifact_manager.get_temp_file(
             config.CVS_ITEM_TO_CHANGESET_ALLBROKEN),
-        DB_OPEN_WRITE)
+        DB_OPEN_NEW,
+        artifact_manager.get_temp_file(
+            config.CVS_ITEM_TO_CHANGESET_SYMBROKEN))
 
     self.changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_INDEX),
         DB_OPEN_NEW)
 
-    self.changeset_graph = ChangesetGraph(
+    self.changeset_graph = create_changeset_graph(
         self.changeset_db, self.cvs_item_to_changeset_id
         )
+    self.changeset_graph.write_snapshot(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_ALLBROKEN)
+        )
 
     # A map {changeset_id : ordinal} for OrderedChangesets:
     self.ordinals = {}
@@ -1383,16 +1591,18 @@ class BreakAllChangesetCyclesPass(Pass):
     ordered_changeset_map = {}
     # A list of all BranchChangeset ids:
     branch_changeset_ids = []
+    graph_builder = ChangesetGraphBuilder(self.changeset_graph)
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       self.changeset_db.store(changeset)
-      self.changeset_graph.add_changeset(changeset)
+      graph_builder.add_changeset(changeset)
       if isinstance(changeset, OrderedChangeset):
         ordered_changeset_map[changeset.ordinal] = changeset.id
         self.ordinals[changeset.id] = changeset.ordinal
       elif isinstance(changeset, BranchChangeset):
         branch_changeset_ids.append(changeset.id)
       max_changeset_id = max(max_changeset_id, changeset.id)
+    graph_builder.finish()
 
     # An array of ordered_changeset ids, indexed by ordinal:
     ordered_changesets = []
@@ -1476,11 +1686,33 @@ class TopologicalSortPass(Pass):
     self._register_temp_file_needed(config.CHANGESETS_ALLBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_ALLBROKEN_INDEX)
     self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_ALLBROKEN)
+    # ...which only stores its differences from one of these (the last
+    # one that was too different from its base to remain an overlay):
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_SYMBROKEN)
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET)
+    self._register_temp_file_needed(config.CHANGESET_GRAPH_ALLBROKEN)
 
   def get_source_changesets(self, changeset_db):
     for changeset_id in changeset_db.keys():
       yield changeset_db[changeset_id]
 
+  def verify_changeset_graph(
+        self, changeset_graph, changeset_db, cvs_item_to_changeset_id
+        ):
+    """Check CHANGESET_GRAPH against the graph derived from CHANGESET_DB.
+
+    CVS_ITEM_TO_CHANGESET_ID is the table that CHANGESET_GRAPH uses."""
+
+    derived_graph = create_changeset_graph(
+        changeset_db, cvs_item_to_changeset_id
+        )
+    graph_builder = ChangesetGraphBuilder(derived_graph)
+    for changeset in self.get_source_changesets(changeset_db):
+      graph_builder.add_changeset(changeset)
+    graph_builder.finish()
+    check_changeset_graph_snapshot(changeset_graph, derived_graph)
+
   def get_changesets(self):
     """Generate (changeset, timestamp) pairs in commit order."""
 
@@ -1489,22 +1721,31 @@ class TopologicalSortPass(Pass):
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_INDEX),
         DB_OPEN_READ)
 
-    changeset_graph = ChangesetGraph(
-        changeset_db,
-        CVSItemToChangesetTable(
-            artifact_manager.get_temp_file(
-                config.CVS_ITEM_TO_CHANGESET_ALLBROKEN
-                ),
-            DB_OPEN_READ,
+    cvs_item_to_changeset_id = CVSItemToChangesetTable(
+        artifact_manager.get_temp_file(
+            config.CVS_ITEM_TO_CHANGESET_ALLBROKEN
             ),
+        DB_OPEN_READ,
+        )
+    changeset_graph = create_changeset_graph(
+        changeset_db, cvs_item_to_changeset_id
         )
+    load_changeset_graph_snapshot(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_ALLBROKEN),
+        changeset_graph,
+        )
+
     symbol_changeset_ids = set()
 
     for changeset in self.get_source_changesets(changeset_db):
-      changeset_graph.add_changeset(changeset)
       if isinstance(changeset, SymbolChangeset):
         symbol_changeset_ids.add(changeset.id)
 
+    if Ctx().verify_changeset_graph_snapshots:
+      self.verify_changeset_graph(
+          changeset_graph, changeset_db, cvs_item_to_changeset_id
+          )
+
     # Ensure a monotonically-increasing timestamp series by keeping
     # track of the previous timestamp and ensuring that the following
     # one is larger.
@@ -1561,6 +1802,8 @@ class CreateRevsPass(Pass):
     self._register_temp_file(config.SVN_COMMITS_STORE)
     self._register_temp_file(config.CVS_REVS_TO_SVN_REVNUMS)
     self._register_temp_file(config.SYMBOL_OPENINGS_CLOSINGS)
+    self._register_temp_file(config.SYMBOL_OFFSETS_DB)
+    self._register_temp_file(config.SVN_SYMBOL_COMMIT_REVNUMS)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
     self._register_temp_file_needed(config.CVS_ITEMS_SORTED_STORE)
@@ -1622,14 +1865,26 @@ class CreateRevsPass(Pass):
 
     persistence_manager = PersistenceManager(DB_OPEN_NEW)
 
+    # The revision numbers of the SVNSymbolCommits, which are filled
+    # by PlanSymbolFillsPass:
+    symbol_commit_revnums = []
+
     creator = SVNCommitCreator()
     for svn_commit in self.get_svn_commits(creator):
       self.log_svn_commit(svn_commit)
       persistence_manager.put_svn_commit(svn_commit)
+      if isinstance(svn_commit, SVNSymbolCommit):
+        symbol_commit_revnums.append(svn_commit.revnum)
 
     stats_keeper.set_svn_rev_count(creator.revnum_generator.get_last_id())
     del creator
 
+    f = open(
+        artifact_manager.get_temp_file(config.SVN_SYMBOL_COMMIT_REVNUMS), 'wb'
+        )
+    cPickle.dump(symbol_commit_revnums, f, -1)
+    f.close()
+
     persistence_manager.close()
     Ctx()._symbolings_logger.close()
     Ctx()._cvs_items_db.close()
@@ -1640,7 +1895,13 @@ class CreateRevsPass(Pass):
 
 
 class SortSymbolOpeningsClosingsPass(Pass):
-  """This pass was formerly known as pass6."""
+  """Sort the openings and closings of symbols by symbol and revnum.
+
+  The records of each symbol end up where SymbolingsLogger expected
+  them when it wrote SYMBOL_OFFSETS_DB.  This pass was formerly known
+  as pass6; it used to be followed by IndexSymbolsPass (formerly
+  pass7), which found the offsets of the symbols in the sorted
+  file."""
 
   def register_artifacts(self):
     self._register_temp_file(config.SYMBOL_OPENINGS_CLOSINGS_SORTED)
@@ -1649,73 +1910,86 @@ class SortSymbolOpeningsClosingsPass(Pass):
   def run(self, run_options, stats_keeper):
     logger.quiet("Sorting symbolic name source revisions...")
 
-    def sort_key(line):
-      line = line.split(' ', 2)
-      return (int(line[0], 16), int(line[1]), line[2],)
-
     sort_file(
         artifact_manager.get_temp_file(config.SYMBOL_OPENINGS_CLOSINGS),
         artifact_manager.get_temp_file(
             config.SYMBOL_OPENINGS_CLOSINGS_SORTED
             ),
-        key=sort_key,
         tempdirs=[Ctx().tmpdir],
+        memory_limit=Ctx().sort_memory,
+        jobs=Ctx().jobs,
+        record_size=SYMBOLING_RECORD_SIZE,
         )
     logger.quiet("Done")
 
 
-class IndexSymbolsPass(Pass):
-  """This pass was formerly known as pass7."""
+class PlanSymbolFillsPass(Pass):
+  """Decide from which sources the symbol fills will be copied.
+
+  For each SVNSymbolCommit, score the possible sources of the paths
+  that have to be filled and store the resulting plan in a
+  FillPlanDatabase, which OutputPass uses to fill the symbol.  The
+  plans do not depend on the state of the repository mirror; OutputPass
+  still decides which paths have to be copied or deleted."""
 
   def register_artifacts(self):
-    self._register_temp_file(config.SYMBOL_OFFSETS_DB)
+    self._register_temp_file(config.SYMBOL_FILL_PLANS_STORE)
+    self._register_temp_file(config.SYMBOL_FILL_PLANS_INDEX_TABLE)
     self._register_temp_file_needed(config.PROJECTS)
+    self._register_temp_file_needed(config.CVS_PATHS_DB)
+    self._register_temp_file_needed(config.CVS_ITEMS_SORTED_STORE)
+    self._register_temp_file_needed(config.CVS_ITEMS_SORTED_INDEX_TABLE)
     self._register_temp_file_needed(config.SYMBOL_DB)
+    self._register_temp_file_needed(config.SVN_COMMITS_INDEX_TABLE)
+    self._register_temp_file_needed(config.SVN_COMMITS_STORE)
+    self._register_temp_file_needed(config.CVS_REVS_TO_SVN_REVNUMS)
+    self._register_temp_file_needed(config.SVN_SYMBOL_COMMIT_REVNUMS)
     self._register_temp_file_needed(config.SYMBOL_OPENINGS_CLOSINGS_SORTED)
+    self._register_temp_file_needed(config.SYMBOL_OFFSETS_DB)
 
-  def generate_offsets_for_symbolings(self):
-    """This function iterates through all the lines in
-    SYMBOL_OPENINGS_CLOSINGS_SORTED, writing out a file mapping
-    SYMBOLIC_NAME to the file offset in SYMBOL_OPENINGS_CLOSINGS_SORTED
-    where SYMBOLIC_NAME is first encountered.  This will allow us to
-    seek to the various offsets in the file and sequentially read only
-    the openings and closings that we need."""
-
-    offsets = {}
+  def _iter_svn_symbol_commits(self, persistence_manager):
+    """Generate the SVNSymbolCommits in order of revision number."""
 
     f = open(
-        artifact_manager.get_temp_file(
-            config.SYMBOL_OPENINGS_CLOSINGS_SORTED),
-        'r')
-    old_id = None
-    while True:
-      fpos = f.tell()
-      line = f.readline()
-      if not line:
-        break
-      id, svn_revnum, ignored = line.split(" ", 2)
-      id = int(id, 16)
-      if id != old_id:
-        logger.verbose(' ', Ctx()._symbol_db.get_symbol(id).name)
-        old_id = id
-        offsets[id] = fpos
-
+        artifact_manager.get_temp_file(config.SVN_SYMBOL_COMMIT_REVNUMS), 'rb'
+        )
+    symbol_commit_revnums = cPickle.load(f)
     f.close()
 
-    offsets_db = file(
-        artifact_manager.get_temp_file(config.SYMBOL_OFFSETS_DB), 'wb')
-    cPickle.dump(offsets, offsets_db, -1)
-    offsets_db.close()
+    for revnum in symbol_commit_revnums:
+      yield persistence_manager.get_svn_commit(revnum)
 
   def run(self, run_options, stats_keeper):
-    logger.quiet("Determining offsets for all symbolic names...")
-    Ctx()._projects = read_projects(
-        artifact_manager.get_temp_file(config.PROJECTS)
-        )
-    Ctx()._symbol_db = SymbolDatabase()
-    self.generate_offsets_for_symbolings()
-    Ctx()._symbol_db.close()
-    logger.quiet("Done.")
+    logger.quiet("Planning symbol fills...")
+
+    fill_plans = FillPlanDatabase(DB_OPEN_NEW)
+
+    if Ctx().output_option.uses_fill_plans:
+      Ctx()._projects = read_projects(
+          artifact_manager.get_temp_file(config.PROJECTS)
+          )
+      Ctx()._cvs_path_db = CVSPathDatabase(DB_OPEN_READ)
+      Ctx()._symbol_db = SymbolDatabase()
+      Ctx()._cvs_items_db = IndexedCVSItemStore(
+          artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_STORE),
+          artifact_manager.get_temp_file(
+              config.CVS_ITEMS_SORTED_INDEX_TABLE
+              ),
+          DB_OPEN_READ)
+      persistence_manager = PersistenceManager(DB_OPEN_READ)
+
+      plan_symbol_fills(
+          self._iter_svn_symbol_commits(persistence_manager), fill_plans
+          )
+
+      persistence_manager.close()
+      Ctx()._cvs_items_db.close()
+      Ctx()._symbol_db.close()
+      Ctx()._cvs_path_db.close()
+
+    fill_plans.close()
+
+    logger.quiet("Done")
 
 
 class OutputPass(Pass):
@@ -1734,6 +2008,66 @@ class OutputPass(Pass):
     self._register_temp_file_needed(config.CVS_REVS_TO_SVN_REVNUMS)
     Ctx().output_option.register_artifacts(self)
 
+  def _iter_svn_commits(self, start_revnum=1):
+    """Generate the SVNCommits in order of revision number.
+
+    Start with the SVNCommit with revision number START_REVNUM."""
+
+    svn_revnum = start_revnum
+    svn_commit = Ctx()._persistence_manager.get_svn_commit(svn_revnum)
+    while svn_commit:
+      yield svn_commit
+      svn_revnum += 1
+      svn_commit = Ctx()._persistence_manager.get_svn_commit(svn_revnum)
+
+  def _iter_svn_commits_with_prefetch(
+        self, revision_reader, start_revnum=1, announced_revnum=0
+        ):
+    """Generate the SVNCommits, announcing their contents in advance.
+
+    Read ahead in the list of SVNCommits, and pass the CVSRevisions
+    whose contents will be needed to REVISION_READER.prefetch() up to
+    REVISION_READER.prefetch_window revisions before the commits that
+    contain them are generated.  Start with the SVNCommit with
+    revision number START_REVNUM, but do not announce the contents of
+    the SVNCommits up to ANNOUNCED_REVNUM again.  Record the revision
+    number of the last SVNCommit whose contents were announced in
+    self._announced_revnum."""
+
+    window = revision_reader.prefetch_window
+
+    # A list of (svn_commit, number of revisions announced for it):
+    lookahead = deque()
+    announced = 0
+
+    for svn_commit in self._iter_svn_commits(start_revnum):
+      if isinstance(svn_commit, SVNPrimaryCommit) \
+             and svn_commit.revnum > announced_revnum:
+        cvs_revs = [
+            cvs_rev
+            for cvs_rev in svn_commit.cvs_revs
+            if isinstance(cvs_rev, CVSRevisionModification)
+            ]
+      else:
+        cvs_revs = []
+
+      while lookahead and (
+            announced + len(cvs_revs) > window or len(lookahead) >= window
+            ):
+        (old_svn_commit, n) = lookahead.popleft()
+        announced -= n
+        yield old_svn_commit
+
+      if cvs_revs:
+        revision_reader.prefetch(cvs_revs)
+      self._announced_revnum = max(self._announced_revnum, svn_commit.revnum)
+      lookahead.append((svn_commit, len(cvs_revs)))
+      announced += len(cvs_revs)
+
+    while lookahead:
+      (svn_commit, n) = lookahead.popleft()
+      yield svn_commit
+
   def run(self, run_options, stats_keeper):
     Ctx()._projects = read_projects(
         artifact_manager.get_temp_file(config.PROJECTS)
@@ -1751,16 +2085,64 @@ class OutputPass(Pass):
     Ctx()._symbol_db = SymbolDatabase()
     Ctx()._persistence_manager = PersistenceManager(DB_OPEN_READ)
 
-    Ctx().output_option.setup(stats_keeper.svn_rev_count())
+    checkpoint = Checkpoint(config.OUTPUT_CHECKPOINT)
+    state = None
+    if run_options.resume:
+      state = checkpoint.load()
+    if state is not None:
+      try:
+        Ctx().output_option.resume(
+            stats_keeper.svn_rev_count(), state['output_option']
+            )
+      except CheckpointError, e:
+        logger.warn(
+            '%s: Cannot continue from the checkpoint (%s); '
+            'starting the pass from the beginning.'
+            % (warning_prefix, e,)
+            )
+        state = None
+      else:
+        logger.normal(
+            'Continuing from the checkpoint after r%d.' % (state['revnum'],)
+            )
+    if state is None:
+      checkpoint.remove()
+      Ctx().output_option.setup(stats_keeper.svn_rev_count())
+      state = {'revnum' : 0, 'announced_revnum' : 0}
+
+    self._announced_revnum = state['announced_revnum']
+    revision_reader = Ctx().revision_reader
+    if revision_reader is not None and revision_reader.prefetch_window:
+      svn_commits = self._iter_svn_commits_with_prefetch(
+          revision_reader, state['revnum'] + 1, state['announced_revnum']
+          )
+    else:
+      svn_commits = self._iter_svn_commits(state['revnum'] + 1)
 
-    svn_revnum = 1
-    svn_commit = Ctx()._persistence_manager.get_svn_commit(svn_revnum)
-    while svn_commit:
+    checkpoint_interval = Ctx().output_checkpoint_interval
+    commits_since_checkpoint = 0
+    for svn_commit in svn_commits:
       svn_commit.output(Ctx().output_option)
-      svn_revnum += 1
-      svn_commit = Ctx()._persistence_manager.get_svn_commit(svn_revnum)
+      commits_since_checkpoint += 1
+      if checkpoint_interval \
+             and commits_since_checkpoint >= checkpoint_interval:
+        output_option_state = Ctx().output_option.get_checkpoint_state()
+        if output_option_state is None:
+          logger.verbose(
+              'The output cannot be continued later; '
+              'not saving checkpoints.'
+              )
+          checkpoint_interval = 0
+        else:
+          checkpoint.save({
+              'revnum' : svn_commit.revnum,
+              'announced_revnum' : self._announced_revnum,
+              'output_option' : output_option_state,
+              })
+          commits_since_checkpoint = 0
 
     Ctx().output_option.cleanup()
+    checkpoint.remove()
     Ctx()._persistence_manager.close()
 
     Ctx()._symbol_db.close()
@@ -1789,7 +2171,7 @@ passes = [
     TopologicalSortPass(),
     CreateRevsPass(),
     SortSymbolOpeningsClosingsPass(),
-    IndexSymbolsPass(),
+    PlanSymbolFillsPass(),
     OutputPass(),
     ]
 
@@ -14,7 +14,17 @@
 # history and logs, available at http://cvs2svn.tigris.org/.
 # ====================================================================
 
-"""This module processes RCS diffs (deltas)."""
+"""This module processes RCS diffs (deltas).
+
+There are two implementations of the same interface: RCSStream holds
+the text as a list of lines, and BufferRCSStream holds it as a single
+string.  The latter is faster for checking out a revision of a large
+file (loading the text of the previous revision and applying a single
+delta), because it never splits the text into lines; applying a delta
+only copies a few big blocks of text.  RCSStream remains the better
+choice for applying a long series of deltas to the same text.
+create_rcs_stream() chooses between the two based on the size of the
+text."""
 
 
 from cStringIO import StringIO
@@ -350,3 +360,237 @@ class RCSStream:
     #self._lines[:] = [collapse_keywords(myline)
     #                  if string.count(myline, r'$') >= 2 else myline
     #                  for myline in self._lines]
+
+
+def _skip_lines(text, offset, count, line_length):
+  """Return the offset in TEXT of the line COUNT lines after OFFSET.
+
+  OFFSET must be the offset of the start of a line, and TEXT must
+  contain at least COUNT more lines (the last of which may be
+  unterminated).  LINE_LENGTH is an estimate of the average length of
+  the lines.  Most of the work is done by str.count() and str.rfind(),
+  which find the newlines in C rather than line by line."""
+
+  while count > 16:
+    end = offset + int(count * line_length) + 1
+    n = text.count('\n', offset, end)
+    if n == 0:
+      line_length *= 2
+    elif n > count:
+      # We overshot; aim lower next time:
+      line_length *= count / (n + 1.0)
+    else:
+      new_offset = text.rfind('\n', offset, end) + 1
+      line_length = (new_offset - offset) / float(n)
+      offset = new_offset
+      count -= n
+
+  while count:
+    offset = text.find('\n', offset)
+    if offset == -1:
+      return len(text)
+    offset += 1
+    count -= 1
+
+  return offset
+
+
+def _generate_inverse_edits(blocks):
+  """Generate the RCS edits that revert BLOCKS.
+
+  BLOCKS is a list of blocks as returned by
+  BufferRCSStream._apply_edits().  The edits are generated as tuples
+  in the format described in the docstring for generate_edits()."""
+
+  input_position = 0
+  for (command, old_lines, new_lines) in blocks:
+    if command == 'c':
+      input_position += old_lines
+    else:
+      if new_lines:
+        yield ('d', input_position, len(new_lines))
+        input_position += len(new_lines)
+      if old_lines:
+        yield ('a', input_position, old_lines)
+
+
+class BufferRCSStream:
+  """An RCSStream that holds the text in a single string.
+
+  Rather than splitting the text into lines, this class only locates
+  the lines that are touched by a delta, using _skip_lines().  Deltas
+  are applied by joining a few slices of the old text with the added
+  lines.  The interface and the results are the same as those of
+  RCSStream, but the work per delta is dominated by copying the text
+  rather than by handling each line in Python."""
+
+  def __init__(self, text):
+    """Instantiate and initialize the file content with TEXT."""
+
+    self.set_text(text)
+
+  def get_text(self):
+    """Return the current file content."""
+
+    return self._text
+
+  def set_lines(self, lines):
+    """Set the current contents to the specified LINES.
+
+    LINES has the same meaning as for RCSStream.set_lines()."""
+
+    self.set_text(''.join(lines))
+
+  def set_text(self, text):
+    """Set the current file content."""
+
+    self._text = text
+    self._num_lines = text.count('\n')
+    if not text.endswith('\n') and text:
+      self._num_lines += 1
+
+  def _apply_edits(self, edits):
+    """Apply EDITS to the current file content.
+
+    Return a list of the blocks implied by EDITS, in the format
+    (COMMAND, OLD_LINES, NEW_LINES) described in the docstring for
+    RCSStream.generate_blocks(), except that for 'c' blocks OLD_LINES
+    and NEW_LINES are both the number of lines copied.  Adjacent
+    blocks of the same kind are merged."""
+
+    text = self._text
+    num_lines = self._num_lines
+    line_length = len(text) / float(max(num_lines, 1))
+
+    new_text = []
+    new_num_lines = 0
+    blocks = []
+
+    # The number of lines from the old version that have been processed
+    # so far, and the offset in the old text where they end:
+    input_pos = 0
+    offset = 0
+
+    for (command, start, arg) in edits:
+      if command == 'd':
+        # "d" - Delete command
+        count = arg
+        if start < input_pos:
+          raise MalformedDeltaException('Deletion before last edit')
+        if start > num_lines:
+          raise MalformedDeltaException('Deletion past file end')
+        if start + count > num_lines:
+          raise MalformedDeltaException('Deletion beyond file end')
+      else:
+        # "a" - Add command
+        if start < input_pos:
+          raise MalformedDeltaException('Insertion before last edit')
+        if start > num_lines:
+          raise MalformedDeltaException('Insertion past file end')
+
+      if input_pos < start:
+        end = _skip_lines(text, offset, start - input_pos, line_length)
+        new_text.append(text[offset:end])
+        new_num_lines += start - input_pos
+        if blocks and blocks[-1][0] == 'c':
+          blocks[-1][1] += start - input_pos
+          blocks[-1][2] += start - input_pos
+        else:
+          blocks.append(['c', start - input_pos, start - input_pos])
+        input_pos = start
+        offset = end
+
+      if command == 'd':
+        end = _skip_lines(text, offset, count, line_length)
+        old_lines = msplit(text[offset:end])
+        new_lines = []
+        input_pos = start + count
+        offset = end
+      else:
+        old_lines = []
+        new_lines = arg
+        new_text.append(''.join(new_lines))
+        new_num_lines += len(new_lines)
+
+      if blocks and blocks[-1][0] == 'r':
+        blocks[-1][1].extend(old_lines)
+        blocks[-1][2].extend(new_lines)
+      else:
+        blocks.append(['r', old_lines, list(new_lines)])
+
+    # Pass along the part of the input that follows all of the delta
+    # blocks:
+    if input_pos < num_lines:
+      new_text.append(text[offset:])
+      new_num_lines += num_lines - input_pos
+      if blocks and blocks[-1][0] == 'c':
+        blocks[-1][1] += num_lines - input_pos
+        blocks[-1][2] += num_lines - input_pos
+      else:
+        blocks.append(['c', num_lines - input_pos, num_lines - input_pos])
+
+    self._text = ''.join(new_text)
+    self._num_lines = new_num_lines
+
+    return blocks
+
+  def apply_diff(self, diff):
+    """Apply the RCS diff DIFF to the current file content."""
+
+    self._apply_edits(generate_edits(diff))
+
+  def apply_and_invert_edits(self, edits):
+    """Apply EDITS and generate their inverse.
+
+    Apply EDITS to the current file content.  Simultaneously generate
+    edits suitable for reverting the change."""
+
+    return _generate_inverse_edits(self._apply_edits(edits))
+
+  def invert_diff(self, diff):
+    """Apply DIFF and generate its inverse.
+
+    Apply the RCS diff DIFF to the current file content.
+    Simultaneously generate an RCS diff suitable for reverting the
+    change, and return it as a string."""
+
+    inverse_diff = StringIO()
+    write_edits(
+        inverse_diff, self.apply_and_invert_edits(generate_edits(diff))
+        )
+    return inverse_diff.getvalue()
+
+  def expand_keywords(self, rcsfile, rev, timestamp, author):
+    """Expand CVS keywords in the current file content.
+
+    See RCSStream.expand_keywords()."""
+
+    rcs_stream = RCSStream(self._text)
+    rcs_stream.expand_keywords(rcsfile, rev, timestamp, author)
+    self.set_text(rcs_stream.get_text())
+
+  def collapse_keywords(self):
+    """Collapse CVS keywords in the current file content.
+
+    See RCSStream.collapse_keywords()."""
+
+    rcs_stream = RCSStream(self._text)
+    rcs_stream.collapse_keywords()
+    self.set_text(rcs_stream.get_text())
+
+
+# Texts at least this long are held in a BufferRCSStream by
+# create_rcs_stream():
+BUFFER_RCS_STREAM_THRESHOLD = 16 * 1024
+
+
+def create_rcs_stream(text):
+  """Return an RCSStream or a BufferRCSStream holding TEXT.
+
+  A BufferRCSStream is used if TEXT is at least
+  BUFFER_RCS_STREAM_THRESHOLD bytes long."""
+
+  if len(text) >= BUFFER_RCS_STREAM_THRESHOLD:
+    return BufferRCSStream(text)
+  else:
+    return RCSStream(text)
@@ -35,6 +35,19 @@ def select_texttools_parser():
   selected_parser = cvs2svn_rcsparse.texttools.Parser
 
 
+def select_regexp_parser():
+  """Configure this module to use the regexp parser.
+
+  The regexp parser is written in Python, like the Python parser, but
+  it leaves the scanning of the file to the re module and to find().
+  It is faster than the Python parser, especially for files with many
+  revisions and symbols, and only uses the standard library."""
+
+  global selected_parser
+  import cvs2svn_rcsparse.regexp
+  selected_parser = cvs2svn_rcsparse.regexp.Parser
+
+
 def select_python_parser():
   """Configure this module to use the Python parser.
 
@@ -51,7 +64,10 @@ def select_parser():
   try:
     select_texttools_parser()
   except ImportError:
-    select_python_parser()
+    try:
+      select_regexp_parser()
+    except ImportError:
+      select_python_parser()
 
 
 def parse(file, sink):
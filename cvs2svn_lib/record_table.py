@@ -37,6 +37,8 @@ import os
 import types
 import struct
 import mmap
+import array
+import bisect
 
 from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import DB_OPEN_WRITE
@@ -48,6 +50,13 @@ from cvs2svn_lib.log import logger
 # preventing the use of None.
 _unset = object()
 
+# The array typecode used to store record indexes in overlay files (an
+# unsigned 32-bit integer):
+if array.array('I').itemsize == 4:
+  _INDEX_TYPECODE = 'I'
+else:
+  _INDEX_TYPECODE = 'L'
+
 
 class Packer(object):
   def __init__(self, record_len, empty_value=None):
@@ -218,16 +227,69 @@ class AbstractRecordTable:
         pass
 
 
+class RecordTableCacheStatistics(object):
+  """Counters describing the use of the RecordTable block caches."""
+
+  def __init__(self):
+    # The number of record lookups that were satisfied by the cache:
+    self.hits = 0
+    # The number of blocks that had to be read from disk because of a
+    # lookup:
+    self.misses = 0
+    # The number of additional blocks that were read ahead of time:
+    self.readahead = 0
+    # The number of dirty blocks that were written back to disk:
+    self.writebacks = 0
+
+  def add(self, other):
+    self.hits += other.hits
+    self.misses += other.misses
+    self.readahead += other.readahead
+    self.writebacks += other.writebacks
+
+
+# The statistics of all RecordTables closed since the last call to
+# pop_cache_statistics():
+_cache_statistics = RecordTableCacheStatistics()
+
+
+def pop_cache_statistics():
+  """Return the RecordTable cache statistics collected so far.
+
+  The statistics are reset, so the next call only reports on
+  RecordTables that are closed after this call."""
+
+  global _cache_statistics
+
+  retval = _cache_statistics
+  _cache_statistics = RecordTableCacheStatistics()
+  return retval
+
+
 class RecordTable(AbstractRecordTable):
+  """A RecordTable that reads and writes its file through a block cache.
+
+  The file is divided into blocks of about BLOCK_SIZE bytes (a whole
+  number of records).  Up to about self.cache_memory bytes worth of
+  blocks are kept in memory; when the cache is full, the least
+  recently used block is evicted, and written back to disk if it has
+  been modified.  When a miss immediately follows a miss on the
+  preceding block, the following blocks are read in the same read()
+  call, doubling the amount read ahead (up to MAX_READAHEAD blocks)
+  for as long as the access pattern stays sequential."""
+
   # The approximate amount of memory that should be used for the cache
-  # for each instance of this class:
+  # for each instance of this class (unless overridden by passing
+  # cache_memory to the constructor):
   CACHE_MEMORY = 4 * 1024 * 1024
 
-  # Empirically, each entry in the cache table has an overhead of
-  # about 96 bytes on a 32-bit computer.
-  CACHE_OVERHEAD_PER_ENTRY = 96
+  # The approximate size of a block, in bytes:
+  BLOCK_SIZE = 16 * 1024
+
+  # The maximum number of blocks to read ahead:
+  MAX_READAHEAD = 16
 
-  def __init__(self, filename, mode, packer, cache_memory=CACHE_MEMORY):
+  def __init__(self, filename, mode, packer, cache_memory=None):
     AbstractRecordTable.__init__(self, filename, mode, packer)
     if self.mode == DB_OPEN_NEW:
       self.f = open(self.filename, 'wb+')
@@ -237,19 +299,34 @@ class RecordTable(AbstractRecordTable):
       self.f = open(self.filename, 'rb')
     else:
       raise RuntimeError('Invalid mode %r' % self.mode)
+    if cache_memory is None:
+      cache_memory = self.CACHE_MEMORY
     self.cache_memory = cache_memory
 
-    # Number of items that can be stored in the write cache.
-    self._max_memory_cache = (
-        self.cache_memory
-        / (self.CACHE_OVERHEAD_PER_ENTRY + self._record_len))
+    self._records_per_block = max(1, self.BLOCK_SIZE // self._record_len)
+    self._block_len = self._records_per_block * self._record_len
+    self._empty_block = self.packer.empty_value * self._records_per_block
 
-    # Read and write cache; a map {i : (dirty, s)}, where i is an
-    # index, dirty indicates whether the value has to be written to
-    # disk, and s is the packed value for the index.  Up to
-    # self._max_memory_cache items can be stored here.  When the cache
-    # fills up, it is written to disk in one go and then cleared.
+    # The maximum number of blocks that can be stored in the cache:
+    self._max_blocks = max(2, self.cache_memory // self._block_len)
+
+    # The cache: a map {block_number : [prev, next, block_number, block,
+    # dirty]}, where block is an array of the block's bytes and dirty
+    # indicates whether it has to be written to disk.  The entries
+    # also form a circular doubly-linked list in order of use, with
+    # self._lru as its sentinel: self._lru[1] is the most recently
+    # used entry and self._lru[0] the least recently used one.
     self._cache = {}
+    self._lru = [None, None, None, None, False]
+    self._lru[0] = self._lru[1] = self._lru
+
+    # The number of the last block that was read from disk due to a
+    # miss, and the number of blocks to read ahead on the next
+    # sequential miss:
+    self._last_miss = None
+    self._readahead = 1
+
+    self.statistics = RecordTableCacheStatistics()
 
     # The index just beyond the last record ever written:
     self._limit = os.path.getsize(self.filename) // self._record_len
@@ -257,64 +334,148 @@ class RecordTable(AbstractRecordTable):
     # The index just beyond the last record ever written to disk:
     self._limit_written = self._limit
 
+  def _write_block(self, entry):
+    """Write the block in cache entry ENTRY to disk and mark it clean."""
+
+    start = entry[2] * self._records_per_block
+    end = min(start + self._records_per_block, self._limit)
+    f = self.f
+    if start > self._limit_written:
+      # Fill the gap with empty values:
+      f.seek(self._limit_written * self._record_len)
+      f.write(self.packer.empty_value * (start - self._limit_written))
+    else:
+      f.seek(start * self._record_len)
+    f.write(entry[3][:(end - start) * self._record_len].tostring())
+    self._limit_written = max(self._limit_written, end)
+    entry[4] = False
+    self.statistics.writebacks += 1
+
+  def _insert(self, block_number, block):
+    """Add BLOCK to the cache as the most recently used block.
+
+    Evict the least recently used block if necessary.  Return the new
+    cache entry."""
+
+    lru = self._lru
+    if len(self._cache) >= self._max_blocks:
+      victim = lru[0]
+      if victim[4]:
+        self._write_block(victim)
+      victim[0][1] = lru
+      lru[0] = victim[0]
+      del self._cache[victim[2]]
+
+    first = lru[1]
+    entry = [lru, first, block_number, block, False]
+    first[0] = lru[1] = entry
+    self._cache[block_number] = entry
+    return entry
+
+  def _load_block(self, block_number):
+    """Read block BLOCK_NUMBER (and maybe some following ones) from disk.
+
+    Return the cache entry for BLOCK_NUMBER."""
+
+    if self._last_miss is not None and block_number == self._last_miss + 1:
+      self._readahead = min(2 * self._readahead, self.MAX_READAHEAD)
+    else:
+      self._readahead = 1
+    self._last_miss = block_number
+    self.statistics.misses += 1
+
+    # Don't read ahead past the end of the file or over blocks that are
+    # already cached (which might be dirty):
+    limit_block = (
+        (self._limit_written + self._records_per_block - 1)
+        // self._records_per_block
+        )
+    max_count = min(self._readahead, self._max_blocks // 2)
+    count = 1
+    while count < max_count \
+          and block_number + count < limit_block \
+          and block_number + count not in self._cache:
+      count += 1
+
+    if block_number < limit_block:
+      self.f.seek(block_number * self._block_len)
+      data = self.f.read(count * self._block_len)
+    else:
+      data = ''
+
+    for i in range(count - 1, -1, -1):
+      s = data[i * self._block_len:(i + 1) * self._block_len]
+      if len(s) < self._block_len:
+        s += self._empty_block[len(s):]
+      entry = self._insert(block_number + i, array.array('c', s))
+    self.statistics.readahead += count - 1
+    self._last_miss = block_number + count - 1
+
+    return entry
+
+  def _get_entry(self, block_number):
+    """Return the cache entry for block BLOCK_NUMBER, loading it if needed.
+
+    Make the entry the most recently used one."""
+
+    try:
+      entry = self._cache[block_number]
+    except KeyError:
+      return self._load_block(block_number)
+
+    self.statistics.hits += 1
+    lru = self._lru
+    if lru[1] is not entry:
+      # Unlink the entry and move it to the front of the list:
+      entry[0][1] = entry[1]
+      entry[1][0] = entry[0]
+      first = lru[1]
+      entry[0] = lru
+      entry[1] = first
+      first[0] = lru[1] = entry
+
+    return entry
+
   def flush(self):
     logger.debug('Flushing cache for %s' % (self,))
 
-    pairs = [(i, s) for (i, (dirty, s)) in self._cache.items() if dirty]
-
-    if pairs:
-      pairs.sort()
-      old_i = None
-      f = self.f
-      for (i, s) in pairs:
-        if i == old_i:
-          # No seeking needed
-          pass
-        elif i <= self._limit_written:
-          # Just jump there:
-          f.seek(i * self._record_len)
-        else:
-          # Jump to the end of the file then write _empty_values until
-          # we reach the correct location:
-          f.seek(self._limit_written * self._record_len)
-          while self._limit_written < i:
-            f.write(self.packer.empty_value)
-            self._limit_written += 1
-        f.write(s)
-        old_i = i + 1
-        self._limit_written = max(self._limit_written, old_i)
+    dirty = [
+        (block_number, entry)
+        for (block_number, entry) in self._cache.iteritems()
+        if entry[4]
+        ]
 
-      self.f.flush()
+    if dirty:
+      dirty.sort()
+      for (block_number, entry) in dirty:
+        self._write_block(entry)
 
-    self._cache.clear()
+      self.f.flush()
 
   def _set_packed_record(self, i, s):
     if self.mode == DB_OPEN_READ:
       raise RecordTableAccessError()
     if i < 0:
       raise KeyError()
-    self._cache[i] = (True, s)
-    if len(self._cache) >= self._max_memory_cache:
-      self.flush()
+    (block_number, j) = divmod(i, self._records_per_block)
+    entry = self._get_entry(block_number)
+    j *= self._record_len
+    entry[3][j:j + self._record_len] = array.array('c', s)
+    entry[4] = True
     self._limit = max(self._limit, i + 1)
 
   def _get_packed_record(self, i):
-    try:
-      return self._cache[i][1]
-    except KeyError:
-      if not 0 <= i < self._limit_written:
-        raise KeyError(i)
-      self.f.seek(i * self._record_len)
-      s = self.f.read(self._record_len)
-      self._cache[i] = (False, s)
-      if len(self._cache) >= self._max_memory_cache:
-        self.flush()
-
-      return s
+    if not 0 <= i < self._limit:
+      raise KeyError(i)
+    (block_number, j) = divmod(i, self._records_per_block)
+    j *= self._record_len
+    return self._get_entry(block_number)[3][j:j + self._record_len].tostring()
 
   def close(self):
     self.flush()
     self._cache = None
+    self._lru = None
+    _cache_statistics.add(self.statistics)
     self.f.close()
     self.f = None
 
@@ -397,3 +558,308 @@ class MmapRecordTable(AbstractRecordTable):
     self.python_file.close()
 
 
+class OverlayRecordTable(AbstractRecordTable):
+  """A RecordTable that only stores how it differs from a base table.
+
+  The base table is a plain RecordTable file, which is opened
+  read-only and is never modified.  The overlay's own file starts with
+  OVERLAY_MAGIC and the name of the base file (relative to the
+  directory containing the overlay file), each on a line of its own.
+  It is followed by the delta, as a series of blocks that are appended
+  whenever new records are written to disk.  Each block consists of
+  the number of records in it, their indexes (in increasing order),
+  and the packed records themselves.  A record in a later block
+  overrides one with the same index in an earlier block.
+
+  The records of the delta that have been written to disk are held in
+  two sorted arrays, which are cheap to search and to load.  Newly
+  set records go into a dict; when that has collected COMPACT_LIMIT
+  records, or when the table is flushed, they are appended to the file
+  as a new block and merged into the arrays.
+
+  Once the delta holds more than FOLD_FRACTION of the number of
+  records in the base table, storing the differences doesn't save
+  much any more.  The table is then folded: the base table and the
+  delta are merged into a plain table that replaces the contents of
+  the overlay's own file, and that table is modified directly from
+  then on.  So after it has been closed, the file might turn out to
+  be a plain table rather than an overlay (see is_overlay_file()).
+
+  Creating an overlay on top of another overlay doesn't make a chain:
+  the new overlay starts out with a copy of the other one's delta and
+  uses the same base file.  So the base file must be kept as long as
+  any overlay derived from it is needed."""
+
+  # The first line of an overlay file:
+  OVERLAY_MAGIC = 'cvs2svn record table overlay\n'
+
+  # The number of new records to collect before merging them into the
+  # sorted arrays:
+  COMPACT_LIMIT = 100000
+
+  # The size of the delta, as a fraction of the number of records in
+  # the base table, above which the overlay is folded:
+  FOLD_FRACTION = 0.25
+
+  def __init__(self, filename, mode, packer, base_filename=None,
+               base_class=RecordTable):
+    """Open the overlay table in FILENAME.
+
+    If MODE is DB_OPEN_NEW, the overlay is created on top of the table
+    in BASE_FILENAME, which may itself be a plain table or an overlay;
+    otherwise the base file is read from the overlay file.  The base
+    file is opened read-only using BASE_CLASS, which is also used to
+    open the plain table that results from folding the overlay."""
+
+    AbstractRecordTable.__init__(self, filename, mode, packer)
+    self._base_class = base_class
+
+    # The indexes of the records in the delta, in increasing order:
+    self._indexes = array.array(_INDEX_TYPECODE)
+    # The packed records corresponding to self._indexes:
+    self._records = array.array('c')
+    # New records that have not yet been merged into the arrays: a map
+    # {index : packed_record}:
+    self._changes = {}
+    # True iff the overlay has been folded into a plain table, which
+    # is then self._base:
+    self._folded = False
+
+    if self.mode == DB_OPEN_NEW:
+      if base_filename is None:
+        raise RuntimeError('An overlay table needs a base table')
+      if is_overlay_file(base_filename):
+        base_overlay = OverlayRecordTable(
+            base_filename, DB_OPEN_READ, packer, base_class=base_class
+            )
+        self._base_filename = base_overlay._base_filename
+        indexes = base_overlay._indexes
+        records = base_overlay._records
+        base_overlay.close()
+      else:
+        self._base_filename = base_filename
+        indexes = records = None
+      self.f = open(self.filename, 'wb+')
+      self.f.write(self.OVERLAY_MAGIC)
+      self.f.write('%s\n' % (os.path.basename(self._base_filename),))
+      if indexes:
+        self._write_block(indexes, records)
+        self._indexes = indexes
+        self._records = records
+    elif self.mode == DB_OPEN_WRITE:
+      self.f = open(self.filename, 'rb+')
+      self._read_delta()
+    elif self.mode == DB_OPEN_READ:
+      self.f = open(self.filename, 'rb')
+      self._read_delta()
+    else:
+      raise RuntimeError('Invalid mode %r' % self.mode)
+
+    self._base = base_class(self._base_filename, DB_OPEN_READ, packer)
+
+    # The index just beyond the last record ever written:
+    self._limit = self._base._limit
+    if self._indexes:
+      self._limit = max(self._limit, self._indexes[-1] + 1)
+
+    self._fold_if_large()
+
+  def _read_delta(self):
+    """Read the base file name and the delta from self.f."""
+
+    if self.f.readline() != self.OVERLAY_MAGIC:
+      raise RuntimeError('%r is not an overlay table' % (self.filename,))
+    self._base_filename = os.path.join(
+        os.path.dirname(self.filename), self.f.readline()[:-1]
+        )
+    while True:
+      count = array.array(_INDEX_TYPECODE)
+      try:
+        count.fromfile(self.f, 1)
+      except EOFError:
+        break
+      indexes = array.array(_INDEX_TYPECODE)
+      indexes.fromfile(self.f, count[0])
+      records = array.array('c')
+      records.fromfile(self.f, count[0] * self._record_len)
+      self._merge(indexes, records)
+
+  def _write_block(self, indexes, records):
+    """Append a block holding INDEXES and RECORDS to the delta file."""
+
+    f = self.f
+    f.seek(0, 2)
+    array.array(_INDEX_TYPECODE, [len(indexes)]).tofile(f)
+    indexes.tofile(f)
+    records.tofile(f)
+
+  def _merge(self, new_indexes, new_records):
+    """Merge sorted NEW_INDEXES and NEW_RECORDS into the delta arrays.
+
+    The new records override any old ones with the same index."""
+
+    old_indexes = self._indexes
+    old_records = self._records
+    record_len = self._record_len
+    indexes = array.array(_INDEX_TYPECODE)
+    records = array.array('c')
+
+    j = 0
+    for n in xrange(len(new_indexes)):
+      i = new_indexes[n]
+      k = bisect.bisect_left(old_indexes, i, j)
+      # Copy the unchanged records that come before I:
+      indexes.extend(old_indexes[j:k])
+      records.extend(old_records[j * record_len:k * record_len])
+      if k < len(old_indexes) and old_indexes[k] == i:
+        # The record was changed again; skip its old value:
+        k += 1
+      indexes.append(i)
+      records.extend(new_records[n * record_len:(n + 1) * record_len])
+      j = k
+    indexes.extend(old_indexes[j:])
+    records.extend(old_records[j * record_len:])
+
+    self._indexes = indexes
+    self._records = records
+
+  def _compact(self):
+    """Write self._changes to disk and merge them into the arrays."""
+
+    if not self._changes:
+      return
+
+    changes = self._changes.items()
+    changes.sort()
+    self._changes = {}
+
+    indexes = array.array(_INDEX_TYPECODE)
+    records = array.array('c')
+    for (i, s) in changes:
+      indexes.append(i)
+      records.fromstring(s)
+
+    self._write_block(indexes, records)
+    self._merge(indexes, records)
+    self._fold_if_large()
+
+  def _fold_if_large(self):
+    """Fold the overlay if its delta has grown too large."""
+
+    if self.mode != DB_OPEN_READ \
+       and len(self._indexes) > self.FOLD_FRACTION * self._base._limit:
+      self._fold()
+
+  def _fold(self):
+    """Merge the base table and the delta into a plain table in self.f.
+
+    From then on, the plain table is used as self._base, and records
+    are written to it directly."""
+
+    logger.debug(
+        'Folding %d records of %s into a copy of its base table'
+        % (len(self._indexes), self,)
+        )
+
+    self._base.close()
+    self._base = None
+
+    record_len = self._record_len
+    f = self.f
+    f.seek(0)
+    f.truncate()
+
+    # Copy the base table, then fill the gap up to self._limit:
+    remaining = self._limit * record_len
+    base_file = open(self._base_filename, 'rb')
+    while remaining:
+      s = base_file.read(min(remaining, 1024 * 1024))
+      if not s:
+        break
+      f.write(s)
+      remaining -= len(s)
+    base_file.close()
+    f.write(self.packer.empty_value * (remaining // record_len))
+
+    for k in xrange(len(self._indexes)):
+      f.seek(self._indexes[k] * record_len)
+      f.write(self._records[k * record_len:(k + 1) * record_len].tostring())
+
+    f.close()
+    self.f = None
+
+    self._indexes = array.array(_INDEX_TYPECODE)
+    self._records = array.array('c')
+    self._base_filename = None
+    self._folded = True
+    self._base = self._base_class(self.filename, DB_OPEN_WRITE, self.packer)
+
+  def _set_packed_record(self, i, s):
+    if self.mode == DB_OPEN_READ:
+      raise RecordTableAccessError()
+    if i < 0:
+      raise KeyError()
+    self._limit = max(self._limit, i + 1)
+    if self._folded:
+      self._base._set_packed_record(i, s)
+      return
+    self._changes[i] = s
+    if len(self._changes) >= self.COMPACT_LIMIT:
+      self._compact()
+
+  def _get_packed_record(self, i):
+    try:
+      return self._changes[i]
+    except KeyError:
+      pass
+
+    k = bisect.bisect_left(self._indexes, i)
+    if k < len(self._indexes) and self._indexes[k] == i:
+      return self._records[
+          k * self._record_len:(k + 1) * self._record_len
+          ].tostring()
+    elif 0 <= i < self._base._limit:
+      return self._base._get_packed_record(i)
+    elif 0 <= i < self._limit:
+      return self.packer.empty_value
+    else:
+      raise KeyError(i)
+
+  def flush(self):
+    if self.mode == DB_OPEN_READ:
+      return
+
+    if self._folded:
+      self._base.flush()
+    else:
+      logger.debug('Flushing delta for %s' % (self,))
+      self._compact()
+      if self.f is not None:
+        self.f.flush()
+
+  def close(self):
+    self.flush()
+    self._base.close()
+    self._base = None
+    self._indexes = None
+    self._records = None
+    self._changes = None
+    if self.f is not None:
+      self.f.close()
+      self.f = None
+
+
+def is_overlay_file(filename):
+  """Return True iff FILENAME contains an OverlayRecordTable.
+
+  A plain RecordTable file could only be mistaken for an overlay if
+  its first records happened to spell out OVERLAY_MAGIC."""
+
+  f = open(filename, 'rb')
+  try:
+    magic = OverlayRecordTable.OVERLAY_MAGIC
+    return f.read(len(magic)) == magic
+  finally:
+    f.close()
+
+
@@ -42,9 +42,9 @@ corresponding to a particular (revnum, lod).  This is done by keeping
 an LODHistory instance for each LOD, which can determine the root
 directory node ID for that LOD for any revnum.  It does so by
 recording changes to the root directory node ID only for revisions in
-which it changed.  Thus it stores two arrays, revnums (a list of the
-revision numbers when the ID changed), and ids (a list of the
-corresponding IDs).  To find the ID for a particular revnum, first a
+which it changed.  Thus it stores two arrays of integers, revnums (the
+revision numbers when the ID changed), and ids (the corresponding
+IDs).  To find the ID for a particular revnum, first a
 binary search is done in the revnums array to find the index of the
 last change preceding revnum, then the corresponding ID is read from
 the ids array.  Since most revisions change only one LOD, this allows
@@ -133,9 +133,11 @@ Probably the semantics should be changed.
 
 
 import bisect
+import array
 
 from cvs2svn_lib import config
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.log import logger
 from cvs2svn_lib.context import Ctx
@@ -488,6 +490,14 @@ class _CurrentMirrorWritableSubdirectory(
   pass
 
 
+# The array typecode of a 32-bit unsigned integer, used to store the
+# histories of LODs and the entries of directory nodes:
+if array.array('I').itemsize == 4:
+  _ENTRY_TYPECODE = 'I'
+else:
+  _ENTRY_TYPECODE = 'L'
+
+
 class LODHistory(object):
   """The history of root nodes for a line of development.
 
@@ -498,17 +508,19 @@ class LODHistory(object):
 
     lod -- (LineOfDevelopment) the LOD described by this LODHistory.
 
-    revnums -- (list of int) the revision numbers in which the id
-        changed, in numerical order.
+    revnums -- (array of unsigned int) the revision numbers in which
+        the id changed, in numerical order.
 
-    ids -- (list of (int or None)) the ID of the node describing the
+    ids -- (array of unsigned int) the ID of the node describing the
         root of this LOD starting at the corresponding revision
-        number, or None if the LOD did not exist in that revision.
+        number, or 0 if the LOD did not exist in that revision.  (Node
+        ids start at 1.)
 
   To find the root id for a given revision number, a binary search is
   done within REVNUMS to find the index of the most recent revision at
   the time of REVNUM, then that index is used to read the id out of
-  IDS.
+  IDS.  Storing the history in arrays takes 8 bytes per change,
+  whereas lists of ints take several times as much.
 
   A sentry is written at the zeroth index of both arrays to describe
   the initial situation, namely, that the LOD doesn't exist in
@@ -519,8 +531,8 @@ class LODHistory(object):
   def __init__(self, mirror, lod):
     self._mirror = mirror
     self.lod = lod
-    self.revnums = [0]
-    self.ids = [None]
+    self.revnums = array.array(_ENTRY_TYPECODE, [0])
+    self.ids = array.array(_ENTRY_TYPECODE, [0])
 
   def get_id(self, revnum):
     """Get the ID of the root path for this LOD in REVNUM.
@@ -530,7 +542,11 @@ class LODHistory(object):
     index = bisect.bisect_right(self.revnums, revnum) - 1
     id = self.ids[index]
 
-    if id is None:
+    if index < len(self.ids) - 1:
+      # The root node has changed since REVNUM:
+      self._mirror._superseded_lod_lookups += 1
+
+    if id == 0:
       raise KeyError(revnum)
 
     return id
@@ -542,7 +558,7 @@ class LODHistory(object):
 
     id = self.ids[-1]
 
-    if id is None:
+    if id == 0:
       raise KeyError()
 
     return id
@@ -550,7 +566,7 @@ class LODHistory(object):
   def exists(self):
     """Return True iff LOD exists in the current revision."""
 
-    return self.ids[-1] is not None
+    return self.ids[-1] != 0
 
   def update(self, revnum, id):
     """Indicate that the root node of this LOD changed to ID at REVNUM.
@@ -562,6 +578,9 @@ class LODHistory(object):
     ID can be a node ID, or it can be None to indicate that this LOD
     ceased to exist in REVNUM."""
 
+    if id is None:
+      id = 0
+
     if revnum < self.revnums[-1]:
       raise KeyError(revnum)
     elif revnum == self.revnums[-1]:
@@ -569,11 +588,11 @@ class LODHistory(object):
       # updated during this revision.  Don't allow the replacement
       # None -> None or allow one new id to be replaced with another:
       old_id = self.ids[-1]
-      if old_id is None and id is None:
+      if old_id == 0 and id == 0:
         raise InternalError(
             'ID changed from None -> None for %s, r%d' % (self.lod, revnum,)
             )
-      elif (old_id is not None and id is not None
+      elif (old_id != 0 and id != 0
             and old_id in self._mirror._new_nodes):
         raise InternalError(
             'ID changed from %x -> %x for %s, r%d'
@@ -585,108 +604,196 @@ class LODHistory(object):
       self.ids.append(id)
 
 
+class _GenerationalCache(object):
+  """A size-bounded cache that approximately retains recently-used values.
+
+  The values are kept in two generations, each a dict {key : (value,
+  size)}.  Values that are added, and old values that are looked up,
+  are put into the young generation.  When the total size of the
+  young generation exceeds half of the cache's maximum size, the old
+  generation is discarded and the young generation becomes the old
+  one.  So a value that has been used since the previous turnover is
+  never discarded, the total size of the cache stays bounded, and
+  looking up a young value costs only one dict lookup."""
+
+  def __init__(self, max_size):
+    self._max_young_size = max(max_size // 2, 1)
+    self._young = {}
+    self._young_size = 0
+    self._old = {}
+
+  def get(self, key):
+    """Return the value stored under KEY, or None if it is not cached."""
+
+    try:
+      return self._young[key][0]
+    except KeyError:
+      item = self._old.pop(key, None)
+      if item is None:
+        return None
+      self._add(key, item)
+      return item[0]
+
+  def put(self, key, value, size):
+    """Store VALUE, which has the specified SIZE, under KEY."""
+
+    self._add(key, (value, size))
+
+  def _add(self, key, item):
+    self._young[key] = item
+    self._young_size += item[1]
+    if self._young_size > self._max_young_size:
+      self._old = self._young
+      self._young = {}
+      self._young_size = 0
+
+  def clear(self):
+    self._young.clear()
+    self._young_size = 0
+    self._old.clear()
+
+
 class _NodeDatabase(object):
   """A database storing all of the directory nodes.
 
-  The nodes are written in groups every time write_new_nodes() is
+  The nodes are written in pages every time write_new_nodes() is
   called.  To the database is written a dictionary {node_id :
-  [(cvs_path.id, node_id),...]}, where the keys are the node_ids of
-  the new nodes.  When a node is read, its whole group is read and
-  cached under the assumption that the other nodes in the group are
-  likely to be needed soon.  The cache is retained across revisions
-  and cleared when _cache_max_size is exceeded.
-
-  The dictionaries for nodes that have been read from the database
-  during the current revision are cached by node_id in the _cache
-  member variable.  The corresponding dictionaries are *not* copied
-  when read.  To avoid cross-talk between distinct MirrorDirectory
-  instances that have the same node_id, users of these dictionaries
-  have to copy them before modification."""
-
-  # How many entries should be allowed in the cache for each
-  # CVSDirectory in the repository.  (This number is very roughly the
+  entries}, where the keys are the node_ids of the new nodes.  ENTRIES
+  is the string representation of an array of unsigned 32-bit integers
+  [cvs_path.id, node_id, cvs_path.id, node_id, ...] in which the
+  node_id of a CVSFile is written as 0 (node ids start at 1).  This
+  takes about half of the space of a marshalled list of tuples,
+  and a node's entries are only converted to a dictionary when that
+  node is needed.
+
+  Pages that have been read recently are kept, still encoded, in
+  _page_cache, which is limited to about PAGE_CACHE_MEMORY bytes under
+  the assumption that the other nodes in a page are likely to be
+  needed soon.  The decoded dictionaries {cvs_path : node_id} are kept
+  in _node_cache, which is limited to a number of entries proportional
+  to the number of CVSPaths in the repository.  Both caches drop the
+  values that have been used least recently a generation at a time
+  (see _GenerationalCache), so looking up the nodes of old revisions
+  (e.g., the sources of symbol fills) only displaces the nodes that
+  haven't been used for a while, rather than the whole cache.
+
+  The dictionaries of cached nodes are *not* copied when read.  To
+  avoid cross-talk between distinct MirrorDirectory instances that
+  have the same node_id, users of these dictionaries have to copy them
+  before modification."""
+
+  # How many directory entries should be allowed in the node cache for
+  # each CVSPath in the repository.  (This number is very roughly the
   # number of complete lines of development that can be stored in the
   # cache at one time.)
   CACHE_SIZE_MULTIPLIER = 5
 
-  # But the cache will never be limited to less than this number:
-  MIN_CACHE_LIMIT = 5000
+  # But the node cache will never be limited to less than this number
+  # of entries:
+  MIN_CACHE_LIMIT = 50000
 
-  def __init__(self):
-    self.cvs_path_db = Ctx()._cvs_path_db
-    self.db = IndexedDatabase(
-        artifact_manager.get_temp_file(config.MIRROR_NODES_STORE),
-        artifact_manager.get_temp_file(config.MIRROR_NODES_INDEX_TABLE),
-        DB_OPEN_NEW, serializer=MarshalSerializer(),
-        )
+  # The approximate number of bytes of encoded pages to keep in
+  # memory:
+  PAGE_CACHE_MEMORY = 16 * 1024 * 1024
 
-    # A list of the maximum node_id stored by each call to
-    # write_new_nodes():
-    self._max_node_ids = [0]
+  def __init__(self, checkpoint_state=None):
+    """Create the database.
 
-    # A map {node_id : {cvs_path : node_id}}:
-    self._cache = {}
+    If CHECKPOINT_STATE is specified, it is a value returned by
+    get_checkpoint_state(); reopen the database as it was then."""
 
-    # The number of directories in the repository:
-    num_dirs = len([
-        cvs_path
-        for cvs_path in self.cvs_path_db.itervalues()
-        if isinstance(cvs_path, CVSDirectory)
-        ])
+    self.cvs_path_db = Ctx()._cvs_path_db
+    if checkpoint_state is None:
+      self.db = IndexedDatabase(
+          artifact_manager.get_temp_file(config.MIRROR_NODES_STORE),
+          artifact_manager.get_temp_file(config.MIRROR_NODES_INDEX_TABLE),
+          DB_OPEN_NEW, serializer=MarshalSerializer(),
+          )
 
-    self._cache_max_size = max(
-        int(self.CACHE_SIZE_MULTIPLIER * num_dirs),
-        self.MIN_CACHE_LIMIT,
-        )
+      # A list of the maximum node_id stored by each call to
+      # write_new_nodes():
+      self._max_node_ids = [0]
+    else:
+      (self._max_node_ids, db_checkpoint) = checkpoint_state
+      self.db = IndexedDatabase(
+          artifact_manager.get_temp_file(config.MIRROR_NODES_STORE),
+          artifact_manager.get_temp_file(config.MIRROR_NODES_INDEX_TABLE),
+          DB_OPEN_WRITE, checkpoint=db_checkpoint,
+          )
 
-  def _load(self, items):
-    retval = {}
-    for (id, value) in items:
-      retval[self.cvs_path_db.get_path(id)] = value
-    return retval
+    # The number of CVSPaths in the repository:
+    num_paths = len(list(self.cvs_path_db.itervalues()))
+
+    # A cache {node_id : {cvs_path : node_id}}, with sizes measured in
+    # entries:
+    self._node_cache = _GenerationalCache(max(
+        int(self.CACHE_SIZE_MULTIPLIER * num_paths),
+        self.MIN_CACHE_LIMIT,
+        ))
+
+    # A cache {index : {node_id : entries}}, with sizes measured in
+    # bytes:
+    self._page_cache = _GenerationalCache(self.PAGE_CACHE_MEMORY)
+
+    # The number of pages that had to be read from the database:
+    self._pages_read = 0
+
+  def _load(self, entries):
+    ids = array.array(_ENTRY_TYPECODE)
+    ids.fromstring(entries)
+    get_path = self.cvs_path_db.get_path
+    return dict([
+        (get_path(ids[i]), ids[i + 1] or None)
+        for i in xrange(0, len(ids), 2)
+        ])
 
   def _dump(self, node):
-    return [
-        (cvs_path.id, value)
-        for (cvs_path, value) in node.iteritems()
-        ]
+    ids = array.array(_ENTRY_TYPECODE)
+    for (cvs_path, value) in node.iteritems():
+      ids.append(cvs_path.id)
+      ids.append(value or 0)
+    return ids.tostring()
 
   def _determine_index(self, id):
-    """Return the index of the record holding the node with ID."""
+    """Return the index of the page holding the node with ID."""
 
     return bisect.bisect_left(self._max_node_ids, id)
 
+  def _get_page(self, index):
+    page = self._page_cache.get(index)
+    if page is None:
+      page = self.db[index]
+      self._pages_read += 1
+      self._page_cache.put(
+          index, page, sum([len(entries) for entries in page.itervalues()])
+          )
+    return page
+
   def __getitem__(self, id):
-    try:
-      items = self._cache[id]
-    except KeyError:
-      index = self._determine_index(id)
-      for (node_id, items) in self.db[index].items():
-        self._cache[node_id] = self._load(items)
-      items = self._cache[id]
+    node = self._node_cache.get(id)
+    if node is None:
+      node = self._load(self._get_page(self._determine_index(id))[id])
+      self._node_cache.put(id, node, len(node) + 1)
 
-    return items
+    return node
 
   def write_new_nodes(self, nodes):
     """Write NODES to the database.
 
     NODES is an iterable of writable CurrentMirrorDirectory instances."""
 
-    if len(self._cache) > self._cache_max_size:
-      # The size of the cache has exceeded the threshold.  Discard the
-      # old cache values (but still store the new nodes into the
-      # cache):
-      logger.debug('Clearing node cache')
-      self._cache.clear()
-
-    data = {}
+    page = {}
+    size = 0
     max_node_id = 0
     for node in nodes:
       max_node_id = max(max_node_id, node.id)
-      data[node.id] = self._dump(node._entries)
-      self._cache[node.id] = node._entries
+      page[node.id] = entries = self._dump(node._entries)
+      size += len(entries)
+      self._node_cache.put(node.id, node._entries, len(node._entries) + 1)
 
-    self.db[len(self._max_node_ids)] = data
+    index = len(self._max_node_ids)
+    self.db[index] = page
+    self._page_cache.put(index, page, size)
 
     if max_node_id == 0:
       # Rewrite last value:
@@ -694,8 +801,18 @@ class _NodeDatabase(object):
     else:
       self._max_node_ids.append(max_node_id)
 
+  def get_checkpoint_state(self):
+    """Write the database to disk and return a picklable description of it."""
+
+    return (self._max_node_ids, self.db.checkpoint(),)
+
   def close(self):
-    self._cache.clear()
+    logger.debug(
+        'Read %d of %d mirror node pages from disk'
+        % (self._pages_read, len(self._max_node_ids) - 1,)
+        )
+    self._node_cache.clear()
+    self._page_cache.clear()
     self.db.close()
     self.db = None
 
@@ -711,7 +828,8 @@ class RepositoryMirror:
   stored in self._lod_histories.  An LODHistory keeps track of each
   revnum in which files were added to or deleted from that LOD, as
   well as the node id of the root of the node tree describing the LOD
-  contents at that revision.
+  contents at that revision.  The number of lookups of LOD roots in
+  old revisions is logged when the mirror is closed.
 
   The LOD trees themselves are stored in the _node_db database, which
   maps node ids to nodes.  A node is a map from CVSPath to ids of the
@@ -735,8 +853,11 @@ class RepositoryMirror:
         config.MIRROR_NODES_STORE, which_pass
         )
 
-  def open(self):
-    """Set up the RepositoryMirror and prepare it for commits."""
+  def open(self, checkpoint_state=None):
+    """Set up the RepositoryMirror and prepare it for commits.
+
+    If CHECKPOINT_STATE is specified, it is a value returned by
+    get_checkpoint_state(); continue from the state at that time."""
 
     self._key_generator = KeyGenerator()
 
@@ -744,6 +865,23 @@ class RepositoryMirror:
     # been referenced so far:
     self._lod_histories = {}
 
+    # The number of times that the root node of an LOD was looked up
+    # for an old revision, and the number of those lookups for which
+    # the root node has changed since then:
+    self._old_lod_lookups = 0
+    self._superseded_lod_lookups = 0
+
+    if checkpoint_state is not None:
+      (self._key_generator, self._youngest, lod_histories, node_db_state) = \
+          checkpoint_state
+      for (lod_id, revnums, ids) in lod_histories:
+        lod_history = LODHistory(self, Ctx()._symbol_db.get_symbol(lod_id))
+        lod_history.revnums = revnums
+        lod_history.ids = ids
+        self._lod_histories[lod_history.lod] = lod_history
+      self._node_db = _NodeDatabase(node_db_state)
+      return
+
     # This corresponds to the 'nodes' table in a Subversion fs.  (We
     # don't need a 'representations' or 'strings' table because we
     # only track file existence, not file contents.)
@@ -752,6 +890,22 @@ class RepositoryMirror:
     # Start at revision 0 without a root node.
     self._youngest = 0
 
+  def get_checkpoint_state(self):
+    """Return the state of the mirror, as a picklable object.
+
+    This may only be called between commits.  The node database is
+    written to disk."""
+
+    return (
+        self._key_generator,
+        self._youngest,
+        [
+            (lod.id, lod_history.revnums, lod_history.ids)
+            for (lod, lod_history) in self._lod_histories.iteritems()
+            ],
+        self._node_db.get_checkpoint_state(),
+        )
+
   def start_commit(self, revnum):
     """Start a new commit."""
 
@@ -794,6 +948,7 @@ class RepositoryMirror:
     Return an instance of MirrorDirectory if the path exists;
     otherwise, raise KeyError."""
 
+    self._old_lod_lookups += 1
     lod_history = self._get_lod_history(lod)
     id = lod_history.get_id(revnum)
     return OldMirrorDirectory(self, id, self._node_db[id])
@@ -890,6 +1045,18 @@ class RepositoryMirror:
   def close(self):
     """Free resources and close databases."""
 
+    logger.debug(
+        'Looked up LOD roots in old revisions %d times (%d times superseded); '
+        '%d LOD histories hold %d changes'
+        % (
+            self._old_lod_lookups, self._superseded_lod_lookups,
+            len(self._lod_histories),
+            sum([
+                len(lod_history.revnums) - 1
+                for lod_history in self._lod_histories.itervalues()
+                ]),
+            )
+        )
     self._lod_histories = None
     self._node_db.close()
     self._node_db = None
@@ -0,0 +1,268 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Measure the resources used by the passes of a conversion.
+
+If --profile-resources is specified, a ResourceMonitor measures each
+pass: its CPU time (including that of its worker processes), its peak
+resident set size, the I/O done by the main process, and the sizes of
+the temporary files that it created or used (except for the statistics
+file that it creates, which is written after the pass is measured).
+The measurements are kept by the StatsKeeper and written as JSON to
+config.RESOURCE_USAGE_FILE in the temporary directory after each
+pass.
+
+Some of the measurements depend on the platform.  The peak RSS of a
+single pass can only be measured on Linux, where the kernel allows
+the peak to be reset; elsewhere the peak of the whole process so far
+is reported.  The I/O counters are read from /proc/self/io and are
+only available on Linux.  Values that cannot be measured are null."""
+
+
+import sys
+import os
+import time
+
+try:
+  import resource
+except ImportError:
+  # The resource module is not available on Windows:
+  resource = None
+
+try:
+  import json
+except ImportError:
+  # json was only added in Python 2.6:
+  json = None
+
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.context import Ctx
+
+
+def _read_proc_file(filename):
+  """Return a map { key : value } for the 'key: value' lines in FILENAME.
+
+  Return None if the file cannot be read."""
+
+  try:
+    f = open(filename)
+  except IOError:
+    return None
+
+  try:
+    retval = {}
+    for line in f:
+      (key, value) = line.split(':', 1)
+      retval[key.strip()] = value.strip()
+    return retval
+  finally:
+    f.close()
+
+
+def _get_io_counters():
+  """Return a map of this process's I/O counters, or None."""
+
+  counters = _read_proc_file('/proc/self/io')
+  if counters is None:
+    return None
+
+  return {
+      'read_chars' : int(counters['rchar']),
+      'written_chars' : int(counters['wchar']),
+      'read_bytes' : int(counters['read_bytes']),
+      'written_bytes' : int(counters['write_bytes']),
+      }
+
+
+def _reset_peak_rss():
+  """Reset the peak RSS of this process.  Return True iff it worked."""
+
+  # Writing '5' to clear_refs resets VmHWM (Linux 4.0 and later):
+  try:
+    f = open('/proc/self/clear_refs', 'w')
+    try:
+      f.write('5')
+    finally:
+      f.close()
+  except (IOError, OSError):
+    return False
+
+  return True
+
+
+def _get_peak_rss_since_reset():
+  """Return the peak RSS of this process since _reset_peak_rss(), or None."""
+
+  status = _read_proc_file('/proc/self/status')
+  if status is None or 'VmHWM' not in status:
+    return None
+
+  # The value is given like '1234 kB':
+  return int(status['VmHWM'].split()[0]) * 1024
+
+
+def _maxrss_to_bytes(maxrss):
+  """Convert a ru_maxrss value to bytes."""
+
+  if sys.platform == 'darwin':
+    # Mac OS X reports bytes...
+    return maxrss
+  else:
+    # ...but Linux and the BSDs report kilobytes:
+    return maxrss * 1024
+
+
+def _get_file_size(filename):
+  try:
+    return os.path.getsize(filename)
+  except OSError:
+    return None
+
+
+def _get_directory_size(path):
+  """Return the total size of the files within directory PATH."""
+
+  total = 0
+  for (dirpath, dirnames, filenames) in os.walk(path):
+    for filename in filenames:
+      total += _get_file_size(os.path.join(dirpath, filename)) or 0
+  return total
+
+
+class ResourceMonitor(object):
+  """Measure the resources used by one pass.
+
+  Call start() before the pass is run and stop() afterwards."""
+
+  def __init__(self, artifacts):
+    """Prepare to measure a pass that uses ARTIFACTS.
+
+    ARTIFACTS is a list of (artifact, created) pairs, where created is
+    True for the artifacts that are created by the pass.  The sizes of
+    the artifacts that are temporary files are recorded.  Raise
+    FatalError if this Python cannot write the results."""
+
+    if json is None:
+      raise FatalError(
+          'Profiling the resource usage requires the Python json module\n'
+          '(Python 2.6 or later).'
+          )
+
+    self._artifacts = [
+        (artifact, created)
+        for (artifact, created) in artifacts
+        if hasattr(artifact, 'basename')
+        ]
+    self._artifacts.sort(key=lambda pair: pair[0].basename)
+
+  def start(self):
+    self._start_time = time.time()
+    if resource is not None:
+      self._start_rusage = resource.getrusage(resource.RUSAGE_SELF)
+      self._start_children_rusage = resource.getrusage(
+          resource.RUSAGE_CHILDREN
+          )
+    self._start_io = _get_io_counters()
+    self._peak_rss_reset = _reset_peak_rss()
+    self._start_sizes = [
+        _get_file_size(artifact.filename)
+        for (artifact, created) in self._artifacts
+        ]
+
+  def stop(self):
+    """Return a map describing the resources used since start().
+
+    The map can be converted to JSON."""
+
+    usage = {}
+    usage['wall_time'] = time.time() - self._start_time
+
+    if resource is None:
+      usage['cpu_time'] = None
+      peak_rss = None
+    else:
+      rusage = resource.getrusage(resource.RUSAGE_SELF)
+      children_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+      usage['cpu_time'] = {
+          'user' : rusage.ru_utime - self._start_rusage.ru_utime,
+          'system' : rusage.ru_stime - self._start_rusage.ru_stime,
+          'children_user' : (
+              children_rusage.ru_utime
+              - self._start_children_rusage.ru_utime
+              ),
+          'children_system' : (
+              children_rusage.ru_stime
+              - self._start_children_rusage.ru_stime
+              ),
+          }
+      peak_rss = _maxrss_to_bytes(rusage.ru_maxrss)
+
+    if self._peak_rss_reset:
+      pass_peak_rss = _get_peak_rss_since_reset()
+      if pass_peak_rss is not None:
+        peak_rss = pass_peak_rss
+    else:
+      pass_peak_rss = None
+    usage['peak_rss'] = peak_rss
+    if pass_peak_rss is not None:
+      usage['peak_rss_scope'] = 'pass'
+    elif peak_rss is not None:
+      usage['peak_rss_scope'] = 'process'
+    else:
+      usage['peak_rss_scope'] = None
+
+    io = _get_io_counters()
+    if io is None or self._start_io is None:
+      usage['io'] = None
+    else:
+      usage['io'] = dict(
+          (key, io[key] - self._start_io[key])
+          for key in io
+          )
+
+    usage['artifacts'] = [
+        {
+            'name' : artifact.basename,
+            'created' : created,
+            'size_before' : size_before,
+            'size_after' : _get_file_size(artifact.filename),
+            }
+        for ((artifact, created), size_before)
+        in zip(self._artifacts, self._start_sizes)
+        ]
+    usage['tmpdir_size'] = _get_directory_size(Ctx().tmpdir)
+
+    return usage
+
+
+def write_resource_usage(filename, passes):
+  """Write the resource usage of PASSES to FILENAME as JSON.
+
+  PASSES is a list of (pass_num, pass_name, usage) tuples, where usage
+  is a map returned by ResourceMonitor.stop()."""
+
+  records = []
+  for (pass_num, pass_name, usage) in passes:
+    record = {'pass' : pass_num, 'name' : pass_name}
+    record.update(usage)
+    records.append(record)
+
+  f = open(filename, 'w')
+  try:
+    json.dump({'passes' : records}, f, indent=2, sort_keys=True)
+    f.write('\n')
+  finally:
+    f.close()
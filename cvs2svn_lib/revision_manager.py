@@ -80,6 +80,12 @@ class NullRevisionCollector(RevisionCollector):
 class RevisionReader(object):
   """An object that can read the contents of CVSRevisions."""
 
+  # The number of revisions whose contents should be announced via
+  # prefetch() before they are requested, or 0 if the reader does not
+  # benefit from prefetching.  This value is only meaningful after
+  # start() has been called.
+  prefetch_window = 0
+
   def register_artifacts(self, which_pass):
     """Register artifacts that will be needed during branch exclusion.
 
@@ -133,6 +139,37 @@ class RevisionReader(object):
 
     raise NotImplementedError()
 
+  def prefetch(self, cvs_revs):
+    """Announce that the contents of CVS_REVS will be requested soon.
+
+    CVS_REVS is a list of CVSRevisions, in the order in which
+    get_content() will be called for them.  A reader may use this
+    information to start computing the contents in the background.
+    Every revision announced this way must later be requested, after
+    any revisions announced before it."""
+
+    pass
+
+  def get_checkpoint_state(self):
+    """Return the state of this reader, as a picklable object.
+
+    This method is called between commits while OutputPass saves a
+    checkpoint.  The return value can later be passed to resume() to
+    continue reading from this point.  Return None if the reader
+    cannot be continued (which is the default)."""
+
+    return None
+
+  def resume(self, checkpoint_state):
+    """Prepare for calls to get_content(), continuing from a checkpoint.
+
+    This is called instead of start() when an interrupted OutputPass
+    is continued.  CHECKPOINT_STATE is a value that was returned by
+    get_checkpoint_state().  Raise CheckpointError if the reader
+    cannot be continued from that state."""
+
+    raise NotImplementedError()
+
   def finish(self):
     """Inform the reader that all calls to get_content() are done.
 
@@ -40,6 +40,8 @@ from cvs2svn_lib.rcs_revision_manager import RCSRevisionReader
 from cvs2svn_lib.cvs_revision_manager import CVSRevisionReader
 from cvs2svn_lib.checkout_internal import InternalRevisionCollector
 from cvs2svn_lib.checkout_internal import InternalRevisionReader
+from cvs2svn_lib.database import check_backend
+from cvs2svn_lib.changeset_graph import check_graph_backend
 from cvs2svn_lib.symbol_strategy import AllBranchRule
 from cvs2svn_lib.symbol_strategy import AllExcludedRule
 from cvs2svn_lib.symbol_strategy import AllTagRule
@@ -215,7 +217,9 @@ class RunOptions(object):
     self.pass_manager = pass_manager
     self.start_pass = 1
     self.end_pass = self.pass_manager.num_passes
+    self.resume = False
     self.profiling = False
+    self.profile_resources = False
 
     self.projects = []
 
@@ -291,8 +295,10 @@ class RunOptions(object):
             '\\fB--options\\fR: \\fB-h\\fR/\\fB--help\\fR, '
             '\\fB--help-passes\\fR, \\fB--version\\fR, '
             '\\fB-v\\fR/\\fB--verbose\\fR, \\fB-q\\fR/\\fB--quiet\\fR, '
-            '\\fB-p\\fR/\\fB--pass\\fR/\\fB--passes\\fR, \\fB--dry-run\\fR, '
-            '\\fB--profile\\fR, \\fB--trunk-only\\fR, \\fB--encoding\\fR, '
+            '\\fB-p\\fR/\\fB--pass\\fR/\\fB--passes\\fR, \\fB--resume\\fR, '
+            '\\fB--dry-run\\fR, '
+            '\\fB--profile\\fR, \\fB--profile-resources\\fR, '
+            '\\fB--trunk-only\\fR, \\fB--encoding\\fR, '
             'and \\fB--fallback-encoding\\fR. '
             'Options are processed in the order specified on the command '
             'line.'
@@ -714,6 +720,79 @@ class RunOptions(object):
             ) % (tempfile.gettempdir(),),
         metavar='PATH',
         ))
+    group.add_option(ContextOption(
+        '--jobs', '-j', type='int',
+        action='store',
+        help=(
+            'use up to N worker processes for the parts of the '
+            'conversion that can be run in parallel (default 1)'
+            ),
+        man_help=(
+            'Use up to \\fIn\\fR worker processes for the parts of the '
+            'conversion that can be run in parallel, such as parsing the '
+            'RCS files in CollectRevsPass, sorting the temporary data '
+            'files, splitting up the preliminary changesets, building the '
+            'changeset dependency graphs, choosing the sources of '
+            'symbol fills, and '
+            'reconstructing file contents in OutputPass.  '
+            'The output of the conversion '
+            'does not depend on this option.  The default is 1 (do all of '
+            'the work in the main process).'
+            ),
+        metavar='N',
+        ))
+    group.add_option(IncompatibleOption(
+        '--sort-memory', type='string',
+        action='callback', callback=self.callback_sort_memory,
+        help=(
+            'use about SIZE bytes of memory (e.g., "512M" or "2G") for '
+            'sorting temporary files'
+            ),
+        man_help=(
+            'Use about \\fIsize\\fR bytes of memory, summed over all '
+            'jobs, for sorting the temporary data files.  \\fIsize\\fR '
+            'can have a suffix \\fBK\\fR, \\fBM\\fR, or \\fBG\\fR.  '
+            'Larger values make the sorting passes faster.  The default '
+            'is 128M.'
+            ),
+        metavar='SIZE',
+        ))
+    group.add_option(ContextOption(
+        '--db-backend', type='choice',
+        choices=['logstore', 'anydbm'],
+        action='store',
+        help=(
+            'store temporary key-value databases using BACKEND, which is '
+            '"logstore" (default) or "anydbm"'
+            ),
+        man_help=(
+            'Use \\fIbackend\\fR to store the temporary key-value '
+            'databases (such as the checkout database used by '
+            '\\fB--use-internal-co\\fR).  \\fIbackend\\fR must be '
+            '\'logstore\' (a log-structured store built into cvs2svn) or '
+            '\'anydbm\' (whatever DBM module Python\'s anydbm module '
+            'chooses).  The default is \'logstore\'.'
+            ),
+        metavar='BACKEND',
+        ))
+    group.add_option(ContextOption(
+        '--changeset-graph', type='choice',
+        choices=['dict', 'compact'],
+        action='store', dest='changeset_graph_backend',
+        help=(
+            'store the changeset dependency graph using BACKEND, which is '
+            '"dict" (default) or "compact"'
+            ),
+        man_help=(
+            'Use \\fIbackend\\fR to store the changeset dependency graph '
+            'in the passes that sort the changesets and break cycles '
+            'among them.  \\fIbackend\\fR must be \'dict\' (a Python '
+            'object for each changeset) or \'compact\' (arrays of '
+            'integers, which need far less memory for large '
+            'repositories).  The default is \'dict\'.'
+            ),
+        metavar='BACKEND',
+        ))
     self.parser.set_default('co_executable', config.CO_EXECUTABLE)
     group.add_option(IncompatibleOption(
         '--co', type='string',
@@ -771,6 +850,45 @@ class RunOptions(object):
             ),
         metavar='[START]:[END]',
         ))
+    group.add_option(ManOption(
+        '--resume',
+        action='callback', callback=self.callback_resume,
+        help=(
+            'resume an interrupted conversion, skipping the passes that '
+            'were completed'
+            ),
+        man_help=(
+            'Resume a conversion that was interrupted.  The passes that '
+            'were completed are skipped, and CollectRevsPass and '
+            'OutputPass continue from the last checkpoint that they '
+            'saved, if any.  The conversion must be restarted with the '
+            'same options, and the temporary directory (see '
+            '\\fB--tmpdir\\fR) must contain the files that were '
+            'generated by the interrupted conversion.'
+            ),
+        ))
+
+    # Options for testing --resume.  Save checkpoints every N files or
+    # commits, and stop a pass with an error when it has saved N
+    # checkpoints and is about to save another one:
+    group.add_option(ContextOption(
+        '--collect-checkpoint-interval', type='int',
+        action='store', compatible_with_option=True,
+        help=optparse.SUPPRESS_HELP,
+        man_help=optparse.SUPPRESS_HELP,
+        ))
+    group.add_option(ContextOption(
+        '--output-checkpoint-interval', type='int',
+        action='store', compatible_with_option=True,
+        help=optparse.SUPPRESS_HELP,
+        man_help=optparse.SUPPRESS_HELP,
+        ))
+    group.add_option(ContextOption(
+        '--interrupt-after-checkpoint', type='int',
+        action='store', compatible_with_option=True,
+        help=optparse.SUPPRESS_HELP,
+        man_help=optparse.SUPPRESS_HELP,
+        ))
 
     return group
 
@@ -853,6 +971,22 @@ class RunOptions(object):
             'Profile with \'' + prof + '\' (into file \\fIcvs2svn.' + prof + '\\fR).'
             ),
         ))
+    group.add_option(ManOption(
+        '--profile-resources',
+        action='callback', callback=self.callback_profile_resources,
+        help=(
+            'record the CPU time, memory, I/O and temporary file sizes of '
+            'each pass (into file %s in the temporary directory)'
+            % (config.RESOURCE_USAGE_FILE,)
+            ),
+        man_help=(
+            'Record the CPU time, peak memory usage, I/O and temporary '
+            'file sizes of each pass, and write them as JSON to the file '
+            '\\fI%s\\fR in the temporary directory (see '
+            '\\fB--tmpdir\\fR).'
+            % (config.RESOURCE_USAGE_FILE,)
+            ),
+        ))
 
     return group
 
@@ -936,9 +1070,28 @@ class RunOptions(object):
           self.start_pass = \
           self.pass_manager.get_pass_number(value)
 
+  def callback_resume(self, option, opt_str, value, parser):
+    self.resume = True
+
   def callback_profile(self, option, opt_str, value, parser):
     self.profiling = True
 
+  def callback_profile_resources(self, option, opt_str, value, parser):
+    self.profile_resources = True
+
+  _size_re = re.compile(r'^\s*(\d+)\s*([kmg]?)b?\s*$', re.IGNORECASE)
+
+  def callback_sort_memory(self, option, opt_str, value, parser):
+    m = self._size_re.match(value)
+    if not m:
+      raise FatalError(
+          'The value of %s must be a number of bytes, optionally with a '
+          'suffix K, M, or G (not %r).' % (opt_str, value,)
+          )
+    Ctx().sort_memory = int(m.group(1)) * {
+        '' : 1, 'k' : 1024, 'm' : 1024 ** 2, 'g' : 1024 ** 3,
+        }[m.group(2).lower()]
+
   def callback_symbol_hints(self, option, opt_str, value, parser):
     parser.values.symbol_strategy_rules.append(SymbolHintsFileRule(value))
 
@@ -1100,6 +1253,15 @@ class RunOptions(object):
     if not self.projects:
       raise FatalError('No project specified.')
 
+    if ctx.jobs < 1:
+      raise FatalError('The number of jobs must be at least 1.')
+
+    if ctx.sort_memory is not None and ctx.sort_memory <= 0:
+      raise FatalError('The sort memory must be positive.')
+
+    check_backend(ctx.db_backend)
+    check_graph_backend(ctx.changeset_graph_backend)
+
   def verify_option_compatibility(self):
     """Verify that no options incompatible with --options were used.
 
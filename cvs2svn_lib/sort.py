@@ -16,8 +16,10 @@
 
 """Functions to sort large files.
 
-The functions in this module were originally downloaded from the
-following URL:
+The files can either consist of lines (which are sorted as strings,
+or by a key function), or of fixed-width binary records (which are
+sorted as strings).  The functions in this module were originally
+downloaded from the following URL:
 
     http://code.activestate.com/recipes/466302/
 
@@ -33,6 +35,10 @@ import shutil
 import heapq
 import itertools
 import tempfile
+import cStringIO
+import mmap
+
+from cvs2svn_lib.worker_pool import create_worker_pool
 
 
 # The buffer size to use for open files:
@@ -95,12 +101,27 @@ def merge(iterables, key=None):
       heapq.heappush(values, (key(value), index, value, iterator))
 
 
-def merge_files_onepass(input_filenames, output_filename, key=None):
+def read_records(f, record_size=None):
+  """Iterate over the records in file F.
+
+  If RECORD_SIZE is None, the records are lines.  Otherwise they are
+  strings of RECORD_SIZE bytes."""
+
+  if record_size is None:
+    return iter(f)
+  else:
+    return iter(lambda: f.read(record_size), '')
+
+
+def merge_files_onepass(
+    input_filenames, output_filename, key=None, record_size=None,
+    ):
   """Merge a number of input files into one output file.
 
   This is a merge in the sense of mergesort; namely, it is assumed
   that the input files are each sorted, and (under that assumption)
-  the output file will also be sorted."""
+  the output file will also be sorted.  RECORD_SIZE has the same
+  meaning as for read_records()."""
 
   input_filenames = list(input_filenames)
   if len(input_filenames) == 1:
@@ -112,7 +133,12 @@ def merge_files_onepass(input_filenames, output_filename, key=None):
       try:
         for input_filename in input_filenames:
           chunks.append(open(input_filename, 'rb', BUFSIZE))
-        output_file.writelines(merge(chunks, key))
+        output_file.writelines(
+            merge(
+                [read_records(chunk, record_size) for chunk in chunks],
+                key,
+                )
+            )
       finally:
         for chunk in chunks:
           try:
@@ -154,24 +180,35 @@ def tempfile_generator(tempdirs=[]):
 
 
 def _merge_file_generation(
-    input_filenames, delete_inputs, key=None,
-    max_merge=DEFAULT_MAX_MERGE, tempfiles=None,
+    input_filenames, deletable, key=None,
+    max_merge=DEFAULT_MAX_MERGE, tempfiles=None, worker_pool=None,
+    record_size=None,
     ):
   """Merge multiple input files into fewer output files.
 
   This is a merge in the sense of mergesort; namely, it is assumed
   that the input files are each sorted, and (under that assumption)
-  the output file will also be sorted.  At most MAX_MERGE input files
+  the output files will also be sorted.  At most MAX_MERGE input files
   will be merged at once, to avoid exceeding operating system
   restrictions on the number of files that can be open at one time.
 
-  If DELETE_INPUTS is True, then the input files will be deleted when
-  they are no longer needed.
+  Only as many groups of files are merged as are needed to reduce the
+  number of files to MAX_MERGE (or as close to it as one generation
+  allows); the remaining files are passed through untouched, so that
+  they don't have to be read and written an extra time.  The output
+  of each group takes the place of the group in the list of files, so
+  the relative order of the inputs is preserved.
+
+  DELETABLE is a set containing the names of the files that may be
+  deleted when they are no longer needed.  The names of the new
+  output files are added to it.
 
   If temporary files need to be used, they will be created using the
-  specified TEMPFILES tempfile generator.
+  specified TEMPFILES tempfile generator.  If WORKER_POOL is
+  specified, the groups are merged concurrently in its worker
+  processes.  RECORD_SIZE has the same meaning as for read_records().
 
-  Generate the names of the output files."""
+  Return the list of the names of the output files."""
 
   if max_merge <= 1:
     raise ValueError('max_merge must be greater than one')
@@ -183,19 +220,49 @@ def _merge_file_generation(
   if len(filenames) <= 1:
     raise ValueError('It makes no sense to merge a single file')
 
-  while filenames:
-    group = filenames[:max_merge]
-    del filenames[:max_merge]
-    group_output = tempfiles.next()
-    merge_files_onepass(group, group_output, key=key)
-    if delete_inputs:
-      _try_delete_files(group)
-    yield group_output
+  # Each group that is merged reduces the number of files by
+  # (max_merge - 1):
+  group_count = -(-(len(filenames) - max_merge) // (max_merge - 1))
+  merge_count = min(len(filenames), group_count * max_merge)
+  groups = [
+      filenames[i:i + max_merge]
+      for i in range(0, merge_count, max_merge)
+      ]
+  rest = filenames[merge_count:]
+  if len(groups[-1]) == 1:
+    # There is no point merging a single file:
+    rest = groups.pop() + rest
+
+  outputs = [tempfiles.next() for group in groups]
+
+  if worker_pool is None:
+    for (group, group_output) in zip(groups, outputs):
+      merge_files_onepass(
+          group, group_output, key=key, record_size=record_size
+          )
+  else:
+    results = [
+        worker_pool.apply_async(
+            merge_files_onepass, group, group_output, key, record_size
+            )
+        for (group, group_output) in zip(groups, outputs)
+        ]
+    for result in results:
+      result.get()
+
+  for group in groups:
+    _try_delete_files([
+        filename for filename in group if filename in deletable
+        ])
+  deletable.update(outputs)
+
+  return outputs + rest
 
 
 def merge_files(
     input_filenames, output_filename, key=None, delete_inputs=False,
-    max_merge=DEFAULT_MAX_MERGE, tempfiles=None,
+    max_merge=DEFAULT_MAX_MERGE, tempfiles=None, worker_pool=None,
+    record_size=None,
     ):
   """Merge a number of input files into one output file.
 
@@ -209,7 +276,9 @@ def merge_files(
   they are no longer needed.
 
   If temporary files need to be used, they will be created using the
-  specified TEMPFILES tempfile generator."""
+  specified TEMPFILES tempfile generator.  If WORKER_POOL is
+  specified, intermediate merges are done in its worker processes.
+  RECORD_SIZE has the same meaning as for read_records()."""
 
   filenames = list(input_filenames)
   if not filenames:
@@ -218,58 +287,169 @@ def merge_files(
   else:
     if tempfiles is None:
       tempfiles = tempfile_generator()
+    if delete_inputs:
+      deletable = set(filenames)
+    else:
+      deletable = set()
     while len(filenames) > max_merge:
       # Reduce the number of files by performing groupwise merges:
-      filenames = list(
-          _merge_file_generation(
-              filenames, delete_inputs, key=key,
-              max_merge=max_merge, tempfiles=tempfiles
-              )
+      filenames = _merge_file_generation(
+          filenames, deletable, key=key,
+          max_merge=max_merge, tempfiles=tempfiles,
+          worker_pool=worker_pool, record_size=record_size,
           )
-      # After the first iteration, we are only working with temporary
-      # files so they can definitely be deleted them when we are done
-      # with them:
-      delete_inputs = True
 
     # The last merge writes the results directly into the output
     # file:
-    merge_files_onepass(filenames, output_filename, key=key)
-    if delete_inputs:
-      _try_delete_files(filenames)
+    merge_files_onepass(
+        filenames, output_filename, key=key, record_size=record_size
+        )
+    _try_delete_files([
+        filename for filename in filenames if filename in deletable
+        ])
+
+
+# The default number of bytes of memory that sort_file() may use for
+# holding chunks of its input in memory:
+DEFAULT_MEMORY_LIMIT = 128 * 1024 * 1024
+
+# A rough estimate of how many bytes of memory are needed per byte of
+# input to hold a chunk of lines in memory while it is being sorted
+# (the chunk is read as a single string, split into a list of line
+# strings, then sorted, possibly with a key per line):
+MEMORY_OVERHEAD = 4
+
+# The smallest chunk that is worth sorting on its own, in bytes:
+MIN_CHUNK_SIZE = 64 * 1024
+
+
+def _find_chunks(filename, chunk_size, record_size=None):
+  """Split FILENAME into chunks of about CHUNK_SIZE bytes.
+
+  Each chunk consists of whole records (see read_records()).
+  Generate (start, end) tuples giving the byte offsets of each chunk
+  within the file."""
+
+  size = os.path.getsize(filename)
+  if record_size is not None:
+    if size % record_size:
+      raise ValueError(
+          'Size of %r is not a multiple of %d' % (filename, record_size,)
+          )
+    chunk_size = max(chunk_size - chunk_size % record_size, record_size)
+    for start in range(0, size, chunk_size):
+      yield (start, min(start + chunk_size, size))
+    return
+
+  f = open(filename, 'rb')
+  try:
+    start = 0
+    while start < size:
+      f.seek(start + chunk_size)
+      # Extend the chunk to the end of the current line:
+      f.readline()
+      end = min(f.tell(), size)
+      yield (start, end)
+      start = end
+  finally:
+    f.close()
+
+
+def _sort_chunk(input, start, end, output, key=None, record_size=None):
+  """Sort the records between offsets START and END of file INPUT.
+
+  Write the sorted records to file OUTPUT.  This function is run in a
+  worker process if sort_file() is running more than one job."""
+
+  f = open(input, 'rb')
+  try:
+    if record_size is None:
+      f.seek(start)
+      records = cStringIO.StringIO(f.read(end - start)).readlines()
+    else:
+      # Slice the records directly out of a memory map of the file:
+      m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        records = [
+            m[i:i + record_size]
+            for i in xrange(start, end, record_size)
+            ]
+      finally:
+        m.close()
+  finally:
+    f.close()
+
+  records.sort(key=key)
+
+  f = open(output, 'wb', BUFSIZE)
+  try:
+    f.writelines(records)
+  finally:
+    f.close()
 
 
 def sort_file(
       input, output, key=None,
-      buffer_size=32000, tempdirs=[], max_merge=DEFAULT_MAX_MERGE,
+      memory_limit=None, tempdirs=[], max_merge=DEFAULT_MAX_MERGE,
+      jobs=1, record_size=None,
       ):
+  """Sort the records of file INPUT and write them to file OUTPUT.
+
+  If RECORD_SIZE is None, the records are lines; otherwise they are
+  fixed-width strings of RECORD_SIZE bytes.  If KEY is specified, it
+  should be a function that returns the sort key for a record.  INPUT
+  is split into chunks that are small enough to be sorted in memory;
+  the sorted chunks are written to temporary files in TEMPDIRS and
+  then merged into OUTPUT.
+
+  MEMORY_LIMIT is the approximate number of bytes of memory that may
+  be used for sorting chunks, summed over all jobs; if it is None,
+  DEFAULT_MEMORY_LIMIT is used.  If JOBS is greater than one, then up
+  to JOBS chunks are sorted (and intermediate merges are done)
+  concurrently in worker processes; in that case KEY must be picklable
+  (e.g., a module-level function).  The output does not depend on
+  MEMORY_LIMIT or JOBS."""
+
+  if memory_limit is None:
+    memory_limit = DEFAULT_MEMORY_LIMIT
+
+  chunk_size = max(
+      memory_limit // (max(jobs, 1) * MEMORY_OVERHEAD), MIN_CHUNK_SIZE
+      )
+
   tempfiles = tempfile_generator(tempdirs)
 
   filenames = []
 
-  input_file = file(input, 'rb', BUFSIZE)
+  worker_pool = create_worker_pool(jobs)
   try:
-    try:
-      input_iterator = iter(input_file)
-      while True:
-        current_chunk = list(itertools.islice(input_iterator, buffer_size))
-        if not current_chunk:
-          break
-        current_chunk.sort(key=key)
-        filename = tempfiles.next()
-        filenames.append(filename)
-        f = open(filename, 'w+b', BUFSIZE)
-        try:
-          f.writelines(current_chunk)
-        finally:
-          f.close()
-    finally:
-      input_file.close()
+    chunks = []
+    for (start, end) in _find_chunks(input, chunk_size, record_size):
+      filename = tempfiles.next()
+      filenames.append(filename)
+      chunks.append((start, end, filename))
+
+    if worker_pool is None or len(chunks) <= 1:
+      for (start, end, filename) in chunks:
+        _sort_chunk(input, start, end, filename, key, record_size)
+    else:
+      results = [
+          worker_pool.apply_async(
+              _sort_chunk, input, start, end, filename, key, record_size
+              )
+          for (start, end, filename) in chunks
+          ]
+      for result in results:
+        result.get()
 
     merge_files(
         filenames, output, key=key,
         delete_inputs=True, max_merge=max_merge, tempfiles=tempfiles,
+        worker_pool=worker_pool, record_size=record_size,
         )
   finally:
+    if worker_pool is not None:
+      worker_pool.close()
     _try_delete_files(filenames)
 
 
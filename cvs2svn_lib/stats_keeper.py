@@ -35,12 +35,39 @@ class StatsKeeper:
     self._first_rev_date = 1L<<32
     self._last_rev_date = 0
     self._pass_timings = { }
+    # A map {pass_num : RecordTableCacheStatistics}:
+    self._record_table_cache_statistics = { }
+    # A map {pass_num : CycleBreakingStatistics}:
+    self._cycle_breaking_statistics = { }
+    # A map {pass_num : usage}, where usage is a map returned by
+    # ResourceMonitor.stop() (only filled with --profile-resources):
+    self._resource_usage = { }
     self._stats_reflect_exclude = False
     self.reset_cvs_rev_info()
 
   def log_duration_for_pass(self, duration, pass_num, pass_name):
     self._pass_timings[pass_num] = (pass_name, duration,)
 
+  def log_record_table_cache_statistics(self, statistics, pass_num):
+    self._record_table_cache_statistics[pass_num] = statistics
+
+  def log_cycle_breaking_statistics(self, statistics, pass_num):
+    self._cycle_breaking_statistics[pass_num] = statistics
+
+  def log_resource_usage_for_pass(self, usage, pass_num):
+    self._resource_usage[pass_num] = usage
+
+  def resource_usage(self):
+    """Return a list of (pass_num, pass_name, usage) for profiled passes."""
+
+    passes = self._resource_usage.keys()
+    passes.sort()
+    return [
+        (pass_num, self._pass_timings[pass_num][0],
+         self._resource_usage[pass_num])
+        for pass_num in passes
+        ]
+
   def set_stats_reflect_exclude(self, value):
     self._stats_reflect_exclude = value
 
@@ -99,6 +126,9 @@ class StatsKeeper:
     # This can get kinda large, so we don't store it:
     return state
 
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+
   def archive(self, filename):
     f = open(filename, 'wb')
     cPickle.dump(self, f)
@@ -176,6 +206,78 @@ class StatsKeeper:
     f.write((format + '   total') % total)
     return f.getvalue()
 
+  def record_table_cache_statistics(self):
+    """Return a table of the RecordTable cache statistics of each pass.
+
+    Passes that didn't use any RecordTables are omitted.  Return None
+    if there is nothing to report."""
+
+    statistics = self._record_table_cache_statistics
+    passes = [
+        pass_num
+        for pass_num in statistics
+        if statistics[pass_num].hits or statistics[pass_num].misses
+        ]
+    if not passes:
+      return None
+    passes.sort()
+
+    f = StringIO()
+    f.write('RecordTable block cache:\n')
+    f.write('------------------------\n')
+    f.write(
+        '%10s %8s %9s %10s\n'
+        % ('hits', 'misses', 'readahead', 'writebacks',)
+        )
+    for pass_num in passes:
+      statistics = self._record_table_cache_statistics[pass_num]
+      (pass_name, duration,) = self._pass_timings[pass_num]
+      f.write(
+          '%10d %8d %9d %10d   pass%-2d   %s\n'
+          % (
+              statistics.hits, statistics.misses, statistics.readahead,
+              statistics.writebacks, pass_num, pass_name,
+              )
+          )
+    return f.getvalue().rstrip('\n')
+
+  def cycle_breaking_statistics(self):
+    """Return a table of the changeset cycles broken by each pass.
+
+    Passes that didn't break any cycles using
+    ChangesetGraph.consume_graph() are omitted.  Return None if there
+    is nothing to report."""
+
+    statistics = self._cycle_breaking_statistics
+    passes = [
+        pass_num
+        for pass_num in statistics
+        if statistics[pass_num].cycles
+        ]
+    if not passes:
+      return None
+    passes.sort()
+
+    f = StringIO()
+    f.write('Changeset cycle breaking:\n')
+    f.write('-------------------------\n')
+    f.write(
+        '%8s %10s %8s %8s %8s\n'
+        % ('rounds', 'components', 'cycles', 'splits', 'new',)
+        )
+    for pass_num in passes:
+      statistics = self._cycle_breaking_statistics[pass_num]
+      (pass_name, duration,) = self._pass_timings[pass_num]
+      f.write(
+          '%8d %10d %8d %8d %8d   pass%-2d   %s\n'
+          % (
+              statistics.rounds, statistics.components, statistics.cycles,
+              statistics.splits, statistics.new_changesets,
+              pass_num, pass_name,
+              )
+          )
+    return f.getvalue().rstrip('\n')
+
 
 def read_stats_keeper(filename):
   """Factory function: Return a _StatsKeeper instance.
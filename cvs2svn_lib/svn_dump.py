@@ -75,15 +75,24 @@ def generate_ignores(cvsignore, raw_ignore_val):
 class DumpstreamDelegate(SVNRepositoryDelegate):
   """Write output in Subversion dumpfile format."""
 
-  def __init__(self, revision_reader, dumpfile):
+  def __init__(self, revision_reader, dumpfile, checkpoint_state=None):
     """Return a new DumpstreamDelegate instance.
 
     DUMPFILE should be a file-like object opened in binary mode, to
     which the dump stream will be written.  The only methods called on
-    the object are write() and close()."""
+    the object are write() and close().
+
+    If CHECKPOINT_STATE is specified, it is a value returned by
+    get_checkpoint_state(), and DUMPFILE already contains the dump
+    stream up to that point; continue writing it from there."""
 
     self._revision_reader = revision_reader
     self._dumpfile = dumpfile
+
+    if checkpoint_state is not None:
+      self._basic_directories = checkpoint_state
+      return
+
     self._write_dumpfile_header()
 
     # A set of the basic project infrastructure project directories
@@ -93,6 +102,13 @@ class DumpstreamDelegate(SVNRepositoryDelegate):
     # directories etc.
     self._basic_directories = set([''])
 
+  def get_checkpoint_state(self):
+    """Return the state of this instance, as a picklable object.
+
+    This may only be called between commits."""
+
+    return self._basic_directories
+
   def _write_dumpfile_header(self):
     """Initialize the dumpfile with the standard headers.
 
@@ -21,6 +21,7 @@ import os
 import re
 
 from cvs2svn_lib import config
+from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import InternalError
 from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import FatalException
@@ -44,10 +45,16 @@ from cvs2svn_lib.cvs_item import CVSRevisionDelete
 from cvs2svn_lib.cvs_item import CVSRevisionNoop
 from cvs2svn_lib.repository_mirror import RepositoryMirror
 from cvs2svn_lib.repository_mirror import PathExistsError
-from cvs2svn_lib.openings_closings import SymbolingsReader
-from cvs2svn_lib.fill_source import get_source_set
+from cvs2svn_lib.fill_plan_database import FillPlanDatabase
 from cvs2svn_lib.svn_dump import DumpstreamDelegate
 from cvs2svn_lib.svn_dump import LoaderPipe
+from cvs2svn_lib.incremental import IncrementalDumpstreamDelegate
+from cvs2svn_lib.incremental import read_manifest
+from cvs2svn_lib.incremental import write_manifest
+from cvs2svn_lib.incremental import write_recordings
+from cvs2svn_lib.checkpoint import CheckpointError
+from cvs2svn_lib.checkpoint import sync_file
+from cvs2svn_lib.checkpoint import truncate_file
 from cvs2svn_lib.output_option import OutputOption
 
 
@@ -56,6 +63,8 @@ class SVNOutputOption(OutputOption):
 
   name = 'Subversion'
 
+  uses_fill_plans = True
+
   class ParentMissingError(Exception):
     """The parent of a path is missing.
 
@@ -87,14 +96,22 @@ class SVNOutputOption(OutputOption):
         self.author_transforms[cvsauthor] = name
 
   def register_artifacts(self, which_pass):
-    # These artifacts are needed for SymbolingsReader:
+    # These artifacts are needed for FillPlanDatabase:
     artifact_manager.register_temp_file_needed(
-        config.SYMBOL_OPENINGS_CLOSINGS_SORTED, which_pass
+        config.SYMBOL_FILL_PLANS_STORE, which_pass
         )
     artifact_manager.register_temp_file_needed(
-        config.SYMBOL_OFFSETS_DB, which_pass
+        config.SYMBOL_FILL_PLANS_INDEX_TABLE, which_pass
         )
 
+    if Ctx().incremental_manifest is not None:
+      artifact_manager.register_temp_file_needed(
+          config.INCREMENTAL_MANIFEST, which_pass
+          )
+      artifact_manager.register_temp_file_needed(
+          config.INCREMENTAL_RECORDINGS, which_pass
+          )
+
     self._mirror.register_artifacts(which_pass)
     Ctx().revision_reader.register_artifacts(which_pass)
 
@@ -140,12 +157,33 @@ class SVNOutputOption(OutputOption):
           )
 
   def setup(self, svn_rev_count):
-    self._symbolings_reader = SymbolingsReader()
+    self._fill_plans = FillPlanDatabase(DB_OPEN_READ)
     self._mirror.open()
     self._delegates = []
+    self._incremental_delegate = None
     Ctx().revision_reader.start()
     self.svn_rev_count = svn_rev_count
 
+  def get_checkpoint_state(self):
+    reader_state = Ctx().revision_reader.get_checkpoint_state()
+    if reader_state is None:
+      return None
+
+    return (self._mirror.get_checkpoint_state(), reader_state,)
+
+  def resume(self, svn_rev_count, checkpoint_state):
+    (mirror_state, reader_state) = checkpoint_state
+    self._mirror.open(mirror_state)
+    try:
+      Ctx().revision_reader.resume(reader_state)
+    except CheckpointError:
+      self._mirror.close()
+      raise
+    self._fill_plans = FillPlanDatabase(DB_OPEN_READ)
+    self._delegates = []
+    self._incremental_delegate = None
+    self.svn_rev_count = svn_rev_count
+
   def _get_author(self, svn_commit):
     author = svn_commit.get_author()
     name = self.author_transforms.get(author, author)
@@ -407,9 +445,9 @@ class SVNOutputOption(OutputOption):
     Fill SYMBOL starting at the path FILL_SOURCE.cvs_path.  DEST_NODE
     is the node of this destination path, or None if the destination
     does not yet exist.  All directories above this path have already
-    been filled.  FILL_SOURCE is a FillSource instance describing the
-    items within a subtree of the repository that still need to be
-    copied to the destination.
+    been filled.  FILL_SOURCE is a FillSource or PlannedFillSource
+    instance describing the items within a subtree of the repository
+    that still need to be copied to the destination.
 
     PARENT_SOURCE is the SVNRevisionRange that was used to copy the
     parent directory, if it was copied in this commit.  We prefer to
@@ -444,7 +482,7 @@ class SVNOutputOption(OutputOption):
     else:
       copy_source = parent_source
 
-    # The map {CVSPath : FillSource} of entries within this directory
+    # The map {CVSPath : fill source} of entries within this directory
     # that need filling:
     src_entries = fill_source.get_subsource_map()
 
@@ -504,8 +542,9 @@ class SVNOutputOption(OutputOption):
     Fill SYMBOL at path FILL_SOURCE.cvs_path.  DEST_NODE is the node
     of this destination path, or None if the destination does not yet
     exist.  All directories above this path have already been filled
-    as needed.  FILL_SOURCE is a FillSource instance describing the
-    item that needs to be copied to the destination.
+    as needed.  FILL_SOURCE is a FillSource or PlannedFillSource
+    instance describing the item that needs to be copied to the
+    destination.
 
     PARENT_SOURCE is the source from which the parent directory was
     copied, or None if the parent directory was not copied during this
@@ -567,6 +606,25 @@ class SVNOutputOption(OutputOption):
 
     self._delegates.append(delegate)
 
+  def _create_dumpstream_delegate(self, dumpfile, checkpoint_state=None):
+    """Return a DumpstreamDelegate that writes to DUMPFILE.
+
+    For an incremental conversion, the delegate only writes the
+    revisions that are new since the last one (see the incremental
+    module)."""
+
+    if Ctx().incremental_manifest is None:
+      return DumpstreamDelegate(
+          Ctx().revision_reader, dumpfile, checkpoint_state
+          )
+
+    old_manifest = read_manifest(Ctx().incremental_manifest)
+    self._incremental_delegate = IncrementalDumpstreamDelegate(
+        Ctx().revision_reader, dumpfile, old_manifest.revision_digests,
+        checkpoint_state,
+        )
+    return self._incremental_delegate
+
   def _invoke_delegates(self, method, *args):
     """Invoke a method on each delegate.
 
@@ -649,11 +707,8 @@ class SVNOutputOption(OutputOption):
     self.start_commit(svn_commit.revnum, self._get_revprops(svn_commit))
     logger.verbose('Filling branch:', svn_commit.symbol.name)
 
-    # Get the set of sources for the symbolic name:
-    source_set = get_source_set(
-        svn_commit.symbol,
-        self._symbolings_reader.get_range_map(svn_commit),
-        )
+    # Get the planned sources for the symbolic name:
+    source_set = self._fill_plans.get_fill_source(svn_commit)
 
     self.fill_symbol(svn_commit, source_set)
 
@@ -663,11 +718,8 @@ class SVNOutputOption(OutputOption):
     self.start_commit(svn_commit.revnum, self._get_revprops(svn_commit))
     logger.verbose('Filling tag:', svn_commit.symbol.name)
 
-    # Get the set of sources for the symbolic name:
-    source_set = get_source_set(
-        svn_commit.symbol,
-        self._symbolings_reader.get_range_map(svn_commit),
-        )
+    # Get the planned sources for the symbolic name:
+    source_set = self._fill_plans.get_fill_source(svn_commit)
 
     self.fill_symbol(svn_commit, source_set)
 
@@ -675,13 +727,24 @@ class SVNOutputOption(OutputOption):
 
   def cleanup(self):
     self._invoke_delegates('finish')
+    if self._incremental_delegate is not None:
+      manifest = read_manifest(
+          artifact_manager.get_temp_file(config.INCREMENTAL_MANIFEST)
+          )
+      manifest.revision_digests = self._incremental_delegate.revision_digests
+      write_recordings(
+          artifact_manager.get_temp_file(config.INCREMENTAL_RECORDINGS),
+          Ctx().incremental_manifest,
+          )
+      write_manifest(manifest, Ctx().incremental_manifest)
+      self._incremental_delegate = None
     logger.verbose("Finished creating Subversion repository.")
     logger.quiet("Done.")
     self._mirror.close()
     self._mirror = None
     Ctx().revision_reader.finish()
-    self._symbolings_reader.close()
-    del self._symbolings_reader
+    self._fill_plans.close()
+    del self._fill_plans
 
 
 class DumpfileOutputOption(SVNOutputOption):
@@ -697,12 +760,58 @@ class DumpfileOutputOption(SVNOutputOption):
   def setup(self, svn_rev_count):
     logger.quiet("Starting Subversion Dumpfile.")
     SVNOutputOption.setup(self, svn_rev_count)
-    if not Ctx().dry_run:
-      self.add_delegate(
-          DumpstreamDelegate(
-              Ctx().revision_reader, open(self.dumpfile_path, 'wb')
-              )
+    if Ctx().dry_run:
+      self._dumpfile = None
+    else:
+      self._dumpfile = open(self.dumpfile_path, 'wb')
+      self._dumpstream_delegate = self._create_dumpstream_delegate(
+          self._dumpfile
           )
+      self.add_delegate(self._dumpstream_delegate)
+
+  def get_checkpoint_state(self):
+    if self._dumpfile is None:
+      dumpfile_state = None
+    else:
+      try:
+        sync_file(self._dumpfile)
+        dumpfile_state = (
+            self._dumpfile.tell(),
+            self._dumpstream_delegate.get_checkpoint_state(),
+            )
+      except (IOError, OSError):
+        # The dumpfile is not a regular file (e.g., a pipe), so the
+        # output cannot be continued later:
+        return None
+
+    svn_state = SVNOutputOption.get_checkpoint_state(self)
+    if svn_state is None:
+      return None
+
+    return (svn_state, dumpfile_state,)
+
+  def resume(self, svn_rev_count, checkpoint_state):
+    (svn_state, dumpfile_state) = checkpoint_state
+    if (dumpfile_state is None) != bool(Ctx().dry_run):
+      raise CheckpointError(
+          'the checkpoint was saved with a different --dry-run setting'
+          )
+
+    if dumpfile_state is not None:
+      (size, delegate_state) = dumpfile_state
+      truncate_file(self.dumpfile_path, size)
+
+    logger.quiet("Continuing Subversion Dumpfile.")
+    SVNOutputOption.resume(self, svn_rev_count, svn_state)
+    if dumpfile_state is None:
+      self._dumpfile = None
+    else:
+      self._dumpfile = open(self.dumpfile_path, 'rb+')
+      self._dumpfile.seek(0, 2)
+      self._dumpstream_delegate = self._create_dumpstream_delegate(
+          self._dumpfile, delegate_state
+          )
+      self.add_delegate(self._dumpstream_delegate)
 
 
 class RepositoryOutputOption(SVNOutputOption):
@@ -729,9 +838,15 @@ class RepositoryOutputOption(SVNOutputOption):
     SVNOutputOption.setup(self, svn_rev_count)
     if not Ctx().dry_run:
       self.add_delegate(
-          DumpstreamDelegate(Ctx().revision_reader, LoaderPipe(self.target))
+          self._create_dumpstream_delegate(LoaderPipe(self.target))
           )
 
+  def get_checkpoint_state(self):
+    # The revisions that were loaded into the repository after the
+    # checkpoint cannot be undone, so the output cannot be continued
+    # later:
+    return None
+
 
 class NewRepositoryOutputOption(RepositoryOutputOption):
   """Output the result of the conversion into a new SVN repository."""
@@ -773,6 +888,13 @@ class NewRepositoryOutputOption(RepositoryOutputOption):
       raise FatalError("the svn-repos-path '%s' exists.\n"
                        "Remove it, or pass '--existing-svnrepos'."
                        % self.target)
+    if Ctx().incremental_manifest is not None \
+           and read_manifest(Ctx().incremental_manifest).revision_digests:
+      raise FatalError(
+          "the last incremental conversion has already been output.\n"
+          "Pass '--existing-svnrepos' to append the new revisions to its "
+          "repository."
+          )
 
   def setup(self, svn_rev_count):
     logger.normal("Creating new repository '%s'" % (self.target))
@@ -58,13 +58,62 @@ class SVNRevisionRange:
     return str(self)
 
 
+class RevisionDeltas:
+  """The openings and closings of some SVNRevisionRanges, by LOD and revnum.
+
+  The ranges are summarized in self.deltas_map, a map
+
+      { SOURCE_LOD : { REVNUM : DELTA } }
+
+  where DELTA is the number of ranges on SOURCE_LOD that open at
+  REVNUM minus the number that close there.  (An entry is kept even if
+  the two cancel out, because RevisionScores records a score for every
+  revision where a range opens or closes.)
+
+  The instances for two disjoint sets of ranges can be combined with
+  update(), so the deltas for a directory can be computed from those
+  of its entries without looking at the individual ranges again."""
+
+  def __init__(self, svn_revision_ranges=[]):
+    self.deltas_map = {}
+    for range in svn_revision_ranges:
+      self.add_range(range)
+
+  def add_range(self, range):
+    """Add SVNRevisionRange RANGE."""
+
+    try:
+      deltas = self.deltas_map[range.source_lod]
+    except KeyError:
+      deltas = {}
+      self.deltas_map[range.source_lod] = deltas
+    deltas[range.opening_revnum] = deltas.get(range.opening_revnum, 0) + 1
+    if range.closing_revnum is not None:
+      deltas[range.closing_revnum] = deltas.get(range.closing_revnum, 0) - 1
+
+  def update(self, other):
+    """Add the ranges summarized by RevisionDeltas OTHER.
+
+    OTHER is not modified."""
+
+    for (source_lod, other_deltas) in other.deltas_map.iteritems():
+      try:
+        deltas = self.deltas_map[source_lod]
+      except KeyError:
+        self.deltas_map[source_lod] = dict(other_deltas)
+      else:
+        for (revnum, delta) in other_deltas.iteritems():
+          deltas[revnum] = deltas.get(revnum, 0) + delta
+
+
 class RevisionScores:
   """Represent the scores for a range of revisions."""
 
   def __init__(self, svn_revision_ranges):
     """Initialize based on SVN_REVISION_RANGES.
 
-    SVN_REVISION_RANGES is a list of SVNRevisionRange objects.
+    SVN_REVISION_RANGES is a list of SVNRevisionRange objects, or a
+    RevisionDeltas instance that summarizes them.
 
     The score of an svn source is defined to be the number of
     SVNRevisionRanges on that LOD that include the revision.  A score
@@ -78,18 +127,10 @@ class RevisionScores:
 
     If SVN_REVISION_RANGES is empty, then all scores are undefined."""
 
-    deltas_map = {}
-
-    for range in svn_revision_ranges:
-      source_lod = range.source_lod
-      try:
-        deltas = deltas_map[source_lod]
-      except:
-        deltas = []
-        deltas_map[source_lod] = deltas
-      deltas.append((range.opening_revnum, +1))
-      if range.closing_revnum is not None:
-        deltas.append((range.closing_revnum, -1))
+    if isinstance(svn_revision_ranges, RevisionDeltas):
+      revision_deltas = svn_revision_ranges
+    else:
+      revision_deltas = RevisionDeltas(svn_revision_ranges)
 
     # A map:
     #
@@ -103,23 +144,16 @@ class RevisionScores:
     # in the range REV2 <= REV < REV3 is equal to SCORE2.
     self._scores_map = {}
 
-    for (source_lod,deltas) in deltas_map.items():
+    for (source_lod, deltas) in revision_deltas.deltas_map.iteritems():
       # Sort by revision number:
-      deltas.sort()
-
-      # Initialize output list with zeroth element of deltas.  This
-      # element must exist, because it was verified that
-      # svn_revision_ranges (and therefore openings) is not empty.
-      scores = [ deltas[0] ]
-      total = deltas[0][1]
-      for (rev, change) in deltas[1:]:
-        total += change
-        if rev == scores[-1][0]:
-          # Same revision as last entry; modify last entry:
-          scores[-1] = (rev, total)
-        else:
-          # Previously-unseen revision; create new entry:
-          scores.append((rev, total))
+      revnums = deltas.keys()
+      revnums.sort()
+
+      scores = []
+      total = 0
+      for rev in revnums:
+        total += deltas[rev]
+        scores.append((rev, total))
       self._scores_map[source_lod] = scores
 
   def get_score(self, range):
@@ -224,6 +224,30 @@ A directory under \\fI%s\\fR (or the directory specified by
             ),
         metavar='PATH',
         ))
+    group.add_option(ContextOption(
+        '--incremental', type='string',
+        action='store', dest='incremental_manifest',
+        help=(
+            'output only the revisions that are new since the last '
+            'conversion that used the manifest PATH'
+            ),
+        man_help=(
+            'Record the state of the CVS repository and the revisions '
+            'that were output in the manifest file \\fIpath\\fR.  If '
+            'the manifest already exists, output only the revisions that '
+            'are new since the conversion that wrote it, so that they can '
+            'be loaded on top of its output (use '
+            '\\fB--existing-svnrepos\\fR to load them into the same '
+            'repository).  The conversion stops with an error if the CVS '
+            'history has been changed in a way that cannot be appended to '
+            'the earlier output.  All passes are still run; the earlier '
+            'revisions are converted again to check that they have not '
+            'changed, but the ,v files that have not been modified since '
+            'then are not parsed again; their parses, recorded in '
+            '\\fIpath\\fR.recordings, are replayed instead.'
+            ),
+        metavar='PATH',
+        ))
 
     group.add_option(ContextOption(
         '--dry-run',
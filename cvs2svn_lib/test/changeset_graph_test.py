@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This program tests the ChangesetGraph backends and graph snapshots.
+
+The same random graph is built in a DictChangesetGraph and in a
+CompactChangesetGraph, the same nodes are deleted from and added to
+both, and the graphs are checked against each other: their nodes and
+dependencies, the order in which they are consumed, and the cycles
+that are found in them.  The CompactChangesetGraph is made to rebuild
+its arrays several times along the way.
+
+A snapshot is written of a graph whose cycles are broken while it is
+consumed, and the graph loaded from it is checked against the graph
+derived from the final changesets."""
+
+import sys
+import os
+import shutil
+import random
+import unittest
+
+SRCPATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, SRCPATH)
+
+from cvs2svn_lib import sort
+from cvs2svn_lib.common import InternalError
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.time_range import TimeRange
+from cvs2svn_lib.changeset_graph_node import ChangesetGraphNode
+from cvs2svn_lib.changeset_graph import CycleInGraphException
+from cvs2svn_lib.changeset_graph import DictChangesetGraph
+from cvs2svn_lib.changeset_graph import CompactChangesetGraph
+from cvs2svn_lib.changeset_graph_snapshot import \
+    load_changeset_graph_snapshot
+from cvs2svn_lib.changeset_graph_snapshot import \
+    check_changeset_graph_snapshot
+from cvs2svn_lib.changeset_graph_snapshot import SNAPSHOT_MAGIC
+from cvs2svn_lib.changeset_graph_snapshot import _read_node
+
+TMPDIR = os.path.join(SRCPATH, 'cvs2svn-tmp')
+
+
+class SyntheticChangeset(object):
+  """A stand-in for a Changeset, with explicit dependencies."""
+
+  def __init__(self, id, timestamp, pred_ids, succ_ids, duration=0):
+    self.id = id
+    self.timestamp = timestamp
+    self.duration = duration
+    self.pred_ids = pred_ids
+    self.succ_ids = succ_ids
+    self.cvs_item_ids = []
+
+  def create_graph_node(self, cvs_item_to_changeset_id):
+    time_range = TimeRange()
+    time_range.add(self.timestamp)
+    time_range.add(self.timestamp + self.duration)
+    return ChangesetGraphNode(
+        self.id, time_range, set(self.pred_ids), set(self.succ_ids)
+        )
+
+  def __cmp__(self, other):
+    return cmp(self.id, other.id)
+
+
+class SyntheticChangesetDatabase(dict):
+  def store(self, changeset):
+    self[changeset.id] = changeset
+
+  def close(self):
+    pass
+
+
+class SyntheticTable(dict):
+  def close(self):
+    pass
+
+
+def generate_changesets(rng, count, cycles):
+  """Return a list of COUNT SyntheticChangesets with ids 1 to COUNT.
+
+  RNG is the random.Random instance to use.  The dependencies among
+  the changesets form a DAG, except that CYCLES blocks of consecutive
+  ids are made into rings.  No other dependencies are added within
+  those blocks, so each strongly connected component of the graph is
+  a single cycle."""
+
+  blocks = {}
+  for i in range(cycles):
+    start = rng.randrange(2, count - 5)
+    length = rng.randrange(2, 6)
+    if [id for id in range(start - 1, start + length + 1) if id in blocks]:
+      continue
+    for id in range(start, start + length):
+      blocks[id] = start
+
+  pred_ids = [[] for i in range(count + 1)]
+  succ_ids = [[] for i in range(count + 1)]
+
+  def add_dependency(pred_id, succ_id):
+    if pred_id not in pred_ids[succ_id]:
+      pred_ids[succ_id].append(pred_id)
+      succ_ids[pred_id].append(succ_id)
+
+  for id in range(2, count + 1):
+    for i in range(rng.randrange(4)):
+      pred_id = max(1, id - rng.randrange(1, 30))
+      if blocks.get(pred_id, pred_id) != blocks.get(id, id):
+        add_dependency(pred_id, id)
+    if id in blocks and id + 1 not in blocks:
+      add_dependency(id, blocks[id])
+    elif id in blocks:
+      add_dependency(id, id + 1)
+
+  # Use few distinct timestamps, so that the order often depends on
+  # the ids of the changesets:
+  return [
+      SyntheticChangeset(
+          id, 1000000000 + rng.randrange(count // 4) * 60,
+          pred_ids[id], succ_ids[id],
+          )
+      for id in range(1, count + 1)
+      ]
+
+
+def consume(graph, next_ids):
+  """Consume GRAPH, breaking cycles; return the ids in the order consumed.
+
+  Cycles are broken by splitting the changeset with the smallest id
+  into one changeset with its predecessors and one with its
+  successors.  NEXT_IDS is a list containing the next id to use for
+  a new changeset."""
+
+  def break_cycle(cycle):
+    changeset = min(cycle)
+    node = graph[changeset.id]
+    graph.delete_changeset(changeset)
+    for (pred_ids, succ_ids) in [(node.pred_ids, []), ([], node.succ_ids)]:
+      graph.add_new_changeset(SyntheticChangeset(
+          next_ids[0], changeset.timestamp, list(pred_ids), list(succ_ids)
+          ))
+      next_ids[0] += 1
+
+  return [
+      changeset.id
+      for (changeset, time_range)
+      in graph.consume_graph(cycle_breaker=break_cycle)
+      ]
+
+
+class ChangesetGraphTestCase(unittest.TestCase):
+  # The value of _MIN_REBUILD used for the CompactChangesetGraph, low
+  # enough that its arrays are rebuilt several times:
+  MIN_REBUILD = 20
+
+  def setUp(self):
+    self.rng = random.Random(42)
+
+  def create_graphs(self, changesets):
+    """Return a DictChangesetGraph and a CompactChangesetGraph.
+
+    Both graphs contain the changesets in CHANGESETS."""
+
+    graphs = []
+    for graph_class in [DictChangesetGraph, CompactChangesetGraph]:
+      changeset_db = SyntheticChangesetDatabase()
+      for changeset in changesets:
+        changeset_db.store(changeset)
+      graph = graph_class(changeset_db, SyntheticTable())
+      for changeset in changesets:
+        graph.add_changeset(changeset)
+      graphs.append(graph)
+
+    (dict_graph, compact_graph) = graphs
+
+    # Count the times that the arrays of the CompactChangesetGraph are
+    # rebuilt:
+    compact_graph._MIN_REBUILD = self.MIN_REBUILD
+    compact_graph.rebuilds = 0
+    rebuild = compact_graph._rebuild
+    def counting_rebuild():
+      compact_graph.rebuilds += 1
+      rebuild()
+    compact_graph._rebuild = counting_rebuild
+
+    return (dict_graph, compact_graph)
+
+  def check_same(self, dict_graph, compact_graph):
+    """Check that DICT_GRAPH and COMPACT_GRAPH have the same contents."""
+
+    self.assertEqual(bool(dict_graph), bool(compact_graph))
+    ids = sorted(dict_graph.keys())
+    self.assertEqual(sorted(compact_graph.keys()), ids)
+    self.assertEqual(
+        sorted([node.id for node in compact_graph]), ids
+        )
+    for id in ids:
+      self.assert_(id in compact_graph)
+      self.assertEqual(
+          sorted(compact_graph.get_pred_ids(id)),
+          sorted(dict_graph.get_pred_ids(id)),
+          )
+      self.assertEqual(
+          sorted(compact_graph.get_succ_ids(id)),
+          sorted(dict_graph.get_succ_ids(id)),
+          )
+      self.assertEqual(
+          compact_graph.has_pred_ids(id), dict_graph.has_pred_ids(id)
+          )
+      self.assertEqual(
+          compact_graph.get_time_range(id), dict_graph.get_time_range(id)
+          )
+      node = compact_graph[id]
+      self.assertEqual(node.pred_ids, dict_graph[id].pred_ids)
+      self.assertEqual(node.succ_ids, dict_graph[id].succ_ids)
+    self.assertEqual(
+        sorted(compact_graph.iter_nopred_ids()),
+        sorted(dict_graph.iter_nopred_ids()),
+        )
+    self.failIf(0 in compact_graph)
+    self.failIf(max(ids + [0]) + 1 in compact_graph)
+    self.assertRaises(KeyError, compact_graph.__getitem__, 0)
+
+  def get_components(self, graph):
+    return sorted([
+        sorted(component)
+        for component in graph.get_strongly_connected_components()
+        ])
+
+  def test_build(self):
+    changesets = generate_changesets(self.rng, 500, 0)
+    (dict_graph, compact_graph) = self.create_graphs(changesets)
+    self.check_same(dict_graph, compact_graph)
+    self.assertEqual(self.get_components(dict_graph), [])
+    self.assertEqual(self.get_components(compact_graph), [])
+
+  def test_delete_and_add(self):
+    changesets = generate_changesets(self.rng, 500, 0)
+    (dict_graph, compact_graph) = self.create_graphs(changesets)
+    next_id = len(changesets) + 1
+
+    for i in range(20):
+      # Delete some nodes:
+      deleted_ids = self.rng.sample(sorted(dict_graph.keys()), 10)
+      for id in deleted_ids:
+        del dict_graph[id]
+        del compact_graph[id]
+        self.failIf(id in compact_graph)
+
+      # Add some nodes that depend on nodes of the graph (including a
+      # deleted one, whose dependency is ignored), and that nodes of
+      # the graph depend on:
+      for j in range(5):
+        ids = sorted(dict_graph.keys())
+        pred_ids = self.rng.sample(ids[:len(ids) // 2], 3) + deleted_ids[:1]
+        succ_ids = self.rng.sample(ids[len(ids) // 2:], 3)
+        changeset = SyntheticChangeset(
+            next_id, 1000000000 + self.rng.randrange(100) * 60,
+            pred_ids, succ_ids,
+            )
+        next_id += 1
+        for graph in [dict_graph, compact_graph]:
+          graph._changeset_db.store(changeset)
+          graph.add_changeset(changeset)
+
+      self.check_same(dict_graph, compact_graph)
+
+    self.assert_(compact_graph.rebuilds > 0)
+    self.assertEqual(
+        consume(compact_graph, [next_id]),
+        consume(dict_graph, [next_id]),
+        )
+    self.failIf(dict_graph)
+    self.failIf(compact_graph)
+
+  def test_consume(self):
+    changesets = generate_changesets(self.rng, 1000, 0)
+    (dict_graph, compact_graph) = self.create_graphs(changesets)
+    order = consume(dict_graph, [len(changesets) + 1])
+    self.assertEqual(sorted(order), range(1, len(changesets) + 1))
+    self.assertEqual(
+        consume(compact_graph, [len(changesets) + 1]), order
+        )
+    self.assert_(compact_graph.rebuilds > 0)
+    self.failIf(compact_graph)
+
+  def test_find_cycles(self):
+    changesets = generate_changesets(self.rng, 1000, 30)
+    (dict_graph, compact_graph) = self.create_graphs(changesets)
+
+    # Consume the graphs until the first cycle is found:
+    orders = []
+    for graph in [dict_graph, compact_graph]:
+      order = []
+      try:
+        for (changeset, time_range) in graph.consume_graph():
+          order.append(changeset.id)
+      except CycleInGraphException:
+        pass
+      else:
+        self.fail('No cycle found')
+      orders.append(order)
+    self.assertEqual(orders[1], orders[0])
+    self.check_same(dict_graph, compact_graph)
+
+    components = self.get_components(dict_graph)
+    self.assert_(components)
+    self.assertEqual(self.get_components(compact_graph), components)
+    for component in components:
+      for graph in [dict_graph, compact_graph]:
+        cycle = graph.find_cycle(component[0], set(component))
+        self.assertEqual(
+            sorted([changeset.id for changeset in cycle]), component
+            )
+        self.assertEqual(
+            sorted([
+                changeset.id
+                for changeset in graph.find_disjoint_cycles(component)[0]
+                ]),
+            component,
+            )
+
+  def test_break_cycles(self):
+    changesets = generate_changesets(self.rng, 1000, 30)
+    (dict_graph, compact_graph) = self.create_graphs(changesets)
+    order = consume(dict_graph, [len(changesets) + 1])
+    self.assertEqual(
+        consume(compact_graph, [len(changesets) + 1]), order
+        )
+    self.assert_(compact_graph.statistics.cycles > 0)
+    self.assertEqual(
+        compact_graph.statistics.cycles, dict_graph.statistics.cycles
+        )
+    self.assertEqual(
+        compact_graph.statistics.splits, dict_graph.statistics.splits
+        )
+    self.assert_(compact_graph.rebuilds > 0)
+    self.failIf(compact_graph)
+
+
+class ChangesetGraphSnapshotTestCase(unittest.TestCase):
+  GRAPH_CLASSES = [DictChangesetGraph, CompactChangesetGraph]
+
+  def setUp(self):
+    self.dirname = os.path.join(TMPDIR, 'changeset-graph-snapshot-test')
+    if os.path.isdir(self.dirname):
+      shutil.rmtree(self.dirname)
+    os.makedirs(self.dirname)
+    self.filename = os.path.join(self.dirname, 'snapshot.dat')
+    self.rng = random.Random(42)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def write_snapshot(self, graph_class):
+    """Write a snapshot of a graph of class GRAPH_CLASS.
+
+    The graph is consumed, and its cycles are broken along the way.
+    Return a list of the final changesets, in order by id."""
+
+    changesets = generate_changesets(self.rng, 300, 10)
+    changeset_db = SyntheticChangesetDatabase()
+    for changeset in changesets:
+      changeset.duration = self.rng.randrange(3) * 60
+      changeset_db.store(changeset)
+    graph = graph_class(changeset_db, SyntheticTable())
+    graph.write_snapshot(self.filename)
+    for changeset in changesets:
+      graph.add_changeset(changeset)
+    consume(graph, [len(changesets) + 1])
+    self.assert_(graph.statistics.splits > 0)
+    graph.close()
+
+    changesets = changeset_db.values()
+    changesets.sort()
+    return changesets
+
+  def derive_graph(self, changesets):
+    """Return a graph built from CHANGESETS."""
+
+    graph = DictChangesetGraph(SyntheticChangesetDatabase(), SyntheticTable())
+    for changeset in changesets:
+      graph.add_changeset(changeset)
+    return graph
+
+  def load_graph(self, graph_class):
+    """Return a graph of class GRAPH_CLASS loaded from the snapshot."""
+
+    graph = graph_class(SyntheticChangesetDatabase(), SyntheticTable())
+    load_changeset_graph_snapshot(self.filename, graph)
+    return graph
+
+  def read_snapshot(self):
+    """Return the list of the node records in the snapshot file."""
+
+    f = open(self.filename, 'rb')
+    self.assertEqual(f.readline(), SNAPSHOT_MAGIC)
+    count = int(f.readline())
+    records = [_read_node(f) for i in range(count)]
+    self.assertEqual(f.read(), '')
+    f.close()
+    return records
+
+  def test_file_contents(self):
+    """Check the snapshot file itself, not just the graph loaded from it.
+
+    The graphs ignore dependencies on changesets that they don't
+    contain, so loading the snapshot would hide such references."""
+
+    # Make the snapshot writer sort its records in several chunks:
+    (min_chunk_size, sort_memory) = (sort.MIN_CHUNK_SIZE, Ctx().sort_memory)
+    sort.MIN_CHUNK_SIZE = Ctx().sort_memory = 1024
+    try:
+      changesets = self.write_snapshot(CompactChangesetGraph)
+    finally:
+      (sort.MIN_CHUNK_SIZE, Ctx().sort_memory) = (min_chunk_size, sort_memory)
+    self.failIf([
+        filename
+        for filename in os.listdir(self.dirname)
+        if filename != os.path.basename(self.filename)
+        ])
+
+    records = self.read_snapshot()
+    ids = [record[0] for record in records]
+    self.assertEqual(ids, [changeset.id for changeset in changesets])
+
+    derived_graph = self.derive_graph(changesets)
+    pred_dependencies = set()
+    succ_dependencies = set()
+    for (id, t_min, t_max, pred_ids, succ_ids) in records:
+      # Each list of neighbors is sorted, without duplicates:
+      self.assertEqual(list(pred_ids), sorted(set(pred_ids)))
+      self.assertEqual(list(succ_ids), sorted(set(succ_ids)))
+      self.assertEqual(set(pred_ids), set(derived_graph.get_pred_ids(id)))
+      self.assertEqual(set(succ_ids), set(derived_graph.get_succ_ids(id)))
+      for pred_id in pred_ids:
+        pred_dependencies.add((pred_id, id))
+      for succ_id in succ_ids:
+        succ_dependencies.add((id, succ_id))
+    self.assertEqual(pred_dependencies, succ_dependencies)
+
+  def test_round_trip(self):
+    for writer_class in self.GRAPH_CLASSES:
+      changesets = self.write_snapshot(writer_class)
+      derived_graph = self.derive_graph(changesets)
+      for graph_class in self.GRAPH_CLASSES:
+        graph = self.load_graph(graph_class)
+        self.assertEqual(
+            sorted(graph.keys()),
+            [changeset.id for changeset in changesets],
+            )
+        check_changeset_graph_snapshot(graph, derived_graph)
+
+  def test_mismatch(self):
+    changesets = self.write_snapshot(DictChangesetGraph)
+    graph = self.load_graph(CompactChangesetGraph)
+    changeset = changesets[len(changesets) // 2]
+    i = changesets.index(changeset)
+
+    # A missing changeset:
+    self.assertRaises(
+        InternalError, check_changeset_graph_snapshot,
+        graph, self.derive_graph(changesets[:i] + changesets[i + 1:]),
+        )
+
+    # An extra dependency:
+    other_ids = [
+        other.id
+        for other in changesets
+        if other.id != changeset.id
+            and other.id not in changeset.pred_ids
+            and other.id not in changeset.succ_ids
+        ]
+    changed = SyntheticChangeset(
+        changeset.id, changeset.timestamp,
+        changeset.pred_ids, changeset.succ_ids + [other_ids[0]],
+        )
+    self.assertRaises(
+        InternalError, check_changeset_graph_snapshot,
+        graph, self.derive_graph(
+            changesets[:i] + [changed] + changesets[i + 1:]
+            ),
+        )
+
+    # A different time range:
+    for (timestamp, duration) in [
+          (changeset.timestamp + 1, changeset.duration - 1),
+          (changeset.timestamp, changeset.duration + 1),
+          ]:
+      changed = SyntheticChangeset(
+          changeset.id, timestamp,
+          changeset.pred_ids, changeset.succ_ids, duration,
+          )
+      self.assertRaises(
+          InternalError, check_changeset_graph_snapshot,
+          graph, self.derive_graph(
+              changesets[:i] + [changed] + changesets[i + 1:]
+              ),
+          )
+
+    # The unchanged changesets still match:
+    check_changeset_graph_snapshot(graph, self.derive_graph(changesets))
+
+  def test_not_a_snapshot(self):
+    f = open(self.filename, 'wb')
+    f.write('not a snapshot\n')
+    f.close()
+    self.assertRaises(
+        InternalError, self.load_graph, DictChangesetGraph
+        )
+
+
+if __name__ == '__main__':
+  unittest.main()
+
+
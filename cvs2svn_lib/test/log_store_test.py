@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This program tests the LogStore class.
+
+Random writes, overwrites, and deletions are applied both to a
+LogStore and to a dict, and the store is checked against the dict
+while it is open, after it has been reopened, after it has been
+compacted, and after it has been truncated to a checkpoint."""
+
+import sys
+import os
+import shutil
+import random
+import unittest
+
+SRCPATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, SRCPATH)
+
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.common import DB_OPEN_WRITE
+from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.checkpoint import truncate_file
+from cvs2svn_lib.log_store import LogStore
+
+TMPDIR = os.path.join(SRCPATH, 'cvs2svn-tmp')
+
+
+class LogStoreTestCase(unittest.TestCase):
+  def setUp(self):
+    self.dirname = os.path.join(TMPDIR, 'log-store-test')
+    if os.path.isdir(self.dirname):
+      shutil.rmtree(self.dirname)
+    os.makedirs(self.dirname)
+    self.filename = os.path.join(self.dirname, 'store.db')
+    self.rng = random.Random(42)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def open(self, mode):
+    store = LogStore(self.filename, mode)
+    # Make the buffer small enough that some records are written while
+    # others are still pending:
+    store.WRITE_BUFFER_SIZE = 1000
+    return store
+
+  def modify(self, store, expected, count):
+    """Apply COUNT random changes to both STORE and EXPECTED."""
+
+    for i in range(count):
+      key = 'key%d' % (self.rng.randrange(200),)
+      if key in expected and self.rng.random() < 0.3:
+        del store[key]
+        del expected[key]
+      else:
+        value = '%s-%d-' % (key, i,) * self.rng.randrange(0, 20)
+        store[key] = value
+        expected[key] = value
+
+  def check(self, store, expected):
+    self.assertEqual(len(store), len(expected))
+    self.assertEqual(sorted(store.keys()), sorted(expected.keys()))
+    for (key, value) in expected.items():
+      self.assert_(key in store)
+      self.assertEqual(store[key], value)
+    self.failIf('missing' in store)
+    self.assertRaises(KeyError, store.__getitem__, 'missing')
+
+  def test_write_read(self):
+    store = self.open(DB_OPEN_NEW)
+    expected = {}
+    self.modify(store, expected, 2000)
+    self.check(store, expected)
+    store.close()
+
+  def test_reopen(self):
+    store = self.open(DB_OPEN_NEW)
+    expected = {}
+    self.modify(store, expected, 2000)
+    store.close()
+
+    store = self.open(DB_OPEN_READ)
+    self.check(store, expected)
+    self.assertRaises(RuntimeError, store.__setitem__, 'key', 'value')
+    store.close()
+
+    store = self.open(DB_OPEN_WRITE)
+    self.check(store, expected)
+    self.modify(store, expected, 2000)
+    self.check(store, expected)
+    store.close()
+
+    store = self.open(DB_OPEN_READ)
+    self.check(store, expected)
+    store.close()
+
+  def test_compact(self):
+    store = self.open(DB_OPEN_NEW)
+    store.MIN_GARBAGE = 0
+    expected = {}
+    self.modify(store, expected, 2000)
+    self.check(store, expected)
+    store.compact()
+    self.check(store, expected)
+    self.modify(store, expected, 100)
+    store.close()
+    self.assert_(not os.path.exists(self.filename + '.compact'))
+
+    store = self.open(DB_OPEN_READ)
+    self.check(store, expected)
+    store.close()
+
+  def test_checkpoint(self):
+    store = self.open(DB_OPEN_NEW)
+    expected = {}
+    self.modify(store, expected, 2000)
+    size = store.checkpoint()
+    saved = expected.copy()
+    self.modify(store, expected, 2000)
+    store.close()
+
+    truncate_file(self.filename, size)
+    store = self.open(DB_OPEN_WRITE)
+    self.check(store, saved)
+    store.close()
+
+  def test_partial_record(self):
+    store = self.open(DB_OPEN_NEW)
+    expected = {}
+    self.modify(store, expected, 100)
+    store.close()
+
+    # A record whose write was interrupted is ignored:
+    f = open(self.filename, 'ab')
+    f.write('\x05\x00\x00\x00\x10\x00\x00\x00keyXXval')
+    f.close()
+    store = self.open(DB_OPEN_WRITE)
+    self.check(store, expected)
+    self.modify(store, expected, 100)
+    store.close()
+
+    store = self.open(DB_OPEN_READ)
+    self.check(store, expected)
+    store.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
+
+
@@ -34,6 +34,7 @@ import unittest
 from cvs2svn_lib.rcsparser import Sink
 from cvs2svn_lib.rcsparser import parse
 from cvs2svn_lib.rcs_stream import RCSStream
+from cvs2svn_lib.rcs_stream import BufferRCSStream
 
 TMPDIR = os.path.join(SRCPATH, 'cvs2svn-tmp')
 
@@ -53,12 +54,13 @@ class RCSRecorder(Sink):
 
 
 class RCSStreamTestCase(unittest.TestCase):
-  def __init__(self, name, doc, v1, v2):
+  def __init__(self, name, doc, v1, v2, stream_class=RCSStream):
     unittest.TestCase.__init__(self)
     self.name = name
     self.doc = doc
     self.v1 = v1
     self.v2 = v2
+    self.stream_class = stream_class
     self.filename = os.path.join(TMPDIR, 'rcsstream-%s' % self.name, 'a.txt')
 
   def shortDescription(self):
@@ -89,12 +91,12 @@ class RCSStreamTestCase(unittest.TestCase):
         )
 
   def applyTest(self, old, delta, new):
-    s1 = RCSStream(old)
+    s1 = self.stream_class(old)
     self.assertEqual(s1.get_text(), old)
     s1.apply_diff(delta)
     self.assertEqual(s1.get_text(), new)
 
-    s2 = RCSStream(old)
+    s2 = self.stream_class(old)
     self.assertEqual(s2.get_text(), old)
     s2.invert_diff(delta)
     self.assertEqual(s2.get_text(), new)
@@ -112,7 +114,7 @@ class RCSStreamTestCase(unittest.TestCase):
     v2 = recorder.texts['1.2']
     self.assertEqual(v2, self.v2)
     delta = recorder.texts['1.1']
-    s = RCSStream(v2)
+    s = self.stream_class(v2)
     self.assertEqual(s.get_text(), self.v2)
     invdelta = s.invert_diff(delta)
     self.assertEqual(s.get_text(), self.v1)
@@ -137,6 +139,14 @@ def add_test_pair(name, v1, v2):
   suite.addTest(RCSStreamTestCase(name, name, v1, v2))
   if v1 != v2:
     suite.addTest(RCSStreamTestCase(name + '-reverse', name + '-reverse', v2, v1))
+  suite.addTest(RCSStreamTestCase(
+      name + '-buffer', name + '-buffer', v1, v2, BufferRCSStream
+      ))
+  if v1 != v2:
+    suite.addTest(RCSStreamTestCase(
+        name + '-reverse-buffer', name + '-reverse-buffer', v2, v1,
+        BufferRCSStream
+        ))
 
 
 def add_test(name, v1, v2):
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This program tests the OverlayRecordTable class.
+
+The base table of each test holds the records i -> 1000 + i for
+i < BASE_LIMIT, except for a gap at every tenth index.  The tests
+cover the cases where the overlay has to differ from what a lookup in
+the base table would return, the layout of the overlay file, and the
+folding of an overlay into a plain table."""
+
+import sys
+import os
+import shutil
+import unittest
+
+SRCPATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, SRCPATH)
+
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.common import DB_OPEN_WRITE
+from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.record_table import UnsignedIntegerPacker
+from cvs2svn_lib.record_table import RecordTableAccessError
+from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import MmapRecordTable
+from cvs2svn_lib.record_table import OverlayRecordTable
+from cvs2svn_lib.record_table import is_overlay_file
+
+TMPDIR = os.path.join(SRCPATH, 'cvs2svn-tmp')
+
+BASE_LIMIT = 100
+
+
+class SmallOverlayRecordTable(OverlayRecordTable):
+  # Write a block to the overlay file every few records:
+  COMPACT_LIMIT = 7
+
+  # Fold only if explicitly asked to (by setting this lower):
+  FOLD_FRACTION = 1000.0
+
+
+class OverlayRecordTableTestCase(unittest.TestCase):
+  def setUp(self):
+    self.dirname = os.path.join(TMPDIR, 'record-table-test')
+    if os.path.isdir(self.dirname):
+      shutil.rmtree(self.dirname)
+    os.makedirs(self.dirname)
+    self.packer = UnsignedIntegerPacker()
+    self.base_filename = self.path('base.dat')
+
+  def tearDown(self):
+    shutil.rmtree(self.dirname)
+
+  def path(self, basename):
+    return os.path.join(self.dirname, basename)
+
+  def create_base(self, base_class=RecordTable):
+    table = base_class(self.base_filename, DB_OPEN_NEW, self.packer)
+    for i in range(BASE_LIMIT):
+      if i % 10 != 3:
+        table[i] = 1000 + i
+    table.close()
+
+  def base_contents(self):
+    return dict([
+        (i, 1000 + i) for i in range(BASE_LIMIT) if i % 10 != 3
+        ])
+
+  def open(self, basename, mode, base_filename=None, base_class=RecordTable):
+    return SmallOverlayRecordTable(
+        self.path(basename), mode, self.packer, base_filename,
+        base_class=base_class,
+        )
+
+  def check(self, table, expected):
+    """Check that TABLE holds exactly the records in dict EXPECTED."""
+
+    keys = expected.keys()
+    keys.sort()
+    self.assertEqual(list(table.iterkeys()), keys)
+    self.assertEqual(
+        list(table.itervalues()), [expected[i] for i in keys]
+        )
+    for i in range(table._limit + 5):
+      self.assertEqual(table.get(i), expected.get(i))
+    self.assertEqual(
+        list(table.get_many([5, 3, 1000])),
+        [(3, expected.get(3)), (5, expected.get(5)), (1000, None)],
+        )
+
+  def test_deletes_hide_base_records(self):
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay.dat', DB_OPEN_NEW, self.base_filename)
+    for i in range(0, BASE_LIMIT, 4):
+      if i in expected:
+        del table[i]
+        del expected[i]
+    # A record that is missing from the base table can't be deleted:
+    self.assertRaises(KeyError, table.__delitem__, 13)
+    # A record can be deleted, set again, and deleted again:
+    table[0] = 5
+    del table[0]
+    self.check(table, expected)
+    table.close()
+
+    table = self.open('overlay.dat', DB_OPEN_READ)
+    self.check(table, expected)
+    table.close()
+    base = RecordTable(self.base_filename, DB_OPEN_READ, self.packer)
+    self.check(base, self.base_contents())
+    base.close()
+
+  def test_write_past_base_limit(self):
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay.dat', DB_OPEN_NEW, self.base_filename)
+    table[BASE_LIMIT + 50] = 1
+    expected[BASE_LIMIT + 50] = 1
+    self.assertEqual(table._limit, BASE_LIMIT + 51)
+    # The gap between the base table and the new record is empty:
+    self.assertRaises(KeyError, table.__getitem__, BASE_LIMIT)
+    self.assertRaises(KeyError, table.__delitem__, BASE_LIMIT + 10)
+    self.check(table, expected)
+    table.close()
+
+    table = self.open('overlay.dat', DB_OPEN_WRITE)
+    self.assertEqual(table._limit, BASE_LIMIT + 51)
+    del table[BASE_LIMIT + 50]
+    del expected[BASE_LIMIT + 50]
+    # The limit doesn't shrink again:
+    self.assertEqual(table._limit, BASE_LIMIT + 51)
+    self.check(table, expected)
+    table.close()
+
+  def test_flush_appends(self):
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay.dat', DB_OPEN_NEW, self.base_filename)
+    for i in range(20):
+      table[i] = 1
+      expected[i] = 1
+    table.flush()
+    contents = open(self.path('overlay.dat'), 'rb').read()
+    self.failUnless(contents.startswith(
+        OverlayRecordTable.OVERLAY_MAGIC + 'base.dat\n'
+        ))
+
+    # Records set again override the ones in the earlier blocks:
+    for i in range(0, 20, 2):
+      table[i] = 2
+      expected[i] = 2
+    table.flush()
+    new_contents = open(self.path('overlay.dat'), 'rb').read()
+    self.failUnless(new_contents.startswith(contents))
+    self.failUnless(len(new_contents) > len(contents))
+
+    # Flushing without new records doesn't write anything:
+    table.flush()
+    self.assertEqual(open(self.path('overlay.dat'), 'rb').read(), new_contents)
+    table.close()
+
+    table = self.open('overlay.dat', DB_OPEN_READ)
+    self.check(table, expected)
+    self.assertRaises(RecordTableAccessError, table.__setitem__, 1, 1)
+    table.close()
+
+  def test_overlay_of_reopened_overlay(self):
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay1.dat', DB_OPEN_NEW, self.base_filename)
+    for i in range(5, 30):
+      table[i] = 1
+      expected[i] = 1
+    table.close()
+
+    table = self.open('overlay1.dat', DB_OPEN_WRITE)
+    del table[5]
+    del expected[5]
+    table[6] = 2
+    expected[6] = 2
+    table.close()
+    expected1 = expected.copy()
+
+    table = self.open('overlay2.dat', DB_OPEN_NEW, self.path('overlay1.dat'))
+    # The new overlay uses the same base table rather than the overlay:
+    self.assertEqual(table._base_filename, self.base_filename)
+    self.check(table, expected)
+    table[5] = 3
+    expected[5] = 3
+    table[BASE_LIMIT] = 3
+    expected[BASE_LIMIT] = 3
+    table.close()
+
+    table = self.open('overlay2.dat', DB_OPEN_READ)
+    self.check(table, expected)
+    table.close()
+    table = self.open('overlay1.dat', DB_OPEN_READ)
+    self.check(table, expected1)
+    table.close()
+
+  def test_relative_base_filename(self):
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay.dat', DB_OPEN_NEW, self.base_filename)
+    table[1] = 1
+    expected[1] = 1
+    table.close()
+
+    # Move both files to another directory, and open the overlay using
+    # a relative path from yet another directory:
+    moved_dirname = os.path.join(self.dirname, 'moved')
+    os.mkdir(moved_dirname)
+    for basename in ['base.dat', 'overlay.dat']:
+      os.rename(self.path(basename), os.path.join(moved_dirname, basename))
+    os.mkdir(self.path('cwd'))
+    cwd = os.getcwd()
+    os.chdir(self.path('cwd'))
+    try:
+      table = OverlayRecordTable(
+          os.path.join('..', 'moved', 'overlay.dat'), DB_OPEN_READ,
+          self.packer,
+          )
+      self.check(table, expected)
+      table.close()
+    finally:
+      os.chdir(cwd)
+
+  def run_fold_test(self, base_class):
+    self.create_base(base_class)
+    expected = self.base_contents()
+    table = self.open(
+        'overlay.dat', DB_OPEN_NEW, self.base_filename, base_class
+        )
+    # Fold once the delta holds more than 20 records (a memory mapped
+    # base table is padded, so its limit is larger than BASE_LIMIT):
+    table.FOLD_FRACTION = 20.0 / table._base._limit
+    del table[0]
+    del expected[0]
+    table[BASE_LIMIT + 10] = 1
+    expected[BASE_LIMIT + 10] = 1
+    for i in range(1, 7):
+      table[i] = 2
+      expected[i] = 2
+    self.failIf(table._folded)
+    # This fills the second block (overriding some records of the first
+    # one) and pushes the delta over the limit:
+    for i in range(4, 26):
+      table[i] = 3
+      expected[i] = 3
+    self.failUnless(table._folded)
+    self.assertEqual(len(table._indexes), 0)
+    self.check(table, expected)
+
+    # Changes after folding go straight to the plain table:
+    del table[1]
+    del expected[1]
+    table[BASE_LIMIT + 20] = 4
+    expected[BASE_LIMIT + 20] = 4
+    self.check(table, expected)
+    table.close()
+
+    self.failIf(is_overlay_file(self.path('overlay.dat')))
+    table = base_class(self.path('overlay.dat'), DB_OPEN_READ, self.packer)
+    self.check(table, expected)
+    table.close()
+    base = base_class(self.base_filename, DB_OPEN_READ, self.packer)
+    self.check(base, self.base_contents())
+    base.close()
+
+    # An overlay of the folded table uses it as its base:
+    table = self.open(
+        'overlay2.dat', DB_OPEN_NEW, self.path('overlay.dat'), base_class
+        )
+    self.assertEqual(table._base_filename, self.path('overlay.dat'))
+    table[2] = 5
+    expected[2] = 5
+    table.close()
+    table = self.open('overlay2.dat', DB_OPEN_READ, base_class=base_class)
+    self.check(table, expected)
+    table.close()
+
+  def test_fold(self):
+    self.run_fold_test(RecordTable)
+
+  def test_fold_mmap_base(self):
+    self.run_fold_test(MmapRecordTable)
+
+  def test_fold_copied_delta(self):
+    """An overlay of an overlay folds if the copied delta is too large."""
+
+    self.create_base()
+    expected = self.base_contents()
+    table = self.open('overlay1.dat', DB_OPEN_NEW, self.base_filename)
+    for i in range(50):
+      table[i] = 1
+      expected[i] = 1
+    table.close()
+
+    fold_fraction = SmallOverlayRecordTable.FOLD_FRACTION
+    SmallOverlayRecordTable.FOLD_FRACTION = 0.2
+    try:
+      table = self.open(
+          'overlay2.dat', DB_OPEN_NEW, self.path('overlay1.dat')
+          )
+    finally:
+      SmallOverlayRecordTable.FOLD_FRACTION = fold_fraction
+    self.failUnless(table._folded)
+    self.check(table, expected)
+    table.close()
+    self.failIf(is_overlay_file(self.path('overlay2.dat')))
+    self.failUnless(is_overlay_file(self.path('overlay1.dat')))
+
+
+if __name__ == '__main__':
+  unittest.main()
+
+
@@ -0,0 +1,132 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Farm independent units of work out to a pool of worker processes.
+
+The work done by a conversion pass is normally carried out in the main
+process.  Some passes contain steps that are independent of each other
+(e.g., parsing separate RCS files); if Ctx().jobs is greater than one,
+those steps can be run in a WorkerPool instead.  The results are
+always consumed by the main process in the order in which the work was
+submitted, so the output of the conversion does not depend on the
+number of jobs.
+
+The functions run in the worker processes must be module-level
+functions, and their arguments and return values must be picklable."""
+
+
+from collections import deque
+
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.log import logger
+
+try:
+  import multiprocessing
+except ImportError:
+  # The multiprocessing module was only added in Python 2.6.
+  multiprocessing = None
+
+
+class WorkerPool(object):
+  """A pool of worker processes that preserves the order of results."""
+
+  def __init__(self, jobs):
+    """Start JOBS worker processes.
+
+    Raise FatalError if this Python does not support multiprocessing."""
+
+    if multiprocessing is None:
+      raise FatalError(
+          'Running more than one job requires the Python '
+          'multiprocessing module\n'
+          '(Python 2.6 or later).'
+          )
+
+    self.jobs = jobs
+    logger.verbose('Starting %d worker processes' % (self.jobs,))
+    self._pool = multiprocessing.Pool(self.jobs)
+
+  def apply_async(self, function, *args):
+    """Start computing FUNCTION(*ARGS) in a worker process.
+
+    Return an object whose get() method waits for and returns the
+    result (or re-raises the exception raised by FUNCTION)."""
+
+    return self._pool.apply_async(function, args)
+
+  def imap(self, function, iterable, lookahead=None):
+    """Generate FUNCTION(arg) for each arg in ITERABLE, in order.
+
+    At most LOOKAHEAD arguments (by default, a few per job) are
+    submitted to the workers before the corresponding results have
+    been consumed, so ITERABLE may be arbitrarily long.  ITERABLE is
+    only ever iterated over in the calling thread."""
+
+    for (arg, result) in self.imap_tagged(
+          function, ((arg, arg) for arg in iterable), lookahead
+          ):
+      yield result
+
+  def imap_tagged(self, function, iterable, lookahead=None):
+    """Generate (tag, FUNCTION(arg)) for each (tag, arg) in ITERABLE.
+
+    The results are generated in the order of ITERABLE.  If arg is
+    None, then FUNCTION is not called and (tag, None) is generated
+    without any work being done in a worker process.  LOOKAHEAD has
+    the same meaning as for imap()."""
+
+    if lookahead is None:
+      lookahead = 4 * self.jobs
+
+    pending = deque()
+    for (tag, arg) in iterable:
+      if arg is None:
+        pending.append((tag, None))
+      else:
+        pending.append((tag, self._pool.apply_async(function, (arg,))))
+
+      while len(pending) > lookahead:
+        (tag, result) = pending.popleft()
+        yield (tag, result and result.get())
+
+    while pending:
+      (tag, result) = pending.popleft()
+      yield (tag, result and result.get())
+
+  def close(self):
+    """Wait for the workers to finish their current work, then stop them."""
+
+    self._pool.close()
+    self._pool.join()
+    self._pool = None
+
+  def terminate(self):
+    """Stop the workers immediately, discarding any outstanding work."""
+
+    self._pool.terminate()
+    self._pool.join()
+    self._pool = None
+
+
+def create_worker_pool(jobs):
+  """Return a WorkerPool with JOBS workers, or None if JOBS <= 1.
+
+  Callers should do the work in the main process if None is returned."""
+
+  if jobs is None or jobs <= 1:
+    return None
+  else:
+    return WorkerPool(jobs)
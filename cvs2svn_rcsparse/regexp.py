@@ -0,0 +1,162 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2010 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""An RCS tokenizer that uses compiled regular expressions.
+
+This module is part of cvs2svn, not of ViewVC's rcsparse.  It provides
+a token stream with the same interface as the one in default.py, but
+instead of examining the file one character at a time, it maps the
+whole file into memory and lets the re module find the tokens.  The
+end of an @-string is found using find(), which skips over the text of
+a revision in a few big steps, and the string is copied out of the
+file in one piece per doubled '@'.  Since it only uses the standard
+library, it can be used everywhere that default.py can.
+
+For the same input, the sink gets the same callbacks and an error is
+raised in the same cases as with default.py, except that a file that
+ends in the middle of a token is not silently accepted (see
+run-tests.py, which compares the two)."""
+
+import re
+import mmap
+
+import common
+
+
+# Whitespace, followed by a token.  A token is ';', ':', a run of
+# characters that ends at whitespace, ';', or ':' (group 1), or the '@'
+# that starts a string.  (Like default.py, this allows '@' within a
+# token.)
+_token_re = re.compile(r'\s*(?:([;:]|[^\s;:@][^\s;:]*)|@)')
+
+
+def _eof():
+  raise RuntimeError, 'EOF'
+
+
+def _map(file):
+  """Return the rest of FILE as an mmap or as a string.
+
+  mmap cannot be used for files that are empty or aren't regular files
+  (e.g., pipes), and it maps the whole file, so it is only used if FILE
+  hasn't been read from yet."""
+
+  try:
+    if file.tell() == 0:
+      return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+  except (AttributeError, EnvironmentError, ValueError):
+    pass
+  return file.read()
+
+
+class _TokenStream:
+  def __init__(self, buf):
+    # BUF is the contents of the file, as returned by _map():
+    self.buf = buf
+    if not self.buf:
+      raise RuntimeError, 'EOF'
+    # A scanner's match() method matches _token_re where the previous
+    # match ended, which saves keeping track of the position in Python.
+    self._match = _token_re.scanner(self.buf).match
+
+  def get(self):
+    "Get the next token from the RCS file."
+
+    m = self._match()
+    if m is None:
+      # signal EOF by returning None as the token
+      self._match = _eof   # so we fail if get() is called again
+      return None
+
+    token = m.group(1)
+    if token is not None:
+      return token
+
+    # a "string" which starts with the "@" character.  Any other '@'
+    # within the string is doubled; each doubled '@' ends a chunk that
+    # includes one of them.
+    buf = self.buf
+    find = buf.find
+    idx = m.end()
+    chunks = [ ]
+    while 1:
+      i = find('@', idx)
+      if i == -1:
+        raise RuntimeError, 'EOF'
+      if i + 1 == len(buf):
+        # default.py cannot tell whether an '@' at the end of the file
+        # is doubled, so it rejects files that end right after a string
+        # (RCS always writes a newline there).  Do the same, so that
+        # the parsers accept the same files:
+        raise RuntimeError, 'EOF'
+      if find('@@', i, i + 2) != i:
+        break
+      chunks.append(buf[idx:i + 1])
+      idx = i + 2
+
+    # continue scanning after the string:
+    self._match = _token_re.scanner(buf, i + 1).match
+
+    if chunks:
+      chunks.append(buf[idx:i])
+      return ''.join(chunks)
+    else:
+      return buf[idx:i]
+
+  def match(self, match):
+    "Try to match the next token from the input buffer."
+
+    token = self.get()
+    if token != match:
+      raise common.RCSExpected(token, match)
+
+  def unget(self, token):
+    "Put this token back, for the next get() to return."
+
+    # As in default.py, override the get() method with a function that
+    # removes the override again and returns TOKEN.
+    def give_it_back(self=self, token=token):
+      del self.get
+      return token
+
+    self.get = give_it_back
+
+  def mget(self, count):
+    "Return multiple tokens. 'next' is at the end."
+    result = [ ]
+    for i in range(count):
+      result.append(self.get())
+    result.reverse()
+    return result
+
+
+class Parser(common._Parser):
+  stream_class = _TokenStream
+
+  def parse(self, file, sink):
+    """Parse an RCS file; see common._Parser.parse().
+
+    The file is mapped here rather than in the token stream, so that
+    the mapping is closed even if parsing fails."""
+
+    buf = _map(file)
+    try:
+      common._Parser.parse(self, buf, sink)
+    finally:
+      if not isinstance(buf, str):
+        buf.close()
+
+
@@ -16,58 +16,163 @@
 # history and logs, available at http://viewvc.tigris.org/.
 # ====================================================================
 
-"""Run tests of rcsparse code."""
+"""Run tests of rcsparse code.
+
+Each parser parses the *,v files in test-data, and its output is
+compared with the corresponding *.out file.  The regexp parser (and the
+texttools parser, if mx.TextTools is installed) must also produce the
+same output as the default parser for all of the *,v files in cvs2svn's
+test-data directory, and fail for the same files.  The same is checked
+for every truncated version of the *,v files in test-data, except that
+where the default parser silently drops a token that is cut off at the
+end of the file, the other parsers must fail."""
 
 import sys
 import os
+import string
 import glob
 from cStringIO import StringIO
 from difflib import Differ
 
-# Since there is nontrivial logic in __init__.py, we have to import
-# parse() via that file.  First make sure that the directory
-# containing this script is in the path:
+# Since the parser modules import common.py as a top-level module,
+# make sure that the directory containing this script is in the path:
 script_dir = os.path.dirname(sys.argv[0])
 sys.path.insert(0, script_dir)
 
-from __init__ import parse
 from parse_rcs_file import LoggingSink
 
+import default
+import regexp
+
+parsers = [
+    ('default', default.Parser),
+    ('regexp', regexp.Parser),
+    ]
+
+try:
+    import texttools
+except ImportError:
+    sys.stderr.write('mx.TextTools is not installed; skipping texttools.\n')
+else:
+    parsers.append(('texttools', texttools.Parser))
+
 
 test_dir = os.path.join(script_dir, 'test-data')
 
 filelist = glob.glob(os.path.join(test_dir, '*,v'))
 filelist.sort()
 
-all_tests_ok = 1
+# The *,v files of the cvs2svn test repositories:
+cvs2svn_test_dir = os.path.join(script_dir, '..', 'test-data')
+cvs2svn_filelist = []
+for (dirpath, dirnames, filenames) in os.walk(cvs2svn_test_dir):
+    for filename in filenames:
+        if filename.endswith(',v'):
+            cvs2svn_filelist.append(os.path.join(dirpath, filename))
+cvs2svn_filelist.sort()
+
+
+def parse(parser, file):
+    """Parse FILE using PARSER.
+
+    Return the output of a LoggingSink, or None if parsing failed."""
 
-for filename in filelist:
-    sys.stderr.write('%s: ' % (filename,))
     f = StringIO()
     try:
-        parse(open(filename, 'rb'), LoggingSink(f))
-    except Exception, e:
-        sys.stderr.write('Error parsing file: %s!\n' % (e,))
-        all_tests_ok = 0
+        parser().parse(file, LoggingSink(f))
+    except Exception:
+        return None
+    return f.getvalue()
+
+
+def write_diff(expected_output, output):
+    differ = Differ()
+    for diffline in differ.compare(
+        expected_output.splitlines(1), output.splitlines(1)
+        ):
+        sys.stderr.write(diffline)
+
+
+all_tests_ok = 1
+
+for (name, parser) in parsers:
+    for filename in filelist:
+        sys.stderr.write('%s: %s: ' % (name, filename,))
+        f = StringIO()
+        try:
+            parser().parse(open(filename, 'rb'), LoggingSink(f))
+        except Exception, e:
+            sys.stderr.write('Error parsing file: %s!\n' % (e,))
+            all_tests_ok = 0
+        else:
+            output = f.getvalue()
+
+            expected_output_filename = filename[:-2] + '.out'
+            expected_output = open(expected_output_filename, 'rb').read()
+
+            if output == expected_output:
+                sys.stderr.write('OK\n')
+            else:
+                sys.stderr.write('Output does not match expected output!\n')
+                write_diff(expected_output, output)
+                all_tests_ok = 0
+
+for (name, parser) in parsers[1:]:
+    sys.stderr.write(
+        '%s: comparing %d files with the default parser: '
+        % (name, len(cvs2svn_filelist),)
+        )
+    failures = []
+    for filename in cvs2svn_filelist:
+        expected_output = parse(default.Parser, open(filename, 'rb'))
+        output = parse(parser, open(filename, 'rb'))
+        if output != expected_output:
+            failures.append((filename, expected_output, output))
+
+    if not failures:
+        sys.stderr.write('OK\n')
     else:
-        output = f.getvalue()
+        sys.stderr.write('%d files differ!\n' % (len(failures),))
+        for (filename, expected_output, output) in failures:
+            if expected_output is None:
+                sys.stderr.write(
+                    '%s: only the default parser failed\n' % (filename,)
+                    )
+            elif output is None:
+                sys.stderr.write('%s: only %s failed\n' % (filename, name,))
+            else:
+                sys.stderr.write('%s: output differs:\n' % (filename,))
+                write_diff(expected_output, output)
+        all_tests_ok = 0
 
-        expected_output_filename = filename[:-2] + '.out'
-        expected_output = open(expected_output_filename, 'rb').read()
+    for filename in filelist:
+        sys.stderr.write('%s: %s: truncated: ' % (name, filename,))
+        data = open(filename, 'rb').read()
+        failures = []
+        for length in range(1, len(data)):
+            expected_output = parse(default.Parser, StringIO(data[:length]))
+            output = parse(parser, StringIO(data[:length]))
+            if output == expected_output:
+                pass
+            elif (
+                output is None
+                and data[length - 1] not in string.whitespace + ';:@'
+                ):
+                # The file ends in the middle of a token.
+                pass
+            else:
+                failures.append(length)
 
-        if output == expected_output:
+        if not failures:
             sys.stderr.write('OK\n')
         else:
-            sys.stderr.write('Output does not match expected output!\n')
-            differ = Differ()
-            for diffline in differ.compare(
-                expected_output.splitlines(1), output.splitlines(1)
-                ):
-                sys.stderr.write(diffline)
+            sys.stderr.write(
+                'results differ for lengths %s!\n'
+                % (', '.join([str(length) for length in failures]),)
+                )
             all_tests_ok = 0
 
 if all_tests_ok:
     sys.exit(0)
 else:
     sys.exit(1)
-
@@ -4070,6 +4070,283 @@ def vendor_1_1_not_root():
       )
 
 
+@Cvs2SvnTestFunction
+def parallel_collect():
+  "verify that --jobs does not change the output"
+
+  serial_conv = ensure_conversion(
+      'main', dumpfile='parallel-collect-1.dump',
+      )
+  conv = ensure_conversion(
+      'main', args=['--jobs=3'], dumpfile='parallel-collect-3.dump',
+      )
+  serial_lines = list(open(serial_conv.dumpfile, 'rb'))
+  lines = list(open(conv.dumpfile, 'rb'))
+  # Compare all lines following the repository UUID:
+  if lines[3:] != serial_lines[3:]:
+    raise Failure()
+
+
+def interrupted_conversion(name, interrupted_pass, dumpfile):
+  """Convert NAME to DUMPFILE, interrupting and resuming a pass.
+
+  Run the passes before pass number INTERRUPTED_PASS, then run the
+  remaining passes, letting INTERRUPTED_PASS stop with an error when
+  it is about to save its third checkpoint.  Then complete the
+  conversion using --resume, which has to discard the work done since
+  the second checkpoint.  Checkpoints are saved every three files or commits.
+  Return the path of the dumpfile."""
+
+  cvsrepos = os.path.join(test_data_dir, '%s-cvsrepos' % (name,))
+  conv_tmp_dir = os.path.join(tmp_dir, '%s-resume-tmp' % (name,))
+  dumpfile = os.path.join(tmp_dir, dumpfile)
+  erase(conv_tmp_dir)
+  erase(dumpfile)
+
+  args = [
+      '--collect-checkpoint-interval=3',
+      '--output-checkpoint-interval=3',
+      '--tmpdir=%s' % (conv_tmp_dir,),
+      '--dumpfile=%s' % (dumpfile,),
+      cvsrepos,
+      ]
+
+  if interrupted_pass > 1:
+    run_script(
+        cvs2svn, None, '-qqqqqq', '--passes=:%d' % (interrupted_pass - 1,),
+        *args
+        )
+  run_script(
+      cvs2svn, r'ERROR: Interrupted after saving checkpoint 2 ',
+      '-qqqqqq', '--passes=%d:' % (interrupted_pass,),
+      '--interrupt-after-checkpoint=2', *args
+      )
+  # (cvs2svn logs to stderr, so this also checks that the pass was
+  # continued from its checkpoint rather than restarted.)
+  run_script(cvs2svn, r'Continuing from the checkpoint', '--resume', *args)
+
+  erase(conv_tmp_dir)
+  return dumpfile
+
+
+@Cvs2SvnTestFunction
+def resume_collect_revs():
+  "resume a conversion interrupted in CollectRevsPass"
+
+  conv = ensure_conversion('main', dumpfile='resume-reference.dump')
+  dumpfile = interrupted_conversion('main', 1, 'resume-collect-revs.dump')
+  if open(dumpfile, 'rb').read() != open(conv.dumpfile, 'rb').read():
+    raise Failure()
+
+
+@Cvs2SvnTestFunction
+def resume_output():
+  "resume a conversion interrupted in OutputPass"
+
+  conv = ensure_conversion('main', dumpfile='resume-reference.dump')
+  dumpfile = interrupted_conversion(
+      'main', Conversion.get_last_pass(), 'resume-output.dump'
+      )
+  if open(dumpfile, 'rb').read() != open(conv.dumpfile, 'rb').read():
+    raise Failure()
+
+
+@Cvs2SvnTestFunction
+def resume_after_stale_statistics():
+  "--resume ignores statistics of an earlier run"
+
+  conv = ensure_conversion('main', dumpfile='resume-reference.dump')
+  cvsrepos = os.path.join(test_data_dir, 'main-cvsrepos')
+  conv_tmp_dir = os.path.join(tmp_dir, 'main-stale-statistics-tmp')
+  dumpfile = os.path.join(tmp_dir, 'resume-after-stale-statistics.dump')
+  erase(conv_tmp_dir)
+  erase(dumpfile)
+
+  args = [
+      '--tmpdir=%s' % (conv_tmp_dir,),
+      '--dumpfile=%s' % (dumpfile,),
+      cvsrepos,
+      ]
+
+  # A complete conversion leaves the statistics files of all of the
+  # passes behind:
+  run_script(cvs2svn, None, '-qqqqqq', '--skip-cleanup', *args)
+  os.remove(dumpfile)
+  # A new conversion that runs only the first few passes:
+  run_script(cvs2svn, None, '-qqqqqq', '--skip-cleanup', '--passes=:3', *args)
+  # ...has to be resumed after them, not treated as complete:
+  run_script(
+      cvs2svn, r'Resuming the conversion at pass 4\.', '--resume', *args
+      )
+  if open(dumpfile, 'rb').read() != open(conv.dumpfile, 'rb').read():
+    raise Failure()
+
+  erase(conv_tmp_dir)
+
+
+class IncrementalConversion:
+  """A series of --incremental conversions of a copy of main-cvsrepos.
+
+  The copy gets an extra file, proj/late.txt,v, whose revisions are
+  later than all of the others, so that changes to it are appended to
+  the history (see write_late_file())."""
+
+  def __init__(self, name):
+    self.cvsrepos = os.path.join(tmp_dir, '%s-cvsrepos' % (name,))
+    self.conv_tmp_dir = os.path.join(tmp_dir, '%s-tmp' % (name,))
+    self.manifest = os.path.join(tmp_dir, '%s.manifest' % (name,))
+    self.dumpfile = os.path.join(tmp_dir, '%s.dump' % (name,))
+    erase(self.cvsrepos)
+    erase(self.manifest)
+    erase(self.manifest + '.recordings')
+    shutil.copytree(
+        os.path.join(test_data_dir, 'main-cvsrepos'), self.cvsrepos
+        )
+    os.mkdir(os.path.join(self.cvsrepos, 'CVSROOT'))
+    self.late_file = os.path.join(self.cvsrepos, 'proj', 'late.txt,v')
+    self.write_late_file(['Add late.txt.'])
+
+  def write_late_file(self, log_messages):
+    """Write late.txt,v, with a revision for each of LOG_MESSAGES.
+
+    Revision 1.N adds line N to the file."""
+
+    count = len(log_messages)
+    f = open(self.late_file, 'wb')
+    f.write(
+        'head\t1.%d;\naccess;\nsymbols;\nlocks; strict;\n'
+        'comment\t@# @;\n\n' % (count,)
+        )
+    for n in range(count, 0, -1):
+      f.write(
+          '\n1.%d\ndate\t2010.01.%02d.12.00.00;\tauthor jrandom;\t'
+          'state Exp;\nbranches;\nnext\t%s;\n'
+          % (n, n, n > 1 and '1.%d' % (n - 1,) or '',)
+          )
+    f.write('\n\ndesc\n@@\n')
+    for n in range(count, 0, -1):
+      if n == count:
+        text = ''.join(['line %d\n' % (i,) for i in range(1, count + 1)])
+      else:
+        text = 'd%d 1\n' % (n + 1,)
+      f.write(
+          '\n\n1.%d\nlog\n@%s\n@\ntext\n@%s@\n'
+          % (n, log_messages[n - 1], text,)
+          )
+    f.close()
+
+  def count_rcs_files(self):
+    count = 0
+    for (dirpath, dirnames, filenames) in os.walk(self.cvsrepos):
+      for filename in filenames:
+        if filename.endswith(',v'):
+          count += 1
+    return count
+
+  def run(self, error_re):
+    """Run an incremental conversion; ERROR_RE must match its stderr."""
+
+    erase(self.conv_tmp_dir)
+    erase(self.dumpfile)
+    run_script(
+        cvs2svn, error_re,
+        '--incremental=%s' % (self.manifest,),
+        '--tmpdir=%s' % (self.conv_tmp_dir,),
+        '--dumpfile=%s' % (self.dumpfile,),
+        self.cvsrepos,
+        )
+    erase(self.conv_tmp_dir)
+
+  def get_revision_numbers(self):
+    """Return the list of the revision numbers in the dumpfile."""
+
+    return [
+        int(line.split()[1])
+        for line in open(self.dumpfile, 'rb')
+        if line.startswith('Revision-number:')
+        ]
+
+  def cleanup(self):
+    erase(self.cvsrepos)
+    erase(self.manifest)
+    erase(self.manifest + '.recordings')
+    erase(self.dumpfile)
+
+
+@Cvs2SvnTestFunction
+def incremental_replay():
+  "reparse only modified ,v files with --incremental"
+
+  conv = IncrementalConversion('incremental-replay')
+  # (cvs2svn logs to stderr, so these check how many files were parsed.)
+  conv.run(r'Replayed the recorded parses of 0 unchanged ')
+
+  # Change the timestamp of one file, but not its contents:
+  t = time.time() - 3600
+  os.utime(conv.late_file, (t, t,))
+  conv.run(
+      r'Replayed the recorded parses of %d unchanged '
+      % (conv.count_rcs_files() - 1,)
+      )
+
+  # No new revisions were output:
+  if conv.get_revision_numbers():
+    raise Failure()
+
+  conv.cleanup()
+
+
+@Cvs2SvnTestFunction
+def incremental_new_revision():
+  "output only the new revisions with --incremental"
+
+  conv = IncrementalConversion('incremental-new-revision')
+  conv.run(r'Replayed the recorded parses of 0 unchanged ')
+  revnums = conv.get_revision_numbers()
+  if revnums != range(1, len(revnums) + 1):
+    raise Failure()
+
+  conv.write_late_file(['Add late.txt.', 'Add line 2.'])
+  conv.run(
+      r'Replayed the recorded parses of %d unchanged '
+      % (conv.count_rcs_files() - 1,)
+      )
+
+  # Only the revision that adds line 2 was output, numbered so that it
+  # follows the earlier output:
+  if conv.get_revision_numbers() != [len(revnums) + 1]:
+    raise Failure()
+  dump = open(conv.dumpfile, 'rb').read()
+  if 'Add line 2.' not in dump or 'line 2\n' not in dump \
+         or 'Add late.txt.' in dump:
+    raise Failure()
+
+  conv.cleanup()
+
+
+@Cvs2SvnTestFunction
+def incremental_rewritten_history():
+  "--incremental fails if the history was changed"
+
+  conv = IncrementalConversion('incremental-rewritten-history')
+  conv.run(r'Replayed the recorded parses of 0 unchanged ')
+  last_revnum = conv.get_revision_numbers()[-1]
+  manifest = open(conv.manifest, 'rb').read()
+
+  # Change the log message of the last revision that was output:
+  conv.write_late_file(['Add late.txt (reworded).'])
+  conv.run(
+      r'ERROR: r%d differs from the r%d that was output by the last '
+      r'incremental conversion' % (last_revnum, last_revnum,)
+      )
+
+  # The manifest still describes the earlier output:
+  if open(conv.manifest, 'rb').read() != manifest:
+    raise Failure()
+
+  conv.cleanup()
+
+
 ########################################################################
 # Run the tests
 
@@ -4289,6 +4566,13 @@ test_list = [
     missing_vendor_branch,
     newphrases,
     vendor_1_1_not_root,
+    parallel_collect,
+    resume_collect_revs,
+    resume_output,
+    resume_after_stale_statistics,
+    incremental_replay,
+    incremental_new_revision,
+    incremental_rewritten_history,
     ]
 
 if __name__ == '__main__':